@@ -0,0 +1,198 @@
+# This file is part of Pyrakoon, a distributed key-value store client.
+#
+# Copyright (C) 2014 Incubaid BVBA
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''Run a request on every node of a cluster concurrently
+
+Some requests, like `statistics`, `version`, `get_current_state`,
+`who_master`, `expect_progress_possible` and the administrative calls in
+:mod:`pyrakoon.client.admin`, are handled by the node they're sent to,
+instead of by the master. :func:`broadcast` sends such a request to a set
+of nodes in parallel, using a separate connection per node, and collects
+the result (or exception) of every node.
+
+Example::
+
+    nodes = {
+        'arakoon_0': ('127.0.0.1', 4000),
+        'arakoon_1': ('127.0.0.1', 4001),
+        'arakoon_2': ('127.0.0.1', 4002),
+    }
+
+    results = broadcast(nodes, 'ricky', protocol.WhoMaster(), timeout=2.0)
+    results = broadcast(nodes, 'ricky',
+        lambda client: client.collapse_tlogs(5))
+'''
+
+import time
+import socket
+import logging
+import threading
+
+from pyrakoon import client, protocol
+from pyrakoon.client import admin
+
+LOGGER = logging.getLogger(__name__)
+'''Logger for code in this module''' #pylint: disable=W0105
+
+DEFAULT_TIMEOUT = 5.0
+'''Default time to wait for every node, in seconds''' #pylint: disable=W0105
+
+
+class NodeClient(client.SocketClient, client.ClientMixin, admin.ClientMixin):
+    '''Client connected to a single node, using socket timeouts
+
+    This client provides all regular and administrative calls. Every socket
+    operation (connecting, sending and receiving) fails with
+    :class:`socket.timeout` when it takes longer than `timeout`.
+    '''
+
+    def __init__(self, address, cluster_id, timeout=DEFAULT_TIMEOUT):
+        '''
+        :param address: Node address (host & port)
+        :type address: `(str, int)`
+        :param cluster_id: Identifier of the cluster
+        :type cluster_id: `str`
+        :param timeout: Timeout of socket operations, in seconds
+        :type timeout: :class:`float`
+        '''
+
+        super(NodeClient, self).__init__(address, cluster_id)
+
+        self._timeout = timeout
+
+    def connect(self):
+        self._socket = socket.create_connection(self._address, self._timeout)
+        self._socket.settimeout(self._timeout)
+
+        self._socket.sendall(protocol.build_prologue(self._cluster_id))
+
+    def close(self):
+        '''Close the connection'''
+
+        self._disconnect()
+
+    def abort(self):
+        '''Interrupt any pending socket operation
+
+        This can be called from any thread. The connection can't be used
+        afterwards.
+        '''
+
+        sock = self._socket
+
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+
+
+def _make_call(call):
+    '''Turn a message or callable into a callable taking a client'''
+
+    if isinstance(call, protocol.Message):
+        return lambda client_: client_._process(call) #pylint: disable=W0212
+
+    if not callable(call):
+        raise TypeError('Expected a message or callable, got %r' % call)
+
+    return call
+
+
+def broadcast(nodes, cluster_id, call, timeout=DEFAULT_TIMEOUT):
+    '''Run a request on a set of nodes concurrently
+
+    Every node is contacted using a new :class:`NodeClient` in a separate
+    thread. The call returns once all nodes answered, or after `timeout`
+    seconds. Nodes which didn't answer in time are reported with a
+    :class:`socket.timeout` exception.
+
+    :param nodes: Addresses (host & port) of the nodes to contact, by name
+    :type nodes: `dict` of `str` to `(str, int)`
+    :param cluster_id: Identifier of the cluster
+    :type cluster_id: :class:`str`
+    :param call: Message to send to every node, or a callable taking a
+        connected :class:`NodeClient` and returning a result
+    :type call: :class:`pyrakoon.protocol.Message` or `callable`
+    :param timeout: Time to wait for the nodes, in seconds
+    :type timeout: :class:`float`
+
+    :return: Result or exception raised for every node, by name
+    :rtype: `dict` of `str` to `object`
+
+    :raise TypeError: `call` is neither a message nor callable
+    '''
+
+    call = _make_call(call)
+
+    lock = threading.Lock()
+    results = {}
+    clients = {}
+
+    def run(name, address):
+        '''Contact a single node, storing its result'''
+
+        client_ = NodeClient(address, cluster_id, timeout)
+
+        lock.acquire()
+        try:
+            clients[name] = client_
+        finally:
+            lock.release()
+
+        try:
+            client_.connect()
+            result = call(client_)
+        except Exception as exc: #pylint: disable=W0703
+            LOGGER.debug('Broadcast to node %s failed: %s', name, exc)
+            result = exc
+        finally:
+            client_.close()
+
+        lock.acquire()
+        try:
+            results.setdefault(name, result)
+        finally:
+            lock.release()
+
+    threads = []
+
+    for name, address in nodes.iteritems():
+        thread = threading.Thread(target=run, args=(name, address),
+            name='broadcast-%s' % name)
+        thread.daemon = True
+        thread.start()
+
+        threads.append(thread)
+
+    deadline = time.time() + timeout
+
+    for thread in threads:
+        thread.join(max(0.0, deadline - time.time()))
+
+    lock.acquire()
+    try:
+        for name in nodes:
+            if name not in results:
+                results[name] = socket.timeout(
+                    'No response within %.3f seconds' % timeout)
+
+                if name in clients:
+                    clients[name].abort()
+
+        return dict(results)
+    finally:
+        lock.release()
@@ -0,0 +1,885 @@
+# This file is part of Pyrakoon, a distributed key-value store client.
+#
+# Copyright (C) 2014 Incubaid BVBA
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''Bulk loading of key-value records
+
+Records are sorted by key, packed into size-bounded *sequence* batches, and
+submitted over a pipelined connection, keeping a bounded number of batches in
+flight. Batches can be encoded by a pool of worker processes.
+
+This module can be executed as a script to load a file of records::
+
+    python -m pyrakoon.bulk -c ricky -n arakoon_0:127.0.0.1:4000 records.txt
+
+Every line of a record file contains a key and a value, separated by a tab
+character. Both are encoded using the Python *string_escape* codec, so any
+binary content can be represented.
+'''
+
+import os
+import sys
+import time
+import heapq
+import random
+import socket
+import logging
+import optparse
+import operator
+import tempfile
+import collections
+import multiprocessing
+
+from pyrakoon import compat, errors, protocol, sequence, utils
+from pyrakoon.client import ClientMixin, SocketClient
+
+LOGGER = logging.getLogger(__name__)
+'''Logger for code in this module''' #pylint: disable=W0105
+
+DEFAULT_BATCH_BYTES = 1024 * 1024
+'''Default maximum size of a single batch, in bytes''' #pylint: disable=W0105
+DEFAULT_BATCH_COUNT = 1000
+'''Default maximum number of records in a single batch''' #pylint: disable=W0105
+DEFAULT_MAX_IN_FLIGHT = 4
+'''Default maximum number of outstanding batches''' #pylint: disable=W0105
+DEFAULT_SORT_BUFFER = 64 * 1024 * 1024
+'''Default amount of record data sorted in memory''' #pylint: disable=W0105
+
+RETRY_ERRORS = (errors.NotMaster, errors.NoLongerMaster, errors.GoingDown,
+    errors.TooManyDeadNodes, errors.MaxConnections,
+    socket.error, EnvironmentError, EOFError)
+'''Errors after which a batch is resubmitted''' #pylint: disable=W0105
+MASTER_ERRORS = (errors.NotMaster, errors.NoLongerMaster, errors.GoingDown)
+'''Errors after which the master is looked up again''' #pylint: disable=W0105
+
+
+def read_records(fd):
+    '''Read records from a record file
+
+    Example:
+
+        >>> import StringIO
+        >>> list(read_records(StringIO.StringIO('a\\\\tb\\t1\\nc\\t\\\\x00\\n')))
+        [('a\\tb', '1'), ('c', '\\x00')]
+
+    :param fd: File to read from
+    :type fd: `file`
+
+    :return: Iterator over all `(key, value)` records in the file
+    :rtype: iterator of `(str, str)`
+
+    :raise ValueError: Malformed record encountered
+    '''
+
+    for lineno, line in enumerate(fd, 1):
+        line = line.rstrip('\r\n')
+
+        if not line:
+            continue
+
+        parts = line.split('\t')
+        if len(parts) != 2:
+            raise ValueError('Malformed record on line %d' % lineno)
+
+        key, value = parts
+
+        yield key.decode('string_escape'), value.decode('string_escape')
+
+
+def format_record(key, value):
+    '''Format a record as a line in a record file
+
+    Example:
+
+        >>> format_record('a\\tb', '\\x00')
+        'a\\\\tb\\t\\\\x00\\n'
+
+    :param key: Record key
+    :type key: :class:`str`
+    :param value: Record value
+    :type value: :class:`str`
+
+    :return: Formatted record
+    :rtype: :class:`str`
+    '''
+
+    return '%s\t%s\n' % (key.encode('string_escape'),
+        value.encode('string_escape'))
+
+
+def _spill(records):
+    '''Write sorted `(key, index, value)` records to a temporary file'''
+
+    fd = tempfile.TemporaryFile(prefix='pyrakoon-bulk-')
+
+    for key, index, value in records:
+        for bytes_ in protocol.STRING.serialize(key):
+            fd.write(bytes_)
+        for bytes_ in protocol.UINT64.serialize(index):
+            fd.write(bytes_)
+        for bytes_ in protocol.STRING.serialize(value):
+            fd.write(bytes_)
+
+    fd.seek(0)
+
+    return fd, len(records)
+
+def _unspill(fd, count):
+    '''Read `count` `(key, index, value)` records written by `_spill`'''
+
+    recv = lambda type_: utils.read_blocking(type_.receive(), fd.read)
+
+    for _ in xrange(count):
+        key = recv(protocol.STRING)
+        index = recv(protocol.UINT64)
+        value = recv(protocol.STRING)
+
+        yield key, index, value
+
+
+def sort_records(records, buffer_size=DEFAULT_SORT_BUFFER):
+    '''Sort records by key, using bounded memory
+
+    Records are sorted in memory until `buffer_size` bytes of keys and values
+    are buffered, at which point they're written to a temporary file. All
+    temporary files are merged afterwards. Records with equal keys retain
+    their original order.
+
+    Example:
+
+        >>> list(sort_records([('b', '1'), ('a', '2'), ('b', '0')], 4))
+        [('a', '2'), ('b', '1'), ('b', '0')]
+
+    :param records: Records to sort
+    :type records: iterable of `(str, str)`
+    :param buffer_size: Amount of record data to sort in memory
+    :type buffer_size: :class:`int`
+
+    :return: Iterator over the sorted records
+    :rtype: iterator of `(str, str)`
+    '''
+
+    spills = []
+    chunk = []
+    chunk_size = 0
+
+    try:
+        for index, (key, value) in enumerate(records):
+            chunk.append((key, index, value))
+            chunk_size += len(key) + len(value)
+
+            if chunk_size >= buffer_size:
+                chunk.sort()
+                spills.append(_spill(chunk))
+
+                chunk = []
+                chunk_size = 0
+
+        chunk.sort()
+
+        sources = [_unspill(fd, count) for (fd, count) in spills]
+        sources.append(iter(chunk))
+
+        for key, _, value in heapq.merge(*sources):
+            yield key, value
+    finally:
+        for fd, _ in spills:
+            fd.close()
+
+
+def batch_records(records, max_bytes=DEFAULT_BATCH_BYTES,
+    max_count=DEFAULT_BATCH_COUNT):
+    '''Group records in batches
+
+    A batch contains at most `max_count` records, and the keys and values it
+    contains are at most `max_bytes` bytes in total, unless a single record
+    exceeds this limit.
+
+    Example:
+
+        >>> records = [('a', '1'), ('b', '2'), ('c', '3'), ('ddd', '4')]
+        >>> list(batch_records(records, max_bytes=4))
+        [[('a', '1'), ('b', '2')], [('c', '3')], [('ddd', '4')]]
+        >>> list(batch_records(records, max_count=3))
+        [[('a', '1'), ('b', '2'), ('c', '3')], [('ddd', '4')]]
+
+    :param records: Records to group
+    :type records: iterable of `(str, str)`
+    :param max_bytes: Maximum size of a batch
+    :type max_bytes: :class:`int`
+    :param max_count: Maximum number of records in a batch
+    :type max_count: :class:`int`
+
+    :return: Iterator over batches of records
+    :rtype: iterator of `[(str, str)]`
+    '''
+
+    batch = []
+    batch_size = 0
+
+    for key, value in records:
+        size = len(key) + len(value)
+
+        if batch and \
+            (len(batch) >= max_count or batch_size + size > max_bytes):
+            yield batch
+
+            batch = []
+            batch_size = 0
+
+        batch.append((key, value))
+        batch_size += size
+
+    if batch:
+        yield batch
+
+
+def encode_batch(records, sync=False):
+    '''Encode a batch of records as a *sequence* message
+
+    This is a module-level function so it can be run by worker processes.
+
+    :param records: Records to encode
+    :type records: `[(str, str)]`
+    :param sync: Use *synced_sequence*
+    :type sync: :class:`bool`
+
+    :return: Serialized message
+    :rtype: :class:`str`
+    '''
+
+    steps = [sequence.Set(key, value) for key, value in records]
+
+    return ''.join(protocol.Sequence(steps, sync).serialize())
+
+
+class EncodedMessage(protocol.Message):
+    '''A message which has been serialized before'''
+
+    __slots__ = '_data',
+
+    ARGS = ()
+    RETURN_TYPE = protocol.UNIT
+
+    def __init__(self, data):
+        super(EncodedMessage, self).__init__()
+
+        self._data = data
+
+    data = property(operator.attrgetter('_data'))
+
+    def serialize(self):
+        yield self._data
+
+
+class _SourceError(Exception):
+    '''Wrapper for errors raised while preparing batches
+
+    These should never cause a batch to be resubmitted.
+    '''
+
+    def __init__(self, exc_info):
+        super(_SourceError, self).__init__(exc_info[1])
+
+        self.exc_info = exc_info
+
+
+class _Batch(object): #pylint: disable=R0903
+    '''An encoded batch, ready to be submitted'''
+
+    __slots__ = 'message', 'count', 'last_key', 'size',
+
+    def __init__(self, message, count, last_key, size):
+        self.message = message
+        self.count = count
+        self.last_key = last_key
+        self.size = size
+
+
+class LoadStatistics(object):
+    '''Progress information of a bulk load'''
+
+    def __init__(self):
+        self.start = time.time()
+        self.records = 0
+        self.batches = 0
+        self.bytes = 0
+        self.retries = 0
+        self.skipped = 0
+        self.last_key = None
+
+    @property
+    def elapsed(self):
+        '''Time since the load started, in seconds'''
+
+        return time.time() - self.start
+
+    @property
+    def records_per_second(self):
+        '''Average number of records loaded per second'''
+
+        elapsed = self.elapsed
+
+        return self.records / elapsed if elapsed > 0 else 0.0
+
+    @property
+    def bytes_per_second(self):
+        '''Average number of bytes submitted per second'''
+
+        elapsed = self.elapsed
+
+        return self.bytes / elapsed if elapsed > 0 else 0.0
+
+    def __repr__(self):
+        return '<LoadStatistics records=%d batches=%d bytes=%d retries=%d ' \
+            'skipped=%d rate=%.1f/s>' % (self.records, self.batches,
+                self.bytes, self.retries, self.skipped,
+                self.records_per_second)
+
+
+def read_checkpoint(path):
+    '''Read a checkpoint file written by :class:`BulkLoader`
+
+    :param path: Path of the checkpoint file
+    :type path: :class:`str`
+
+    :return: Number of records loaded and last key loaded, or :data:`None` if
+        no checkpoint exists
+    :rtype: `(int, str)`
+    '''
+
+    if not os.path.exists(path):
+        return None
+
+    fd = open(path, 'rb')
+    try:
+        read = fd.read
+        count = utils.read_blocking(protocol.UINT64.receive(), read)
+        last_key = utils.read_blocking(
+            protocol.Option(protocol.STRING).receive(), read)
+    finally:
+        fd.close()
+
+    return count, last_key
+
+def write_checkpoint(path, count, last_key):
+    '''Atomically write a checkpoint file
+
+    :param path: Path of the checkpoint file
+    :type path: :class:`str`
+    :param count: Number of records loaded
+    :type count: :class:`int`
+    :param last_key: Last key loaded
+    :type last_key: :class:`str` or :data:`None`
+    '''
+
+    tmp_path = '%s.tmp' % path
+
+    fd = open(tmp_path, 'wb')
+    try:
+        for bytes_ in protocol.UINT64.serialize(count):
+            fd.write(bytes_)
+        for bytes_ in protocol.Option(protocol.STRING).serialize(last_key):
+            fd.write(bytes_)
+
+        fd.flush()
+        os.fsync(fd.fileno())
+    finally:
+        fd.close()
+
+    os.rename(tmp_path, path)
+
+
+class BulkLoader(object): #pylint: disable=R0902
+    '''Load large amounts of records into a cluster
+
+    The given client should be connected to the master node. If it supports
+    pipelining (see
+    :meth:`pyrakoon.client.AbstractClient._process_pipelined`), up to
+    `max_in_flight` batches are submitted before the result of the first one
+    is awaited.
+
+    When `processes` is larger than 0, batches are encoded by a
+    :class:`multiprocessing.Pool` of this size.
+
+    Failed batches are resubmitted up to `max_retries` times in a row, if the
+    failure is one of :data:`RETRY_ERRORS`. A client which got disconnected
+    is reconnected using its `connect` method. When the client has a
+    `redirect` method (like the client returned by :func:`connect_master`),
+    it's called with the error first, and batches are resubmitted without
+    delay if it returns :data:`True`. Otherwise, after failures with one of
+    :data:`MASTER_ERRORS`, the master is looked up again before resubmitting,
+    see :func:`rediscover_master`.
+
+    When a `checkpoint` path is given, the number of records loaded (and the
+    last key) is written to this file regularly. When loading is restarted
+    using the same input and checkpoint file, records which were loaded
+    already are skipped.
+    '''
+
+    #pylint: disable=R0913
+    def __init__(self, client, batch_bytes=DEFAULT_BATCH_BYTES,
+        batch_count=DEFAULT_BATCH_COUNT, max_in_flight=DEFAULT_MAX_IN_FLIGHT,
+        processes=0, max_retries=5, backoff=0.5, checkpoint=None,
+        checkpoint_interval=5.0, report_interval=10.0, progress=None,
+        sort=True, sync=False):
+        '''Initialize a bulk loader
+
+        :param client: Client to use
+        :type client: :class:`pyrakoon.client.AbstractClient`
+        :param batch_bytes: Maximum size of a batch
+        :type batch_bytes: :class:`int`
+        :param batch_count: Maximum number of records in a batch
+        :type batch_count: :class:`int`
+        :param max_in_flight: Maximum number of outstanding batches
+        :type max_in_flight: :class:`int`
+        :param processes: Number of encoding worker processes
+        :type processes: :class:`int`
+        :param max_retries: Maximum number of consecutive retries
+        :type max_retries: :class:`int`
+        :param backoff: Base delay between retries, in seconds
+        :type backoff: :class:`float`
+        :param checkpoint: Path of the checkpoint file
+        :type checkpoint: :class:`str`
+        :param checkpoint_interval: Minimal time between checkpoints
+        :type checkpoint_interval: :class:`float`
+        :param report_interval: Time between progress reports
+        :type report_interval: :class:`float`
+        :param progress: Callable invoked with a :class:`LoadStatistics` on
+            every progress report
+        :type progress: `callable`
+        :param sort: Sort the records by key before loading
+        :type sort: :class:`bool`
+        :param sync: Use *synced_sequence*
+        :type sync: :class:`bool`
+        '''
+
+        self._client = client
+        self._batch_bytes = batch_bytes
+        self._batch_count = batch_count
+        self._max_in_flight = max_in_flight
+        self._processes = processes
+        self._max_retries = max_retries
+        self._backoff = backoff
+        self._checkpoint = checkpoint
+        self._checkpoint_interval = checkpoint_interval
+        self._report_interval = report_interval
+        self._progress = progress
+        self._sort = sort
+        self._sync = sync
+
+    def _skip_loaded(self, records, stats):
+        '''Skip records covered by an existing checkpoint'''
+
+        checkpoint = read_checkpoint(self._checkpoint) \
+            if self._checkpoint else None
+
+        if not checkpoint:
+            return records
+
+        count, last_key = checkpoint
+        LOGGER.info('Resuming after %d records (key %r)', count, last_key)
+
+        stats.records = count
+        stats.last_key = last_key
+
+        def skip():
+            '''Drop the first `count` records'''
+
+            for index, record in enumerate(records):
+                if index < count:
+                    stats.skipped += 1
+                    continue
+
+                yield record
+
+        return skip()
+
+    def _encode(self, batches):
+        '''Encode batches, possibly using a process pool'''
+
+        if self._processes <= 0:
+            for batch in batches:
+                yield batch, encode_batch(batch, self._sync)
+
+            return
+
+        pool = multiprocessing.Pool(self._processes)
+        pending = collections.deque()
+        prefetch = self._processes * 2 + self._max_in_flight
+
+        try:
+            for batch in batches:
+                pending.append((batch,
+                    pool.apply_async(encode_batch, (batch, self._sync))))
+
+                if len(pending) >= prefetch:
+                    batch, result = pending.popleft()
+                    yield batch, result.get()
+
+            while pending:
+                batch, result = pending.popleft()
+                yield batch, result.get()
+
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def _prepare(self, records, stats):
+        '''Turn records into an iterator of encoded batches'''
+
+        if self._sort:
+            records = sort_records(records)
+
+        records = self._skip_loaded(records, stats)
+        batches = batch_records(records, self._batch_bytes, self._batch_count)
+
+        for batch, data in self._encode(batches):
+            yield _Batch(EncodedMessage(data), len(batch), batch[-1][0],
+                len(data))
+
+    def _submit(self, batches, stats):
+        '''Submit batches to the cluster, yielding acknowledged ones'''
+
+        client = self._client
+        unacked = collections.deque()
+
+        def feed():
+            '''Resubmit unacknowledged batches, then pull new ones'''
+
+            for batch in tuple(unacked):
+                yield batch.message
+
+            while True:
+                try:
+                    batch = batches.next()
+                except StopIteration:
+                    return
+                except Exception:
+                    raise _SourceError(sys.exc_info())
+
+                unacked.append(batch)
+                yield batch.message
+
+        attempt = 0
+
+        while True:
+            try:
+                if not client.connected and hasattr(client, 'connect'):
+                    client.connect()
+
+                for _ in client._process_pipelined( #pylint: disable=W0212
+                    feed(), self._max_in_flight):
+                    attempt = 0
+                    yield unacked.popleft()
+
+                return
+            except _SourceError as exc:
+                raise exc.exc_info[0], exc.exc_info[1], exc.exc_info[2]
+            except RETRY_ERRORS as exc:
+                attempt += 1
+                stats.retries += 1
+
+                if attempt > self._max_retries:
+                    raise
+
+                redirected = hasattr(client, 'redirect') and \
+                    client.redirect(exc)
+
+                if redirected:
+                    delay = 0.0
+                else:
+                    delay = random.uniform(0, self._backoff * (2 ** attempt))
+                LOGGER.warning('Batch failed (%s), resubmitting %d batches '
+                    'in %.2f seconds', exc, len(unacked), delay)
+
+                time.sleep(delay)
+
+                if not redirected:
+                    rediscover_master(client, exc)
+
+    def load(self, records):
+        '''Load records into the cluster
+
+        :param records: Records to load
+        :type records: iterable of `(str, str)`
+
+        :return: Load statistics
+        :rtype: :class:`LoadStatistics`
+        '''
+
+        stats = LoadStatistics()
+        last_checkpoint = last_report = time.time()
+
+        for batch in self._submit(self._prepare(records, stats), stats):
+            stats.records += batch.count
+            stats.batches += 1
+            stats.bytes += batch.size
+            stats.last_key = batch.last_key
+
+            now = time.time()
+
+            if self._checkpoint and \
+                now - last_checkpoint >= self._checkpoint_interval:
+                write_checkpoint(self._checkpoint, stats.records,
+                    stats.last_key)
+                last_checkpoint = now
+
+            if now - last_report >= self._report_interval:
+                self._report(stats)
+                last_report = now
+
+        if self._checkpoint:
+            write_checkpoint(self._checkpoint, stats.records, stats.last_key)
+
+        self._report(stats)
+
+        return stats
+
+    def _report(self, stats):
+        '''Report load progress'''
+
+        LOGGER.info('Loaded %d records in %d batches (%.1f records/s, '
+            '%.1f KiB/s, %d retries)', stats.records, stats.batches,
+            stats.records_per_second, stats.bytes_per_second / 1024,
+            stats.retries)
+
+        if self._progress:
+            self._progress(stats)
+
+
+def parse_node(value):
+    '''Parse a node specification of the form *name:host:port*
+
+    Example:
+
+        >>> parse_node('arakoon_0:127.0.0.1:4000')
+        ('arakoon_0', (['127.0.0.1'], 4000))
+
+    :param value: Node specification
+    :type value: :class:`str`
+
+    :return: Node name and location
+    :rtype: `(str, ([str], int))`
+
+    :raise ValueError: Invalid specification
+    '''
+
+    name, host, port = value.rsplit(':', 2)
+
+    return name, ([host], int(port))
+
+
+class NodeClient(SocketClient, ClientMixin):
+    '''Native client connected to a single node'''
+
+
+class MasterClient(NodeClient):
+    '''Native client connected to the master node of a cluster
+
+    After the master changed, the client can be switched to the new master
+    using :meth:`redirect` or :meth:`rediscover`, and connected to it using
+    :meth:`connect`.
+    '''
+
+    def __init__(self, config):
+        '''Look up the master node
+
+        :param config: Cluster configuration
+        :type config: :class:`pyrakoon.compat.ArakoonClientConfig`
+        '''
+
+        self._config = config
+
+        super(MasterClient, self).__init__(self._find_master(),
+            config.getClusterId())
+
+    def _find_master(self):
+        '''Look up the address of the master node'''
+
+        client_ = compat.ArakoonClient(self._config)
+
+        try:
+            master = client_.whoMaster()
+        finally:
+            client_.dropConnections()
+
+        LOGGER.info('Master node is %s', master)
+
+        return self._config.getNodeLocation(master)
+
+    def _switch(self, address):
+        '''Switch to another node, leaving the client disconnected
+
+        :return: Whether the address changed
+        :rtype: :class:`bool`
+        '''
+
+        if address == self._address:
+            return False
+
+        self._disconnect()
+        self._address = address
+
+        return True
+
+    def redirect(self, exc):
+        '''Switch to the master node named in an error, if any
+
+        :param exc: Error raised by a request
+        :type exc: :class:`Exception`
+
+        :return: Whether the client was redirected
+        :rtype: :class:`bool`
+        '''
+
+        master = errors.master_hint(exc, self._config.getNodes())
+
+        if master is None:
+            return False
+
+        if self._switch(self._config.getNodeLocation(master)):
+            LOGGER.info('Redirecting to master node %s', master)
+            return True
+
+        return False
+
+    def rediscover(self):
+        '''Look up the master node again, and switch to it
+
+        :return: Whether the master changed
+        :rtype: :class:`bool`
+        '''
+
+        return self._switch(self._find_master())
+
+
+def rediscover_master(client_, exc):
+    '''Look up the master again after a request failed with one of
+    :data:`MASTER_ERRORS`, if the client supports it (see
+    :meth:`MasterClient.rediscover`)
+
+    Failures to find the master are logged, the next request will fail again
+    if the cluster has no master.
+
+    :param client_: Client which sent the request
+    :type client_: :class:`pyrakoon.client.AbstractClient`
+    :param exc: Error raised by the request
+    :type exc: :class:`Exception`
+
+    :return: Whether the client was switched to another master
+    :rtype: :class:`bool`
+    '''
+
+    if not isinstance(exc, MASTER_ERRORS) or \
+        not hasattr(client_, 'rediscover'):
+        return False
+
+    try:
+        return client_.rediscover()
+    except Exception: #pylint: disable=W0703
+        LOGGER.warning('Unable to look up the master node', exc_info=True)
+        return False
+
+
+def connect_master(cluster_id, nodes):
+    '''Connect a pipelining client to the master node of a cluster
+
+    :param cluster_id: Identifier of the cluster
+    :type cluster_id: :class:`str`
+    :param nodes: Node locations
+    :type nodes: `dict` of `str` to `([str], int)`
+
+    :return: Connected client
+    :rtype: :class:`MasterClient`
+    '''
+
+    client_ = MasterClient(compat.ArakoonClientConfig(cluster_id, nodes))
+    client_.connect()
+
+    return client_
+
+
+def build_option_parser(usage):
+    '''Create an option parser with cluster connection options
+
+    :param usage: Usage string
+    :type usage: :class:`str`
+
+    :return: Option parser
+    :rtype: :class:`optparse.OptionParser`
+    '''
+
+    parser = optparse.OptionParser(usage=usage)
+    parser.add_option('-c', '--cluster-id', help='cluster identifier')
+    parser.add_option('-n', '--node', action='append', default=[],
+        metavar='NAME:HOST:PORT', help='cluster node (can be repeated)')
+    parser.add_option('-v', '--verbose', action='store_true', default=False,
+        help='enable debug output')
+
+    return parser
+
+
+def main(args=None):
+    '''Command-line entry point'''
+
+    parser = build_option_parser('%prog [options] -c CLUSTER -n NODE FILE')
+    parser.add_option('--batch-bytes', type='int', default=DEFAULT_BATCH_BYTES,
+        help='maximum batch size in bytes [default: %default]')
+    parser.add_option('--batch-count', type='int', default=DEFAULT_BATCH_COUNT,
+        help='maximum records per batch [default: %default]')
+    parser.add_option('--in-flight', type='int', default=DEFAULT_MAX_IN_FLIGHT,
+        help='maximum outstanding batches [default: %default]')
+    parser.add_option('--processes', type='int', default=0,
+        help='number of encoding processes [default: %default]')
+    parser.add_option('--retries', type='int', default=5,
+        help='maximum consecutive retries [default: %default]')
+    parser.add_option('--checkpoint', metavar='PATH',
+        help='checkpoint file, used to resume an interrupted load')
+    parser.add_option('--no-sort', action='store_false', dest='sort',
+        default=True, help='don\'t sort records by key')
+    parser.add_option('--sync', action='store_true', default=False,
+        help='use synced sequences')
+
+    options, args = parser.parse_args(args)
+
+    if len(args) != 1 or not options.cluster_id or not options.node:
+        parser.error('cluster, node and input file are required')
+
+    logging.basicConfig(
+        level=logging.DEBUG if options.verbose else logging.INFO,
+        format='%(asctime)s %(levelname)s %(message)s')
+
+    nodes = dict(parse_node(node) for node in options.node)
+    client_ = connect_master(options.cluster_id, nodes)
+
+    loader = BulkLoader(client_, batch_bytes=options.batch_bytes,
+        batch_count=options.batch_count, max_in_flight=options.in_flight,
+        processes=options.processes, max_retries=options.retries,
+        checkpoint=options.checkpoint, sort=options.sort, sync=options.sync)
+
+    fd = sys.stdin if args[0] == '-' else open(args[0], 'rb')
+    try:
+        loader.load(read_records(fd))
+    finally:
+        if fd is not sys.stdin:
+            fd.close()
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
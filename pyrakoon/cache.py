@@ -0,0 +1,515 @@
+# This file is part of Pyrakoon, a distributed key-value store client.
+#
+# Copyright (C) 2014 Incubaid BVBA
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''In-process cache for dirty reads
+
+Reads with `allow_dirty` set may return stale values anyway, so their
+results can be cached for a short while without changing the guarantees
+they offer. A :class:`CachingClient` serves `get`, `exists`, `multi_get`
+and `multi_get_option` calls with `allow_dirty` set from a
+:class:`ReadCache`, which is bounded by number of entries and by size,
+evicts the least recently used entries, and expires entries after a TTL.
+Keys which don't exist are cached as well (negative caching), with a
+separate TTL.
+
+Writes issued through the same client invalidate the keys they modify,
+including all steps of a `sequence`. `delete_prefix` invalidates all
+matching keys, and `user_function` clears the cache.
+
+To share a cache between worker processes, use a
+:class:`pyrakoon.shmcache.SharedReadCache` instead of a :class:`ReadCache`.
+
+Example:
+
+    >>> from pyrakoon import test
+    >>> client = CachingClient(test.FakeClient(), ReadCache(ttl=60))
+    >>> client.set('key', 'value')
+    >>> client.get('key', allow_dirty=True)
+    'value'
+    >>> client.get('key', allow_dirty=True)
+    'value'
+    >>> client.exists('other', allow_dirty=True)
+    False
+    >>> client.get('other', allow_dirty=True)
+    Traceback (most recent call last):
+        ...
+    NotFound: 'other'
+    >>> stats = client.cache.statistics
+    >>> stats['hits'], stats['misses'], stats['negative_hits']
+    (2, 2, 1)
+
+:warning: Writes by other clients are only noticed once the cached entries
+    expire. Reads without `allow_dirty` always bypass the cache.
+'''
+
+import time
+import threading
+import collections
+
+from pyrakoon import client, errors, protocol, sequence
+
+DEFAULT_MAX_ENTRIES = 10000
+'''Default maximum number of cached entries''' #pylint: disable=W0105
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+'''Default maximum size of cached keys and values''' #pylint: disable=W0105
+DEFAULT_TTL = 1.0
+'''Default time entries are cached, in seconds''' #pylint: disable=W0105
+
+ENTRY_OVERHEAD = 64
+'''Size accounted for every entry, besides its key and value
+''' #pylint: disable=W0105
+
+
+class ReadCache(object):
+    '''Bounded, thread-safe LRU cache of values by key
+
+    A value of :data:`None` denotes a key which doesn't exist.
+    '''
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES,
+        max_bytes=DEFAULT_MAX_BYTES, ttl=DEFAULT_TTL, negative_ttl=None):
+        '''Initialize a read cache
+
+        :param max_entries: Maximum number of entries
+        :type max_entries: :class:`int`
+        :param max_bytes: Maximum total size of keys and values, including
+            :data:`ENTRY_OVERHEAD` per entry
+        :type max_bytes: :class:`int`
+        :param ttl: Time entries are kept, in seconds
+        :type ttl: :class:`float`
+        :param negative_ttl: Time entries of non-existing keys are kept, in
+            seconds, defaults to `ttl`
+        :type negative_ttl: :class:`float`
+        '''
+
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        self._ttl = ttl
+        self._negative_ttl = negative_ttl if negative_ttl is not None \
+            else ttl
+
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+        self._bytes = 0
+        self._epoch = 0
+
+        self._hits = 0
+        self._negative_hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+        self._invalidations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def _size(key, value):
+        '''Calculate the accounted size of an entry'''
+
+        return ENTRY_OVERHEAD + len(key) + (len(value) if value else 0)
+
+    def _remove(self, key):
+        '''Remove an entry, returning whether it existed'''
+
+        entry = self._entries.pop(key, None)
+
+        if entry is None:
+            return False
+
+        self._bytes -= self._size(key, entry[0])
+
+        return True
+
+    def get(self, key):
+        '''Look up a key
+
+        :param key: Key to look up
+        :type key: :class:`str`
+
+        :return: Whether the key was found in the cache, and its value
+            (:data:`None` if the key doesn't exist)
+        :rtype: `(bool, str)`
+        '''
+
+        self._lock.acquire()
+        try:
+            entry = self._entries.pop(key, None)
+
+            if entry is None:
+                self._misses += 1
+                return False, None
+
+            value, expires = entry
+
+            if time.time() >= expires:
+                self._bytes -= self._size(key, value)
+                self._expirations += 1
+                self._misses += 1
+                return False, None
+
+            self._entries[key] = entry
+
+            if value is None:
+                self._negative_hits += 1
+            self._hits += 1
+
+            return True, value
+        finally:
+            self._lock.release()
+
+    epoch = property(lambda self: self._epoch,
+        doc='Number of invalidations so far, see :meth:`put`')
+
+    def put(self, key, value, epoch=None):
+        '''Store the value of a key
+
+        A value read before an invalidation may be stale, so pass the
+        :attr:`epoch` from before the read: the value is dropped if any
+        invalidation happened since.
+
+        :param key: Key
+        :type key: :class:`str`
+        :param value: Value, or :data:`None` if the key doesn't exist
+        :type value: :class:`str`
+        :param epoch: Value of :attr:`epoch` before the value was read
+        :type epoch: :class:`int`
+        '''
+
+        size = self._size(key, value)
+
+        if size > self._max_bytes:
+            return
+
+        ttl = self._ttl if value is not None else self._negative_ttl
+        entries = self._entries
+
+        self._lock.acquire()
+        try:
+            if epoch is not None and epoch != self._epoch:
+                return
+
+            self._remove(key)
+
+            entries[key] = (value, time.time() + ttl)
+            self._bytes += size
+
+            while len(entries) > self._max_entries or \
+                self._bytes > self._max_bytes:
+                key_, (value_, _) = entries.popitem(last=False)
+                self._bytes -= self._size(key_, value_)
+                self._evictions += 1
+        finally:
+            self._lock.release()
+
+    def discard(self, key):
+        '''Remove a key from the cache
+
+        :param key: Key to remove
+        :type key: :class:`str`
+        '''
+
+        self._lock.acquire()
+        try:
+            self._epoch += 1
+
+            if self._remove(key):
+                self._invalidations += 1
+        finally:
+            self._lock.release()
+
+    def discard_prefix(self, prefix):
+        '''Remove all keys starting with a prefix from the cache
+
+        :param prefix: Prefix of keys to remove
+        :type prefix: :class:`str`
+        '''
+
+        self._lock.acquire()
+        try:
+            self._epoch += 1
+
+            for key in [key for key in self._entries
+                if key.startswith(prefix)]:
+                self._remove(key)
+                self._invalidations += 1
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        '''Remove all entries'''
+
+        self._lock.acquire()
+        try:
+            self._epoch += 1
+            self._invalidations += len(self._entries)
+            self._entries.clear()
+            self._bytes = 0
+        finally:
+            self._lock.release()
+
+    @property
+    def statistics(self):
+        '''Number of entries, their size, and counters of hits (of which
+        negative hits), misses, evictions, expirations and invalidations
+
+        :type: `dict` of `str` to `int`
+        '''
+
+        self._lock.acquire()
+        try:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'hits': self._hits,
+                'negative_hits': self._negative_hits,
+                'misses': self._misses,
+                'evictions': self._evictions,
+                'expirations': self._expirations,
+                'invalidations': self._invalidations,
+            }
+        finally:
+            self._lock.release()
+
+
+def _step_keys(step):
+    '''Get all keys modified by a sequence step'''
+
+    if isinstance(step, (sequence.Set, sequence.Delete)):
+        yield step.key
+    elif isinstance(step, sequence.Sequence):
+        for step_ in step.steps:
+            for key in _step_keys(step_):
+                yield key
+
+
+_KEY_WRITES = (protocol.Set, protocol.Delete, protocol.TestAndSet,
+    protocol.Replace, protocol.Confirm)
+_READS = (protocol.Get, protocol.Exists, protocol.MultiGet,
+    protocol.MultiGetOption)
+
+
+class CachingClient(object, client.AbstractClient, client.ClientMixin):
+    '''Client wrapper serving dirty reads from a :class:`ReadCache`
+
+    See the module documentation for the calls served from the cache, and
+    the ones invalidating it. All other calls are passed to the wrapped
+    client unchanged.
+    '''
+
+    def __init__(self, client_, cache=None):
+        '''Wrap a client
+
+        :param client_: Client to wrap
+        :type client_: :class:`pyrakoon.client.AbstractClient`
+        :param cache: Cache to use
+        :type cache: :class:`ReadCache`
+        '''
+
+        super(CachingClient, self).__init__()
+
+        self._client = client_
+        self._cache = cache if cache is not None else ReadCache()
+
+    cache = property(lambda self: self._cache, doc='Read cache in use')
+
+    @property
+    def connected(self):
+        '''Check whether the wrapped client is connected'''
+
+        return self._client.connected
+
+    def _invalidate(self, message):
+        '''Remove the keys a message (possibly) modifies from the cache'''
+
+        cache = self._cache
+        type_ = type(message)
+
+        if type_ in _KEY_WRITES:
+            cache.discard(message.key)
+        elif type_ is protocol.Sequence:
+            for key in _step_keys(message.sequence):
+                cache.discard(key)
+        elif type_ is protocol.DeletePrefix:
+            cache.discard_prefix(message.prefix)
+        elif type_ is protocol.UserFunction:
+            cache.clear()
+
+    def _lookup(self, message):
+        '''Look up the result of a dirty read in the cache
+
+        :return: Cached values by key, and keys which weren't found in the
+            cache, or :data:`None` if the message can't be served from the
+            cache
+        :rtype: `(dict of str to str, list of str)`
+        '''
+
+        if not isinstance(message, _READS) or not message.allow_dirty:
+            return None
+
+        if isinstance(message, (protocol.Get, protocol.Exists)):
+            keys = [message.key]
+        else:
+            keys = message.keys
+
+        cached = {}
+        missing = []
+
+        for key in keys:
+            found, value = self._cache.get(key)
+
+            if found:
+                cached[key] = value
+            else:
+                missing.append(key)
+
+        return cached, missing
+
+    @staticmethod
+    def _result(message, values):
+        '''Build the result of a read from the values of its keys
+
+        :raise errors.NotFound: A key passed to `get` or `multi_get` doesn't
+            exist
+        '''
+
+        type_ = type(message)
+
+        if type_ is protocol.Exists:
+            return values[message.key] is not None
+
+        keys = [message.key] if type_ is protocol.Get else message.keys
+        result = [values[key] for key in keys]
+
+        if type_ is protocol.MultiGetOption:
+            return result
+
+        for key, value in zip(keys, result):
+            if value is None:
+                raise errors.NotFound(key)
+
+        return result[0] if type_ is protocol.Get else result
+
+    def _store(self, message, result, epoch):
+        '''Store the result of a read in the cache'''
+
+        type_ = type(message)
+        cache = self._cache
+
+        if type_ is protocol.Get:
+            cache.put(message.key, result, epoch)
+        elif type_ is protocol.Exists:
+            if not result:
+                cache.put(message.key, None, epoch)
+        elif type_ in (protocol.MultiGet, protocol.MultiGetOption):
+            for key, value in zip(message.keys, result):
+                cache.put(key, value, epoch)
+
+    def _process(self, message):
+        #pylint: disable=W0212
+        lookup = self._lookup(message)
+
+        if lookup is None:
+            self._invalidate(message)
+
+            try:
+                return self._client._process(message)
+            finally:
+                self._invalidate(message)
+
+        values, missing = lookup
+
+        if not missing:
+            return self._result(message, values)
+
+        if isinstance(message, (protocol.MultiGet, protocol.MultiGetOption)):
+            # Only fetch the keys which aren't cached
+            message_ = type(message)(True, missing)
+        else:
+            message_ = message
+
+        epoch = self._cache.epoch
+
+        try:
+            result = self._client._process(message_)
+        except errors.NotFound:
+            if type(message) is protocol.Get:
+                self._cache.put(message.key, None, epoch)
+            raise
+
+        self._store(message_, result, epoch)
+
+        if message_ is message:
+            return result
+
+        values.update(zip(missing, result))
+
+        return self._result(message, values)
+
+    def _pipeline(self, process, messages, max_in_flight):
+        '''Handle messages using `process`, serving reads which are fully
+        cached without sending them'''
+
+        pending = collections.deque()
+
+        def feed():
+            '''Queue messages, skipping cached reads'''
+
+            for message in messages:
+                lookup = self._lookup(message)
+
+                if lookup is not None and not lookup[1]:
+                    pending.append((message, lookup[0], None))
+                elif lookup is not None:
+                    pending.append((message, None, self._cache.epoch))
+                    yield message
+                else:
+                    self._invalidate(message)
+                    pending.append((message, None, None))
+                    yield message
+
+        def cached():
+            '''Yield results of cached reads at the head of the queue'''
+
+            while pending and pending[0][1] is not None:
+                message, values, _ = pending.popleft()
+                yield self._result(message, values)
+
+        for result in process(feed(), max_in_flight):
+            for result_ in cached():
+                yield result_
+
+            message, _, epoch = pending.popleft()
+
+            if epoch is not None:
+                self._store(message, result, epoch)
+            else:
+                self._invalidate(message)
+
+            yield result
+
+        for result_ in cached():
+            yield result_
+
+    def _process_pipelined(self, messages, max_in_flight=None):
+        return self._pipeline(
+            self._client._process_pipelined, #pylint: disable=W0212
+            messages, max_in_flight)
+
+    def _process_spread(self, messages, max_in_flight=None):
+        return self._pipeline(
+            self._client._process_spread, #pylint: disable=W0212
+            messages, max_in_flight)
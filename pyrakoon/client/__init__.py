@@ -16,9 +16,14 @@
 
 '''Arakoon client interface'''
 
+import functools
+import collections
+
 from pyrakoon import errors, protocol
+import pyrakoon.trace
 import pyrakoon.utils
-from pyrakoon.client.utils import call
+from pyrakoon.client.utils import call, chunk_keys, page_range, \
+    prefix_upper_bound, validate_types
 
 class ClientMixin: #pylint: disable=W0232,R0904,old-style-class
     '''Mixin providing client actions for standard cluster functionality
@@ -26,6 +31,25 @@ class ClientMixin: #pylint: disable=W0232,R0904,old-style-class
     This can be mixed into any class implementing :class:`AbstractClient`.
     '''
 
+    #pylint: disable=pointless-string-statement
+    MULTI_GET_CHUNK_KEYS = 1000
+    '''Maximum number of keys sent in a single *multi_get* message
+
+    :type: :class:`int`
+    '''
+
+    MULTI_GET_CHUNK_BYTES = 64 * 1024
+    '''Maximum size of the keys sent in a single *multi_get* message
+
+    :type: :class:`int`
+    '''
+
+    MULTI_GET_MAX_IN_FLIGHT = 4
+    '''Maximum number of outstanding *multi_get* chunks per connection
+
+    :type: :class:`int`
+    '''
+
     #pylint: disable=C0111
     @call(protocol.Hello)
     def hello(self): #pylint: disable=R0201
@@ -71,14 +95,6 @@ class ClientMixin: #pylint: disable=W0232,R0904,old-style-class
     def range_entries(self): #pylint: disable=R0201
         assert False
 
-    @call(protocol.MultiGet)
-    def multi_get(self): #pylint: disable=R0201
-        assert False
-
-    @call(protocol.MultiGetOption)
-    def multi_get_option(self): #pylint: disable=R0201
-        assert False
-
     @call(protocol.ExpectProgressPossible)
     def expect_progress_possible(self): #pylint: disable=R0201
         assert False
@@ -130,6 +146,139 @@ class ClientMixin: #pylint: disable=W0232,R0904,old-style-class
     @call(protocol.GetCurrentState)
     def get_current_state(self): #pylint: disable=R0201
         assert False
+    #pylint: enable=C0111
+
+    #pylint: disable=R0913
+    def iter_range(self, begin_key, begin_inclusive, end_key, end_inclusive,
+        page_size, with_values=False, allow_dirty=False):
+        '''Iterate over all keys in a range, one page at a time
+
+        Unlike :meth:`range` and :meth:`range_entries`, this doesn't return
+        all matching items in a single reply: at most `page_size` items are
+        requested per call, resuming right after the last key received.
+
+        :param begin_key: Begin of range
+        :type begin_key: :class:`str` or :data:`None`
+        :param begin_inclusive: `begin_key` is in- or exclusive
+        :type begin_inclusive: :class:`bool`
+        :param end_key: End of range
+        :type end_key: :class:`str` or :data:`None`
+        :param end_inclusive: `end_key` is in- or exclusive
+        :type end_inclusive: :class:`bool`
+        :param page_size: Maximum number of items to retrieve per call
+        :type page_size: :class:`int`
+        :param with_values: Yield `(key, value)` pairs instead of keys
+        :type with_values: :class:`bool`
+        :param allow_dirty: Allow reads from slave nodes
+        :type allow_dirty: :class:`bool`
+
+        :return: Iterator over matching keys or `(key, value)` pairs
+        :rtype: iterator of :class:`str` or `(str, str)`
+        '''
+
+        method = self.range_entries if with_values else self.range
+
+        fetch = lambda begin_key, begin_inclusive, end_key, end_inclusive, \
+            max_elements: method(begin_key, begin_inclusive, end_key,
+                end_inclusive, max_elements, allow_dirty)
+
+        return page_range(fetch, begin_key, begin_inclusive, end_key,
+            end_inclusive, page_size, with_values)
+
+    def iter_prefix(self, prefix, page_size, with_values=False,
+        allow_dirty=False):
+        '''Iterate over all keys matching a prefix, one page at a time
+
+        :param prefix: Prefix to match
+        :type prefix: :class:`str`
+        :param page_size: Maximum number of items to retrieve per call
+        :type page_size: :class:`int`
+        :param with_values: Yield `(key, value)` pairs instead of keys
+        :type with_values: :class:`bool`
+        :param allow_dirty: Allow reads from slave nodes
+        :type allow_dirty: :class:`bool`
+
+        :return: Iterator over matching keys or `(key, value)` pairs
+        :rtype: iterator of :class:`str` or `(str, str)`
+
+        :see: :meth:`iter_range`
+        '''
+
+        return self.iter_range(prefix, True, prefix_upper_bound(prefix),
+            False, page_size, with_values, allow_dirty)
+
+    def _multi_get_chunked(self, message_type, keys, allow_dirty):
+        '''Look up a list of keys, using several messages if required
+
+        The keys are split in chunks bounded by :attr:`MULTI_GET_CHUNK_KEYS`
+        and :attr:`MULTI_GET_CHUNK_BYTES`. Chunks are pipelined, or spread
+        over all nodes when `allow_dirty` is set, and their results are
+        concatenated in order.
+        '''
+
+        if not self.connected:
+            raise NotConnectedError('Not connected')
+
+        validate_types(message_type.ARGS, (allow_dirty, keys))
+
+        chunks = list(chunk_keys(keys, self.MULTI_GET_CHUNK_KEYS,
+            self.MULTI_GET_CHUNK_BYTES))
+
+        if len(chunks) <= 1:
+            return self._process( #pylint: disable=E1101
+                message_type(allow_dirty, keys))
+
+        messages = (message_type(allow_dirty, chunk) for chunk in chunks)
+
+        if allow_dirty:
+            process = self._process_spread #pylint: disable=E1101
+        else:
+            process = self._process_pipelined #pylint: disable=E1101
+
+        result = []
+        for values in process(messages, self.MULTI_GET_MAX_IN_FLIGHT):
+            result.extend(values)
+
+        return result
+
+    def multi_get(self, keys, allow_dirty=False):
+        '''Send a "multi_get" command to the server
+
+        This method returns a list of the values for all requested keys.
+
+        Large lists of keys are transparently split in several messages, see
+        :attr:`MULTI_GET_CHUNK_KEYS` and :attr:`MULTI_GET_CHUNK_BYTES`.
+
+        :param keys: Keys to look up
+        :type keys: iterable of :class:`str`
+        :param allow_dirty: Allow reads from slave nodes
+        :type allow_dirty: :class:`bool`
+
+        :return: Requested values
+        :rtype: iterable of :class:`str`
+        '''
+
+        return self._multi_get_chunked(protocol.MultiGet, keys, allow_dirty)
+
+    def multi_get_option(self, keys, allow_dirty=False):
+        '''Send a "multi_get_option" command to the server
+
+        This method returns a list of value options for all requested keys.
+
+        Large lists of keys are transparently split in several messages, see
+        :attr:`MULTI_GET_CHUNK_KEYS` and :attr:`MULTI_GET_CHUNK_BYTES`.
+
+        :param keys: Keys to look up
+        :type keys: iterable of :class:`str`
+        :param allow_dirty: Allow reads from slave nodes
+        :type allow_dirty: :class:`bool`
+
+        :return: Requested values
+        :rtype: iterable of (`str` or `None`)
+        '''
+
+        return self._multi_get_chunked(protocol.MultiGetOption, keys,
+            allow_dirty)
 
     __getitem__ = get
     __setitem__ = set
@@ -176,6 +325,55 @@ class AbstractClient: #pylint: disable=W0232,R0903,R0922,old-style-class
 
         raise NotImplementedError
 
+    def _process_pipelined(self, messages, max_in_flight=None):
+        '''
+        Submit several messages to the server, yielding their results in order
+
+        Implementations can pipeline the given `messages` over a single
+        connection, i.e. submit a message before the result of the previous
+        one was received, keeping at most `max_in_flight` messages
+        outstanding. The `messages` iterable is consumed lazily, so it can be
+        used to apply backpressure.
+
+        The default implementation handles all messages one by one using
+        :meth:`_process`.
+
+        :param messages: Messages to handle
+        :type messages: iterable of :class:`pyrakoon.protocol.Message`
+        :param max_in_flight: Maximum number of outstanding messages, or
+            :data:`None` for no limit
+        :type max_in_flight: :class:`int`
+
+        :return: Iterator over the server result values
+        :rtype: iterator of :obj:`object`
+        '''
+
+        for message in messages:
+            yield self._process(message)
+
+    def _process_spread(self, messages, max_in_flight=None):
+        '''
+        Submit several read-only messages, which may be handled by any node
+
+        This is used for messages with the `allow_dirty` flag set.
+        Implementations which are connected to several nodes of a cluster can
+        spread the given `messages` over these nodes. Results must be yielded
+        in the order of `messages`.
+
+        The default implementation calls :meth:`_process_pipelined`.
+
+        :param messages: Messages to handle
+        :type messages: iterable of :class:`pyrakoon.protocol.Message`
+        :param max_in_flight: Maximum number of outstanding messages per
+            node, or :data:`None` for no limit
+        :type max_in_flight: :class:`int`
+
+        :return: Iterator over the server result values
+        :rtype: iterator of :obj:`object`
+        '''
+
+        return self._process_pipelined(messages, max_in_flight)
+
 
 #pylint: disable=R0904
 class SocketClient(object, AbstractClient):
@@ -185,6 +383,18 @@ class SocketClient(object, AbstractClient):
         not intended to be used in real-world code.
     '''
 
+    instrumentation = None
+    '''Instrumentation recording the outcome of every request
+
+    :type: :class:`pyrakoon.instrument.Instrumentation`
+    ''' #pylint: disable=W0105
+
+    tracer = None
+    '''Tracer notified of the progress of every request
+
+    :type: :class:`pyrakoon.trace.Tracer`
+    ''' #pylint: disable=W0105
+
     def __init__(self, address, cluster_id):
         '''
         :param address: Node address (host & port)
@@ -218,22 +428,159 @@ class SocketClient(object, AbstractClient):
 
         return self._socket is not None
 
+    def _recv(self, count):
+        '''Read exactly `count` bytes from the socket'''
+
+        parts = []
+
+        while count > 0:
+            data = self._socket.recv(count)
+
+            if not data:
+                raise EOFError('Connection closed by peer')
+
+            parts.append(data)
+            count -= len(data)
+
+        return ''.join(parts)
+
+    def _disconnect(self):
+        '''Close the socket after a failure, leaving the client disconnected'''
+
+        try:
+            if self._socket:
+                self._socket.close()
+        finally:
+            self._socket = None
+
     def _process(self, message):
+        process = self._process_message
+
+        tracer = self.tracer
+
+        if tracer is not None and tracer.sample(message):
+            process = functools.partial(process, trace=pyrakoon.trace.Trace(
+                tracer, type(message), self._address, message))
+
+        instrumentation = self.instrumentation
+
+        if instrumentation is not None:
+            return instrumentation.process(process, message)
+
+        return process(message)
+
+    def _process_message(self, message, trace=None, counts=None):
+        '''Send a message and read its result
+
+        :param message: Message to send
+        :type message: :class:`pyrakoon.protocol.Message`
+        :param trace: Trace to record the progress of the request in
+        :type trace: :class:`pyrakoon.trace.Trace`
+        :param counts: Counts to add the bytes sent and received to
+        :type counts: :class:`pyrakoon.instrument.ByteCounts`
+        '''
+
+        parts = message.serialize()
+        read = self._recv
+
+        if trace is not None or counts is not None:
+            parts = [''.join(parts)]
+
+        if trace is not None:
+            trace.mark_serialized(len(parts[0]))
+            read = trace.reader(read)
+
+        if counts is not None:
+            counts.sent += len(parts[0])
+            read = counts.reader(read)
+
         self._lock.acquire()
 
         try:
-            for part in message.serialize():
+            if trace is not None:
+                trace.mark_acquired()
+
+            for part in parts:
                 self._socket.sendall(part)
 
-            return pyrakoon.utils.read_blocking(
-                message.receive(), self._socket.recv)
+            if trace is not None:
+                trace.mark_sent()
+
+            result = pyrakoon.utils.read_blocking(message.receive(), read)
+
+            if trace is not None:
+                trace.mark_decoded()
+
+            return result
         except Exception as exc:
             if not isinstance(exc, errors.ArakoonError):
+                self._disconnect()
+
+            if trace is not None:
+                trace.mark_failed(exc)
+
+            raise
+        finally:
+            self._lock.release()
+
+    def _process_pipelined(self, messages, max_in_flight=None):
+        '''
+        Submit several messages over the connection, yielding their results
+
+        The connection is locked until the returned iterator is exhausted or
+        closed. When the server returns an error for any of the messages, no
+        further messages are submitted, the results of all outstanding
+        messages are read (and discarded), and the first error is raised.
+
+        :see: :meth:`AbstractClient._process_pipelined`
+        '''
+
+        messages = iter(messages)
+        outstanding = collections.deque()
+        exhausted = False
+        error = None
+
+        self._lock.acquire()
+
+        try:
+            while True:
+                while not exhausted and error is None and \
+                    (max_in_flight is None or len(outstanding) < max_in_flight):
+                    try:
+                        message = messages.next()
+                    except StopIteration:
+                        exhausted = True
+                        break
+
+                    self._socket.sendall(''.join(message.serialize()))
+                    outstanding.append(message)
+
+                if not outstanding:
+                    break
+
+                message = outstanding.popleft()
+
                 try:
-                    if self._socket:
-                        self._socket.close()
-                finally:
-                    self._socket = None
+                    result = pyrakoon.utils.read_blocking(
+                        message.receive(), self._recv)
+                except errors.ArakoonError as exc:
+                    error = error or exc
+                    continue
+
+                if error is None:
+                    yield result
+
+            if error is not None:
+                raise error #pylint: disable=E0702
+        except GeneratorExit:
+            # Results of outstanding messages won't be read anymore
+            if outstanding:
+                self._disconnect()
+
+            raise
+        except Exception as exc:
+            if not isinstance(exc, errors.ArakoonError):
+                self._disconnect()
 
             raise
         finally:
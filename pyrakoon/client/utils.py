@@ -102,3 +102,151 @@ def call(message_type):
         return wrapped
 
     return wrapper
+
+
+def prefix_upper_bound(prefix):
+    '''Calculate the exclusive upper bound of all keys matching a prefix
+
+    Any key starting with `prefix` is strictly smaller than the returned key,
+    and any key which doesn't start with `prefix` but is larger than it, is
+    larger than or equal to the returned key.
+
+    If no such bound exists (i.e. the prefix is empty, or consists of
+    ``\\xff`` characters only), :data:`None` is returned.
+
+    Example:
+
+        >>> prefix_upper_bound('abc')
+        'abd'
+        >>> prefix_upper_bound('ab\\xff\\xff')
+        'ac'
+        >>> print prefix_upper_bound('\\xff')
+        None
+        >>> print prefix_upper_bound('')
+        None
+
+    :param prefix: Key prefix
+    :type prefix: :class:`str`
+
+    :return: Exclusive upper bound of the prefix range
+    :rtype: :class:`str` or :data:`None`
+    '''
+
+    stripped = prefix.rstrip('\xff')
+
+    if not stripped:
+        return None
+
+    return stripped[:-1] + chr(ord(stripped[-1]) + 1)
+
+
+#pylint: disable=R0913
+def page_range(fetch, begin_key, begin_inclusive, end_key, end_inclusive,
+    page_size, entries=False):
+    '''Iterate over a key range, retrieving it page by page
+
+    The given `fetch` callable should have the signature of
+    :meth:`pyrakoon.client.ClientMixin.range` or
+    :meth:`pyrakoon.client.ClientMixin.range_entries`, i.e. take a begin key,
+    begin inclusion flag, end key, end inclusion flag and maximum number of
+    elements. Every page is requested starting right after the last key
+    returned by the previous page, until a short page is received.
+
+    Example:
+
+        >>> keys = ['a', 'b', 'c', 'd', 'e']
+        >>> def fetch(begin_key, begin_inclusive, end_key, end_inclusive,
+        ...     max_elements):
+        ...     print 'fetch from %r' % begin_key
+        ...     matches = [k for k in keys
+        ...         if (k >= begin_key if begin_inclusive else k > begin_key)
+        ...         and (end_key is None or k < end_key)]
+        ...     return matches[:max_elements]
+
+        >>> list(page_range(fetch, 'b', True, None, False, 2))
+        fetch from 'b'
+        fetch from 'c'
+        fetch from 'e'
+        ['b', 'c', 'd', 'e']
+
+    :param fetch: Callable used to retrieve a single page
+    :type fetch: `callable`
+    :param begin_key: Begin of range
+    :type begin_key: :class:`str` or :data:`None`
+    :param begin_inclusive: `begin_key` is in- or exclusive
+    :type begin_inclusive: :class:`bool`
+    :param end_key: End of range
+    :type end_key: :class:`str` or :data:`None`
+    :param end_inclusive: `end_key` is in- or exclusive
+    :type end_inclusive: :class:`bool`
+    :param page_size: Maximum number of items to retrieve per call
+    :type page_size: :class:`int`
+    :param entries: Whether `fetch` returns `(key, value)` pairs
+    :type entries: :class:`bool`
+
+    :return: Iterator over all keys or `(key, value)` pairs in the range
+    :rtype: iterator of :class:`str` or `(str, str)`
+
+    :raise ValueError: `page_size` is not positive
+    '''
+
+    if page_size <= 0:
+        raise ValueError('Invalid page size %r' % page_size)
+
+    while True:
+        page = fetch(begin_key, begin_inclusive, end_key, end_inclusive,
+            page_size)
+
+        for item in page:
+            yield item
+
+        if len(page) < page_size:
+            return
+
+        last = page[-1]
+        begin_key = last[0] if entries else last
+        begin_inclusive = False
+
+
+def chunk_keys(keys, max_count, max_bytes):
+    '''Split a list of keys in chunks
+
+    Every chunk contains at most `max_count` keys, and at most `max_bytes`
+    bytes of (serialized) keys, unless a single key exceeds this limit.
+
+    Example:
+
+        >>> list(chunk_keys(['a', 'b', 'c', 'd', 'e'], 2, 1024))
+        [['a', 'b'], ['c', 'd'], ['e']]
+        >>> list(chunk_keys(['aaaa', 'b', 'c'], 10, 10))
+        [['aaaa'], ['b', 'c']]
+
+    :param keys: Keys to split
+    :type keys: iterable of :class:`str`
+    :param max_count: Maximum number of keys in a chunk
+    :type max_count: :class:`int`
+    :param max_bytes: Maximum size of the keys in a chunk
+    :type max_bytes: :class:`int`
+
+    :return: Iterator over chunks of keys
+    :rtype: iterator of `[str]`
+    '''
+
+    chunk = []
+    chunk_size = 0
+
+    for key in keys:
+        # Every key is prefixed by its length
+        size = len(key) + 4
+
+        if chunk and (len(chunk) >= max_count or chunk_size + size > max_bytes):
+            yield chunk
+
+            chunk = []
+            chunk_size = 0
+
+        chunk.append(key)
+        chunk_size += size
+
+    if chunk:
+        yield chunk
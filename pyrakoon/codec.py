@@ -0,0 +1,450 @@
+# This file is part of Pyrakoon, a distributed key-value store client.
+#
+# Copyright (C) 2014 Incubaid BVBA
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''Transparent compression of values
+
+A :class:`CodecClient` wraps any other client, compressing values larger
+than a threshold before they're sent to the server, and decompressing them
+when they're retrieved.
+
+Encoded values start with a small header: the magic string
+:data:`MAGIC`, the identifier of the codec used (a single byte) and the
+length of the original value (32-bit, little-endian). Values without this
+header are returned as-is, so values stored before compression was enabled
+remain readable.
+
+Example:
+
+    >>> from pyrakoon import test
+    >>> inner = test.FakeClient()
+    >>> client = CodecClient(inner, ValueCodec(threshold=16))
+    >>> client.set('key', 'value ' * 100)
+    >>> len(inner.get('key'))
+    29
+    >>> client.get('key') == 'value ' * 100
+    True
+    >>> client.set('small', 'value')
+    >>> inner.get('small')
+    'value'
+'''
+
+import time
+import zlib
+import struct
+import logging
+import threading
+import collections
+
+from pyrakoon import client, protocol, sequence
+
+LOGGER = logging.getLogger(__name__)
+'''Logger for code in this module''' #pylint: disable=W0105
+
+MAGIC = '\x00\xffPC'
+'''Magic string at the start of every encoded value''' #pylint: disable=W0105
+DEFAULT_THRESHOLD = 512
+'''Default minimal size of values to compress''' #pylint: disable=W0105
+
+_HEADER = struct.Struct('<%dsBI' % len(MAGIC))
+
+def _wrap(codec, value, encoded):
+    '''Prepend a header to an encoded value'''
+
+    return _HEADER.pack(MAGIC, codec.ID, len(value)) + encoded
+
+
+class Codec(object):
+    '''Base class for value codecs'''
+
+    ID = None
+    '''Identifier of the codec, stored in value headers
+
+    :type: :class:`int`
+    ''' #pylint: disable=W0105
+
+    NAME = None
+    '''Name of the codec, used in statistics
+
+    :type: :class:`str`
+    ''' #pylint: disable=W0105
+
+    def encode(self, data):
+        '''Encode data
+
+        :param data: Data to encode
+        :type data: :class:`str`
+
+        :return: Encoded data
+        :rtype: :class:`str`
+        '''
+
+        raise NotImplementedError
+
+    def decode(self, data):
+        '''Decode data
+
+        :param data: Data to decode
+        :type data: :class:`str`
+
+        :return: Decoded data
+        :rtype: :class:`str`
+        '''
+
+        raise NotImplementedError
+
+
+class IdentityCodec(Codec):
+    '''Codec which leaves data untouched
+
+    This is used for small values which happen to start with :data:`MAGIC`.
+    '''
+
+    ID = 0
+    NAME = 'identity'
+
+    def encode(self, data):
+        return data
+
+    def decode(self, data):
+        return data
+
+
+class ZlibCodec(Codec):
+    '''Codec using :mod:`zlib` compression'''
+
+    ID = 1
+    NAME = 'zlib'
+
+    def __init__(self, level=6):
+        '''Initialize a zlib codec
+
+        :param level: Compression level
+        :type level: :class:`int`
+        '''
+
+        super(ZlibCodec, self).__init__()
+
+        self._level = level
+
+    def encode(self, data):
+        return zlib.compress(data, self._level)
+
+    def decode(self, data):
+        return zlib.decompress(data)
+
+
+class CodecStatistics(object): #pylint: disable=R0902
+    '''Statistics of a single codec'''
+
+    def __init__(self):
+        self.encoded = 0
+        self.encoded_bytes_in = 0
+        self.encoded_bytes_out = 0
+        self.encode_time = 0.0
+        self.skipped = 0
+        self.decoded = 0
+        self.decoded_bytes_in = 0
+        self.decoded_bytes_out = 0
+        self.decode_time = 0.0
+
+    @property
+    def ratio(self):
+        '''Compression ratio of all encoded values'''
+
+        if not self.encoded_bytes_out:
+            return 1.0
+
+        return float(self.encoded_bytes_in) / self.encoded_bytes_out
+
+    def __repr__(self):
+        return '<CodecStatistics encoded=%d skipped=%d decoded=%d ' \
+            'ratio=%.2f encode_time=%.3fs decode_time=%.3fs>' % (
+                self.encoded, self.skipped, self.decoded, self.ratio,
+                self.encode_time, self.decode_time)
+
+
+class ValueCodec(object):
+    '''Encode and decode values using a codec, above a size threshold
+
+    Values are only stored encoded if this makes them smaller. Statistics
+    are kept per codec, including the processor time spent encoding and
+    decoding.
+    '''
+
+    def __init__(self, codec=None, threshold=DEFAULT_THRESHOLD):
+        '''Initialize a value codec
+
+        :param codec: Codec used to encode values, a :class:`ZlibCodec` by
+            default
+        :type codec: :class:`Codec`
+        :param threshold: Minimal size of values to encode
+        :type threshold: :class:`int`
+        '''
+
+        self._codec = codec or ZlibCodec()
+        self._threshold = threshold
+        self._identity = IdentityCodec()
+
+        self._decoders = {
+            self._identity.ID: self._identity,
+            self._codec.ID: self._codec,
+        }
+
+        self._lock = threading.Lock()
+        self._statistics = collections.defaultdict(CodecStatistics)
+
+    @property
+    def statistics(self):
+        '''Statistics per codec name
+
+        :type: `dict` of `str` to :class:`CodecStatistics`
+        '''
+
+        self._lock.acquire()
+        try:
+            return dict(self._statistics)
+        finally:
+            self._lock.release()
+
+    def encode(self, value):
+        '''Encode a value
+
+        :param value: Value to encode
+        :type value: :class:`str`
+
+        :return: Value to store
+        :rtype: :class:`str`
+        '''
+
+        if len(value) < self._threshold:
+            if value.startswith(MAGIC):
+                return _wrap(self._identity, value, value)
+
+            return value
+
+        start = time.clock()
+        encoded = self._codec.encode(value)
+        elapsed = time.clock() - start
+
+        self._lock.acquire()
+        try:
+            stats = self._statistics[self._codec.NAME]
+            stats.encode_time += elapsed
+
+            if len(encoded) + _HEADER.size < len(value):
+                stats.encoded += 1
+                stats.encoded_bytes_in += len(value)
+                stats.encoded_bytes_out += len(encoded) + _HEADER.size
+            else:
+                stats.skipped += 1
+                encoded = None
+        finally:
+            self._lock.release()
+
+        if encoded is None:
+            if value.startswith(MAGIC):
+                return _wrap(self._identity, value, value)
+
+            return value
+
+        return _wrap(self._codec, value, encoded)
+
+    def decode(self, value):
+        '''Decode a stored value
+
+        Values without a valid header are returned unchanged.
+
+        :param value: Stored value
+        :type value: :class:`str`
+
+        :return: Original value
+        :rtype: :class:`str`
+        '''
+
+        if not value.startswith(MAGIC) or len(value) < _HEADER.size:
+            return value
+
+        _, codec_id, length = _HEADER.unpack_from(value)
+        codec = self._decoders.get(codec_id, None)
+
+        if codec is None:
+            LOGGER.warning('Unknown codec %d, returning raw value', codec_id)
+            return value
+
+        start = time.clock()
+        try:
+            decoded = codec.decode(value[_HEADER.size:])
+        except Exception: #pylint: disable=W0703
+            LOGGER.warning('Unable to decode value, returning raw value')
+            return value
+        elapsed = time.clock() - start
+
+        if len(decoded) != length:
+            LOGGER.warning('Decoded value length mismatch, returning raw '
+                'value')
+            return value
+
+        if codec is not self._identity:
+            self._lock.acquire()
+            try:
+                stats = self._statistics[codec.NAME]
+                stats.decoded += 1
+                stats.decoded_bytes_in += len(value)
+                stats.decoded_bytes_out += len(decoded)
+                stats.decode_time += elapsed
+            finally:
+                self._lock.release()
+
+        return decoded
+
+    def encode_option(self, value):
+        '''Encode a value, unless it's :data:`None`'''
+
+        return self.encode(value) if value is not None else None
+
+    def decode_option(self, value):
+        '''Decode a value, unless it's :data:`None`'''
+
+        return self.decode(value) if value is not None else None
+
+
+class CodecClient(object, client.AbstractClient, client.ClientMixin):
+    '''Client wrapper encoding and decoding values using a
+    :class:`ValueCodec`
+
+    Values passed to `set`, `replace`, `test_and_set`, `confirm`, `assert_`
+    and the `Set` and `Assert` steps of a `sequence` are encoded. Values
+    returned by `get`, `multi_get`, `multi_get_option`, `range_entries`,
+    `rev_range_entries`, `test_and_set` and `replace` are decoded. All other
+    calls are passed to the wrapped client unchanged.
+
+    :note: Values are compared by the server in their stored form, so the
+        test value of `test_and_set` or an `Assert` step only matches values
+        which were stored using the same codec settings.
+    '''
+
+    def __init__(self, client_, codec=None):
+        '''Wrap a client
+
+        :param client_: Client to wrap
+        :type client_: :class:`pyrakoon.client.AbstractClient`
+        :param codec: Value codec to use
+        :type codec: :class:`ValueCodec`
+        '''
+
+        super(CodecClient, self).__init__()
+
+        self._client = client_
+        self._codec = codec or ValueCodec()
+
+    codec = property(lambda self: self._codec, doc='Value codec in use')
+
+    @property
+    def connected(self):
+        '''Check whether the wrapped client is connected'''
+
+        return self._client.connected
+
+    def _encode_step(self, step):
+        '''Encode the values in a sequence step'''
+
+        codec = self._codec
+
+        if isinstance(step, sequence.Set):
+            return sequence.Set(step.key, codec.encode(step.value))
+        elif isinstance(step, sequence.Assert):
+            return sequence.Assert(step.key, codec.encode_option(step.value))
+        elif isinstance(step, sequence.Sequence):
+            return sequence.Sequence(
+                [self._encode_step(step_) for step_ in step.steps])
+        else:
+            return step
+
+    def _encode(self, message):
+        '''Encode the values in a message'''
+
+        codec = self._codec
+        type_ = type(message)
+
+        if type_ is protocol.Set:
+            return protocol.Set(message.key, codec.encode(message.value))
+        elif type_ is protocol.Replace:
+            return protocol.Replace(message.key,
+                codec.encode_option(message.value))
+        elif type_ is protocol.TestAndSet:
+            return protocol.TestAndSet(message.key,
+                codec.encode_option(message.test_value),
+                codec.encode_option(message.set_value))
+        elif type_ is protocol.Confirm:
+            return protocol.Confirm(message.key, codec.encode(message.value))
+        elif type_ is protocol.Assert:
+            return protocol.Assert(message.allow_dirty, message.key,
+                codec.encode_option(message.value))
+        elif type_ is protocol.Sequence:
+            return protocol.Sequence([self._encode_step(message.sequence)],
+                message.sync)
+        else:
+            return message
+
+    def _decode(self, message, result):
+        '''Decode the values in the result of a message'''
+
+        codec = self._codec
+        type_ = type(message)
+
+        if type_ is protocol.Get:
+            return codec.decode(result)
+        elif type_ in (protocol.TestAndSet, protocol.Replace):
+            return codec.decode_option(result)
+        elif type_ is protocol.MultiGet:
+            return [codec.decode(value) for value in result]
+        elif type_ is protocol.MultiGetOption:
+            return [codec.decode_option(value) for value in result]
+        elif type_ in (protocol.RangeEntries, protocol.RevRangeEntries):
+            return [(key, codec.decode(value)) for (key, value) in result]
+        else:
+            return result
+
+    def _process(self, message):
+        result = self._client._process( #pylint: disable=W0212
+            self._encode(message))
+
+        return self._decode(message, result)
+
+    def _wrap_stream(self, process, messages, max_in_flight):
+        '''Encode a stream of messages and decode their results'''
+
+        originals = collections.deque()
+
+        def encode():
+            '''Encode messages, remembering the originals'''
+
+            for message in messages:
+                originals.append(message)
+                yield self._encode(message)
+
+        for result in process(encode(), max_in_flight):
+            yield self._decode(originals.popleft(), result)
+
+    def _process_pipelined(self, messages, max_in_flight=None):
+        return self._wrap_stream(
+            self._client._process_pipelined, #pylint: disable=W0212
+            messages, max_in_flight)
+
+    def _process_spread(self, messages, max_in_flight=None):
+        return self._wrap_stream(
+            self._client._process_spread, #pylint: disable=W0212
+            messages, max_in_flight)
@@ -16,15 +16,20 @@
 
 '''Compatibility layer for the original Arakoon Python client'''
 
+import sys
 import time
 import random
 import select
 import socket
 import logging
+import itertools
 import functools
 import threading
+import collections
 
-from pyrakoon import client, errors, protocol, sequence, utils
+from pyrakoon import client, errors, metrics, protocol, sequence, utils
+from pyrakoon.client.utils import chunk_keys, validate_types
+from pyrakoon.retry import RetryPolicy
 
 __docformat__ = 'epytext'
 
@@ -50,6 +55,8 @@ __docformat__ = 'epytext'
 
 LOGGER = logging.getLogger(__name__)
 
+_UNROUTED = object()
+
 def _add_handler():
     if hasattr(logging, 'NullHandler'):
         handler = logging.NullHandler() #pylint: disable=E1101
@@ -141,8 +148,33 @@ def _convert_exceptions(fun):
     return wrapped
 
 
+def _convert_exceptions_iter(iterable):
+    '''
+    Iterate over `iterable`, converting `pyrakoon` exceptions raised while
+    doing so into suitable `ArakoonException` instances
+    '''
+
+    iterator = iter(iterable)
+
+    while True:
+        try:
+            item = iterator.next()
+        except StopIteration:
+            return
+        except Exception, exc:
+            new_exception = _convert_exception(exc)
+
+            if new_exception is exc:
+                raise
+
+            raise new_exception
+
+        yield item
+
+
 class ArakoonClient(object):
-    def __init__(self, config):
+    def __init__(self, config, rateLimiter=None, instrumentation=None,
+        tracer=None, router=None, scatter=None):
         """
         Constructor of an Arakoon client object.
 
@@ -153,9 +185,27 @@ class ArakoonClient(object):
         @type config: L{ArakoonClientConfig}
         @param config: The L{ArakoonClientConfig} object to be used by the client. Defaults to None in which
             case a default L{ArakoonClientConfig} object will be created.
+        @type rateLimiter: L{pyrakoon.ratelimit.RateLimiter}
+        @param rateLimiter: Rate limiter applied to all requests, which can be
+            shared by several clients. Defaults to None, i.e. no limits.
+        @type instrumentation: L{pyrakoon.instrument.Instrumentation}
+        @param instrumentation: Instrumentation recording the latency of all
+            requests, which can be shared by several clients. Defaults to None.
+        @type tracer: L{pyrakoon.trace.Tracer}
+        @param tracer: Tracer notified of the progress of every request.
+            Defaults to None.
+        @type router: L{pyrakoon.routing.RendezvousRouter}
+        @param router: Router picking the node handling every read which
+            allows dirty results. Defaults to None, i.e. such reads are
+            handled by the master, or spread round-robin.
+        @type scatter: L{pyrakoon.scatter.Scatter}
+        @param scatter: Partitioning of the keys of large multi-gets which
+            allow dirty results over all nodes. Defaults to None, i.e. such
+            multi-gets are split in chunks of a fixed size.
         """
 
-        self._client = _ArakoonClient(config)
+        self._client = _ArakoonClient(config, rateLimiter, instrumentation,
+            tracer, router, scatter)
 
         # Keep a reference, for compatibility reasons
         self._config = config
@@ -389,6 +439,30 @@ class ArakoonClient(object):
 
         return result
 
+    @utils.update_argspec('self', 'keyPrefix', 'pageSize', ('withValues', False))
+    @_convert_exceptions
+    @_validate_signature('string', 'int', 'bool')
+    def iter_prefix(self, keyPrefix, pageSize, withValues=False):
+        """
+        Iterate over all keys that match with the provided prefix.
+
+        Contrary to L{prefix}, the keys are retrieved in pages of at most
+        pageSize elements, so arbitrarily large prefixes can be walked.
+
+        @type keyPrefix: string
+        @type pageSize: integer
+        @type withValues: boolean
+        @param keyPrefix: The prefix that will be used when pattern matching the keys in the store
+        @param pageSize: The maximum number of keys to retrieve in a single call
+        @param withValues: Whether to yield (key, value) tuples instead of keys
+
+        @rtype: iterator of strings or (string, string) tuples
+        @return: Returns an iterator over the keys (or key-value pairs) matching the provided prefix
+        """
+
+        return _convert_exceptions_iter(
+            self._client.iter_prefix(keyPrefix, pageSize, withValues))
+
     @utils.update_argspec('self')
     @_convert_exceptions
     def whoMaster(self):
@@ -613,6 +687,37 @@ class ArakoonClient(object):
     def dropConnections(self):
         return self._client.drop_connections()
 
+    def broadcast(self, call, timeout=None):
+        """
+        Run a request on all configured nodes concurrently
+
+        Every node is contacted over a separate connection, so the total
+        duration is bounded by the slowest node, or the timeout.
+
+        @type call: L{pyrakoon.protocol.Message} or callable
+        @param call: The message to send to every node, or a callable taking a L{pyrakoon.broadcast.NodeClient}
+        @type timeout: float
+        @param timeout: Time to wait for the nodes, in seconds. Defaults to the connection timeout.
+
+        @rtype: dict
+        @return: Returns a dictionary mapping node identifiers to the result of the call, or the exception it raised
+        """
+
+        from pyrakoon import broadcast as broadcast_
+
+        if timeout is None:
+            timeout = ArakoonClientConfig.getConnectionTimeout()
+
+        nodes = dict((node_id, self._config.getNodeLocation(node_id))
+            for node_id in self._config.getNodes())
+
+        results = broadcast_.broadcast(nodes, self._config.getClusterId(),
+            call, timeout)
+
+        return dict((node_id, _convert_exception(result)
+                if isinstance(result, Exception) else result)
+            for (node_id, result) in results.iteritems())
+
 
 # Exception types
 # This is mostly a copy from the ArakoonExceptions module, with some cosmetic
@@ -795,7 +900,7 @@ ARA_CFG_NO_MASTER_RETRY = 60
 
 class ArakoonClientConfig :
 
-    def __init__ (self, clusterId, nodes):
+    def __init__ (self, clusterId, nodes, retryPolicy=None):
         """
         Constructor of an ArakoonClientConfig object
 
@@ -815,10 +920,16 @@ class ArakoonClientConfig :
         @param clusterId: name of the cluster
         @type nodes: dict
         @param nodes: A dictionary containing the locations for the server nodes
+        @type retryPolicy: L{pyrakoon.retry.RetryPolicy}
+        @param retryPolicy: Policy deciding whether and when failed requests
+            are retried. Defaults to None, i.e. a policy based on the
+            L{ARA_CFG_TRY_CNT}, L{ARA_CFG_CONN_BACKOFF} and
+            L{ARA_CFG_NO_MASTER_RETRY} globals.
 
         """
         self._clusterId = clusterId
         self._nodes = nodes
+        self._retryPolicy = retryPolicy
 
     @staticmethod
     def getNoMasterRetryPeriod() :
@@ -900,152 +1011,723 @@ class ArakoonClientConfig :
     def getClusterId(self):
         return self._clusterId
 
+    def getRetryPolicy(self):
+        """
+        Retrieve the policy deciding whether and when failed requests are retried
+
+        Unless a policy was passed to the constructor, the policy retries a
+        request for at most L{getNoMasterRetryPeriod} seconds, waiting at most
+        L{getBackoffInterval} seconds between attempts, and makes at most
+        L{getTryCount} attempts after failures of the connection.
+
+        @rtype: L{pyrakoon.retry.RetryPolicy}
+        @return: The retry policy
+        """
+        if self._retryPolicy is not None:
+            return self._retryPolicy
+
+        return RetryPolicy(cap=float(self.getBackoffInterval()),
+            deadline=float(self.getNoMasterRetryPeriod()),
+            tries=self.getTryCount())
+
 # Actual client implementation
 class _ArakoonClient(object, client.AbstractClient, client.ClientMixin):
-    def __init__(self, config):
+    def __init__(self, config, limiter=None, instrumentation=None,
+        tracer=None, router=None, scatter=None):
         self._config = config
+        self._limiter = limiter
+        self._instrumentation = instrumentation
+        self._tracer = tracer
+        self._router = router
+        self._scatter = scatter
         self.master_id = None
+        self._last_master_id = None
 
+        # The lock only guards master discovery and the connection
+        # generation. Requests are sent over connections private to the
+        # calling thread, so threads don't wait for each other.
         self._lock = threading.RLock()
-        self._connections = dict()
+        self._local = threading.local()
+        self._generation = 0
 
     @property
     def connected(self):
         return True
 
+    @property
+    def _connections(self):
+        # Connections of the calling thread, by node identifier. Connections
+        # dropped by `drop_connections` (in any thread) are closed first.
+        local = self._local
+        connections = getattr(local, 'connections', None)
+
+        if connections is None or local.generation != self._generation:
+            for connection in (connections or {}).itervalues():
+                try:
+                    connection.close()
+                except Exception:
+                    LOGGER.exception('Error while closing connection')
+
+            connections = local.connections = {}
+            local.generation = self._generation
+
+        return connections
+
+    @_connections.setter
+    def _connections(self, connections):
+        self._local.connections = connections
+        self._local.generation = self._generation
+
     def _process(self, message):
+        process = self._process_message
+
+        if self._tracer is not None and self._tracer.sample(message):
+            process = self._process_traced
+
+        if self._instrumentation is not None:
+            process = functools.partial(self._instrumentation.process,
+                process)
+
+        if self._limiter is not None:
+            return self._limiter.call(process, message)
+
+        return process(message)
+
+    def _process_traced(self, message, counts=None):
+        from pyrakoon import trace
+
+        return self._process_message(message,
+            trace.Trace(self._tracer, type(message), None, message), counts)
+
+    def _process_message(self, message, trace=None, counts=None):
         bytes_ = ''.join(message.serialize())
 
-        self._lock.acquire()
+        if trace is not None:
+            trace.mark_serialized(len(bytes_))
+
+        if counts is not None:
+            counts.sent += len(bytes_)
+
+        retry_ = self._config.getRetryPolicy().start()
+        redirects = 0
 
         try:
-            start = time.time()
-            tryCount = 0.0
-            backoffPeriod = 0.2
-            callSucceeded = False
-            retryPeriod = ArakoonClientConfig.getNoMasterRetryPeriod()
-            deadline = start + retryPeriod
-
-            while not callSucceeded and time.time() < deadline:
+            while True:
+                if trace is not None:
+                    trace.mark_acquired()
+
+                if self._router is not None and \
+                    getattr(message, 'allow_dirty', False):
+                    result = self._process_routed(message, bytes_, trace,
+                        counts)
+
+                    if result is not _UNROUTED:
+                        return result
+
+                master_id = self.master_id
+                sent = False
+
                 try:
+                    if trace is not None and master_id is None:
+                        trace.mark_master_lookup()
+
                     # Send on wire
-                    connection = self._send_to_master(bytes_)
-                    return utils.read_blocking(message.receive(),
-                        connection.read)
-                except (errors.NotMaster, ArakoonNoMaster):
-                    self.master_id = None
+                    master_id, connection = self._send_to_master(bytes_)
+                    sent = True
+
+                    return self._receive(message, master_id, connection,
+                        trace, counts)
+                except errors.NoLongerMaster, exc:
+                    # Later requests can go to the new master directly
+                    self.master_id = self._master_hint(exc)
+                    error = sys.exc_info()
+                except (errors.NotMaster, ArakoonNoMaster), exc:
+                    hint = self._master_hint(exc)
+
+                    # Redirect to the node named in the error right away,
+                    # but don't bounce between nodes which disagree
+                    if hint is not None and hint != master_id and \
+                        redirects < len(self._config.getNodes()):
+                        LOGGER.info(
+                            'Node %s is not master, redirecting to %s',
+                            master_id, hint)
+
+                        if trace is not None:
+                            trace.mark_retry()
+
+                        redirects += 1
+                        self.master_id = hint
+                        continue
+
+                    self._forget_master(master_id)
                     self.drop_connections()
+                    error = sys.exc_info()
+                except (errors.GoingDown, errors.MaxConnections), exc:
+                    # The node won't handle requests over this connection
+                    self._drop_connection(master_id)
+
+                    if isinstance(exc, errors.GoingDown):
+                        self._forget_master(master_id)
+
+                    error = sys.exc_info()
+                except errors.ArakoonError:
+                    # Left to the retry policy, which only retries errors
+                    # leaving the outcome unknown (for idempotent requests)
+                    error = sys.exc_info()
+                except Exception:
+                    # The connection may be in an unknown state
+                    if sent:
+                        self._drop_connection(master_id)
+                        self._forget_master(master_id)
 
-                    sleepPeriod = backoffPeriod * tryCount
-                    if time.time() + sleepPeriod > deadline:
-                        raise
+                    error = sys.exc_info()
 
-                    tryCount += 1.0
-                    LOGGER.warning(
-                        'Master not found, retrying in %0.2f seconds' % \
-                            sleepPeriod)
+                delay = retry_.backoff(error[1], message, sent,
+                    isinstance(error[1], ArakoonNoMaster))
 
-                    time.sleep(sleepPeriod)
+                if delay is None:
+                    raise error[0], error[1], error[2]
+
+                if trace is not None:
+                    trace.mark_retry()
+
+                LOGGER.warning('Request failed (%r), retrying in %0.2f seconds',
+                    error[1], delay)
+
+                time.sleep(delay)
+        except Exception, exc:
+            if trace is not None:
+                trace.mark_failed(exc)
+
+            raise
 
+    def _process_routed(self, message, bytes_, trace, counts):
+        # Try the nodes picked by the router in order, skipping nodes which
+        # fail or are overloaded. Returns `_UNROUTED` if all nodes failed.
+        candidates = self._router.candidates(message,
+            self._config.getNodes().keys(), self.master_id)
+
+        for node_id in candidates:
+            try:
+                connection = self._send_message(node_id, bytes_)
+
+                return self._receive(message, node_id, connection, trace,
+                    counts)
+            except (errors.GoingDown, errors.MaxConnections), exc:
+                LOGGER.warning('Node %s refused routed request: %r', node_id,
+                    exc)
+                self._mark_failed(node_id)
+                self._drop_connection(node_id)
+            except errors.ArakoonError:
+                raise
+            except Exception:
+                LOGGER.warning('Routed request to node %s failed', node_id)
+                self._mark_failed(node_id)
+                self._drop_connection(node_id)
+
+        return _UNROUTED
+
+    def _receive(self, message, node_id, connection, trace, counts):
+        # Read the result of a message sent to a node
+        read = connection.read
+
+        if trace is not None:
+            trace.node = node_id
+            trace.mark_sent()
+            read = trace.reader(read)
+
+        if counts is not None:
+            read = counts.reader(read)
+
+        result = utils.read_blocking(message.receive(), read)
+
+        if trace is not None:
+            trace.mark_decoded()
+
+        return result
+
+    def _master_hint(self, exc):
+        return errors.master_hint(exc, self._config.getNodes().keys())
+
+    def _mark_failed(self, node_id):
+        if self._router is not None:
+            self._router.mark_failed(node_id)
+        if self._scatter is not None:
+            self._scatter.mark_failed(node_id)
+
+    def _forget_master(self, master_id):
+        # Another thread may have found a new master already
+        self._lock.acquire()
+        try:
+            if self.master_id == master_id:
+                self.master_id = None
         finally:
             self._lock.release()
 
-    def _send_message(self, node_id, data, count=-1):
-        result = None
+    def _drop_connection(self, node_id):
+        connection = self._connections.pop(node_id, None)
+
+        if connection is not None:
+            connection.close()
+
+    def _process_pipelined(self, messages, max_in_flight=None):
+        if self._limiter is not None:
+            return self._limiter.pipeline(self._pipeline_to_master, messages,
+                max_in_flight)
+
+        return self._pipeline_to_master(messages, max_in_flight)
+
+    def _process_spread(self, messages, max_in_flight=None):
+        if self._limiter is not None:
+            return self._limiter.pipeline(self._pipeline_to_all, messages,
+                max_in_flight)
+
+        return self._pipeline_to_all(messages, max_in_flight)
+
+    def _pipeline_to_master(self, messages, max_in_flight):
+        self.determine_master()
 
-        if count < 0:
-            count = self._config.getTryCount()
+        for result in self._pipeline(messages, [self.master_id],
+            max_in_flight):
+            yield result
 
-        for i in xrange(count):
-            if i > 0:
-                max_sleep = i * ArakoonClientConfig.getBackoffInterval()
-                time.sleep(random.randint(0, max_sleep))
+    def _pipeline_to_all(self, messages, max_in_flight):
+        node_ids = self._config.getNodes().keys()
+        random.shuffle(node_ids)
 
-            self._lock.acquire()
+        choose = None
+
+        if self._router is not None:
+            choose = self._choose_routed
+
+        for result in self._pipeline(messages, node_ids, max_in_flight,
+            choose):
+            yield result
+
+    def _multi_get_chunked(self, message_type, keys, allow_dirty):
+        # Keys can be given as any iterable
+        keys = list(keys)
+
+        if self._scatter is None or not allow_dirty or \
+            len(keys) < self._scatter.min_keys:
+            return client.ClientMixin._multi_get_chunked(self, message_type,
+                keys, allow_dirty)
+
+        validate_types(message_type.ARGS, (allow_dirty, keys))
+
+        # Every node looks up a slice of the keys, chunked as usual. All
+        # chunks are sent before any result is read, so nodes handle their
+        # slices concurrently.
+        messages = []
+        assigned = {}
+
+        for node_id, part in self._scatter.partition(keys,
+            self._config.getNodes().keys()):
+            for chunk in chunk_keys(part, self.MULTI_GET_CHUNK_KEYS,
+                self.MULTI_GET_CHUNK_BYTES):
+                message = message_type(True, chunk)
+                assigned[message] = node_id
+                messages.append(message)
+
+        if self._limiter is not None:
+            results = self._limiter.pipeline(
+                functools.partial(self._pipeline_scattered, assigned),
+                messages, None)
+        else:
+            results = self._pipeline_scattered(assigned, messages, None)
+
+        result = []
+        for values in results:
+            result.extend(values)
+
+        return result
+
+    def _pipeline_scattered(self, assigned, messages, max_in_flight):
+        # All chunks are sent before any result is read. The results of every
+        # node are read by a thread of their own (the calling thread reads
+        # those of the last node), so the time a node took is measured until
+        # its own last result arrived, regardless of slower nodes. Messages
+        # which can't be sent, or whose result can't be read, are handled by
+        # `_process_message` afterwards.
+        messages = list(messages)
+        start = time.time()
+        retry = object()
+        results = {}
+        durations = {}
+        failed = []
+        pending = collections.defaultdict(list)
+
+        for message in messages:
+            pending[assigned[message]].append(message)
+
+        def read(node_id, connection, node_messages):
+            for index, message in enumerate(node_messages):
+                try:
+                    results[message] = utils.read_blocking(message.receive(),
+                        connection.read)
+                except errors.ArakoonError, exc:
+                    # Keep reading outstanding results, so the connection
+                    # remains usable
+                    results[message] = exc
+                except Exception:
+                    LOGGER.warning('Scattered request to node %s failed, '
+                        'resubmitting', node_id)
+                    failed.append(node_id)
+
+                    for message_ in node_messages[index:]:
+                        results[message_] = retry
+
+                    return
+
+            durations[node_id] = time.time() - start
+
+        readers = []
+
+        for node_id, node_messages in sorted(pending.iteritems()):
             try:
-                connection = self._get_connection(node_id)
-                connection.send(data)
+                for message in node_messages:
+                    connection = self._send_message(node_id,
+                        ''.join(message.serialize()))
+            except Exception:
+                self._mark_failed(node_id)
 
-                result = connection
+                for message in node_messages:
+                    results[message] = retry
+            else:
+                readers.append((node_id, connection, node_messages))
+
+        threads = []
+
+        for args in readers[:-1]:
+            thread = threading.Thread(target=read, args=args,
+                name='pyrakoon-scatter-%s' % args[0])
+            thread.daemon = True
+            thread.start()
+
+            threads.append(thread)
+
+        if readers:
+            read(*readers[-1])
+
+        # Reads are bounded by the connection timeout
+        for thread in threads:
+            thread.join()
+
+        for node_id in failed:
+            self._mark_failed(node_id)
+            self._drop_connection(node_id)
+
+        for node_id, duration in durations.iteritems():
+            self._scatter.record(node_id,
+                sum(len(message.keys) for message in pending[node_id]),
+                duration)
+
+        for message in messages:
+            result = results[message]
+
+            if result is retry:
+                result = self._process_message(message)
+            elif isinstance(result, errors.ArakoonError):
+                raise result
+
+            yield result
+
+    def _choose_routed(self, message, node_ids, in_flight, max_in_flight):
+        # Pick the preferred node which isn't overloaded, i.e. has less than
+        # `max_in_flight` messages outstanding
+        candidates = self._router.candidates(message, node_ids,
+            self.master_id)
+
+        for node_id in candidates:
+            if max_in_flight is None or \
+                in_flight.get(node_id, 0) < max_in_flight:
+                return node_id
+
+        return candidates[0]
+
+    def _pipeline(self, messages, node_ids, max_in_flight, choose=None):
+        # Messages are assigned to the given nodes round-robin, and sent
+        # before the results of previous messages are read. Whenever a message
+        # can't be sent, its result can't be read, or the node is no longer
+        # master, sending stops until all outstanding results are read, after
+        # which the failed messages are handled by `_process`.
+        messages = iter(messages)
+        outstanding = collections.deque()
+        done = []
+        window = None if max_in_flight is None \
+            else max_in_flight * len(node_ids)
+        exhausted = False
+        stalled = False
+        error = None
+        index = 0
+        in_flight = {}
+        retry = object()
+
+        while True:
+            while not exhausted and not stalled and error is None and \
+                (window is None or len(outstanding) < window):
+                try:
+                    message = messages.next()
+                except StopIteration:
+                    exhausted = True
+                    break
+
+                if choose is None:
+                    node_id = node_ids[index % len(node_ids)]
+                    index += 1
+                else:
+                    node_id = choose(message, node_ids, in_flight,
+                        max_in_flight)
+
+                try:
+                    connection = self._send_message(node_id,
+                        ''.join(message.serialize()))
+                except Exception:
+                    connection = None
+                    self._mark_failed(node_id)
+
+                in_flight[node_id] = in_flight.get(node_id, 0) + 1
+                outstanding.append((message, node_id, connection))
+
+            if not outstanding:
                 break
+
+            message, node_id, connection = outstanding.popleft()
+            in_flight[node_id] -= 1
+
+            try:
+                if connection is None:
+                    raise ArakoonNotConnected
+
+                result = utils.read_blocking(message.receive(),
+                    connection.read)
+            except errors.NotMaster, exc:
+                self.master_id = self._master_hint(exc)
+                result = retry
+            except errors.ArakoonError, exc:
+                # Keep reading outstanding results, so connections remain
+                # usable
+                error = error or exc
+                continue
             except Exception:
-                LOGGER.exception('Message exchange with node %s failed',
-                    node_id)
-                try:
-                    self._connections.pop(node_id).close()
-                finally:
-                    self.master_id = None
+                LOGGER.warning('Pipelined request failed, resubmitting')
+                result = retry
+                self._mark_failed(node_id)
+
+            if error is not None:
+                continue
+
+            done.append((message, result))
+
+            if result is retry:
+                stalled = True
+            if stalled and outstanding:
+                continue
+
+            # No results are outstanding when resubmitting failed messages
+            for message, result in done:
+                if result is retry:
+                    result = self._process_message(message)
+
+                yield result
+
+            done = []
+            stalled = False
+
+        if error is not None:
+            raise error #pylint: disable=E0702
+
+    def _send_message(self, node_id, data):
+        try:
+            connection = self._get_connection(node_id)
+            connection.send(data)
+        except Exception:
+            LOGGER.exception('Message exchange with node %s failed', node_id)
+            try:
+                self._drop_connection(node_id)
             finally:
-                self._lock.release()
+                self._forget_master(node_id)
 
-        if not result:
             raise
 
-        return result
+        return connection
 
     def _send_to_master(self, data):
         self.determine_master()
 
-        connection = self._send_message(self.master_id, data)
+        # The master may be changed by other threads meanwhile
+        master_id = self.master_id
+        connection = self._send_message(master_id, data)
 
-        return connection
+        return master_id, connection
 
     def drop_connections(self):
-        for key in tuple(self._connections.iterkeys()):
-            self._connections.pop(key).close()
+        # Connections of other threads are closed when they're used next
+        self._lock.acquire()
+        try:
+            self._generation += 1
+        finally:
+            self._lock.release()
+
+        # Looking up the connections of this thread closes them right away
+        self._connections.clear()
 
     def determine_master(self):
-        node_ids = []
+        master_id = self.master_id
 
-        if self.master_id is None:
-            node_ids = self._config.getNodes().keys()
-            random.shuffle(node_ids)
+        if master_id is not None and master_id == self._last_master_id:
+            return
 
-            while self.master_id is None and node_ids:
-                node = node_ids.pop()
+        self._lock.acquire()
+        try:
+            # Only a single thread looks up the master, others use its result
+            if self.master_id is None:
+                self.master_id = self._discover_master()
 
-                try:
-                    self.master_id = self._get_master_id_from_node(node)
-                    tmp_master = self.master_id
+            master_id = self.master_id
 
-                    try:
-                        if self.master_id is not None:
-                            if self.master_id != node and not \
-                                self._validate_master_id(self.master_id):
-                                self.master_id = None
-                            else:
-                                LOGGER.warning(
-                                    'Node "%s" doesn\'t know the master',
-                                    node)
-                    except Exception:
-                        LOGGER.exception(
-                            'Unable to validate master on node %s', tmp_master)
-                        self.master_id = None
+            if not master_id:
+                LOGGER.error('Unable to determine master node')
+                raise ArakoonNoMaster
 
-                except Exception:
-                    LOGGER.exception(
-                        'Unable to query node "%s" to look up master', node)
+            if master_id != self._last_master_id:
+                if self._last_master_id is not None:
+                    LOGGER.info('Master changed from %s to %s',
+                        self._last_master_id, master_id)
+                    metrics.MASTER_CHANGES.labels(
+                        self._config.getClusterId()).inc()
+
+                self._last_master_id = master_id
+        finally:
+            self._lock.release()
 
-        if not self.master_id:
-            LOGGER.error('Unable to determine master node')
-            raise ArakoonNoMaster
+    def _discover_master(self):
+        # All nodes are asked who the master is at once. A candidate is only
+        # accepted if it says it's the master itself, and a majority of the
+        # nodes agrees (or, when a majority can't be reached, all nodes which
+        # know a master agree).
+        node_ids = self._config.getNodes().keys()
+        answers = self._query_all(node_ids, protocol.WhoMaster())
+
+        votes = collections.defaultdict(int)
+
+        for node_id, answer in answers.iteritems():
+            if isinstance(answer, Exception):
+                LOGGER.warning('Unable to query node "%s" to look up master: '
+                    '%r', node_id, answer)
+            elif answer is None:
+                LOGGER.warning('Node "%s" doesn\'t know the master', node_id)
+            else:
+                votes[answer] += 1
 
-    def _get_master_id_from_node(self, node_id):
-        command = protocol.WhoMaster()
-        data = ''.join(command.serialize())
+        confirmed = [(count, master_id)
+            for (master_id, count) in votes.iteritems()
+            if answers.get(master_id) == master_id]
 
-        connection = self._send_message(node_id, data)
+        if not confirmed:
+            return None
 
-        receiver = command.receive()
-        return utils.read_blocking(receiver, connection.read)
+        count, master_id = max(confirmed)
 
-    def _validate_master_id(self, master_id):
-        if not master_id:
-            return False
+        if count >= len(node_ids) // 2 + 1:
+            return master_id
 
-        other_master_id = self._get_master_id_from_node(master_id)
+        if len(votes) == 1:
+            LOGGER.warning('Master "%s" confirmed by %d of %d nodes only',
+                master_id, count, len(node_ids))
+            return master_id
 
-        return other_master_id == master_id
+        LOGGER.error('No quorum on master, votes: %r', dict(votes))
+        return None
+
+    def _query_all(self, node_ids, message):
+        # Send a message to all nodes concurrently, using a thread per node.
+        # Nodes which don't answer before the deadline, or fail, lose their
+        # connection.
+        data = ''.join(message.serialize())
+        connections = dict(self._connections)
+        results = {}
+        lock = threading.Lock()
+        collected = []
+
+        def query(node_id):
+            connection = connections.get(node_id)
+            created = connection is None
+
+            try:
+                if created:
+                    connection = _ClientConnection(
+                        self._config.getNodeLocation(node_id),
+                        self._config.getClusterId())
+                    connection.connect()
+
+                connection.send(data)
+                result = utils.read_blocking(message.receive(),
+                    connection.read)
+            except Exception, exc:
+                result = exc
+
+            lock.acquire()
+            try:
+                late = bool(collected)
+
+                if not late:
+                    results[node_id] = (connection, result)
+            finally:
+                lock.release()
+
+            # Nobody takes over a connection created after the deadline
+            if late and created and connection is not None:
+                connection.close()
+
+        threads = []
+
+        for node_id in node_ids:
+            thread = threading.Thread(target=query, args=(node_id,),
+                name='pyrakoon-query-%s' % node_id)
+            thread.daemon = True
+            thread.start()
+
+            threads.append(thread)
+
+        # Connecting and reading are bounded by the timeout each
+        deadline = time.time() + 2 * ArakoonClientConfig.getConnectionTimeout()
+
+        for thread in threads:
+            thread.join(max(0.0, deadline - time.time()))
+
+        # Answers of threads still running are discarded from now on
+        lock.acquire()
+        try:
+            collected.append(True)
+        finally:
+            lock.release()
+
+        answers = {}
+
+        for node_id in node_ids:
+            if node_id in results:
+                connection, result = results[node_id]
+            else:
+                connection = connections.get(node_id)
+                result = ArakoonSockNotReadable()
+
+            if isinstance(result, Exception):
+                if connection is not None:
+                    if self._connections.get(node_id) is connection:
+                        del self._connections[node_id]
+
+                    try:
+                        connection.close()
+                    except Exception:
+                        LOGGER.exception('Error while closing connection to '
+                            'node %s', node_id)
+            else:
+                self._connections[node_id] = connection
+
+            answers[node_id] = result
+
+        return answers
 
     def _get_connection(self, node_id):
         connection = None
@@ -1070,6 +1752,7 @@ class _ClientConnection(object):
         self._connected = False
         self._socket = None
         self._cluster_id = cluster_id
+        self._node_label = '%s:%s' % tuple(address)
 
     def connect(self):
         if self._socket:
@@ -1087,6 +1770,9 @@ class _ClientConnection(object):
             self._connected = True
         except Exception:
             LOGGER.exception('Unable to connect to %s', self._address)
+            metrics.CONNECTION_FAILURES.labels(self._node_label).inc()
+        else:
+            metrics.CONNECTIONS.labels(self._node_label).inc()
 
     def send(self, data):
         if not self._connected:
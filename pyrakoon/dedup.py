@@ -0,0 +1,363 @@
+# This file is part of Pyrakoon, a distributed key-value store client.
+#
+# Copyright (C) 2014 Incubaid BVBA
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''Suppression of writes which don't change the stored value
+
+Jobs which periodically synchronize a data set into a cluster tend to write
+the same values over and over, and every such write ends up in the
+transaction logs. A :class:`WriteIfChangedClient` remembers a digest of the
+last value written to every key in a bounded :class:`DigestCache`:
+
+- A `set` of a value equal to the one written before is not sent at all
+- A `set` of a key which isn't in the cache is sent as a `confirm`, which
+  the server turns into a no-op when the value is unchanged
+- Any other `set` is sent as-is
+
+Example:
+
+    >>> from pyrakoon import test
+    >>> client = WriteIfChangedClient(test.FakeClient())
+    >>> client.set('key', 'value')
+    >>> client.set('key', 'value')
+    >>> client.set('key', 'other')
+    >>> sorted(client.statistics.items())
+    [('confirmed', 1), ('invalidated', 0), ('suppressed', 1), ('written', 1)]
+
+:warning: The cache only knows about writes done through the same client.
+    When other clients update the same keys, a write can be suppressed
+    although the stored value differs. Use `ttl` to bound how long a digest
+    is trusted, or don't use this client in such setups.
+'''
+
+import time
+import hashlib
+import threading
+import collections
+
+from pyrakoon import client, protocol, sequence
+
+DEFAULT_CACHE_SIZE = 100000
+'''Default maximum number of digests kept''' #pylint: disable=W0105
+
+
+def digest(value):
+    '''Calculate the digest of a value
+
+    :param value: Value to digest
+    :type value: :class:`str`
+
+    :return: Digest of `value`
+    :rtype: :class:`str`
+    '''
+
+    return hashlib.sha1(value).digest()
+
+
+class DigestCache(object):
+    '''Bounded, thread-safe cache of value digests by key
+
+    When full, the least recently used entry is evicted.
+    '''
+
+    def __init__(self, size=DEFAULT_CACHE_SIZE, ttl=None):
+        '''Initialize a digest cache
+
+        :param size: Maximum number of entries
+        :type size: :class:`int`
+        :param ttl: Time after which entries expire, in seconds, or
+            :data:`None` to never expire entries
+        :type ttl: :class:`float`
+        '''
+
+        self._size = size
+        self._ttl = ttl
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        '''Look up the digest of the value last written to a key
+
+        :param key: Key to look up
+        :type key: :class:`str`
+
+        :return: Digest, or :data:`None` if unknown
+        :rtype: :class:`str`
+        '''
+
+        self._lock.acquire()
+        try:
+            entry = self._entries.pop(key, None)
+
+            if entry is None:
+                return None
+
+            digest_, stored = entry
+
+            if self._ttl is not None and time.time() - stored > self._ttl:
+                return None
+
+            self._entries[key] = entry
+
+            return digest_
+        finally:
+            self._lock.release()
+
+    def put(self, key, digest_):
+        '''Store the digest of the value written to a key
+
+        :param key: Key written
+        :type key: :class:`str`
+        :param digest_: Digest of the value written
+        :type digest_: :class:`str`
+        '''
+
+        self._lock.acquire()
+        try:
+            self._entries.pop(key, None)
+            self._entries[key] = (digest_, time.time())
+
+            while len(self._entries) > self._size:
+                self._entries.popitem(last=False)
+        finally:
+            self._lock.release()
+
+    def discard(self, key):
+        '''Forget the digest of a key
+
+        :param key: Key to forget
+        :type key: :class:`str`
+        '''
+
+        self._lock.acquire()
+        try:
+            self._entries.pop(key, None)
+        finally:
+            self._lock.release()
+
+    def discard_prefix(self, prefix):
+        '''Forget the digests of all keys starting with a prefix
+
+        :param prefix: Prefix of keys to forget
+        :type prefix: :class:`str`
+        '''
+
+        self._lock.acquire()
+        try:
+            for key in [key for key in self._entries
+                if key.startswith(prefix)]:
+                del self._entries[key]
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        '''Forget all digests'''
+
+        self._lock.acquire()
+        try:
+            self._entries.clear()
+        finally:
+            self._lock.release()
+
+
+def _step_keys(step):
+    '''Get all keys modified by a sequence step'''
+
+    if isinstance(step, (sequence.Set, sequence.Delete)):
+        yield step.key
+    elif isinstance(step, sequence.Sequence):
+        for step_ in step.steps:
+            for key in _step_keys(step_):
+                yield key
+
+
+class WriteIfChangedClient(object, client.AbstractClient, client.ClientMixin):
+    '''Client wrapper skipping writes of unchanged values
+
+    `set` and `confirm` calls are rewritten as described in the module
+    documentation. Keys modified by `delete`, `test_and_set`, `replace` or a
+    `sequence` are removed from the cache, `delete_prefix` removes all
+    matching keys, and a `user_function` call clears the cache. All other
+    calls are passed to the wrapped client unchanged.
+    '''
+
+    def __init__(self, client_, cache=None):
+        '''Wrap a client
+
+        :param client_: Client to wrap
+        :type client_: :class:`pyrakoon.client.AbstractClient`
+        :param cache: Digest cache to use
+        :type cache: :class:`DigestCache`
+        '''
+
+        super(WriteIfChangedClient, self).__init__()
+
+        self._client = client_
+        self._cache = cache if cache is not None else DigestCache()
+
+        self._lock = threading.Lock()
+        self._suppressed = 0
+        self._confirmed = 0
+        self._written = 0
+        self._invalidated = 0
+
+    cache = property(lambda self: self._cache, doc='Digest cache in use')
+
+    @property
+    def connected(self):
+        '''Check whether the wrapped client is connected'''
+
+        return self._client.connected
+
+    @property
+    def statistics(self):
+        '''Counters of suppressed, confirmed and written values, and cache
+        invalidations
+
+        :type: `dict` of `str` to `int`
+        '''
+
+        self._lock.acquire()
+        try:
+            return {
+                'suppressed': self._suppressed,
+                'confirmed': self._confirmed,
+                'written': self._written,
+                'invalidated': self._invalidated,
+            }
+        finally:
+            self._lock.release()
+
+    def _count(self, name):
+        '''Increment a counter'''
+
+        self._lock.acquire()
+        try:
+            setattr(self, name, getattr(self, name) + 1)
+        finally:
+            self._lock.release()
+
+    def _rewrite(self, message):
+        '''Rewrite a message before it's sent
+
+        :return: Message to send and digest of the value written, or
+            :data:`None` if the message doesn't need to be sent at all
+        '''
+
+        type_ = type(message)
+
+        if type_ not in (protocol.Set, protocol.Confirm):
+            return message, None
+
+        digest_ = digest(message.value)
+        cached = self._cache.get(message.key)
+
+        if cached == digest_:
+            self._count('_suppressed')
+            return None
+        elif cached is None and type_ is protocol.Set:
+            self._count('_confirmed')
+            return protocol.Confirm(message.key, message.value), digest_
+        else:
+            self._count('_written')
+            return message, digest_
+
+    def _invalidate(self, message):
+        '''Forget the digests of keys a message (possibly) modified'''
+
+        cache = self._cache
+        type_ = type(message)
+
+        if type_ in (protocol.Delete, protocol.TestAndSet, protocol.Replace):
+            cache.discard(message.key)
+        elif type_ is protocol.Sequence:
+            for key in _step_keys(message.sequence):
+                cache.discard(key)
+        elif type_ is protocol.DeletePrefix:
+            cache.discard_prefix(message.prefix)
+        elif type_ is protocol.UserFunction:
+            cache.clear()
+        else:
+            return
+
+        self._count('_invalidated')
+
+    def _process(self, message):
+        rewritten = self._rewrite(message)
+
+        if rewritten is None:
+            return None
+
+        message_, digest_ = rewritten
+
+        self._invalidate(message)
+
+        try:
+            result = self._client._process(message_) #pylint: disable=W0212
+        except:
+            if digest_ is not None:
+                self._cache.discard(message.key)
+            raise
+
+        if digest_ is not None:
+            self._cache.put(message.key, digest_)
+
+        return result
+
+    def _process_pipelined(self, messages, max_in_flight=None):
+        pending = collections.deque()
+
+        def feed():
+            '''Rewrite messages, skipping suppressed ones'''
+
+            for message in messages:
+                rewritten = self._rewrite(message)
+                pending.append((message, rewritten))
+
+                if rewritten is not None:
+                    self._invalidate(message)
+                    yield rewritten[0]
+
+        def skip_suppressed():
+            '''Yield results of suppressed messages at the head of the
+            queue'''
+
+            while pending and pending[0][1] is None:
+                pending.popleft()
+                yield None
+
+        try:
+            for result in self._client._process_pipelined( #pylint: disable=W0212
+                feed(), max_in_flight):
+                for result_ in skip_suppressed():
+                    yield result_
+
+                message, (_, digest_) = pending.popleft()
+
+                if digest_ is not None:
+                    self._cache.put(message.key, digest_)
+
+                yield result
+
+            for result_ in skip_suppressed():
+                yield result_
+        except:
+            for message, rewritten in pending:
+                if rewritten is not None and rewritten[1] is not None:
+                    self._cache.discard(message.key)
+            raise
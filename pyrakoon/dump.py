@@ -0,0 +1,585 @@
+# This file is part of Pyrakoon, a distributed key-value store client.
+#
+# Copyright (C) 2014 Incubaid BVBA
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''Export and import of the key space using binary dump files
+
+A dump is written while walking (part of) the key space one page at a time,
+and read back one record at a time, so memory usage doesn't depend on the
+size of the dump.
+
+Dump file format
+================
+
+All integers are little-endian, strings are prefixed by their length as a
+32-bit integer, like in the Arakoon protocol. A dump consists of:
+
+- The magic string `PYRAKOON-DUMP` and a 32-bit format version
+- Any number of *segments*, where a segment is a run of records followed by
+  an index block
+- An end marker
+
+Every record is encoded as the character `R` followed by its key and value.
+
+An index block is encoded as the character `I`, followed by the number of
+records in the segment (32-bit), the offset of the first record of the
+segment in the file (64-bit), the first and last key of the segment, and the
+CRC-32 checksum of all record bytes in the segment (32-bit).
+
+The end marker is encoded as the character `E`, followed by the total number
+of records (64-bit) and the number of segments (32-bit).
+
+This module can be executed as a script::
+
+    python -m pyrakoon.dump -c ricky -n arakoon_0:127.0.0.1:4000 \\
+        export backup.dump
+    python -m pyrakoon.dump -c ricky -n arakoon_0:127.0.0.1:4000 \\
+        import backup.dump
+'''
+
+import sys
+import zlib
+import logging
+
+from pyrakoon import bulk, compat, protocol, utils
+
+LOGGER = logging.getLogger(__name__)
+'''Logger for code in this module''' #pylint: disable=W0105
+
+MAGIC = 'PYRAKOON-DUMP'
+'''Magic string at the start of every dump file''' #pylint: disable=W0105
+VERSION = 1
+'''Dump format version''' #pylint: disable=W0105
+
+DEFAULT_PAGE_SIZE = 1000
+'''Default number of records retrieved per call''' #pylint: disable=W0105
+DEFAULT_SEGMENT_RECORDS = 4096
+'''Default maximum number of records in a segment''' #pylint: disable=W0105
+DEFAULT_SEGMENT_BYTES = 1024 * 1024
+'''Default maximum size of the records in a segment''' #pylint: disable=W0105
+
+RECORD_MARKER = 'R'
+'''Marker preceding every record''' #pylint: disable=W0105
+INDEX_MARKER = 'I'
+'''Marker preceding every index block''' #pylint: disable=W0105
+END_MARKER = 'E'
+'''Marker preceding the end block''' #pylint: disable=W0105
+
+
+class DumpError(ValueError):
+    '''Error raised when reading a malformed or corrupted dump'''
+
+
+class IndexEntry(object): #pylint: disable=R0903
+    '''Index block of a dump segment'''
+
+    __slots__ = 'count', 'offset', 'first_key', 'last_key', 'checksum',
+
+    def __init__(self, count, offset, first_key, last_key, checksum):
+        self.count = count
+        self.offset = offset
+        self.first_key = first_key
+        self.last_key = last_key
+        self.checksum = checksum
+
+    def __repr__(self):
+        return '<IndexEntry count=%d offset=%d first_key=%r last_key=%r>' % (
+            self.count, self.offset, self.first_key, self.last_key)
+
+
+class DumpWriter(object):
+    '''Write records to a dump file
+
+    Records should be written in key order, which is checked when writing.
+    After the last record, :meth:`close` must be called to write the final
+    index block and end marker. The underlying file isn't closed.
+    '''
+
+    def __init__(self, fd, segment_records=DEFAULT_SEGMENT_RECORDS,
+        segment_bytes=DEFAULT_SEGMENT_BYTES):
+        '''Initialize a dump writer, writing the file header
+
+        :param fd: File to write to
+        :type fd: `file`
+        :param segment_records: Maximum number of records in a segment
+        :type segment_records: :class:`int`
+        :param segment_bytes: Maximum size of the records in a segment
+        :type segment_bytes: :class:`int`
+        '''
+
+        self._fd = fd
+        self._segment_records = segment_records
+        self._segment_bytes = segment_bytes
+
+        self._offset = 0
+        self._count = 0
+        self._segments = 0
+        self._last_key = None
+
+        self._segment_offset = None
+        self._segment_count = 0
+        self._segment_size = 0
+        self._segment_first_key = None
+        self._checksum = 0
+
+        self._write(MAGIC)
+        self._write_value(protocol.UINT32, VERSION)
+
+    count = property(lambda self: self._count,
+        doc='Number of records written')
+
+    def _write(self, data):
+        '''Write raw bytes to the file'''
+
+        self._fd.write(data)
+        self._offset += len(data)
+
+    def _write_value(self, type_, value):
+        '''Write a serialized value to the file'''
+
+        for bytes_ in type_.serialize(value):
+            self._write(bytes_)
+
+    def write(self, key, value):
+        '''Write a record
+
+        :param key: Record key
+        :type key: :class:`str`
+        :param value: Record value
+        :type value: :class:`str`
+
+        :raise ValueError: Key not larger than the previous key
+        '''
+
+        if self._last_key is not None and key <= self._last_key:
+            raise ValueError('Keys must be written in ascending order')
+
+        if self._segment_count == 0:
+            self._segment_offset = self._offset
+            self._segment_first_key = key
+
+        data = ''.join((RECORD_MARKER,
+            ''.join(protocol.STRING.serialize(key)),
+            ''.join(protocol.STRING.serialize(value))))
+
+        self._write(data)
+        self._checksum = zlib.crc32(data, self._checksum)
+
+        self._count += 1
+        self._segment_count += 1
+        self._segment_size += len(data)
+        self._last_key = key
+
+        if self._segment_count >= self._segment_records or \
+            self._segment_size >= self._segment_bytes:
+            self._write_index()
+
+    def _write_index(self):
+        '''Finish the current segment by writing its index block'''
+
+        self._write(INDEX_MARKER)
+        self._write_value(protocol.UINT32, self._segment_count)
+        self._write_value(protocol.UINT64, self._segment_offset)
+        self._write_value(protocol.STRING, self._segment_first_key)
+        self._write_value(protocol.STRING, self._last_key)
+        self._write_value(protocol.UINT32, self._checksum & 0xffffffff)
+
+        self._segments += 1
+        self._segment_count = 0
+        self._segment_size = 0
+        self._checksum = 0
+
+    def close(self):
+        '''Write the final index block and end marker'''
+
+        if self._segment_count > 0:
+            self._write_index()
+
+        self._write(END_MARKER)
+        self._write_value(protocol.UINT64, self._count)
+        self._write_value(protocol.UINT32, self._segments)
+
+        self._fd.flush()
+
+
+class _Source(object): #pylint: disable=R0903
+    '''Read values from a file, keeping track of offset and checksum'''
+
+    def __init__(self, fd):
+        self._fd = fd
+        self.offset = 0
+        self.checksum = 0
+
+    def read(self, count):
+        '''Read exactly `count` bytes'''
+
+        data = self._fd.read(count)
+
+        if len(data) != count:
+            raise DumpError('Unexpected end of dump at offset %d' %
+                self.offset)
+
+        self.offset += count
+        self.checksum = zlib.crc32(data, self.checksum)
+
+        return data
+
+    def read_value(self, type_):
+        '''Read a serialized value'''
+
+        return utils.read_blocking(type_.receive(), self.read)
+
+    def skip(self, count):
+        '''Skip `count` bytes without checksumming them'''
+
+        self._fd.seek(count, 1)
+        self.offset += count
+
+
+def _read_header(source):
+    '''Read and check the file header'''
+
+    magic = source.read(len(MAGIC))
+    if magic != MAGIC:
+        raise DumpError('Not a dump file')
+
+    version = source.read_value(protocol.UINT32)
+    if version != VERSION:
+        raise DumpError('Unsupported dump version %d' % version)
+
+
+def _read_index(source):
+    '''Read the body of an index block'''
+
+    count = source.read_value(protocol.UINT32)
+    offset = source.read_value(protocol.UINT64)
+    first_key = source.read_value(protocol.STRING)
+    last_key = source.read_value(protocol.STRING)
+    checksum = source.read_value(protocol.UINT32)
+
+    return IndexEntry(count, offset, first_key, last_key, checksum)
+
+
+def _read_end(source, count, segments):
+    '''Read the end marker, checking totals'''
+
+    total = source.read_value(protocol.UINT64)
+    total_segments = source.read_value(protocol.UINT32)
+
+    if (total, total_segments) != (count, segments):
+        raise DumpError('Dump totals mismatch: %d records in %d segments, '
+            'expected %d in %d' % (count, segments, total, total_segments))
+
+
+def read_dump(fd):
+    '''Read all records from a dump file
+
+    The checksum of every segment is verified once its index block is read,
+    so records of a corrupted segment could be returned before a
+    :class:`DumpError` is raised.
+
+    Example:
+
+        >>> import StringIO
+        >>> fd = StringIO.StringIO()
+        >>> writer = DumpWriter(fd, segment_records=2)
+        >>> for i in xrange(3):
+        ...     writer.write('key_%d' % i, 'value_%d' % i)
+        >>> writer.close()
+        >>> fd.seek(0)
+        >>> list(read_dump(fd))
+        [('key_0', 'value_0'), ('key_1', 'value_1'), ('key_2', 'value_2')]
+
+    :param fd: File to read from
+    :type fd: `file`
+
+    :return: Iterator over all `(key, value)` records in the dump
+    :rtype: iterator of `(str, str)`
+
+    :raise DumpError: Malformed or corrupted dump
+    '''
+
+    source = _Source(fd)
+    _read_header(source)
+
+    count = 0
+    segments = 0
+    segment_count = 0
+    source.checksum = 0
+
+    while True:
+        # The segment checksum covers record bytes only
+        checksum = source.checksum & 0xffffffff
+        marker = source.read(1)
+
+        if marker == RECORD_MARKER:
+            key = source.read_value(protocol.STRING)
+            value = source.read_value(protocol.STRING)
+
+            count += 1
+            segment_count += 1
+
+            yield key, value
+        elif marker == INDEX_MARKER:
+            entry = _read_index(source)
+
+            if entry.count != segment_count:
+                raise DumpError('Segment at offset %d has %d records, '
+                    'expected %d' % (entry.offset, segment_count,
+                        entry.count))
+            if entry.checksum != checksum:
+                raise DumpError('Checksum mismatch in segment at offset %d' %
+                    entry.offset)
+
+            segments += 1
+            segment_count = 0
+            source.checksum = 0
+        elif marker == END_MARKER:
+            if segment_count != 0:
+                raise DumpError('Missing index block before end marker')
+
+            _read_end(source, count, segments)
+
+            return
+        else:
+            raise DumpError('Invalid marker %r at offset %d' % (marker,
+                source.offset - 1))
+
+
+def read_index(fd):
+    '''Read the index blocks of a seekable dump file
+
+    Record contents are skipped, not read, so this is cheap even for large
+    dumps. The offsets in the returned entries can be used to seek to the
+    start of a segment.
+
+    :param fd: File to read from
+    :type fd: `file`
+
+    :return: Iterator over all index blocks in the dump
+    :rtype: iterator of :class:`IndexEntry`
+
+    :raise DumpError: Malformed dump
+    '''
+
+    source = _Source(fd)
+    _read_header(source)
+
+    count = 0
+    segments = 0
+
+    while True:
+        marker = source.read(1)
+
+        if marker == RECORD_MARKER:
+            source.skip(source.read_value(protocol.UINT32))
+            source.skip(source.read_value(protocol.UINT32))
+        elif marker == INDEX_MARKER:
+            entry = _read_index(source)
+
+            count += entry.count
+            segments += 1
+
+            yield entry
+        elif marker == END_MARKER:
+            _read_end(source, count, segments)
+
+            return
+        else:
+            raise DumpError('Invalid marker %r at offset %d' % (marker,
+                source.offset - 1))
+
+
+#pylint: disable=R0913
+def export_dump(client, fd, begin_key=None, end_key=None, prefix=None,
+    page_size=DEFAULT_PAGE_SIZE, allow_dirty=False,
+    segment_records=DEFAULT_SEGMENT_RECORDS,
+    segment_bytes=DEFAULT_SEGMENT_BYTES):
+    '''Export (part of) the key space to a dump file
+
+    Records are retrieved using paged `range_entries` calls (see
+    :meth:`pyrakoon.client.ClientMixin.iter_range`), so neither the client
+    nor the server needs to hold the whole key space in memory.
+
+    Either a `prefix`, or a `begin_key` (inclusive) and `end_key`
+    (exclusive) can be given. By default, all keys are exported.
+
+    :param client: Client to use
+    :type client: :class:`pyrakoon.client.ClientMixin`
+    :param fd: File to write to
+    :type fd: `file`
+    :param begin_key: First key to export
+    :type begin_key: :class:`str`
+    :param end_key: Key to stop exporting at
+    :type end_key: :class:`str`
+    :param prefix: Prefix of keys to export
+    :type prefix: :class:`str`
+    :param page_size: Number of records to retrieve per call
+    :type page_size: :class:`int`
+    :param allow_dirty: Allow reads from slave nodes
+    :type allow_dirty: :class:`bool`
+    :param segment_records: Maximum number of records in a segment
+    :type segment_records: :class:`int`
+    :param segment_bytes: Maximum size of the records in a segment
+    :type segment_bytes: :class:`int`
+
+    :return: Number of records exported
+    :rtype: :class:`int`
+
+    :raise ValueError: Both a prefix and range bounds given
+    '''
+
+    if prefix is not None:
+        if begin_key is not None or end_key is not None:
+            raise ValueError('Either a prefix or range bounds can be given')
+
+        records = client.iter_prefix(prefix, page_size, True, allow_dirty)
+    else:
+        records = client.iter_range(begin_key, True, end_key, False,
+            page_size, True, allow_dirty)
+
+    writer = DumpWriter(fd, segment_records, segment_bytes)
+
+    for key, value in records:
+        writer.write(key, value)
+
+        if writer.count % (page_size * 100) == 0:
+            LOGGER.info('Exported %d records', writer.count)
+
+    writer.close()
+
+    LOGGER.info('Exported %d records', writer.count)
+
+    return writer.count
+
+
+def import_dump(client, fd, **kwargs):
+    '''Import a dump file into the cluster
+
+    Records are submitted in batched *sequence* messages using a
+    :class:`pyrakoon.bulk.BulkLoader`. Since dumps are sorted already,
+    records aren't sorted again.
+
+    :param client: Client to use, connected to the master node
+    :type client: :class:`pyrakoon.client.AbstractClient`
+    :param fd: File to read from
+    :type fd: `file`
+    :param kwargs: Extra arguments passed to
+        :class:`~pyrakoon.bulk.BulkLoader`
+
+    :return: Load statistics
+    :rtype: :class:`pyrakoon.bulk.LoadStatistics`
+
+    :raise DumpError: Malformed or corrupted dump
+    '''
+
+    kwargs.setdefault('sort', False)
+
+    return bulk.BulkLoader(client, **kwargs).load(read_dump(fd))
+
+
+def connect_node(cluster_id, nodes, name):
+    '''Connect a client to a given node of a cluster
+
+    :param cluster_id: Identifier of the cluster
+    :type cluster_id: :class:`str`
+    :param nodes: Node locations
+    :type nodes: `dict` of `str` to `([str], int)`
+    :param name: Name of the node to connect to
+    :type name: :class:`str`
+
+    :return: Connected client
+    :rtype: :class:`pyrakoon.bulk.NodeClient`
+    '''
+
+    config = compat.ArakoonClientConfig(cluster_id, nodes)
+
+    client_ = bulk.NodeClient(config.getNodeLocation(name), cluster_id)
+    client_.connect()
+
+    return client_
+
+
+def main(args=None):
+    '''Command-line entry point'''
+
+    parser = bulk.build_option_parser(
+        '%prog [options] -c CLUSTER -n NODE (export|import) FILE')
+    parser.add_option('--prefix', help='export keys with this prefix only')
+    parser.add_option('--begin', metavar='KEY',
+        help='first key to export (inclusive)')
+    parser.add_option('--end', metavar='KEY',
+        help='last key to export (exclusive)')
+    parser.add_option('--page-size', type='int', default=DEFAULT_PAGE_SIZE,
+        help='records retrieved per call [default: %default]')
+    parser.add_option('--dirty', metavar='NAME',
+        help='export from the given (slave) node, allowing dirty reads')
+    parser.add_option('--batch-bytes', type='int',
+        default=bulk.DEFAULT_BATCH_BYTES,
+        help='maximum import batch size in bytes [default: %default]')
+    parser.add_option('--batch-count', type='int',
+        default=bulk.DEFAULT_BATCH_COUNT,
+        help='maximum records per import batch [default: %default]')
+    parser.add_option('--in-flight', type='int',
+        default=bulk.DEFAULT_MAX_IN_FLIGHT,
+        help='maximum outstanding import batches [default: %default]')
+    parser.add_option('--checkpoint', metavar='PATH',
+        help='checkpoint file, used to resume an interrupted import')
+
+    options, args = parser.parse_args(args)
+
+    if len(args) != 2 or args[0] not in ('export', 'import') or \
+        not options.cluster_id or not options.node:
+        parser.error('cluster, node, action and file are required')
+
+    logging.basicConfig(
+        level=logging.DEBUG if options.verbose else logging.INFO,
+        format='%(asctime)s %(levelname)s %(message)s')
+
+    action, path = args
+    nodes = dict(bulk.parse_node(node) for node in options.node)
+
+    if action == 'export':
+        if options.dirty:
+            client_ = connect_node(options.cluster_id, nodes, options.dirty)
+        else:
+            client_ = bulk.connect_master(options.cluster_id, nodes)
+
+        fd = sys.stdout if path == '-' else open(path, 'wb')
+        try:
+            export_dump(client_, fd, options.begin, options.end,
+                options.prefix, options.page_size,
+                options.dirty is not None)
+        finally:
+            if fd is not sys.stdout:
+                fd.close()
+    else:
+        client_ = bulk.connect_master(options.cluster_id, nodes)
+
+        fd = sys.stdin if path == '-' else open(path, 'rb')
+        try:
+            import_dump(client_, fd, batch_bytes=options.batch_bytes,
+                batch_count=options.batch_count,
+                max_in_flight=options.in_flight,
+                checkpoint=options.checkpoint)
+        finally:
+            if fd is not sys.stdin:
+                fd.close()
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
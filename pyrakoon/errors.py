@@ -16,6 +16,7 @@
 
 '''Exceptions raised by client operations, as returned by a node'''
 
+import re
 import inspect
 
 class ArakoonError(Exception):
@@ -105,3 +106,49 @@ ERROR_MAP = dict((value.CODE, value) for value in globals().itervalues()
         and issubclass(value, ArakoonError)
         and value.CODE is not None)
 '''Map of Arakoon error codes to exception types''' #pylint: disable=W0105
+
+
+def master_hint(exc, node_ids):
+    '''Get the master node named in the message of an error, if any
+
+    A node which isn't the master can name the node it believes to be the
+    master in the message of a :class:`NotMaster` or :class:`NoLongerMaster`
+    error. The message can be a bare node identifier, or contain one as a
+    separate word.
+
+    Example:
+
+        >>> master_hint(NotMaster('arakoon_1'), ['arakoon_0', 'arakoon_1'])
+        'arakoon_1'
+        >>> master_hint(NotMaster('master is arakoon_1.'),
+        ...     ['arakoon_0', 'arakoon_1'])
+        'arakoon_1'
+        >>> print master_hint(NotMaster('None'), ['arakoon_0', 'arakoon_1'])
+        None
+
+    :param exc: Error raised by a node
+    :type exc: :class:`ArakoonError`
+    :param node_ids: Identifiers of the nodes of the cluster
+    :type node_ids: iterable of :class:`str`
+
+    :return: Identifier of the master node, or :data:`None`
+    :rtype: :class:`str`
+    '''
+
+    if not isinstance(exc, (NotMaster, NoLongerMaster)) or not exc.args or \
+        not isinstance(exc.args[0], basestring):
+        return None
+
+    message = exc.args[0].strip()
+    node_ids = set(node_ids)
+
+    if message in node_ids:
+        return message
+
+    for word in re.split(r'[^\w.-]+', message):
+        word = word.strip('.')
+
+        if word in node_ids:
+            return word
+
+    return None
@@ -0,0 +1,424 @@
+# This file is part of Pyrakoon, a distributed key-value store client.
+#
+# Copyright (C) 2014 Incubaid BVBA
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''Detection of hot keys and prefixes
+
+A :class:`HotKeyTracker` finds the keys and prefixes receiving the most
+requests, or causing the most traffic, using bounded memory: occurrences
+are counted in a :class:`CountMinSketch`, and only the `top` keys with the
+highest estimates are remembered, overall and per message type.
+
+Keys are taken from the `key`, `keys` and `begin_key` arguments of
+messages, and from the steps of sequences. Prefixes are taken from `prefix`
+arguments and, if a `separator` is given, derived from keys (the part of a
+key up to and including the last separator).
+
+The tracker is a :class:`pyrakoon.trace.Tracer`, so it can be attached to
+a client like any tracer, or fed directly using :meth:`HotKeyTracker.record`.
+Only a fraction (`sample_rate`) of requests is recorded, estimates are
+scaled accordingly. When attached to a client, the other requests aren't
+traced at all.
+
+Example:
+
+    >>> tracker = HotKeyTracker(sample_rate=1.0)
+    >>> for _ in xrange(9):
+    ...     tracker.record(protocol.Get(False, 'hot'), 100)
+    >>> tracker.record(protocol.Get(False, 'cold'), 100)
+    >>> tracker.record(protocol.PrefixKeys(False, 'user/', -1), 5000)
+    >>> tracker.hot_keys()
+    [<HotKey 'hot' requests=9 bytes=900 share=0.90>, \
+<HotKey 'cold' requests=1 bytes=100 share=0.10>]
+    >>> tracker.hot_prefixes(by=BYTES)
+    [<HotKey 'user/' requests=1 bytes=5000 share=1.00>]
+'''
+
+import zlib
+import array
+import random
+import threading
+
+from pyrakoon import protocol, sequence, trace
+
+REQUESTS = 'requests'
+'''Rank by number of requests''' #pylint: disable=W0105
+BYTES = 'bytes'
+'''Rank by number of bytes sent and received''' #pylint: disable=W0105
+
+DEFAULT_SAMPLE_RATE = 0.01
+'''Default fraction of requests recorded''' #pylint: disable=W0105
+DEFAULT_TOP = 10
+'''Default number of hot keys remembered''' #pylint: disable=W0105
+DEFAULT_WIDTH = 1024
+'''Default number of counters per sketch row''' #pylint: disable=W0105
+DEFAULT_DEPTH = 4
+'''Default number of sketch rows''' #pylint: disable=W0105
+
+
+class CountMinSketch(object):
+    '''Count-min sketch, estimating the total amount added per key
+
+    Estimates never underestimate, and overestimate by at most
+    `2 / width` of the total amount added with probability
+    `1 - 2 ** -depth`. Conservative updates are used, to reduce the
+    overestimation.
+    '''
+
+    def __init__(self, width=DEFAULT_WIDTH, depth=DEFAULT_DEPTH):
+        '''
+        :param width: Number of counters per row
+        :type width: :class:`int`
+        :param depth: Number of rows
+        :type depth: :class:`int`
+        '''
+
+        self._width = width
+        self._rows = [array.array('L', [0]) * width for _ in xrange(depth)]
+
+    def _indexes(self, key):
+        '''Calculate the counter index of a key in every row'''
+
+        first = hash(key)
+        second = zlib.crc32(key) | 1
+        width = self._width
+
+        return [(first + row * second) % width
+            for row in xrange(len(self._rows))]
+
+    def add(self, key, amount=1):
+        '''Add an amount to the counters of a key
+
+        :param key: Key
+        :type key: :class:`str`
+        :param amount: Amount to add, non-negative
+        :type amount: :class:`int`
+
+        :return: New estimate for `key`
+        :rtype: :class:`int`
+        '''
+
+        indexes = self._indexes(key)
+        rows = self._rows
+
+        value = min(row[index] for (row, index) in zip(rows, indexes)) + \
+            amount
+
+        for row, index in zip(rows, indexes):
+            if row[index] < value:
+                row[index] = value
+
+        return value
+
+    def estimate(self, key):
+        '''Estimate the total amount added for a key
+
+        :param key: Key
+        :type key: :class:`str`
+
+        :rtype: :class:`int`
+        '''
+
+        return min(row[index]
+            for (row, index) in zip(self._rows, self._indexes(key)))
+
+
+class _TopK(object):
+    '''Keys with the highest estimates'''
+
+    def __init__(self, size):
+        self._size = size
+        self._items = {}
+
+    def offer(self, key, estimate):
+        '''Update the estimate of a key, keeping it if it's among the top'''
+
+        items = self._items
+
+        if key in items or len(items) < self._size:
+            items[key] = estimate
+            return
+
+        smallest = min(items, key=items.get)
+
+        if estimate > items[smallest]:
+            del items[smallest]
+            items[key] = estimate
+
+    def keys(self):
+        '''Get all keys, highest estimate first'''
+
+        items = self._items
+
+        return sorted(items, key=lambda key: (-items[key], key))
+
+
+class _HeavyHitters(object):
+    '''Hot keys by number of requests and by bytes'''
+
+    def __init__(self, width, depth, size):
+        self.requests = 0
+        self.bytes = 0
+        self.request_sketch = CountMinSketch(width, depth)
+        self.byte_sketch = CountMinSketch(width, depth)
+        self.top_requests = _TopK(size)
+        self.top_bytes = _TopK(size)
+
+    def add(self, key, size):
+        '''Record a request for a key'''
+
+        self.requests += 1
+        self.top_requests.offer(key, self.request_sketch.add(key))
+
+        if size:
+            self.bytes += size
+            self.top_bytes.offer(key, self.byte_sketch.add(key, size))
+
+
+class HotKey(object): #pylint: disable=R0903
+    '''Estimated load of a key or prefix'''
+
+    __slots__ = 'key', 'requests', 'bytes', 'share',
+
+    def __init__(self, key, requests, bytes_, share):
+        self.key = key
+        self.requests = requests
+        self.bytes = bytes_
+        self.share = share
+
+    def __repr__(self):
+        return '<HotKey %r requests=%d bytes=%d share=%.2f>' % (self.key,
+            self.requests, self.bytes, self.share)
+
+
+def _step_keys(step):
+    '''Get all keys of a sequence step'''
+
+    if isinstance(step, sequence.Sequence):
+        for step_ in step.steps:
+            for key in _step_keys(step_):
+                yield key
+    else:
+        key = getattr(step, 'key', None)
+
+        if key is not None:
+            yield key
+
+
+def _message_keys(message):
+    '''Get the keys and prefixes of a message
+
+    :return: Keys and prefixes
+    :rtype: `(list of str, list of str)`
+    '''
+
+    if isinstance(message, protocol.Sequence):
+        return list(_step_keys(message.sequence)), []
+
+    keys = getattr(message, 'keys', None)
+    keys = list(keys) if keys is not None else []
+
+    for name in ('key', 'begin_key'):
+        key = getattr(message, name, None)
+
+        if key is not None:
+            keys.append(key)
+
+    prefix = getattr(message, 'prefix', None)
+
+    return keys, [prefix] if prefix is not None else []
+
+
+class HotKeyTracker(trace.Tracer):
+    '''Tracker of the hottest keys and prefixes, overall and per message
+    type'''
+
+    #pylint: disable=R0913
+    def __init__(self, sample_rate=DEFAULT_SAMPLE_RATE, top=DEFAULT_TOP,
+        width=DEFAULT_WIDTH, depth=DEFAULT_DEPTH, separator=None):
+        '''
+        :param sample_rate: Fraction of requests recorded
+        :type sample_rate: :class:`float`
+        :param top: Number of hot keys and prefixes remembered, per message
+            type
+        :type top: :class:`int`
+        :param width: Number of counters per sketch row
+        :type width: :class:`int`
+        :param depth: Number of sketch rows
+        :type depth: :class:`int`
+        :param separator: Separator used to derive prefixes from keys
+        :type separator: :class:`str`
+        '''
+
+        super(HotKeyTracker, self).__init__()
+
+        self._sample_rate = sample_rate
+        self._top = top
+        self._width = width
+        self._depth = depth
+        self._separator = separator
+
+        self._lock = threading.Lock()
+        self._keys = {}
+        self._prefixes = {}
+
+    def _hitters(self, table, operation):
+        '''Get the heavy hitters of an operation, creating them if needed'''
+
+        hitters = table.get(operation)
+
+        if hitters is None:
+            hitters = table[operation] = _HeavyHitters(self._width,
+                self._depth, self._top)
+
+        return hitters
+
+    def sample(self, message):
+        return self._sample_rate >= 1.0 or \
+            random.random() < self._sample_rate
+
+    def record(self, message, size=0):
+        '''Record a request, subject to sampling
+
+        :param message: Message sent
+        :type message: :class:`pyrakoon.protocol.Message`
+        :param size: Number of bytes sent and received
+        :type size: :class:`int`
+        '''
+
+        if self.sample(message):
+            self._add(message, size)
+
+    def _add(self, message, size):
+        '''Record a sampled request'''
+
+        keys, prefixes = _message_keys(message)
+
+        if self._separator is not None:
+            separator = self._separator
+            prefixes.extend(key[:key.rindex(separator) + len(separator)]
+                for key in keys if separator in key)
+
+        operation = type(message).__name__
+
+        self._lock.acquire()
+        try:
+            for table, keys_ in ((self._keys, keys),
+                (self._prefixes, prefixes)):
+                if not keys_:
+                    continue
+
+                share = size // len(keys_)
+                overall = self._hitters(table, None)
+                by_operation = self._hitters(table, operation)
+
+                for key in keys_:
+                    overall.add(key, share)
+                    by_operation.add(key, share)
+        finally:
+            self._lock.release()
+
+    def _record_trace(self, trace_):
+        '''Record a finished request'''
+
+        # Requests were sampled before they were traced
+        if trace_.message is not None:
+            self._add(trace_.message,
+                trace_.bytes_sent + trace_.bytes_received)
+
+    on_decoded = _record_trace
+    on_error = _record_trace
+
+    def _hot(self, table, operation, by):
+        '''Get the hot keys in a table'''
+
+        if by not in (REQUESTS, BYTES):
+            raise ValueError('Invalid ranking %r' % by)
+
+        scale = 1.0 / self._sample_rate if self._sample_rate < 1.0 else 1.0
+
+        self._lock.acquire()
+        try:
+            hitters = table.get(operation)
+
+            if hitters is None:
+                return []
+
+            top = hitters.top_requests if by == REQUESTS \
+                else hitters.top_bytes
+            total = hitters.requests if by == REQUESTS else hitters.bytes
+
+            result = []
+
+            for key in top.keys():
+                requests = hitters.request_sketch.estimate(key)
+                bytes_ = hitters.byte_sketch.estimate(key)
+                value = requests if by == REQUESTS else bytes_
+
+                result.append(HotKey(key, int(requests * scale),
+                    int(bytes_ * scale),
+                    min(1.0, float(value) / total) if total else 0.0))
+
+            return result
+        finally:
+            self._lock.release()
+
+    def hot_keys(self, operation=None, by=REQUESTS):
+        '''Get the hottest keys
+
+        :param operation: Message type name (e.g. `'Get'`), or :data:`None`
+            for all messages
+        :type operation: :class:`str`
+        :param by: Ranking, :data:`REQUESTS` or :data:`BYTES`
+        :type by: :class:`str`
+
+        :return: Hot keys, hottest first
+        :rtype: `list` of :class:`HotKey`
+        '''
+
+        return self._hot(self._keys, operation, by)
+
+    def hot_prefixes(self, operation=None, by=REQUESTS):
+        '''Get the hottest prefixes, see :meth:`hot_keys`
+
+        :rtype: `list` of :class:`HotKey`
+        '''
+
+        return self._hot(self._prefixes, operation, by)
+
+    @property
+    def operations(self):
+        '''Names of the message types recorded
+
+        :type: `list` of `str`
+        '''
+
+        self._lock.acquire()
+        try:
+            return sorted(operation
+                for operation in set(self._keys) | set(self._prefixes)
+                if operation is not None)
+        finally:
+            self._lock.release()
+
+    def reset(self):
+        '''Forget all measurements'''
+
+        self._lock.acquire()
+        try:
+            self._keys = {}
+            self._prefixes = {}
+        finally:
+            self._lock.release()
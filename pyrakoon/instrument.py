@@ -0,0 +1,556 @@
+# This file is part of Pyrakoon, a distributed key-value store client.
+#
+# Copyright (C) 2014 Incubaid BVBA
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''Client-side latency and traffic instrumentation
+
+An :class:`Instrumentation` object records, per message type, a latency
+histogram, the number of bytes sent and received, and the number of
+requests failing with every type of error. It can be attached to a
+:class:`pyrakoon.client.SocketClient`, a :class:`pyrakoon.tx.ArakoonProtocol`
+or a :class:`pyrakoon.compat.ArakoonClient` by setting their
+`instrumentation` attribute (or argument, for the latter).
+
+Recording a measurement only appends it to a per-thread buffer, without
+any locking. Buffers are aggregated and merged when a
+:meth:`Instrumentation.snapshot` is taken, so snapshots should be taken
+periodically. A thread aggregates its own buffer once it holds
+:data:`MAX_PENDING` measurements. Latencies are stored in
+logarithmic buckets, with :data:`SUB_BUCKETS` linear sub-buckets per power
+of two, so percentiles are accurate to within a few percent.
+
+Example:
+
+    >>> instrumentation = Instrumentation()
+    >>> for latency in (0.001, 0.002, 0.003, 0.1):
+    ...     instrumentation.record(protocol.Get, latency, 20, 10)
+    >>> instrumentation.record(protocol.Get, 0.001, 20, 15, errors.NotFound())
+    >>> stats = instrumentation.snapshot()[protocol.Get.TAG]
+    >>> stats.name, stats.requests, stats.bytes_sent, stats.errors
+    ('Get', 5, 100, {'NotFound': 1})
+    >>> 0.0019 < stats.percentile(50) < 0.0021
+    True
+'''
+
+import math
+import time
+import threading
+
+from pyrakoon import errors, protocol
+
+#pylint: disable=W0611
+# `errors` and `protocol` are used by the module doctest
+
+SUB_BUCKETS = 32
+'''Number of histogram buckets per power of two''' #pylint: disable=W0105
+MAX_PENDING = 65536
+'''Number of measurements a thread buffers before aggregating them itself
+''' #pylint: disable=W0105
+
+
+def _bucket(latency):
+    '''Calculate the histogram bucket of a latency (in seconds)'''
+
+    mantissa, exponent = math.frexp(latency * 1000000.0)
+
+    if exponent < 1:
+        return 0
+
+    return exponent * SUB_BUCKETS + int((mantissa - 0.5) * 2 * SUB_BUCKETS)
+
+def _bucket_value(bucket):
+    '''Calculate the latency (in seconds) in the middle of a bucket'''
+
+    if bucket == 0:
+        return 0.0000005
+
+    exponent, sub = divmod(bucket, SUB_BUCKETS)
+    mantissa = 0.5 + (sub + 0.5) / (2.0 * SUB_BUCKETS)
+
+    return math.ldexp(mantissa, exponent) / 1000000.0
+
+
+class LatencyHistogram(object):
+    '''Histogram of latencies, in logarithmic buckets'''
+
+    def __init__(self, counts=None):
+        '''Create a histogram
+
+        :param counts: Number of samples per bucket
+        :type counts: `dict` of `int` to `int`
+        '''
+
+        self.counts = dict(counts or {})
+
+    def record(self, latency):
+        '''Add a sample
+
+        :param latency: Latency, in seconds
+        :type latency: :class:`float`
+        '''
+
+        bucket = _bucket(latency)
+        self.counts[bucket] = self.counts.get(bucket, 0) + 1
+
+    def merge(self, other):
+        '''Add all samples of another histogram
+
+        :param other: Histogram to merge
+        :type other: :class:`LatencyHistogram`
+        '''
+
+        counts = self.counts
+
+        for bucket, count in other.counts.items():
+            counts[bucket] = counts.get(bucket, 0) + count
+
+    @property
+    def count(self):
+        '''Total number of samples'''
+
+        return sum(self.counts.itervalues())
+
+    def percentile(self, percentile):
+        '''Calculate a latency percentile
+
+        :param percentile: Percentile to calculate, between 0 and 100
+        :type percentile: :class:`float`
+
+        :return: Latency, in seconds, or :data:`None` if the histogram is
+            empty
+        :rtype: :class:`float`
+        '''
+
+        total = self.count
+
+        if not total:
+            return None
+
+        rank = max(1, int(math.ceil(total * percentile / 100.0)))
+        seen = 0
+
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+
+            if seen >= rank:
+                return _bucket_value(bucket)
+
+        return _bucket_value(max(self.counts))
+
+    def __repr__(self):
+        if not self.counts:
+            return '<LatencyHistogram count=0>'
+
+        return '<LatencyHistogram count=%d p50=%.6f p99=%.6f p99.9=%.6f>' % (
+            self.count, self.percentile(50), self.percentile(99),
+            self.percentile(99.9))
+
+
+class OperationStatistics(object): #pylint: disable=R0902
+    '''Statistics of a single message type'''
+
+    def __init__(self, tag, name):
+        self.tag = tag
+        self.name = name
+        self.requests = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.total_latency = 0.0
+        self.errors = {}
+        self.histogram = LatencyHistogram()
+
+    def percentile(self, percentile):
+        '''Calculate a latency percentile, see
+        :meth:`LatencyHistogram.percentile`'''
+
+        return self.histogram.percentile(percentile)
+
+    @property
+    def mean_latency(self):
+        '''Average latency, in seconds'''
+
+        return self.total_latency / self.requests if self.requests else 0.0
+
+    def __repr__(self):
+        return '<OperationStatistics %s requests=%d errors=%d sent=%d ' \
+            'received=%d %r>' % (self.name, self.requests,
+                sum(self.errors.itervalues()), self.bytes_sent,
+                self.bytes_received, self.histogram)
+
+
+class _ThreadStatistics(object): #pylint: disable=R0903
+    '''Measurements of a single thread
+
+    Measurements are appended to `pending` by the owning thread, and
+    aggregated into `totals` and `errors` by :meth:`drain`. `lock` serializes
+    concurrent calls to :meth:`drain`. `active` counts the requests started
+    minus the requests finished by the thread.
+    '''
+
+    __slots__ = 'thread', 'lock', 'pending', 'totals', 'errors', 'active',
+
+    def __init__(self, thread):
+        self.thread = thread
+        self.lock = threading.Lock()
+        # (Message type, latency, sent, received, error) tuples
+        self.pending = []
+        # Message type to [requests, sent, received, total latency,
+        # bucket counts]
+        self.totals = {}
+        # (Message type, error type) to count
+        self.errors = {}
+        self.active = 0
+
+    def add(self, measurements):
+        '''Aggregate measurements'''
+
+        totals_ = self.totals
+        errors_ = self.errors
+
+        for type_, latency, sent, received, error in measurements:
+            totals = totals_.get(type_)
+
+            if totals is None:
+                totals = totals_[type_] = [0, 0, 0, 0.0, {}]
+
+            totals[0] += 1
+            totals[1] += sent
+            totals[2] += received
+            totals[3] += latency
+
+            counts = totals[4]
+            bucket = _bucket(latency)
+            counts[bucket] = counts.get(bucket, 0) + 1
+
+            if error is not None:
+                key = (type_, type(error))
+                errors_[key] = errors_.get(key, 0) + 1
+
+    def drain(self):
+        '''Aggregate all pending measurements
+
+        This can be called from any thread. Measurements appended
+        concurrently are left in place.
+        '''
+
+        self.lock.acquire()
+        try:
+            pending = self.pending
+            count = len(pending)
+
+            self.add(pending[:count])
+            del pending[:count]
+        finally:
+            self.lock.release()
+
+    def merge(self, other):
+        '''Aggregate all (aggregated) measurements of another instance'''
+
+        for type_, totals in other.totals.items():
+            target = self.totals.get(type_)
+
+            if target is None:
+                target = self.totals[type_] = [0, 0, 0, 0.0, {}]
+
+            for index in xrange(4):
+                target[index] += totals[index]
+
+            counts = target[4]
+
+            for bucket, count in totals[4].items():
+                counts[bucket] = counts.get(bucket, 0) + count
+
+        for key, count in other.errors.items():
+            self.errors[key] = self.errors.get(key, 0) + count
+
+        self.active += other.active
+
+
+class ByteCounts(object):
+    '''Number of bytes sent and received by a single request
+
+    Transports update these where they serialize a message and read its
+    result, so messages don't need to be wrapped to be measured.
+    '''
+
+    __slots__ = 'sent', 'received',
+
+    def __init__(self):
+        self.sent = 0
+        self.received = 0
+
+    def reader(self, read):
+        '''Wrap a blocking read function to count received bytes
+
+        :param read: Function reading a given number of bytes
+        :type read: `callable`
+
+        :return: Wrapped function
+        :rtype: `callable`
+        '''
+
+        def read_(count):
+            '''Read `count` bytes, counting them'''
+
+            data = read(count)
+            self.received += len(data)
+
+            return data
+
+        return read_
+
+    def receiver(self, receive):
+        '''Wrap a result parser factory to count received bytes
+
+        :param receive: Function creating a result parser coroutine, see
+            :meth:`pyrakoon.protocol.Message.receive`
+        :type receive: `callable`
+
+        :return: Wrapped function
+        :rtype: `callable`
+        '''
+
+        def receive_():
+            '''Create a result parser, counting the data it's fed'''
+
+            receiver = receive()
+            request = receiver.next()
+
+            while True:
+                data = yield request
+                self.received += len(data)
+                request = receiver.send(data)
+
+        return receive_
+
+
+class Instrumentation(object):
+    '''Per-message-type latency, traffic and error statistics
+
+    A single instance can be shared by any number of clients and threads.
+    '''
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._threads = []
+        self._merged = _ThreadStatistics(None)
+
+    def _register(self):
+        '''Create the measurement storage of the current thread'''
+
+        stats = _ThreadStatistics(threading.current_thread())
+        self._local.stats = stats
+
+        self._lock.acquire()
+        try:
+            self._threads.append(stats)
+        finally:
+            self._lock.release()
+
+        return stats
+
+    def _stats(self):
+        '''Get the measurement storage of the current thread'''
+
+        try:
+            return self._local.stats
+        except AttributeError:
+            return self._register()
+
+    def record(self, type_, latency, sent, received, error=None):
+        '''Record the outcome of a single request
+
+        :param type_: Message type
+        :type type_: `type`
+        :param latency: Latency, in seconds
+        :type latency: :class:`float`
+        :param sent: Number of bytes sent
+        :type sent: :class:`int`
+        :param received: Number of bytes received
+        :type received: :class:`int`
+        :param error: Exception raised by the request, if any
+        :type error: :class:`Exception`
+        '''
+
+        try:
+            stats = self._local.stats
+        except AttributeError:
+            stats = self._register()
+
+        pending = stats.pending
+        pending.append((type_, latency, sent, received, error))
+
+        if len(pending) >= MAX_PENDING:
+            stats.drain()
+
+    def process(self, process, message):
+        '''Handle a message using a blocking transport, recording the outcome
+
+        :param process: Callable sending a message and returning its result,
+            updating the :class:`ByteCounts` passed as its `counts` keyword
+            argument
+        :type process: `callable`
+        :param message: Message to handle
+        :type message: :class:`pyrakoon.protocol.Message`
+
+        :return: Result of `process`
+        '''
+
+        counts = ByteCounts()
+        stats = self._stats()
+        stats.active += 1
+        start = time.time()
+
+        try:
+            result = process(message, counts=counts)
+        except Exception as exc:
+            stats.active -= 1
+            self.record(type(message), time.time() - start, counts.sent,
+                counts.received, exc)
+            raise
+
+        stats.active -= 1
+        self.record(type(message), time.time() - start, counts.sent,
+            counts.received)
+
+        return result
+
+    def process_deferred(self, process, message):
+        '''Handle a message using an asynchronous transport, recording the
+        outcome once the result is available
+
+        :param process: Callable sending a message and returning a
+            `Deferred`, updating the :class:`ByteCounts` passed as its
+            `counts` keyword argument
+        :type process: `callable`
+        :param message: Message to handle
+        :type message: :class:`pyrakoon.protocol.Message`
+
+        :return: Result of `process`
+        :rtype: `twisted.internet.defer.Deferred`
+        '''
+
+        from twisted.python import failure
+
+        counts = ByteCounts()
+        self._stats().active += 1
+        start = time.time()
+
+        def done(result):
+            '''Record the outcome of the request'''
+
+            self._stats().active -= 1
+            error = result.value if isinstance(result, failure.Failure) \
+                else None
+
+            self.record(type(message), time.time() - start, counts.sent,
+                counts.received, error)
+
+            return result
+
+        deferred = process(message, counts=counts)
+        deferred.addBoth(done)
+
+        return deferred
+
+    @property
+    def in_flight(self):
+        '''Number of requests handled by :meth:`process` or
+        :meth:`process_deferred` which didn't finish yet
+
+        :type: :class:`int`
+        '''
+
+        self._lock.acquire()
+        try:
+            return self._merged.active + \
+                sum(stats.active for stats in self._threads)
+        finally:
+            self._lock.release()
+
+    def snapshot(self):
+        '''Aggregate and merge the measurements of all threads
+
+        Measurements of threads which terminated are folded into a single
+        set, so their storage is released.
+
+        :return: Statistics per message tag
+        :rtype: `dict` of `int` to :class:`OperationStatistics`
+        '''
+
+        result = _ThreadStatistics(None)
+
+        self._lock.acquire()
+        try:
+            live = []
+
+            for stats in self._threads:
+                stats.drain()
+
+                if stats.thread.is_alive():
+                    live.append(stats)
+                else:
+                    self._merged.merge(stats)
+
+            self._threads = live
+
+            result.merge(self._merged)
+
+            for stats in live:
+                stats.lock.acquire()
+                try:
+                    result.merge(stats)
+                finally:
+                    stats.lock.release()
+        finally:
+            self._lock.release()
+
+        operations = {}
+
+        for type_, totals in result.totals.iteritems():
+            operation = OperationStatistics(type_.TAG, type_.__name__)
+            operation.requests, operation.bytes_sent, \
+                operation.bytes_received, operation.total_latency, \
+                counts = totals
+            operation.histogram = LatencyHistogram(counts)
+
+            operations[type_.TAG] = operation
+
+        for (type_, error_type), count in result.errors.iteritems():
+            operations[type_.TAG].errors[error_type.__name__] = count
+
+        return operations
+
+    def reset(self):
+        '''Discard all measurements
+
+        Measurements recorded concurrently may get lost.
+        '''
+
+        self._lock.acquire()
+        try:
+            for stats in self._threads:
+                stats.lock.acquire()
+                try:
+                    del stats.pending[:]
+                    stats.totals.clear()
+                    stats.errors.clear()
+                finally:
+                    stats.lock.release()
+
+            self._merged = _ThreadStatistics(None)
+        finally:
+            self._lock.release()
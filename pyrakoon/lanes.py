@@ -0,0 +1,353 @@
+# This file is part of Pyrakoon, a distributed key-value store client.
+#
+# Copyright (C) 2014 Incubaid BVBA
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''Priority lanes, separating latency-critical from bulk traffic
+
+A single connection handles requests strictly in order, so a small request
+queued behind a request returning a large response has to wait for the
+whole response to be transferred. A :class:`LaneClient` keeps a separate
+pool of connections per priority class (*lane*): :data:`INTERACTIVE`,
+:data:`NORMAL` and :data:`BULK`. The number of concurrent bulk requests and
+the rate at which bulk responses are received can be capped.
+
+A :class:`LaneClient` is connected to a single node, use one instance per
+node to separate traffic to several nodes. Example::
+
+    client = LaneClient(('127.0.0.1', 4000), 'ricky',
+        bulk_concurrency=1, bulk_bandwidth=10 * 1024 * 1024)
+
+    client.get('key') # Normal lane
+    client.lane(INTERACTIVE).get('key') # Interactive lane
+    client.range_entries(None, True, None, True) # Bulk lane
+'''
+
+import threading
+
+from pyrakoon import client, protocol
+from pyrakoon.ratelimit import TokenBucket
+
+INTERACTIVE = 'interactive'
+'''Lane for latency-critical requests''' #pylint: disable=W0105
+NORMAL = 'normal'
+'''Lane for regular requests''' #pylint: disable=W0105
+BULK = 'bulk'
+'''Lane for requests with large responses''' #pylint: disable=W0105
+
+LANES = (INTERACTIVE, NORMAL, BULK)
+'''All lanes, in order of priority''' #pylint: disable=W0105
+
+DEFAULT_POOL_SIZES = {
+    INTERACTIVE: 2,
+    NORMAL: 4,
+    BULK: 2,
+}
+'''Default number of connections per lane''' #pylint: disable=W0105
+
+DEFAULT_BULK_THRESHOLD = 1000
+'''Default `max_elements` from which range requests use the bulk lane
+''' #pylint: disable=W0105
+
+_RANGE_MESSAGES = (protocol.Range, protocol.RangeEntries,
+    protocol.RevRangeEntries, protocol.PrefixKeys)
+
+
+class _LaneConnection(client.SocketClient):
+    '''Connection of a lane, optionally throttling received data'''
+
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, address, cluster_id, throttle=None):
+        super(_LaneConnection, self).__init__(address, cluster_id)
+
+        self._throttle = throttle
+
+    def _recv(self, count):
+        if self._throttle is None:
+            return super(_LaneConnection, self)._recv(count)
+
+        parts = []
+
+        while count > 0:
+            part = super(_LaneConnection, self)._recv(
+                min(count, self.CHUNK_SIZE))
+            self._throttle.consume(len(part))
+
+            parts.append(part)
+            count -= len(part)
+
+        return ''.join(parts)
+
+
+class _Pool(object):
+    '''Bounded pool of connections'''
+
+    def __init__(self, factory, size):
+        self._factory = factory
+        self._size = size
+        self._semaphore = threading.BoundedSemaphore(size)
+        self._idle = []
+        self._lock = threading.Lock()
+        self._in_use = 0
+        self._created = 0
+
+    def acquire(self):
+        '''Check out a connection, blocking while all are in use'''
+
+        self._semaphore.acquire()
+
+        try:
+            self._lock.acquire()
+            try:
+                connection = self._idle.pop() if self._idle else None
+                self._in_use += 1
+            finally:
+                self._lock.release()
+
+            if connection is None or not connection.connected:
+                connection = self._factory()
+                connection.connect()
+
+                self._lock.acquire()
+                try:
+                    self._created += 1
+                finally:
+                    self._lock.release()
+        except:
+            self._lock.acquire()
+            try:
+                self._in_use -= 1
+            finally:
+                self._lock.release()
+
+            self._semaphore.release()
+            raise
+
+        return connection
+
+    def release(self, connection):
+        '''Return a connection to the pool
+
+        Connections which got disconnected are dropped.
+        '''
+
+        try:
+            self._lock.acquire()
+            try:
+                self._in_use -= 1
+
+                if connection.connected:
+                    self._idle.append(connection)
+            finally:
+                self._lock.release()
+        finally:
+            self._semaphore.release()
+
+    @property
+    def statistics(self):
+        '''Pool size, connections in use and idle, and connections created
+
+        :type: `dict` of `str` to `int`
+        '''
+
+        self._lock.acquire()
+        try:
+            return {
+                'size': self._size,
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+                'created': self._created,
+            }
+        finally:
+            self._lock.release()
+
+    def close(self):
+        '''Close all idle connections'''
+
+        self._lock.acquire()
+        try:
+            idle, self._idle = self._idle, []
+        finally:
+            self._lock.release()
+
+        for connection in idle:
+            connection._disconnect() #pylint: disable=W0212
+
+
+class LaneClient(object, client.AbstractClient, client.ClientMixin):
+    '''Client using separate connection pools per priority lane
+
+    Requests are handled in the :data:`NORMAL` lane, except for `range`,
+    `range_entries`, `rev_range_entries` and `prefix` requests without a
+    `max_elements` limit, or with a limit of at least `bulk_threshold`,
+    which are handled in the :data:`BULK` lane. Use :meth:`lane` to submit
+    requests in a specific lane.
+
+    Every lane has its own pool of connections to the node, so requests in
+    one lane never wait for the responses of another lane.
+    '''
+
+    #pylint: disable=R0913
+    def __init__(self, address, cluster_id, pool_sizes=None,
+        bulk_concurrency=None, bulk_bandwidth=None,
+        bulk_threshold=DEFAULT_BULK_THRESHOLD):
+        '''
+        :param address: Node address (host & port)
+        :type address: `(str, int)`
+        :param cluster_id: Identifier of the cluster
+        :type cluster_id: `str`
+        :param pool_sizes: Maximum number of connections per lane
+        :type pool_sizes: `dict` of `str` to `int`
+        :param bulk_concurrency: Maximum number of concurrent bulk requests,
+            overrides the size of the bulk pool
+        :type bulk_concurrency: :class:`int`
+        :param bulk_bandwidth: Maximum rate at which bulk responses are
+            received, in bytes per second
+        :type bulk_bandwidth: :class:`float`
+        :param bulk_threshold: Minimal `max_elements` of range requests
+            handled in the bulk lane by default
+        :type bulk_threshold: :class:`int`
+        '''
+
+        super(LaneClient, self).__init__()
+
+        sizes = dict(DEFAULT_POOL_SIZES)
+        sizes.update(pool_sizes or {})
+
+        if bulk_concurrency is not None:
+            sizes[BULK] = bulk_concurrency
+
+        throttle = TokenBucket(bulk_bandwidth) if bulk_bandwidth else None
+
+        def factory(lane):
+            '''Create a connection factory for a lane'''
+
+            lane_throttle = throttle if lane == BULK else None
+
+            return lambda: _LaneConnection(address, cluster_id,
+                lane_throttle)
+
+        self._pools = dict((lane, _Pool(factory(lane), sizes[lane]))
+            for lane in LANES)
+        self._bulk_threshold = bulk_threshold
+        self._closed = False
+
+    @property
+    def connected(self):
+        '''Check whether the client wasn't closed'''
+
+        return not self._closed
+
+    @property
+    def statistics(self):
+        '''Pool size, connections in use and idle, and connections created,
+        per lane
+
+        :type: `dict` of `str` to `dict` of `str` to `int`
+        '''
+
+        return dict((lane, pool.statistics)
+            for (lane, pool) in self._pools.iteritems())
+
+    def close(self):
+        '''Close all idle connections, and refuse new requests'''
+
+        self._closed = True
+
+        for pool in self._pools.itervalues():
+            pool.close()
+
+    def lane(self, lane):
+        '''Get a client submitting all requests in a given lane
+
+        :param lane: Lane to use, one of :data:`LANES`
+        :type lane: :class:`str`
+
+        :return: Client using lane `lane`
+        :rtype: :class:`pyrakoon.client.ClientMixin`
+
+        :raise ValueError: Unknown lane
+        '''
+
+        if lane not in self._pools:
+            raise ValueError('Unknown lane %r' % lane)
+
+        return _LaneView(self, lane)
+
+    def _select_lane(self, message):
+        '''Select the default lane of a message'''
+
+        if isinstance(message, _RANGE_MESSAGES):
+            max_elements = message.max_elements
+
+            if max_elements < 0 or max_elements >= self._bulk_threshold:
+                return BULK
+
+        return NORMAL
+
+    def _process_in(self, lane, message):
+        '''Handle a message using a connection of the given lane'''
+
+        pool = self._pools[lane]
+        connection = pool.acquire()
+
+        try:
+            return connection._process(message) #pylint: disable=W0212
+        finally:
+            pool.release(connection)
+
+    def _process_pipelined_in(self, lane, messages, max_in_flight):
+        '''Pipeline messages over a single connection of the given lane'''
+
+        pool = self._pools[lane]
+        connection = pool.acquire()
+
+        try:
+            for result in connection._process_pipelined( #pylint: disable=W0212
+                messages, max_in_flight):
+                yield result
+        finally:
+            pool.release(connection)
+
+    def _process(self, message):
+        return self._process_in(self._select_lane(message), message)
+
+    def _process_pipelined(self, messages, max_in_flight=None):
+        return self._process_pipelined_in(NORMAL, messages, max_in_flight)
+
+
+class _LaneView(object, client.AbstractClient, client.ClientMixin):
+    '''Client submitting all requests in a single lane of a
+    :class:`LaneClient`'''
+
+    def __init__(self, parent, lane):
+        super(_LaneView, self).__init__()
+
+        self._parent = parent
+        self._lane = lane
+
+    @property
+    def connected(self):
+        '''Check whether the parent client is connected'''
+
+        return self._parent.connected
+
+    def _process(self, message):
+        return self._parent._process_in( #pylint: disable=W0212
+            self._lane, message)
+
+    def _process_pipelined(self, messages, max_in_flight=None):
+        return self._parent._process_pipelined_in( #pylint: disable=W0212
+            self._lane, messages, max_in_flight)
@@ -0,0 +1,860 @@
+# This file is part of Pyrakoon, a distributed key-value store client.
+#
+# Copyright (C) 2014 Incubaid BVBA
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''Client and cluster metrics in the Prometheus text exposition format
+
+A :class:`Registry` holds a set of collectors, and renders the metrics they
+report as text (see :meth:`Registry.render`), which can be served over HTTP
+using :func:`serve`, or written to a file using :func:`dump`.
+
+Collectors are objects with a `collect` method returning
+:class:`MetricFamily` objects. The following ones are available:
+
+- :class:`Counter` and :class:`Gauge`, updated by application code
+- :class:`InstrumentationCollector`, reporting request latencies, traffic,
+  errors and requests in flight recorded by a
+  :class:`pyrakoon.instrument.Instrumentation`
+- :class:`LanePoolCollector`, reporting the connection pools of a
+  :class:`pyrakoon.lanes.LaneClient`
+- :class:`NodeStatisticsCollector`, periodically retrieving the
+  `statistics` of every node of a cluster
+
+:data:`REGISTRY` contains the counters of connections and master changes
+maintained by :class:`pyrakoon.compat.ArakoonClient`.
+
+Incrementing a counter doesn't take any lock: every thread increments its
+own cell, and cells are summed when metrics are collected.
+
+Example:
+
+    >>> registry = Registry()
+    >>> requests = Counter('app_requests_total', 'Requests handled',
+    ...     ('method', ))
+    >>> registry.register(requests)
+    >>> requests.labels('get').inc()
+    >>> requests.labels('get').inc(2)
+    >>> print registry.render(),
+    # HELP app_requests_total Requests handled
+    # TYPE app_requests_total counter
+    app_requests_total{method="get"} 3
+'''
+
+import re
+import math
+import logging
+import threading
+import SocketServer
+import BaseHTTPServer
+
+from pyrakoon import broadcast, protocol
+
+LOGGER = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+'''Content type of the text exposition format''' #pylint: disable=W0105
+
+DEFAULT_ADDRESS = ('127.0.0.1', 9464)
+'''Default address :func:`serve` listens on''' #pylint: disable=W0105
+
+DEFAULT_QUANTILES = (0.5, 0.9, 0.99, 0.999)
+'''Default latency quantiles reported by :class:`InstrumentationCollector`
+''' #pylint: disable=W0105
+
+DEFAULT_SCRAPE_INTERVAL = 60.0
+'''Default interval between node statistics scrapes, in seconds
+''' #pylint: disable=W0105
+
+_NAME_RE = re.compile(r'^[a-zA-Z_:][a-zA-Z0-9_:]*$')
+_INVALID_NAME_CHARS_RE = re.compile(r'[^a-zA-Z0-9_]')
+
+
+def _format_value(value):
+    '''Format a sample value'''
+
+    if isinstance(value, (int, long)):
+        return str(value)
+
+    if math.isnan(value):
+        return 'NaN'
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+
+    return repr(float(value))
+
+def _escape_label(value):
+    '''Escape a label value'''
+
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n') \
+        .replace('"', '\\"')
+
+def _escape_help(value):
+    '''Escape a help text'''
+
+    return value.replace('\\', '\\\\').replace('\n', '\\n')
+
+def _check_name(name):
+    '''Validate a metric name
+
+    :raise ValueError: Invalid name
+    '''
+
+    if not _NAME_RE.match(name):
+        raise ValueError('Invalid metric name %r' % name)
+
+def sanitize_name(name):
+    '''Turn an arbitrary string into a valid metric name (component)
+
+    :param name: String to convert
+    :type name: :class:`str`
+
+    :return: `name`, with all invalid characters replaced by underscores
+    :rtype: :class:`str`
+
+    >>> sanitize_name('avg_set_size')
+    'avg_set_size'
+    >>> sanitize_name('node-0.is')
+    'node_0_is'
+    '''
+
+    return _INVALID_NAME_CHARS_RE.sub('_', name)
+
+
+class MetricFamily(object): #pylint: disable=R0903
+    '''Samples of a single metric, as returned by collectors'''
+
+    def __init__(self, name, type_, documentation):
+        '''
+        :param name: Metric name
+        :type name: :class:`str`
+        :param type_: Metric type, `counter`, `gauge`, `summary` or
+            `untyped`
+        :type type_: :class:`str`
+        :param documentation: Help text
+        :type documentation: :class:`str`
+        '''
+
+        _check_name(name)
+
+        self.name = name
+        self.type = type_
+        self.documentation = documentation
+        self.samples = []
+
+    def add(self, value, labels=None, suffix=''):
+        '''Add a sample
+
+        :param value: Sample value
+        :type value: :class:`int` or :class:`float`
+        :param labels: Sample labels
+        :type labels: `dict` of `str` to `str`
+        :param suffix: Suffix of the sample name, e.g. `_sum`
+        :type suffix: :class:`str`
+        '''
+
+        self.samples.append((self.name + suffix, labels or {}, value))
+
+    def render(self):
+        '''Render the family in the text exposition format
+
+        :rtype: :class:`str`
+        '''
+
+        lines = [
+            '# HELP %s %s' % (self.name, _escape_help(self.documentation)),
+            '# TYPE %s %s' % (self.name, self.type),
+        ]
+
+        for name, labels, value in self.samples:
+            if labels:
+                name = '%s{%s}' % (name, ','.join('%s="%s"' % (
+                    label, _escape_label(labels[label]))
+                    for label in sorted(labels)))
+
+            lines.append('%s %s' % (name, _format_value(value)))
+
+        return '\n'.join(lines) + '\n'
+
+
+class _CounterValue(object):
+    '''Counter value, incremented without locking
+
+    Every thread increments its own cell. Cells of terminated threads are
+    folded into a base value, so their storage is released and the value
+    never decreases.
+    '''
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._base = 0
+        self._cells = []
+
+    def _fold(self):
+        '''Fold the cells of terminated threads into the base value, with
+        the lock held'''
+
+        live = []
+
+        for thread, cell in self._cells:
+            if thread.is_alive():
+                live.append((thread, cell))
+            else:
+                self._base += cell[0]
+
+        self._cells = live
+
+    def _cell(self):
+        '''Create the cell of the current thread'''
+
+        cell = self._local.cell = [0]
+
+        self._lock.acquire()
+        try:
+            self._fold()
+            self._cells.append((threading.current_thread(), cell))
+        finally:
+            self._lock.release()
+
+        return cell
+
+    def inc(self, amount=1):
+        '''Increment the value
+
+        :param amount: Amount to add, non-negative
+        :type amount: :class:`int` or :class:`float`
+        '''
+
+        try:
+            cell = self._local.cell
+        except AttributeError:
+            cell = self._cell()
+
+        cell[0] += amount
+
+    def get(self):
+        '''Get the current value'''
+
+        self._lock.acquire()
+        try:
+            self._fold()
+
+            return self._base + sum(cell[0] for (_, cell) in self._cells)
+        finally:
+            self._lock.release()
+
+
+class _GaugeValue(object):
+    '''Gauge value, set directly or calculated by a callback'''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._value = 0
+        self._function = None
+
+    def set(self, value):
+        '''Set the value'''
+
+        self._lock.acquire()
+        try:
+            self._value = value
+        finally:
+            self._lock.release()
+
+    def inc(self, amount=1):
+        '''Increment the value'''
+
+        self._lock.acquire()
+        try:
+            self._value += amount
+        finally:
+            self._lock.release()
+
+    def dec(self, amount=1):
+        '''Decrement the value'''
+
+        self.inc(-amount)
+
+    def set_function(self, function):
+        '''Calculate the value by calling `function` on collection
+
+        :param function: Callable returning the value
+        :type function: `callable`
+        '''
+
+        self._function = function
+
+    def get(self):
+        '''Get the current value'''
+
+        function = self._function
+
+        if function is not None:
+            return function()
+
+        return self._value
+
+
+class _Metric(object):
+    '''Base class of metrics with optional labels'''
+
+    TYPE = None
+    '''Metric type''' #pylint: disable=W0105
+    _VALUE = None
+
+    def __init__(self, name, documentation, label_names=()):
+        '''
+        :param name: Metric name
+        :type name: :class:`str`
+        :param documentation: Help text
+        :type documentation: :class:`str`
+        :param label_names: Names of the labels of the metric
+        :type label_names: `tuple` of `str`
+        '''
+
+        _check_name(name)
+
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+
+        self._lock = threading.Lock()
+        self._values = {}
+
+        if not self.label_names:
+            self._values[()] = self._VALUE() #pylint: disable=E1102
+
+    def labels(self, *values):
+        '''Get the child metric for a set of label values
+
+        :param values: Label values, in the order of `label_names`
+        :type values: `tuple` of `str`
+
+        :return: Child metric
+        :raise ValueError: Wrong number of values
+        '''
+
+        values = tuple(str(value) for value in values)
+
+        value = self._values.get(values)
+        if value is not None:
+            return value
+
+        if len(values) != len(self.label_names):
+            raise ValueError('Expected %d label values, got %d' % (
+                len(self.label_names), len(values)))
+
+        self._lock.acquire()
+        try:
+            value = self._values.get(values)
+
+            if value is None:
+                value = self._values[values] = \
+                    self._VALUE() #pylint: disable=E1102
+        finally:
+            self._lock.release()
+
+        return value
+
+    def _unlabeled(self):
+        '''Get the value of a metric without labels'''
+
+        if self.label_names:
+            raise ValueError('Metric %s requires labels' % self.name)
+
+        return self._values[()]
+
+    def collect(self):
+        '''Collect the samples of the metric
+
+        :rtype: `list` of :class:`MetricFamily`
+        '''
+
+        family = MetricFamily(self.name, self.TYPE, self.documentation)
+
+        self._lock.acquire()
+        try:
+            values = sorted(self._values.items())
+        finally:
+            self._lock.release()
+
+        for label_values, value in values:
+            family.add(value.get(), dict(zip(self.label_names, label_values)))
+
+        return [family]
+
+
+class Counter(_Metric):
+    '''Monotonically increasing value, e.g. a number of events'''
+
+    TYPE = 'counter'
+    _VALUE = _CounterValue
+
+    def inc(self, amount=1):
+        '''Increment a counter without labels
+
+        :param amount: Amount to add, non-negative
+        :type amount: :class:`int` or :class:`float`
+        '''
+
+        self._unlabeled().inc(amount)
+
+
+class Gauge(_Metric):
+    '''Value which can go up and down, e.g. a number of connections'''
+
+    TYPE = 'gauge'
+    _VALUE = _GaugeValue
+
+    def set(self, value):
+        '''Set the value of a gauge without labels'''
+
+        self._unlabeled().set(value)
+
+    def inc(self, amount=1):
+        '''Increment the value of a gauge without labels'''
+
+        self._unlabeled().inc(amount)
+
+    def dec(self, amount=1):
+        '''Decrement the value of a gauge without labels'''
+
+        self._unlabeled().dec(amount)
+
+    def set_function(self, function):
+        '''Calculate the value of a gauge without labels on collection'''
+
+        self._unlabeled().set_function(function)
+
+
+class Registry(object):
+    '''Set of collectors'''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._collectors = []
+
+    def register(self, collector):
+        '''Add a collector
+
+        :param collector: Object with a `collect` method returning a list
+            of :class:`MetricFamily`
+        '''
+
+        self._lock.acquire()
+        try:
+            if collector not in self._collectors:
+                self._collectors.append(collector)
+        finally:
+            self._lock.release()
+
+    def unregister(self, collector):
+        '''Remove a collector'''
+
+        self._lock.acquire()
+        try:
+            self._collectors.remove(collector)
+        finally:
+            self._lock.release()
+
+    def collect(self):
+        '''Collect the metrics of all collectors
+
+        Collectors raising an exception are skipped.
+
+        :rtype: `list` of :class:`MetricFamily`
+        '''
+
+        self._lock.acquire()
+        try:
+            collectors = list(self._collectors)
+        finally:
+            self._lock.release()
+
+        families = []
+
+        for collector in collectors:
+            try:
+                families.extend(collector.collect())
+            except Exception: #pylint: disable=W0703
+                LOGGER.exception('Collector %r failed', collector)
+
+        return families
+
+    def render(self):
+        '''Render all metrics in the text exposition format
+
+        :rtype: :class:`str`
+        '''
+
+        return ''.join(family.render() for family in self.collect())
+
+
+REGISTRY = Registry()
+'''Default registry''' #pylint: disable=W0105
+
+CONNECTIONS = Counter('pyrakoon_connections_total',
+    'Connections established by compat clients', ('node', ))
+'''Connections established by :class:`pyrakoon.compat.ArakoonClient`, by
+node address''' #pylint: disable=W0105
+CONNECTION_FAILURES = Counter('pyrakoon_connection_failures_total',
+    'Failed connection attempts of compat clients', ('node', ))
+'''Failed connection attempts of :class:`pyrakoon.compat.ArakoonClient`,
+by node address''' #pylint: disable=W0105
+MASTER_CHANGES = Counter('pyrakoon_master_changes_total',
+    'Master changes observed by compat clients', ('cluster', ))
+'''Master changes observed by :class:`pyrakoon.compat.ArakoonClient`, by
+cluster identifier''' #pylint: disable=W0105
+
+for _metric in (CONNECTIONS, CONNECTION_FAILURES, MASTER_CHANGES):
+    REGISTRY.register(_metric)
+del _metric
+
+
+class InstrumentationCollector(object): #pylint: disable=R0903
+    '''Collector reporting the measurements of an
+    :class:`pyrakoon.instrument.Instrumentation`
+
+    Reports, per message type (`operation` label), a latency summary, the
+    number of bytes sent and received, and the number of errors per error
+    type, as well as the number of requests in flight.
+    '''
+
+    def __init__(self, instrumentation, quantiles=DEFAULT_QUANTILES,
+        labels=None):
+        '''
+        :param instrumentation: Instrumentation to report
+        :type instrumentation: :class:`pyrakoon.instrument.Instrumentation`
+        :param quantiles: Latency quantiles to report, between 0 and 1
+        :type quantiles: `tuple` of `float`
+        :param labels: Labels added to all samples, e.g. to distinguish
+            several clients
+        :type labels: `dict` of `str` to `str`
+        '''
+
+        self._instrumentation = instrumentation
+        self._quantiles = quantiles
+        self._labels = labels or {}
+
+    def _with(self, **labels):
+        '''Merge labels with the constant labels'''
+
+        result = dict(self._labels)
+        result.update(labels)
+
+        return result
+
+    def collect(self):
+        '''Collect the metrics
+
+        :rtype: `list` of :class:`MetricFamily`
+        '''
+
+        latency = MetricFamily('pyrakoon_request_duration_seconds', 'summary',
+            'Request latency')
+        sent = MetricFamily('pyrakoon_request_sent_bytes_total', 'counter',
+            'Bytes sent in requests')
+        received = MetricFamily('pyrakoon_request_received_bytes_total',
+            'counter', 'Bytes received in responses')
+        errors_ = MetricFamily('pyrakoon_request_errors_total', 'counter',
+            'Failed requests')
+        in_flight = MetricFamily('pyrakoon_requests_in_flight', 'gauge',
+            'Requests which didn\'t finish yet')
+
+        snapshot = self._instrumentation.snapshot()
+
+        for tag in sorted(snapshot):
+            operation = snapshot[tag]
+            labels = self._with(operation=operation.name)
+
+            for quantile in self._quantiles:
+                latency.add(operation.percentile(quantile * 100),
+                    self._with(operation=operation.name,
+                        quantile=repr(quantile)))
+
+            latency.add(operation.total_latency, labels, '_sum')
+            latency.add(operation.requests, labels, '_count')
+            sent.add(operation.bytes_sent, labels)
+            received.add(operation.bytes_received, labels)
+
+            for error in sorted(operation.errors):
+                errors_.add(operation.errors[error],
+                    self._with(operation=operation.name, error=error))
+
+        in_flight.add(self._instrumentation.in_flight, self._labels)
+
+        return [latency, sent, received, errors_, in_flight]
+
+
+class LanePoolCollector(object): #pylint: disable=R0903
+    '''Collector reporting the connection pools of a
+    :class:`pyrakoon.lanes.LaneClient`, per lane (`lane` label)'''
+
+    def __init__(self, client, labels=None):
+        '''
+        :param client: Client to report
+        :type client: :class:`pyrakoon.lanes.LaneClient`
+        :param labels: Labels added to all samples, e.g. the node address
+        :type labels: `dict` of `str` to `str`
+        '''
+
+        self._client = client
+        self._labels = labels or {}
+
+    def collect(self):
+        '''Collect the metrics
+
+        :rtype: `list` of :class:`MetricFamily`
+        '''
+
+        size = MetricFamily('pyrakoon_pool_size', 'gauge',
+            'Maximum number of connections')
+        connections = MetricFamily('pyrakoon_pool_connections', 'gauge',
+            'Connections in use and idle')
+        created = MetricFamily('pyrakoon_pool_connections_created_total',
+            'counter', 'Connections created')
+
+        statistics = self._client.statistics
+
+        for lane in sorted(statistics):
+            stats = statistics[lane]
+
+            labels = dict(self._labels)
+            labels['lane'] = lane
+
+            size.add(stats['size'], labels)
+            created.add(stats['created'], labels)
+
+            for state in ('in_use', 'idle'):
+                state_labels = dict(labels)
+                state_labels['state'] = state
+                connections.add(stats[state], state_labels)
+
+        return [size, connections, created]
+
+
+def _flatten(statistics, prefix=''):
+    '''Flatten nested node statistics into `(name, value)` pairs, skipping
+    non-numeric values'''
+
+    for name in sorted(statistics):
+        value = statistics[name]
+        name = prefix + sanitize_name(name)
+
+        if isinstance(value, dict):
+            for item in _flatten(value, name + '_'):
+                yield item
+        elif isinstance(value, (int, long, float)):
+            yield name, value
+
+
+class NodeStatisticsCollector(object):
+    '''Collector reporting the `statistics` of the nodes of a cluster
+
+    Statistics are retrieved from all nodes concurrently using
+    :func:`pyrakoon.broadcast.broadcast`, by :meth:`refresh`, or
+    periodically by a background thread once :meth:`start` is called.
+    Collection reports the latest statistics retrieved, so scrapes never
+    block on the cluster.
+
+    Every numeric statistic is reported as a gauge named
+    `arakoon_<statistic>`, nested statistics are flattened using
+    underscores. The `node` label holds the node name. `arakoon_node_up` is
+    1 for nodes which answered the latest request, 0 otherwise.
+    '''
+
+    def __init__(self, nodes, cluster_id, interval=DEFAULT_SCRAPE_INTERVAL,
+        timeout=broadcast.DEFAULT_TIMEOUT):
+        '''
+        :param nodes: Addresses (host & port) of the nodes, by name
+        :type nodes: `dict` of `str` to `(str, int)`
+        :param cluster_id: Identifier of the cluster
+        :type cluster_id: :class:`str`
+        :param interval: Time between background scrapes, in seconds
+        :type interval: :class:`float`
+        :param timeout: Time to wait for the nodes, in seconds
+        :type timeout: :class:`float`
+        '''
+
+        self._nodes = nodes
+        self._cluster_id = cluster_id
+        self._interval = interval
+        self._timeout = timeout
+
+        self._lock = threading.Lock()
+        self._statistics = {}
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def _fetch(self):
+        '''Retrieve the statistics of all nodes
+
+        :return: Statistics, or exception raised, by node name
+        :rtype: `dict` of `str` to `object`
+        '''
+
+        return broadcast.broadcast(self._nodes, self._cluster_id,
+            protocol.Statistics(), self._timeout)
+
+    def refresh(self):
+        '''Retrieve the statistics of all nodes'''
+
+        statistics = {}
+
+        for node, result in self._fetch().iteritems():
+            if isinstance(result, Exception):
+                LOGGER.warning('Unable to retrieve statistics of node %s: %s',
+                    node, result)
+                statistics[node] = None
+            else:
+                statistics[node] = list(_flatten(result))
+
+        self._lock.acquire()
+        try:
+            self._statistics = statistics
+        finally:
+            self._lock.release()
+
+    def _run(self):
+        '''Refresh statistics until stopped'''
+
+        while not self._stopped.is_set():
+            try:
+                self.refresh()
+            except Exception: #pylint: disable=W0703
+                LOGGER.exception('Unable to refresh node statistics')
+
+            self._stopped.wait(self._interval)
+
+    def start(self):
+        '''Start refreshing statistics in a background thread'''
+
+        if self._thread is not None:
+            raise RuntimeError('Already started')
+
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run,
+            name='pyrakoon-node-statistics')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        '''Stop the background thread, if running'''
+
+        thread, self._thread = self._thread, None
+
+        if thread is not None:
+            self._stopped.set()
+            thread.join()
+
+    def collect(self):
+        '''Collect the metrics
+
+        :rtype: `list` of :class:`MetricFamily`
+        '''
+
+        self._lock.acquire()
+        try:
+            statistics = self._statistics
+        finally:
+            self._lock.release()
+
+        up = MetricFamily('arakoon_node_up', 'gauge',
+            'Whether the node answered the latest statistics request')
+        families = {}
+
+        for node in sorted(statistics):
+            values = statistics[node]
+            labels = {'node': node}
+
+            up.add(0 if values is None else 1, labels)
+
+            for name, value in values or ():
+                family = families.get(name)
+
+                if family is None:
+                    family = families[name] = MetricFamily(
+                        'arakoon_' + name, 'gauge',
+                        'Node statistic %s' % name)
+
+                family.add(value, labels)
+
+        return [up] + [families[name] for name in sorted(families)]
+
+
+def dump(fd, registry=REGISTRY):
+    '''Write all metrics of a registry to a file
+
+    :param fd: File to write to
+    :type fd: `file`
+    :param registry: Registry to render
+    :type registry: :class:`Registry`
+    '''
+
+    fd.write(registry.render())
+
+
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    '''Threaded HTTP server'''
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def serve(address=DEFAULT_ADDRESS, registry=REGISTRY):
+    '''Serve the metrics of a registry over HTTP in a background thread
+
+    Metrics are served at `/metrics` (and `/`). Call `shutdown` and
+    `server_close` on the returned server to stop serving.
+
+    :param address: Address (host & port) to listen on, use port 0 to
+        pick a free port
+    :type address: `(str, int)`
+    :param registry: Registry to serve
+    :type registry: :class:`Registry`
+
+    :return: Server, whose `server_address` is the address listened on
+    :rtype: :class:`BaseHTTPServer.HTTPServer`
+    '''
+
+    class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+        '''Request handler rendering the registry'''
+
+        def do_GET(self): #pylint: disable=C0103
+            '''Handle a GET request'''
+
+            if self.path.split('?', 1)[0] not in ('/', '/metrics'):
+                self.send_error(404)
+                return
+
+            body = registry.render()
+
+            self.send_response(200)
+            self.send_header('Content-Type', CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format_, *args): #pylint: disable=W0221
+            LOGGER.debug('%s - %s', self.client_address[0], format_ % args)
+
+    server = _Server(address, Handler)
+
+    thread = threading.Thread(target=server.serve_forever,
+        name='pyrakoon-metrics')
+    thread.daemon = True
+    thread.start()
+
+    return server
@@ -28,6 +28,7 @@ except ImportError:
     import StringIO
 
 from pyrakoon import protocol, utils
+from pyrakoon.client import utils as client_utils
 
 
 LOGGER = logging.getLogger(__name__)
@@ -266,6 +267,55 @@ class NurseryClient(object):
 
         return self._clients[cluster]
 
+    def _find_clients_for_range(self, begin_key, end_key):
+        '''Retrieve the clients responsible for a given key range
+
+        The clients are returned in key order, together with the part of the
+        requested range they're responsible for.
+
+        :param begin_key: Begin of range (inclusive)
+        :type begin_key: `str`
+        :param end_key: End of range (exclusive), or `None` for no limit
+        :type end_key: `str` or `None`
+
+        :return: Iterator of client, lower bound and upper bound tuples
+        :rtype: iterator of `(object, str, str)`
+        '''
+
+        def loop(top, lower, upper):
+            '''Recursive function to find the clusters we're looking for
+
+            :param top: Tree node to walk over
+            :type top: `LeafNode` or `InternalNode`
+            :param lower: Lower bound of the keys handled by `top`
+            :type lower: `str`
+            :param upper: Upper bound of the keys handled by `top`
+            :type upper: `str` or `None`
+            '''
+
+            if isinstance(top, LeafNode):
+                yield top.cluster, lower, upper
+                return
+
+            if isinstance(top, InternalNode):
+                if begin_key < top.boundary:
+                    for cluster in loop(top.left, lower, top.boundary):
+                        yield cluster
+
+                if end_key is None or end_key > top.boundary:
+                    for cluster in loop(top.right, top.boundary, upper):
+                        yield cluster
+
+                return
+
+            raise TypeError
+
+        for cluster, lower, upper in loop(self._routing, '', None):
+            if upper is None or (end_key is not None and end_key < upper):
+                upper = end_key
+
+            yield self._clients[cluster], max(lower, begin_key), upper
+
     def get(self, key):
         '''Retrieve a value from the nursery
 
@@ -306,3 +356,33 @@ class NurseryClient(object):
             self.initialize()
 
         return self._find_client_for_key(key).delete(key)
+
+    def iter_prefix(self, prefix, page_size, with_values=False):
+        '''Iterate over all keys matching a prefix, one page at a time
+
+        The prefix range can span several clusters, which are queried in key
+        order.
+
+        :param prefix: Prefix to match
+        :type prefix: `str`
+        :param page_size: Maximum number of items to retrieve per call
+        :type page_size: `int`
+        :param with_values: Yield `(key, value)` pairs instead of keys
+        :type with_values: `bool`
+
+        :return: Iterator over matching keys or `(key, value)` pairs
+        :rtype: iterator of `str` or `(str, str)`
+        '''
+
+        if not self._initialized:
+            self.initialize()
+
+        end_key = client_utils.prefix_upper_bound(prefix)
+
+        for client, lower, upper in self._find_clients_for_range(
+            prefix, end_key):
+            fetch = client.range_entries if with_values else client.range
+
+            for item in client_utils.page_range(fetch, lower, True, upper,
+                False, page_size, with_values):
+                yield item
@@ -0,0 +1,377 @@
+# This file is part of Pyrakoon, a distributed key-value store client.
+#
+# Copyright (C) 2014 Incubaid BVBA
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''Throttled deletion of key ranges and prefixes
+
+`delete_prefix` removes all matching keys in a single update, which keeps
+the master busy for a long time when the prefix is large. A
+:class:`BulkDeleter` walks the range one page at a time instead, and deletes
+every page in a bounded *sequence* of `Delete` steps. The deletion rate can
+be capped to a number of keys per second, and the batch size is reduced
+whenever a batch takes longer than a latency target, so regular traffic
+keeps being served.
+
+Progress is written to a checkpoint file (see
+:func:`pyrakoon.bulk.write_checkpoint`), so an interrupted purge can be
+resumed after the last deleted key.
+
+This module can be executed as a script::
+
+    python -m pyrakoon.purge -c ricky -n arakoon_0:127.0.0.1:4000 \\
+        --prefix tenant_42/ --rate 5000
+'''
+
+import sys
+import time
+import random
+import logging
+
+from pyrakoon import bulk, errors, sequence
+from pyrakoon.client import utils
+from pyrakoon.ratelimit import TokenBucket
+
+LOGGER = logging.getLogger(__name__)
+'''Logger for code in this module''' #pylint: disable=W0105
+
+DEFAULT_BATCH_COUNT = 500
+'''Default maximum number of keys deleted in a single batch
+''' #pylint: disable=W0105
+DEFAULT_TARGET_LATENCY = 0.2
+'''Default latency target of a single batch, in seconds
+''' #pylint: disable=W0105
+
+
+class DeleteStatistics(object):
+    '''Progress information of a bulk deletion'''
+
+    def __init__(self):
+        self.start = time.time()
+        self.deleted = 0
+        self.batches = 0
+        self.retries = 0
+        self.conflicts = 0
+        self.throttled = 0.0
+        self.batch_count = 0
+        self.last_key = None
+
+    @property
+    def elapsed(self):
+        '''Time since the deletion started, in seconds'''
+
+        return time.time() - self.start
+
+    @property
+    def keys_per_second(self):
+        '''Average number of keys deleted per second'''
+
+        elapsed = self.elapsed
+
+        return self.deleted / elapsed if elapsed > 0 else 0.0
+
+    def __repr__(self):
+        return '<DeleteStatistics deleted=%d batches=%d retries=%d ' \
+            'conflicts=%d throttled=%.1fs rate=%.1f/s>' % (self.deleted,
+                self.batches, self.retries, self.conflicts, self.throttled,
+                self.keys_per_second)
+
+
+class BulkDeleter(object): #pylint: disable=R0902
+    '''Delete large key ranges in small, throttled batches
+
+    The given client should be connected to the master node, and provide
+    the `range` and `sequence` calls of
+    :class:`pyrakoon.client.ClientMixin`.
+
+    Every batch deletes at most `batch_count` keys. When a batch takes longer
+    than `target_latency`, the size of the next batch is halved. Otherwise it
+    grows again, up to `batch_count`. When `rate` is set, at most this many
+    keys are deleted per second.
+
+    A batch fails as a whole when one of its keys was removed concurrently.
+    In this case, the page is retrieved again and retried. Such batches, and
+    batches failing with one of :data:`pyrakoon.bulk.RETRY_ERRORS`, are
+    retried up to `max_retries` times in a row. Like
+    :class:`pyrakoon.bulk.BulkLoader`, master changes are followed using the
+    `redirect` and `rediscover` methods of the client, if any (see
+    :class:`pyrakoon.bulk.MasterClient`).
+    '''
+
+    #pylint: disable=R0913
+    def __init__(self, client, batch_count=DEFAULT_BATCH_COUNT, rate=None,
+        target_latency=DEFAULT_TARGET_LATENCY, max_retries=5, backoff=0.5,
+        checkpoint=None, checkpoint_interval=5.0, report_interval=10.0,
+        progress=None, sync=False):
+        '''Initialize a bulk deleter
+
+        :param client: Client to use
+        :type client: :class:`pyrakoon.client.ClientMixin`
+        :param batch_count: Maximum number of keys in a batch
+        :type batch_count: :class:`int`
+        :param rate: Maximum number of keys deleted per second
+        :type rate: :class:`float`
+        :param target_latency: Maximum duration of a batch, or :data:`None`
+            to use fixed-size batches
+        :type target_latency: :class:`float`
+        :param max_retries: Maximum number of consecutive retries
+        :type max_retries: :class:`int`
+        :param backoff: Base delay between retries, in seconds
+        :type backoff: :class:`float`
+        :param checkpoint: Path of the checkpoint file
+        :type checkpoint: :class:`str`
+        :param checkpoint_interval: Minimal time between checkpoints
+        :type checkpoint_interval: :class:`float`
+        :param report_interval: Time between progress reports
+        :type report_interval: :class:`float`
+        :param progress: Callable invoked with a :class:`DeleteStatistics` on
+            every progress report
+        :type progress: `callable`
+        :param sync: Use *synced_sequence*
+        :type sync: :class:`bool`
+        '''
+
+        self._client = client
+        self._batch_count = batch_count
+        self._bucket = TokenBucket(rate, batch_count) if rate else None
+        self._target_latency = target_latency
+        self._max_retries = max_retries
+        self._backoff = backoff
+        self._checkpoint = checkpoint
+        self._checkpoint_interval = checkpoint_interval
+        self._report_interval = report_interval
+        self._progress = progress
+        self._sync = sync
+
+    def delete_prefix(self, prefix):
+        '''Delete all keys starting with a prefix
+
+        :param prefix: Prefix of the keys to delete
+        :type prefix: :class:`str`
+
+        :return: Deletion statistics
+        :rtype: :class:`DeleteStatistics`
+        '''
+
+        return self.delete_range(prefix, True,
+            utils.prefix_upper_bound(prefix), False)
+
+    def delete_range(self, begin_key, begin_inclusive, end_key,
+        end_inclusive):
+        '''Delete all keys in a range
+
+        :param begin_key: Begin of range, or :data:`None`
+        :type begin_key: :class:`str`
+        :param begin_inclusive: `begin_key` is in- or exclusive
+        :type begin_inclusive: :class:`bool`
+        :param end_key: End of range, or :data:`None`
+        :type end_key: :class:`str`
+        :param end_inclusive: `end_key` is in- or exclusive
+        :type end_inclusive: :class:`bool`
+
+        :return: Deletion statistics
+        :rtype: :class:`DeleteStatistics`
+        '''
+
+        stats = DeleteStatistics()
+        stats.batch_count = self._batch_count
+
+        checkpoint = bulk.read_checkpoint(self._checkpoint) \
+            if self._checkpoint else None
+
+        if checkpoint:
+            stats.deleted, stats.last_key = checkpoint
+            LOGGER.info('Resuming after %d keys (key %r)', stats.deleted,
+                stats.last_key)
+
+            if stats.last_key is not None:
+                begin_key, begin_inclusive = stats.last_key, False
+
+        last_checkpoint = last_report = time.time()
+
+        while True:
+            keys = self._delete_batch(stats, begin_key, begin_inclusive,
+                end_key, end_inclusive)
+
+            if not keys:
+                break
+
+            begin_key, begin_inclusive = keys[-1], False
+
+            now = time.time()
+
+            if self._checkpoint and \
+                now - last_checkpoint >= self._checkpoint_interval:
+                bulk.write_checkpoint(self._checkpoint, stats.deleted,
+                    stats.last_key)
+                last_checkpoint = now
+
+            if now - last_report >= self._report_interval:
+                self._report(stats)
+                last_report = now
+
+        if self._checkpoint:
+            bulk.write_checkpoint(self._checkpoint, stats.deleted,
+                stats.last_key)
+
+        self._report(stats)
+
+        return stats
+
+    def _delete_batch(self, stats, begin_key, begin_inclusive, end_key,
+        end_inclusive):
+        '''Delete the next page of keys, returning the keys deleted'''
+
+        client = self._client
+        attempt = 0
+
+        while True:
+            try:
+                keys = client.range(begin_key, begin_inclusive, end_key,
+                    end_inclusive, stats.batch_count)
+
+                if not keys:
+                    return keys
+
+                if self._bucket:
+                    stats.throttled += self._bucket.consume(len(keys))
+
+                start = time.time()
+                client.sequence([sequence.Delete(key) for key in keys],
+                    self._sync)
+                latency = time.time() - start
+            except errors.NotFound:
+                # Some key got deleted concurrently, fetch the page again
+                attempt += 1
+                stats.conflicts += 1
+
+                if attempt > self._max_retries:
+                    raise
+
+                continue
+            except bulk.RETRY_ERRORS as exc:
+                attempt += 1
+                stats.retries += 1
+
+                if attempt > self._max_retries:
+                    raise
+
+                redirected = hasattr(client, 'redirect') and \
+                    client.redirect(exc)
+
+                if redirected:
+                    delay = 0.0
+                else:
+                    delay = random.uniform(0, self._backoff * (2 ** attempt))
+                LOGGER.warning('Batch failed (%s), retrying in %.2f seconds',
+                    exc, delay)
+
+                time.sleep(delay)
+
+                if not redirected:
+                    bulk.rediscover_master(client, exc)
+
+                if not client.connected and hasattr(client, 'connect'):
+                    client.connect()
+
+                continue
+
+            stats.deleted += len(keys)
+            stats.batches += 1
+            stats.last_key = keys[-1]
+
+            self._adapt(stats, latency)
+
+            return keys
+
+    def _adapt(self, stats, latency):
+        '''Adjust the batch size to the latency of the last batch'''
+
+        if self._target_latency is None:
+            return
+
+        if latency > self._target_latency:
+            stats.batch_count = max(1, stats.batch_count // 2)
+        else:
+            stats.batch_count = min(self._batch_count,
+                stats.batch_count + max(1, stats.batch_count // 10))
+
+    def _report(self, stats):
+        '''Report deletion progress'''
+
+        LOGGER.info('Deleted %d keys in %d batches (%.1f keys/s, batch size '
+            '%d, %d retries)', stats.deleted, stats.batches,
+            stats.keys_per_second, stats.batch_count, stats.retries)
+
+        if self._progress:
+            self._progress(stats)
+
+
+def main(args=None):
+    '''Command-line entry point'''
+
+    parser = bulk.build_option_parser(
+        '%prog [options] -c CLUSTER -n NODE (--prefix PREFIX | --begin KEY '
+        '--end KEY)')
+    parser.add_option('--prefix', help='delete keys with this prefix')
+    parser.add_option('--begin', metavar='KEY',
+        help='first key to delete (inclusive)')
+    parser.add_option('--end', metavar='KEY',
+        help='last key to delete (exclusive)')
+    parser.add_option('--batch-count', type='int',
+        default=DEFAULT_BATCH_COUNT,
+        help='maximum keys per batch [default: %default]')
+    parser.add_option('--rate', type='float',
+        help='maximum keys deleted per second')
+    parser.add_option('--target-latency', type='float',
+        default=DEFAULT_TARGET_LATENCY,
+        help='batch latency target in seconds [default: %default]')
+    parser.add_option('--retries', type='int', default=5,
+        help='maximum consecutive retries [default: %default]')
+    parser.add_option('--checkpoint', metavar='PATH',
+        help='checkpoint file, used to resume an interrupted purge')
+    parser.add_option('--sync', action='store_true', default=False,
+        help='use synced sequences')
+
+    options, args = parser.parse_args(args)
+
+    if args or not options.cluster_id or not options.node:
+        parser.error('cluster and node are required')
+
+    if options.prefix is None and options.begin is None and \
+        options.end is None:
+        parser.error('a prefix or range is required')
+
+    logging.basicConfig(
+        level=logging.DEBUG if options.verbose else logging.INFO,
+        format='%(asctime)s %(levelname)s %(message)s')
+
+    nodes = dict(bulk.parse_node(node) for node in options.node)
+    client_ = bulk.connect_master(options.cluster_id, nodes)
+
+    deleter = BulkDeleter(client_, batch_count=options.batch_count,
+        rate=options.rate, target_latency=options.target_latency,
+        max_retries=options.retries, checkpoint=options.checkpoint,
+        sync=options.sync)
+
+    if options.prefix is not None:
+        deleter.delete_prefix(options.prefix)
+    else:
+        deleter.delete_range(options.begin, True, options.end, False)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,500 @@
+# This file is part of Pyrakoon, a distributed key-value store client.
+#
+# Copyright (C) 2014 Incubaid BVBA
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''Client-side rate limiting and adaptive concurrency control
+
+A :class:`RateLimiter` combines token buckets limiting the number of
+requests and bytes per second with an :class:`AdaptiveLimit` on the number
+of requests in flight. The latter grows additively while request latency
+stays below a target, and shrinks multiplicatively when latency exceeds
+the target or the cluster reports being overloaded.
+
+A limiter can be used by wrapping a client in a :class:`RateLimitedClient`,
+or by passing it to :class:`pyrakoon.compat.ArakoonClient`. A limiter is
+thread-safe, and is typically shared by all clients of a cluster.
+
+Example:
+
+    >>> from pyrakoon import test
+    >>> limiter = RateLimiter(ops_rate=1000,
+    ...     adaptive=AdaptiveLimit(initial=4, target_latency=0.05))
+    >>> client = RateLimitedClient(test.FakeClient(), limiter)
+    >>> client.set('key', 'value')
+    >>> client.get('key')
+    'value'
+    >>> limiter.limit
+    4
+'''
+
+import time
+import itertools
+import threading
+
+from pyrakoon import client, errors, protocol, sequence
+
+OVERLOAD_ERRORS = (errors.GoingDown, errors.MaxConnections)
+'''Errors signalling the cluster is overloaded''' #pylint: disable=W0105
+
+DEFAULT_TARGET_LATENCY = 0.05
+'''Default target request latency, in seconds''' #pylint: disable=W0105
+DEFAULT_WINDOW = 64
+'''Number of messages pipelined at once when no limit applies
+''' #pylint: disable=W0105
+
+
+def _message_size(value):
+    '''Estimate the number of bytes in a message, without serializing it
+
+    Strings in the arguments of the message (and its sequence steps) are
+    counted, including their length prefix. Other framing is ignored.
+    '''
+
+    if isinstance(value, str):
+        return 4 + len(value)
+    elif isinstance(value, (list, tuple)):
+        return sum(_message_size(item) for item in value)
+    elif isinstance(value, protocol.Sequence):
+        return _message_size(value.sequence)
+    elif isinstance(value, sequence.Sequence):
+        return _message_size(value.steps)
+
+    args = getattr(type(value), 'ARGS', None)
+
+    if not args:
+        return 0
+
+    return sum(_message_size(getattr(value, arg[0], None)) for arg in args)
+
+
+def _result_size(result):
+    '''Estimate the number of bytes in a result'''
+
+    if isinstance(result, str):
+        return len(result)
+    elif isinstance(result, (list, tuple)):
+        return sum(_result_size(item) for item in result)
+    else:
+        return 0
+
+
+class TokenBucket(object):
+    '''Token bucket limiting a rate, shared between threads
+
+    Consumers which exceed the rate go into debt, and sleep until it's paid
+    off.
+    '''
+
+    def __init__(self, rate, burst=None):
+        '''Initialize a token bucket
+
+        :param rate: Maximum rate, in units per second
+        :type rate: :class:`float`
+        :param burst: Maximum number of units consumed without delay,
+            defaults to `rate`
+        :type burst: :class:`float`
+        '''
+
+        self._rate = float(rate)
+        self._burst = float(burst if burst is not None else rate)
+        self._tokens = self._burst
+        self._last = time.time()
+        self._lock = threading.Lock()
+
+    rate = property(lambda self: self._rate, doc='Maximum rate')
+
+    def consume(self, amount):
+        '''Consume `amount` units, sleeping if the rate is exceeded
+
+        :param amount: Number of units consumed
+        :type amount: :class:`int`
+
+        :return: Time spent sleeping, in seconds
+        :rtype: :class:`float`
+        '''
+
+        self._lock.acquire()
+        try:
+            now = time.time()
+            self._tokens = min(self._burst,
+                self._tokens + (now - self._last) * self._rate)
+            self._last = now
+
+            self._tokens -= amount
+            debt = -self._tokens
+        finally:
+            self._lock.release()
+
+        if debt <= 0:
+            return 0.0
+
+        delay = debt / self._rate
+        time.sleep(delay)
+
+        return delay
+
+
+class AdaptiveLimit(object):
+    '''Limit on the number of requests in flight, using AIMD
+
+    Every request completing within `target_latency` increases the limit by
+    `increase / limit`, i.e. by about `increase` per round-trip when the
+    limit is fully used. A request exceeding the target, or failing with
+    one of :data:`OVERLOAD_ERRORS`, multiplies the limit by `backoff`. Only
+    requests started after the previous decrease can cause another one.
+    '''
+
+    #pylint: disable=R0913
+    def __init__(self, initial=8, minimum=1, maximum=256,
+        target_latency=DEFAULT_TARGET_LATENCY, backoff=0.5, increase=1.0):
+        '''Initialize an adaptive limit
+
+        :param initial: Initial limit
+        :type initial: :class:`int`
+        :param minimum: Minimal limit
+        :type minimum: :class:`int`
+        :param maximum: Maximal limit
+        :type maximum: :class:`int`
+        :param target_latency: Target request latency, in seconds
+        :type target_latency: :class:`float`
+        :param backoff: Factor applied to the limit on latency spikes or
+            overload
+        :type backoff: :class:`float`
+        :param increase: Additive increase per round-trip
+        :type increase: :class:`float`
+        '''
+
+        self._limit = float(initial)
+        self._minimum = minimum
+        self._maximum = maximum
+        self._target_latency = target_latency
+        self._backoff = backoff
+        self._increase = increase
+
+        self._in_flight = 0
+        self._last_decrease = 0.0
+        self._condition = threading.Condition(threading.Lock())
+
+    @property
+    def limit(self):
+        '''Current limit'''
+
+        return max(self._minimum, int(self._limit))
+
+    in_flight = property(lambda self: self._in_flight,
+        doc='Number of requests in flight')
+
+    def acquire(self, count=1):
+        '''Wait until `count` more requests can be submitted
+
+        A `count` larger than the limit is admitted once no other requests
+        are in flight.
+
+        :param count: Number of requests
+        :type count: :class:`int`
+
+        :return: Time spent waiting, in seconds
+        :rtype: :class:`float`
+        '''
+
+        start = time.time()
+
+        self._condition.acquire()
+        try:
+            while self._in_flight > 0 and \
+                self._in_flight + count > self.limit:
+                self._condition.wait()
+
+            self._in_flight += count
+        finally:
+            self._condition.release()
+
+        return time.time() - start
+
+    def release(self, count, start, latency, overloaded=False):
+        '''Report completion of `count` requests, and adapt the limit
+
+        :param count: Number of requests
+        :type count: :class:`int`
+        :param start: Time at which the requests were submitted
+        :type start: :class:`float`
+        :param latency: Latency of the requests, in seconds
+        :type latency: :class:`float`
+        :param overloaded: The cluster reported being overloaded
+        :type overloaded: :class:`bool`
+        '''
+
+        self._condition.acquire()
+        try:
+            self._in_flight -= count
+
+            if overloaded or latency > self._target_latency:
+                if start > self._last_decrease:
+                    self._limit = max(self._minimum,
+                        self._limit * self._backoff)
+                    self._last_decrease = time.time()
+            else:
+                self._limit = min(self._maximum,
+                    self._limit + self._increase * count / self._limit)
+
+            self._condition.notify_all()
+        finally:
+            self._condition.release()
+
+
+class RateLimiter(object):
+    '''Rate limiter and concurrency controller for cluster requests
+
+    Requests first take tokens from the ops and bytes buckets (if any), then
+    wait for a slot below the adaptive in-flight limit (if any). The bytes
+    bucket is charged with the estimated size of a request before it's sent,
+    and with the estimated size of its result afterwards.
+    '''
+
+    #pylint: disable=R0913
+    def __init__(self, ops_rate=None, bytes_rate=None, ops_burst=None,
+        bytes_burst=None, adaptive=None):
+        '''Initialize a rate limiter
+
+        :param ops_rate: Maximum number of requests per second
+        :type ops_rate: :class:`float`
+        :param bytes_rate: Maximum number of bytes per second
+        :type bytes_rate: :class:`float`
+        :param ops_burst: Burst size of the ops bucket
+        :type ops_burst: :class:`float`
+        :param bytes_burst: Burst size of the bytes bucket
+        :type bytes_burst: :class:`float`
+        :param adaptive: Adaptive in-flight limit
+        :type adaptive: :class:`AdaptiveLimit`
+        '''
+
+        self._ops = TokenBucket(ops_rate, ops_burst) if ops_rate else None
+        self._bytes = TokenBucket(bytes_rate, bytes_burst) \
+            if bytes_rate else None
+        self._adaptive = adaptive
+
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._delayed = 0
+        self._total_delay = 0.0
+        self._queue_delay = 0.0
+
+    ops_rate = property(lambda self: self._ops.rate if self._ops else None,
+        doc='Maximum number of requests per second')
+    bytes_rate = property(
+        lambda self: self._bytes.rate if self._bytes else None,
+        doc='Maximum number of bytes per second')
+
+    @property
+    def limit(self):
+        '''Current in-flight limit, or :data:`None`'''
+
+        return self._adaptive.limit if self._adaptive else None
+
+    @property
+    def in_flight(self):
+        '''Number of requests in flight, or :data:`None`'''
+
+        return self._adaptive.in_flight if self._adaptive else None
+
+    queue_delay = property(lambda self: self._queue_delay,
+        doc='Moving average of the time requests spend queueing, in seconds')
+
+    @property
+    def statistics(self):
+        '''Snapshot of the current limits and counters
+
+        :type: `dict` of `str` to `object`
+        '''
+
+        self._lock.acquire()
+        try:
+            return {
+                'ops_rate': self.ops_rate,
+                'bytes_rate': self.bytes_rate,
+                'limit': self.limit,
+                'in_flight': self.in_flight,
+                'requests': self._requests,
+                'delayed': self._delayed,
+                'total_queue_delay': self._total_delay,
+                'queue_delay': self._queue_delay,
+            }
+        finally:
+            self._lock.release()
+
+    def _admit(self, messages):
+        '''Wait until `messages` can be submitted'''
+
+        delay = 0.0
+
+        if self._ops:
+            delay += self._ops.consume(len(messages))
+        if self._bytes:
+            delay += self._bytes.consume(sum(_message_size(message)
+                for message in messages))
+        if self._adaptive:
+            delay += self._adaptive.acquire(len(messages))
+
+        self._lock.acquire()
+        try:
+            self._requests += len(messages)
+            if delay > 0:
+                self._delayed += len(messages)
+            self._total_delay += delay
+            self._queue_delay = 0.9 * self._queue_delay + 0.1 * delay
+        finally:
+            self._lock.release()
+
+    def _complete(self, count, start, overloaded):
+        '''Report completion of `count` requests submitted at `start`
+
+        The latency is the time until the last result was received, i.e. the
+        latency of the slowest request.
+        '''
+
+        if self._adaptive:
+            self._adaptive.release(count, start, time.time() - start,
+                overloaded)
+
+    def window(self, max_in_flight=None):
+        '''Calculate the number of messages to pipeline at once
+
+        :param max_in_flight: Maximum requested by the caller
+        :type max_in_flight: :class:`int`
+
+        :return: Number of messages to pipeline
+        :rtype: :class:`int`
+        '''
+
+        limits = [value for value in (max_in_flight, self.limit)
+            if value is not None]
+
+        return max(1, min(limits)) if limits else DEFAULT_WINDOW
+
+    def call(self, process, message):
+        '''Handle a message using `process`, applying the limits
+
+        :param process: Function handling a message
+        :type process: `callable`
+        :param message: Message to handle
+        :type message: :class:`pyrakoon.protocol.Message`
+
+        :return: Result of `process`
+        :rtype: :obj:`object`
+        '''
+
+        self._admit([message])
+
+        start = time.time()
+        overloaded = False
+
+        try:
+            result = process(message)
+        except OVERLOAD_ERRORS:
+            overloaded = True
+            raise
+        finally:
+            self._complete(1, start, overloaded)
+
+        if self._bytes:
+            self._bytes.consume(_result_size(result))
+
+        return result
+
+    def pipeline(self, process_pipelined, messages, max_in_flight=None):
+        '''Handle messages using `process_pipelined`, applying the limits
+
+        Messages are pipelined in windows which fit within the limits, see
+        :meth:`window`. The latency of a window is the time needed to handle
+        all of its messages, since the last result is only received after
+        all others.
+
+        :param process_pipelined: Function handling several messages, see
+            :meth:`pyrakoon.client.AbstractClient._process_pipelined`
+        :type process_pipelined: `callable`
+        :param messages: Messages to handle
+        :type messages: iterable of :class:`pyrakoon.protocol.Message`
+        :param max_in_flight: Maximum number of outstanding messages
+        :type max_in_flight: :class:`int`
+
+        :return: Iterator over the results of `messages`
+        :rtype: iterator of :obj:`object`
+        '''
+
+        messages = iter(messages)
+
+        while True:
+            window = self.window(max_in_flight)
+            batch = list(itertools.islice(messages, window))
+
+            if not batch:
+                return
+
+            self._admit(batch)
+
+            start = time.time()
+            overloaded = False
+
+            try:
+                for result in process_pipelined(batch, window):
+                    if self._bytes:
+                        self._bytes.consume(_result_size(result))
+
+                    yield result
+            except OVERLOAD_ERRORS:
+                overloaded = True
+                raise
+            finally:
+                self._complete(len(batch), start, overloaded)
+
+
+class RateLimitedClient(object, client.AbstractClient, client.ClientMixin):
+    '''Client wrapper applying a :class:`RateLimiter` to all requests'''
+
+    def __init__(self, client_, limiter):
+        '''Wrap a client
+
+        :param client_: Client to wrap
+        :type client_: :class:`pyrakoon.client.AbstractClient`
+        :param limiter: Rate limiter to apply
+        :type limiter: :class:`RateLimiter`
+        '''
+
+        super(RateLimitedClient, self).__init__()
+
+        self._client = client_
+        self._limiter = limiter
+
+    limiter = property(lambda self: self._limiter, doc='Rate limiter in use')
+
+    @property
+    def connected(self):
+        '''Check whether the wrapped client is connected'''
+
+        return self._client.connected
+
+    def _process(self, message):
+        return self._limiter.call(
+            self._client._process, message) #pylint: disable=W0212
+
+    def _process_pipelined(self, messages, max_in_flight=None):
+        return self._limiter.pipeline(
+            self._client._process_pipelined, #pylint: disable=W0212
+            messages, max_in_flight)
+
+    def _process_spread(self, messages, max_in_flight=None):
+        return self._limiter.pipeline(
+            self._client._process_spread, #pylint: disable=W0212
+            messages, max_in_flight)
@@ -0,0 +1,223 @@
+# This file is part of Pyrakoon, a distributed key-value store client.
+#
+# Copyright (C) 2014 Incubaid BVBA
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''Retry policies
+
+A :class:`RetryPolicy` decides whether a failed request is sent again, and
+how long to wait before doing so:
+
+- Errors returned by a node which refused to handle a request (e.g.
+  :class:`~pyrakoon.errors.NotMaster`) are always retried, since the request
+  had no effect
+- Failures before a request was sent (e.g. connection failures) are retried
+  up to `tries` attempts
+- Failures after a request was sent (e.g. a connection closed while reading
+  the response, or :class:`~pyrakoon.errors.NoLongerMaster`) leave the
+  outcome of the request unknown, so they're only retried (up to `tries`
+  attempts) for idempotent requests, see :func:`is_idempotent`
+- All other errors returned by a node are never retried
+
+Delays between attempts use *decorrelated jitter*: every delay is drawn
+uniformly between `base` and three times the previous delay, capped at
+`cap`. No attempt is started once the `deadline` has passed.
+
+Example:
+
+    >>> policy = RetryPolicy(base=0.01, cap=0.1, deadline=1.0, tries=2)
+    >>> retry = policy.start()
+    >>> message = protocol.Get(False, 'key')
+    >>> 0.01 <= retry.backoff(errors.NotMaster(''), message) <= 0.1
+    True
+    >>> print retry.backoff(errors.NotFound('key'), message)
+    None
+    >>> retry.backoff(EOFError(), protocol.Delete('key'), sent=False) > 0
+    True
+    >>> print retry.backoff(EOFError(), protocol.Delete('key'))
+    None
+'''
+
+import time
+import random
+
+from pyrakoon import errors, protocol
+
+DEFAULT_BASE = 0.05
+'''Default minimal delay between attempts, in seconds''' #pylint: disable=W0105
+DEFAULT_CAP = 5.0
+'''Default maximal delay between attempts, in seconds''' #pylint: disable=W0105
+DEFAULT_DEADLINE = 60.0
+'''Default time after which no attempts are started, in seconds
+''' #pylint: disable=W0105
+DEFAULT_TRIES = 1
+'''Default number of attempts after failures of the connection
+''' #pylint: disable=W0105
+
+REJECTED_ERRORS = (errors.NotMaster, errors.GoingDown,
+    errors.MaxConnections)
+'''Errors returned by nodes which refused to handle a request
+''' #pylint: disable=W0105
+UNKNOWN_OUTCOME_ERRORS = (errors.NoLongerMaster, errors.TooManyDeadNodes)
+'''Errors returned by nodes after which the outcome of a request is unknown
+''' #pylint: disable=W0105
+
+IDEMPOTENT_MESSAGES = frozenset([
+    protocol.Hello, protocol.WhoMaster, protocol.Exists, protocol.Get,
+    protocol.PrefixKeys, protocol.Range, protocol.RangeEntries,
+    protocol.RevRangeEntries, protocol.MultiGet, protocol.MultiGetOption,
+    protocol.ExpectProgressPossible, protocol.GetKeyCount,
+    protocol.Assert, protocol.AssertExists, protocol.Statistics,
+    protocol.Version, protocol.Nop, protocol.GetCurrentState,
+    protocol.Set, protocol.Confirm,
+])
+'''Message types which can be sent several times with the same result
+''' #pylint: disable=W0105
+
+
+def is_idempotent(message):
+    '''Check whether sending a message several times has the same result as
+    sending it once
+
+    All reads are idempotent, and so are `set` and `confirm`. Other writes
+    aren't, e.g. a second `delete` of a key fails, and a second
+    `test_and_set` may not match.
+
+    :param message: Message
+    :type message: :class:`pyrakoon.protocol.Message`
+
+    :rtype: :class:`bool`
+    '''
+
+    return type(message) in IDEMPOTENT_MESSAGES
+
+
+class RetryPolicy(object):
+    '''Policy deciding whether and when failed requests are retried
+
+    See the module documentation.
+    '''
+
+    def __init__(self, base=DEFAULT_BASE, cap=DEFAULT_CAP,
+        deadline=DEFAULT_DEADLINE, tries=DEFAULT_TRIES):
+        '''
+        :param base: Minimal delay between attempts, in seconds
+        :type base: :class:`float`
+        :param cap: Maximal delay between attempts, in seconds
+        :type cap: :class:`float`
+        :param deadline: Time after which no attempts are started, in seconds
+        :type deadline: :class:`float`
+        :param tries: Number of attempts after failures of the connection
+        :type tries: :class:`int`
+        '''
+
+        self.base = base
+        self.cap = cap
+        self.deadline = deadline
+        self.tries = tries
+
+    def should_retry(self, exc, message, sent=True, rejected=False):
+        '''Check whether a failure is retried at all, ignoring the number of
+        attempts and the deadline
+
+        :param exc: Error raised
+        :type exc: :class:`Exception`
+        :param message: Message which failed
+        :type message: :class:`pyrakoon.protocol.Message`
+        :param sent: Whether the message could have reached the node
+        :type sent: :class:`bool`
+        :param rejected: Whether the request was refused without effect
+            (e.g. because no master was found), regardless of `exc`
+        :type rejected: :class:`bool`
+
+        :rtype: :class:`bool`
+        '''
+
+        if rejected or isinstance(exc, REJECTED_ERRORS):
+            return True
+
+        if isinstance(exc, errors.ArakoonError) and \
+            not isinstance(exc, UNKNOWN_OUTCOME_ERRORS):
+            return False
+
+        return not sent or is_idempotent(message)
+
+    def start(self):
+        '''Start retrying a request
+
+        :rtype: :class:`Retry`
+        '''
+
+        return Retry(self)
+
+    def __repr__(self):
+        return '<RetryPolicy base=%r cap=%r deadline=%r tries=%r>' % (
+            self.base, self.cap, self.deadline, self.tries)
+
+
+class Retry(object):
+    '''Retry state of a single request'''
+
+    def __init__(self, policy):
+        '''
+        :param policy: Policy to apply
+        :type policy: :class:`RetryPolicy`
+        '''
+
+        self._policy = policy
+        self._deadline = time.time() + policy.deadline
+        self._delay = policy.base
+        self._failures = 0
+
+        self.retries = 0
+
+    def backoff(self, exc, message, sent=True, rejected=False):
+        '''Decide whether to retry a failed attempt
+
+        :param exc: Error raised by the attempt
+        :type exc: :class:`Exception`
+        :param message: Message which failed
+        :type message: :class:`pyrakoon.protocol.Message`
+        :param sent: Whether the message could have reached the node
+        :type sent: :class:`bool`
+        :param rejected: Whether the request was refused without effect,
+            see :meth:`RetryPolicy.should_retry`
+        :type rejected: :class:`bool`
+
+        :return: Time to wait before the next attempt, in seconds, or
+            :data:`None` if the request shouldn't be retried
+        :rtype: :class:`float`
+        '''
+
+        policy = self._policy
+
+        if not policy.should_retry(exc, message, sent, rejected):
+            return None
+
+        if not rejected and not isinstance(exc, REJECTED_ERRORS):
+            self._failures += 1
+
+            if self._failures >= policy.tries:
+                return None
+
+        delay = min(policy.cap,
+            random.uniform(policy.base, self._delay * 3))
+        self._delay = delay
+
+        if time.time() + delay > self._deadline:
+            return None
+
+        self.retries += 1
+
+        return delay
@@ -0,0 +1,172 @@
+# This file is part of Pyrakoon, a distributed key-value store client.
+#
+# Copyright (C) 2014 Incubaid BVBA
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''Key-affinity routing of dirty reads
+
+Reads with `allow_dirty` set can be handled by any node. Spreading them
+randomly makes every node serve every key, so the page cache of every node
+needs to hold the whole working set. A :class:`RendezvousRouter` ranks the
+nodes for every read using rendezvous (highest random weight) hashing on its
+key, so reads of a key consistently go to the same node, and adding or
+removing a node only moves the keys of that node.
+
+The routing key of a message is its `key`, the first of its `keys`, its
+`begin_key` or its `prefix`. When a `separator` is given, only the part of
+the key up to and including the last separator is hashed, so all keys
+sharing a prefix go to the same node.
+
+Nodes which failed are ranked last for a while (the *cooldown*), and so is
+the master, which should handle as few dirty reads as possible.
+
+Example:
+
+    >>> router = RendezvousRouter(separator='/')
+    >>> nodes = ['arakoon_0', 'arakoon_1', 'arakoon_2']
+    >>> first = router.candidates(protocol.Get(True, 'user/1'), nodes)
+    >>> first == router.candidates(protocol.Get(True, 'user/2'), nodes)
+    True
+    >>> sorted(first) == nodes
+    True
+    >>> router.mark_failed(first[0])
+    >>> router.candidates(protocol.Get(True, 'user/1'), nodes)[-1] == first[0]
+    True
+'''
+
+import time
+import struct
+import hashlib
+import threading
+
+from pyrakoon import protocol
+
+DEFAULT_COOLDOWN = 5.0
+'''Default time a failed node is avoided, in seconds''' #pylint: disable=W0105
+
+_WEIGHT = struct.Struct('>Q')
+
+
+def routing_key(message):
+    '''Get the key a message is routed on
+
+    :param message: Message
+    :type message: :class:`pyrakoon.protocol.Message`
+
+    :return: Routing key, or :data:`None` if the message has none
+    :rtype: :class:`str`
+    '''
+
+    if isinstance(message, protocol.PrefixKeys):
+        return message.prefix
+
+    key = getattr(message, 'key', None)
+
+    if key is None:
+        keys = getattr(message, 'keys', None)
+        key = keys[0] if keys else None
+
+    if key is None and hasattr(message, 'begin_key'):
+        key = message.begin_key or ''
+
+    return key
+
+
+def weight(node_id, key):
+    '''Calculate the rendezvous weight of a node for a key
+
+    :param node_id: Node identifier
+    :type node_id: :class:`str`
+    :param key: Routing key
+    :type key: :class:`str`
+
+    :rtype: :class:`int`
+    '''
+
+    return _WEIGHT.unpack_from(
+        hashlib.md5('%s\0%s' % (node_id, key)).digest())[0]
+
+
+class RendezvousRouter(object):
+    '''Router ranking nodes by rendezvous hashing on the routing key of
+    messages'''
+
+    def __init__(self, separator=None, cooldown=DEFAULT_COOLDOWN):
+        '''
+        :param separator: Separator delimiting the key prefix to hash on, or
+            :data:`None` to hash on full keys
+        :type separator: :class:`str`
+        :param cooldown: Time a failed node is ranked last, in seconds
+        :type cooldown: :class:`float`
+        '''
+
+        self._separator = separator
+        self._cooldown = cooldown
+
+        self._lock = threading.Lock()
+        self._failed = {}
+
+    def _key(self, message):
+        '''Get the key to hash for a message'''
+
+        key = routing_key(message)
+
+        if key is not None and self._separator is not None and \
+            self._separator in key:
+            key = key[:key.rindex(self._separator) + len(self._separator)]
+
+        return key
+
+    def candidates(self, message, node_ids, last=None):
+        '''Rank nodes to handle a message, preferred node first
+
+        :param message: Message to route
+        :type message: :class:`pyrakoon.protocol.Message`
+        :param node_ids: Identifiers of all nodes
+        :type node_ids: iterable of :class:`str`
+        :param last: Node to rank last, before failed nodes (e.g. the master)
+        :type last: :class:`str`
+
+        :return: Identifiers of all nodes, in order of preference
+        :rtype: `list` of :class:`str`
+        '''
+
+        key = self._key(message) or ''
+        now = time.time()
+
+        self._lock.acquire()
+        try:
+            for node_id, until in self._failed.items():
+                if until <= now:
+                    del self._failed[node_id]
+
+            failed = set(self._failed)
+        finally:
+            self._lock.release()
+
+        return sorted(node_ids, key=lambda node_id: (node_id in failed,
+            node_id == last, -weight(node_id, key)))
+
+    def mark_failed(self, node_id):
+        '''Rank a node last during the cooldown
+
+        :param node_id: Identifier of the node which failed
+        :type node_id: :class:`str`
+        '''
+
+        self._lock.acquire()
+        try:
+            self._failed[node_id] = time.time() + self._cooldown
+        finally:
+            self._lock.release()
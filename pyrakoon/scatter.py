@@ -0,0 +1,183 @@
+# This file is part of Pyrakoon, a distributed key-value store client.
+#
+# Copyright (C) 2014 Incubaid BVBA
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''Scattering of large dirty multi-gets over all nodes
+
+A `multi_get` or `multi_get_option` call with `allow_dirty` set can be
+handled by any node. A :class:`Scatter` partitions the keys of such a call
+over all healthy nodes, so they look up their share of the keys in
+parallel. Each node gets a share proportional to the inverse of the time
+it took per key recently (an exponentially weighted moving average), so
+slower nodes get fewer keys. Nodes without measurements yet get the share
+of an average node.
+
+The keys are partitioned into contiguous slices, one per node, so the
+results can be merged by concatenation. Nodes which failed are skipped for
+a while (the *cooldown*).
+
+Example:
+
+    >>> scatter = Scatter()
+    >>> keys = ['key_%d' % i for i in xrange(300)]
+    >>> parts = scatter.partition(keys, ['node_0', 'node_1', 'node_2'])
+    >>> [(node_id, len(part)) for (node_id, part) in parts]
+    [('node_0', 100), ('node_1', 100), ('node_2', 100)]
+    >>> scatter.record('node_0', 100, 0.01)
+    >>> scatter.record('node_1', 100, 0.02)
+    >>> scatter.record('node_2', 100, 0.02)
+    >>> parts = scatter.partition(keys, ['node_0', 'node_1', 'node_2'])
+    >>> [(node_id, len(part)) for (node_id, part) in parts]
+    [('node_0', 150), ('node_1', 75), ('node_2', 75)]
+'''
+
+import time
+import threading
+
+DEFAULT_MIN_KEYS = 100
+'''Default minimum number of keys for a call to be scattered
+''' #pylint: disable=W0105
+DEFAULT_ALPHA = 0.2
+'''Default weight of a new measurement in the moving average
+''' #pylint: disable=W0105
+DEFAULT_COOLDOWN = 5.0
+'''Default time a failed node is skipped, in seconds''' #pylint: disable=W0105
+
+
+class Scatter(object):
+    '''Partitioning of keys over nodes, weighted by observed latency'''
+
+    def __init__(self, min_keys=DEFAULT_MIN_KEYS, alpha=DEFAULT_ALPHA,
+        cooldown=DEFAULT_COOLDOWN):
+        '''
+        :param min_keys: Minimum number of keys for a call to be scattered
+        :type min_keys: :class:`int`
+        :param alpha: Weight of a new measurement in the moving average,
+            between 0 and 1
+        :type alpha: :class:`float`
+        :param cooldown: Time a failed node is skipped, in seconds
+        :type cooldown: :class:`float`
+        '''
+
+        self.min_keys = min_keys
+        self._alpha = alpha
+        self._cooldown = cooldown
+
+        self._lock = threading.Lock()
+        self._latencies = {}
+        self._failed = {}
+
+    def record(self, node_id, key_count, duration):
+        '''Record the time a node took to look up a number of keys
+
+        :param node_id: Node identifier
+        :type node_id: :class:`str`
+        :param key_count: Number of keys looked up
+        :type key_count: :class:`int`
+        :param duration: Time taken, in seconds
+        :type duration: :class:`float`
+        '''
+
+        if key_count <= 0:
+            return
+
+        latency = float(duration) / key_count
+
+        self._lock.acquire()
+        try:
+            average = self._latencies.get(node_id)
+
+            if average is None:
+                self._latencies[node_id] = latency
+            else:
+                self._latencies[node_id] = average + \
+                    self._alpha * (latency - average)
+        finally:
+            self._lock.release()
+
+    def mark_failed(self, node_id):
+        '''Skip a node during the cooldown
+
+        :param node_id: Identifier of the node which failed
+        :type node_id: :class:`str`
+        '''
+
+        self._lock.acquire()
+        try:
+            self._failed[node_id] = time.time() + self._cooldown
+        finally:
+            self._lock.release()
+
+    def partition(self, keys, node_ids):
+        '''Partition keys over the healthy nodes
+
+        :param keys: Keys to look up
+        :type keys: `list` of :class:`str`
+        :param node_ids: Identifiers of all nodes
+        :type node_ids: iterable of :class:`str`
+
+        :return: Node identifiers and the slice of `keys` they should look
+            up, in order of `keys`, omitting empty slices
+        :rtype: `list` of `(str, list of str)`
+        '''
+
+        node_ids = sorted(node_ids)
+        now = time.time()
+
+        self._lock.acquire()
+        try:
+            healthy = [node_id for node_id in node_ids
+                if self._failed.get(node_id, 0) <= now]
+            latencies = dict(self._latencies)
+        finally:
+            self._lock.release()
+
+        node_ids = healthy or node_ids
+
+        known = [latencies[node_id] for node_id in node_ids
+            if latencies.get(node_id, 0) > 0]
+        default = sum(known) / len(known) if known else 1.0
+
+        weights = [1.0 / (latencies.get(node_id) or default)
+            for node_id in node_ids]
+        total = sum(weights)
+
+        result = []
+        start = 0
+        cumulative = 0.0
+
+        for node_id, weight in zip(node_ids, weights):
+            cumulative += weight
+            end = int(round(len(keys) * cumulative / total))
+
+            if end > start:
+                result.append((node_id, keys[start:end]))
+
+            start = end
+
+        return result
+
+    @property
+    def latencies(self):
+        '''Average time taken per key by every node, in seconds
+
+        :type: `dict` of `str` to `float`
+        '''
+
+        self._lock.acquire()
+        try:
+            return dict(self._latencies)
+        finally:
+            self._lock.release()
@@ -0,0 +1,316 @@
+# This file is part of Pyrakoon, a distributed key-value store client.
+#
+# Copyright (C) 2014 Incubaid BVBA
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''Read-your-writes consistency for dirty reads
+
+Reads with `allow_dirty` set can be handled by slave nodes, which may lag
+behind the master: a client reading a key it just wrote can get the old
+value back. A :class:`SessionClient` remembers the keys written through it
+for a while (the *window*), and turns dirty reads touching any of these keys
+into regular reads, which are handled by the master. All other dirty reads
+are passed on unchanged.
+
+Keys written by `set`, `delete`, `test_and_set`, `replace`, `confirm` and
+all steps of a `sequence` are remembered, and so are the prefixes passed to
+`delete_prefix`. Reads of keys starting with such prefix, and range or
+prefix reads overlapping a written key or prefix, are sent to the master.
+Since the keys a `user_function` writes are unknown, all dirty reads are
+sent to the master during the window after one.
+
+Example:
+
+    >>> from pyrakoon import test
+    >>> client = SessionClient(test.FakeClient(), window=60)
+    >>> client.set('key', 'value')
+    >>> client.get('key', allow_dirty=True)
+    'value'
+    >>> client.get('other', allow_dirty=True)
+    Traceback (most recent call last):
+        ...
+    NotFound: 'other'
+    >>> sorted(client.statistics.items())
+    [('dirty', 1), ('keys', 1), ('master', 1), ('prefixes', 0)]
+
+:note: Only writes issued through the same client are taken into account.
+'''
+
+import time
+import itertools
+import threading
+import collections
+
+from pyrakoon import client, protocol, sequence
+from pyrakoon.client.utils import prefix_upper_bound
+
+DEFAULT_WINDOW = 5.0
+'''Default time written keys are read from the master, in seconds
+''' #pylint: disable=W0105
+
+
+def _step_keys(step):
+    '''Get the keys written by a sequence step'''
+
+    if isinstance(step, (sequence.Set, sequence.Delete)):
+        yield step.key
+    elif isinstance(step, sequence.Sequence):
+        for step_ in step.steps:
+            for key in _step_keys(step_):
+                yield key
+
+
+def _in_range(key, low, high):
+    '''Check whether a key is within bounds, ignoring inclusiveness
+
+    :param low: Lower bound, or :data:`None`
+    :type low: :class:`str`
+    :param high: Upper bound, or :data:`None`
+    :type high: :class:`str`
+    '''
+
+    return (low is None or key >= low) and (high is None or key <= high)
+
+
+_KEY_WRITES = (protocol.Set, protocol.Delete, protocol.TestAndSet,
+    protocol.Replace, protocol.Confirm)
+_KEY_READS = (protocol.Get, protocol.Exists, protocol.Assert,
+    protocol.AssertExists)
+_MULTI_KEY_READS = (protocol.MultiGet, protocol.MultiGetOption)
+_RANGE_READS = (protocol.Range, protocol.RangeEntries,
+    protocol.RevRangeEntries)
+
+
+class SessionClient(object, client.AbstractClient, client.ClientMixin):
+    '''Client wrapper sending dirty reads of recently written keys to the
+    master
+
+    See the module documentation for the calls taken into account. All other
+    calls are passed to the wrapped client unchanged.
+    '''
+
+    def __init__(self, client_, window=DEFAULT_WINDOW):
+        '''Wrap a client
+
+        :param client_: Client to wrap
+        :type client_: :class:`pyrakoon.client.AbstractClient`
+        :param window: Time written keys are read from the master, in
+            seconds
+        :type window: :class:`float`
+        '''
+
+        super(SessionClient, self).__init__()
+
+        self._client = client_
+        self._window = window
+
+        self._lock = threading.Lock()
+        # Keys and prefixes by expiry time, oldest first
+        self._keys = collections.OrderedDict()
+        self._prefixes = collections.OrderedDict()
+        self._all_until = 0.0
+
+        self._dirty = 0
+        self._master = 0
+
+    @property
+    def connected(self):
+        '''Check whether the wrapped client is connected'''
+
+        return self._client.connected
+
+    def _expire(self, now):
+        '''Forget keys and prefixes written before the window, with the lock
+        held'''
+
+        for written in (self._keys, self._prefixes):
+            while written:
+                key, expires = next(written.iteritems())
+
+                if expires > now:
+                    break
+
+                del written[key]
+
+    def _record(self, message):
+        '''Remember the keys and prefixes a message (possibly) writes'''
+
+        type_ = type(message)
+
+        if type_ in _KEY_WRITES:
+            keys, prefixes = [message.key], []
+        elif type_ is protocol.Sequence:
+            keys, prefixes = list(_step_keys(message.sequence)), []
+        elif type_ is protocol.DeletePrefix:
+            keys, prefixes = [], [message.prefix]
+        elif type_ is protocol.UserFunction:
+            keys, prefixes = [], []
+        else:
+            return
+
+        now = time.time()
+        expires = now + self._window
+
+        self._lock.acquire()
+        try:
+            self._expire(now)
+
+            if type_ is protocol.UserFunction:
+                self._all_until = expires
+
+            for written, keys_ in ((self._keys, keys),
+                (self._prefixes, prefixes)):
+                for key in keys_:
+                    # Move the key to the end, keeping expiry order
+                    written.pop(key, None)
+                    written[key] = expires
+        finally:
+            self._lock.release()
+
+    def _written(self, message):
+        '''Check whether a dirty read touches recently written keys, with
+        the lock held'''
+
+        keys = self._keys
+        prefixes = self._prefixes
+
+        if isinstance(message, _KEY_READS + _MULTI_KEY_READS):
+            keys_ = [message.key] if isinstance(message, _KEY_READS) \
+                else message.keys
+
+            return any(key in keys or
+                any(key.startswith(prefix) for prefix in prefixes)
+                for key in keys_)
+
+        if isinstance(message, protocol.PrefixKeys):
+            low = message.prefix
+            high = prefix_upper_bound(low)
+        elif isinstance(message, _RANGE_READS):
+            low, high = message.begin_key, message.end_key
+
+            if isinstance(message, protocol.RevRangeEntries):
+                low, high = high, low
+        else:
+            # Unknown read, be safe
+            return True
+
+        return any(_in_range(key, low, high) for key in keys) or \
+            any((high is None or prefix <= high) and
+                (low is None or prefix_upper_bound(prefix) is None or
+                    prefix_upper_bound(prefix) > low)
+                for prefix in prefixes)
+
+    def _route(self, message):
+        '''Turn a dirty read touching recently written keys into a regular
+        read
+
+        :return: Message to send, and whether it needs the master
+        :rtype: `(pyrakoon.protocol.Message, bool)`
+        '''
+
+        if not getattr(message, 'allow_dirty', False):
+            return message, False
+
+        now = time.time()
+
+        self._lock.acquire()
+        try:
+            self._expire(now)
+
+            written = now < self._all_until or self._written(message)
+
+            if written:
+                self._master += 1
+            else:
+                self._dirty += 1
+        finally:
+            self._lock.release()
+
+        if not written:
+            return message, False
+
+        args = dict((arg[0], getattr(message, arg[0]))
+            for arg in type(message).ARGS)
+        args['allow_dirty'] = False
+
+        return type(message)(**args), True
+
+    def _process(self, message):
+        #pylint: disable=W0212
+        message, _ = self._route(message)
+
+        self._record(message)
+
+        try:
+            return self._client._process(message)
+        finally:
+            self._record(message)
+
+    def _process_pipelined(self, messages, max_in_flight=None):
+        pending = collections.deque()
+
+        def feed():
+            '''Route messages, recording writes when they're sent'''
+
+            for message in messages:
+                message, _ = self._route(message)
+                self._record(message)
+                pending.append(message)
+
+                yield message
+
+        for result in self._client._process_pipelined( #pylint: disable=W0212
+            feed(), max_in_flight):
+            self._record(pending.popleft())
+
+            yield result
+
+    def _process_spread(self, messages, max_in_flight=None):
+        # Runs of messages which need the master are pipelined to it, others
+        # are spread as usual
+        #pylint: disable=W0212
+        runs = itertools.groupby((self._route(message)
+            for message in messages), key=lambda routed: routed[1])
+
+        for master, run in runs:
+            run = (message for (message, _) in run)
+
+            if master:
+                process = self._client._process_pipelined
+            else:
+                process = self._client._process_spread
+
+            for result in process(run, max_in_flight):
+                yield result
+
+    @property
+    def statistics(self):
+        '''Number of keys and prefixes currently read from the master, and
+        counters of dirty reads passed on and sent to the master
+
+        :type: `dict` of `str` to `int`
+        '''
+
+        self._lock.acquire()
+        try:
+            self._expire(time.time())
+
+            return {
+                'keys': len(self._keys),
+                'prefixes': len(self._prefixes),
+                'dirty': self._dirty,
+                'master': self._master,
+            }
+        finally:
+            self._lock.release()
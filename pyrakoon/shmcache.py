@@ -0,0 +1,662 @@
+# This file is part of Pyrakoon, a distributed key-value store client.
+#
+# Copyright (C) 2014 Incubaid BVBA
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''Read cache shared by several processes on a host
+
+A :class:`SharedReadCache` stores values in a shared memory mapping, so
+pre-forked worker processes share a single copy of the cached data. It
+offers the same interface as :class:`pyrakoon.cache.ReadCache`, so it can
+be used by a :class:`pyrakoon.cache.CachingClient`::
+
+    shared = SharedReadCache(size=256 * 1024 * 1024, ttl=5)
+
+    # Fork workers here, then in every worker:
+    client = CachingClient(client_, shared)
+
+Without a `path`, the mapping is backed by an unlinked temporary file, and
+is shared with processes forked after the cache was created. With a `path`,
+unrelated processes mapping the same file share the cache as well.
+
+The mapping holds a fixed-size open-addressing hash table (linear probing,
+at most :data:`PROBE_LIMIT` slots per key), and a region of slabs. Every
+slab is assigned to a size class on first use, and split into chunks of
+that size, holding the key and value of an entry. When a size class runs
+out of chunks, entries of that class are evicted using the CLOCK
+algorithm, approximating LRU.
+
+Lookups don't take any lock, nor make any system call: every slot carries
+a sequence counter which writers make odd while they modify the slot (a
+*seqlock*), and readers retry when the counter was odd or changed while
+they read the slot and its chunk. Writers are serialized by a
+`fcntl.lockf` lock on the backing file, and a lock per process.
+
+:warning: The seqlock relies on the store ordering guarantees of x86
+    processors.
+'''
+
+import os
+import mmap
+import time
+import zlib
+import fcntl
+import struct
+import tempfile
+import threading
+
+from pyrakoon import cache
+
+DEFAULT_SIZE = 64 * 1024 * 1024
+'''Default size of the mapping, in bytes''' #pylint: disable=W0105
+DEFAULT_SLAB_SIZE = 1024 * 1024
+'''Default size of a slab, and maximum size of an entry
+''' #pylint: disable=W0105
+MIN_CHUNK_SIZE = 64
+'''Size of the smallest chunks, chunk sizes double up to the slab size
+''' #pylint: disable=W0105
+PROBE_LIMIT = 16
+'''Maximum number of slots inspected per key''' #pylint: disable=W0105
+READ_RETRIES = 100
+'''Number of attempts to read a slot which is being modified
+''' #pylint: disable=W0105
+
+_MAGIC = 'PYRKSHM1'
+_VERSION = 1
+
+# Magic, version, slot count, slab size, slab count, clock hand, padding,
+# followed by epoch, entries, bytes, evictions, invalidations
+_HEADER = struct.Struct('<8sIIIIII')
+_COUNTER = struct.Struct('<Q')
+_HEADER_SIZE = 128
+_EPOCH, _ENTRIES, _BYTES, _EVICTIONS, _INVALIDATIONS = \
+    [_HEADER.size + index * _COUNTER.size for index in xrange(5)]
+
+# Sequence, state, referenced, key length, value length, chunk offset + 1,
+# key hash, expiry time
+_SLOT = struct.Struct('<IBBHIIQd')
+_SEQUENCE = struct.Struct('<I')
+_POINTER = struct.Struct('<I')
+
+_EMPTY, _USED, _NEGATIVE, _DELETED = 0, 1, 2, 3
+_UNASSIGNED = 0xff
+
+
+def _hash(key):
+    '''Calculate a 64-bit hash of a key, stable across processes'''
+
+    return ((zlib.crc32(key) & 0xffffffff) << 32) | \
+        (zlib.adler32(key) & 0xffffffff)
+
+def _align(offset, alignment):
+    '''Round an offset up to a multiple of `alignment`'''
+
+    return (offset + alignment - 1) // alignment * alignment
+
+
+class _Layout(object): #pylint: disable=R0902,R0903
+    '''Offsets of the regions of a mapping'''
+
+    def __init__(self, size, slot_count, slab_size):
+        self.size = size
+        self.slot_count = slot_count
+        self.slab_size = slab_size
+
+        self.chunk_sizes = []
+        chunk_size = MIN_CHUNK_SIZE
+        while chunk_size < slab_size:
+            self.chunk_sizes.append(chunk_size)
+            chunk_size *= 2
+        self.chunk_sizes.append(slab_size)
+
+        max_slabs = size // slab_size
+
+        self.classes = _HEADER_SIZE
+        self.free_lists = _align(self.classes + max_slabs, 8)
+        self.slots = _align(
+            self.free_lists + len(self.chunk_sizes) * _POINTER.size, 64)
+        self.slabs = _align(self.slots + slot_count * _SLOT.size, 64)
+        self.slab_count = max(0, (size - self.slabs) // slab_size)
+
+        if self.slab_count == 0:
+            raise ValueError('Mapping too small for a single slab')
+
+
+class SharedReadCache(object): #pylint: disable=R0902
+    '''Read cache in shared memory, see the module documentation
+
+    Hit and miss counters are kept per process, all other statistics are
+    shared.
+    '''
+
+    #pylint: disable=R0913
+    def __init__(self, size=DEFAULT_SIZE, path=None, slot_count=None,
+        slab_size=DEFAULT_SLAB_SIZE, ttl=cache.DEFAULT_TTL,
+        negative_ttl=None):
+        '''Create or attach to a shared cache
+
+        :param size: Size of the mapping, in bytes
+        :type size: :class:`int`
+        :param path: Path of the backing file, or :data:`None` to use an
+            unlinked temporary file
+        :type path: :class:`str`
+        :param slot_count: Number of hash table slots, defaults to one per
+            512 bytes
+        :type slot_count: :class:`int`
+        :param slab_size: Size of a slab, and maximum size of an entry
+        :type slab_size: :class:`int`
+        :param ttl: Time entries are kept, in seconds
+        :type ttl: :class:`float`
+        :param negative_ttl: Time entries of non-existing keys are kept, in
+            seconds, defaults to `ttl`
+        :type negative_ttl: :class:`float`
+
+        :raise ValueError: `size` is too small
+        '''
+
+        layout = _Layout(size, slot_count or max(PROBE_LIMIT, size // 512),
+            slab_size)
+
+        self._ttl = ttl
+        self._negative_ttl = negative_ttl if negative_ttl is not None \
+            else ttl
+
+        if path is None:
+            self._file = tempfile.TemporaryFile()
+        else:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0600)
+            self._file = os.fdopen(fd, 'r+b')
+
+        self._lock = threading.Lock()
+
+        self._acquire()
+        try:
+            if os.fstat(self._file.fileno()).st_size != size:
+                os.ftruncate(self._file.fileno(), size)
+
+            self._map = mmap.mmap(self._file.fileno(), size)
+
+            if _HEADER.unpack_from(self._map, 0)[:5] != (_MAGIC, _VERSION,
+                layout.slot_count, layout.slab_size, layout.slab_count):
+                self._initialize(layout)
+        finally:
+            self._release()
+
+        self._layout = layout
+
+        self._hits = 0
+        self._negative_hits = 0
+        self._misses = 0
+        self._expirations = 0
+
+    def _acquire(self):
+        '''Acquire the write lock'''
+
+        self._lock.acquire()
+
+        try:
+            fcntl.lockf(self._file.fileno(), fcntl.LOCK_EX)
+        except:
+            self._lock.release()
+            raise
+
+    def _release(self):
+        '''Release the write lock'''
+
+        try:
+            fcntl.lockf(self._file.fileno(), fcntl.LOCK_UN)
+        finally:
+            self._lock.release()
+
+    def _initialize(self, layout):
+        '''Initialize the mapping, discarding its contents'''
+
+        map_ = self._map
+        map_[:layout.slabs] = '\0' * layout.slabs
+        map_[layout.classes:layout.classes + layout.slab_count] = \
+            chr(_UNASSIGNED) * layout.slab_count
+
+        _HEADER.pack_into(map_, 0, _MAGIC, _VERSION, layout.slot_count,
+            layout.slab_size, layout.slab_count, 0, 0)
+
+    def close(self):
+        '''Unmap the cache'''
+
+        self._map.close()
+        self._file.close()
+
+    def _counter(self, offset):
+        '''Read a shared counter'''
+
+        return _COUNTER.unpack_from(self._map, offset)[0]
+
+    def _add(self, offset, amount):
+        '''Update a shared counter, with the write lock held'''
+
+        _COUNTER.pack_into(self._map, offset,
+            _COUNTER.unpack_from(self._map, offset)[0] + amount)
+
+    epoch = property(lambda self: self._counter(_EPOCH),
+        doc='Number of invalidations so far, see :meth:`put`')
+
+    def __len__(self):
+        return self._counter(_ENTRIES)
+
+    def _slot_offset(self, index):
+        '''Get the offset of a slot'''
+
+        return self._layout.slots + index * _SLOT.size
+
+    def get(self, key):
+        '''Look up a key, without locking
+
+        :param key: Key to look up
+        :type key: :class:`str`
+
+        :return: Whether the key was found in the cache, and its value
+            (:data:`None` if the key doesn't exist)
+        :rtype: `(bool, str)`
+        '''
+
+        map_ = self._map
+        layout = self._layout
+        hash_ = _hash(key)
+        key_length = len(key)
+        start = hash_ % layout.slot_count
+
+        for probe in xrange(PROBE_LIMIT):
+            offset = self._slot_offset((start + probe) % layout.slot_count)
+
+            for _ in xrange(READ_RETRIES):
+                sequence, state, referenced, key_length_, value_length, \
+                    chunk, hash__, expires = _SLOT.unpack_from(map_, offset)
+
+                if sequence & 1:
+                    continue
+
+                if state == _EMPTY or state == _DELETED or \
+                    hash__ != hash_ or key_length_ != key_length:
+                    data = None
+                else:
+                    chunk_offset = layout.slabs + chunk - 1
+                    data = map_[chunk_offset:
+                        chunk_offset + key_length + value_length]
+
+                if _SEQUENCE.unpack_from(map_, offset)[0] == sequence:
+                    break
+            else:
+                # Slot kept changing, give up
+                self._misses += 1
+                return False, None
+
+            if state == _EMPTY:
+                break
+
+            if data is None or data[:key_length] != key:
+                continue
+
+            if time.time() >= expires:
+                self._expirations += 1
+                break
+
+            if not referenced:
+                map_[offset + 5] = '\1'
+
+            self._hits += 1
+
+            if state == _NEGATIVE:
+                self._negative_hits += 1
+                return True, None
+
+            return True, data[key_length:]
+
+        self._misses += 1
+        return False, None
+
+    def _write_slot(self, offset, state, key_length=0, value_length=0,
+        chunk=0, hash_=0, expires=0.0):
+        '''Update a slot, with the write lock held'''
+
+        map_ = self._map
+        sequence = _SEQUENCE.unpack_from(map_, offset)[0]
+
+        _SEQUENCE.pack_into(map_, offset, (sequence + 1) & 0xffffffff)
+        _SLOT.pack_into(map_, offset, (sequence + 1) & 0xffffffff, state, 0,
+            key_length, value_length, chunk, hash_, expires)
+        _SEQUENCE.pack_into(map_, offset, (sequence + 2) & 0xffffffff)
+
+    def _chunk_class(self, chunk):
+        '''Get the size class of a chunk'''
+
+        layout = self._layout
+        slab = (chunk - 1) // layout.slab_size
+
+        return ord(self._map[layout.classes + slab])
+
+    def _remove_slot(self, offset):
+        '''Remove the entry in a slot, with the write lock held'''
+
+        _, state, _, key_length, value_length, chunk, _, _ = \
+            _SLOT.unpack_from(self._map, offset)
+
+        if state not in (_USED, _NEGATIVE):
+            return
+
+        # Mark the slot deleted before freeing its chunk, so readers of the
+        # slot notice the chunk may have been reused
+        self._write_slot(offset, _DELETED)
+        self._free(chunk)
+
+        self._add(_ENTRIES, -1)
+        self._add(_BYTES, -(key_length + value_length))
+
+    def _free(self, chunk):
+        '''Put a chunk back in the free list of its class'''
+
+        map_ = self._map
+        free_list = self._layout.free_lists + \
+            self._chunk_class(chunk) * _POINTER.size
+
+        _POINTER.pack_into(map_, self._layout.slabs + chunk - 1,
+            _POINTER.unpack_from(map_, free_list)[0])
+        _POINTER.pack_into(map_, free_list, chunk)
+
+    def _allocate(self, size):
+        '''Allocate a chunk for `size` bytes, with the write lock held
+
+        :return: Chunk offset + 1, or :data:`None` if nothing could be
+            evicted
+        '''
+
+        layout = self._layout
+        map_ = self._map
+
+        class_ = 0
+        while layout.chunk_sizes[class_] < size:
+            class_ += 1
+
+        free_list = layout.free_lists + class_ * _POINTER.size
+
+        if not _POINTER.unpack_from(map_, free_list)[0]:
+            if not self._assign_slab(class_) and not self._evict(class_):
+                return None
+
+        chunk = _POINTER.unpack_from(map_, free_list)[0]
+        _POINTER.pack_into(map_, free_list,
+            _POINTER.unpack_from(map_, layout.slabs + chunk - 1)[0])
+
+        return chunk
+
+    def _assign_slab(self, class_):
+        '''Split an unused slab into free chunks of a size class'''
+
+        layout = self._layout
+        map_ = self._map
+        classes = map_[layout.classes:layout.classes + layout.slab_count]
+        slab = classes.find(chr(_UNASSIGNED))
+
+        if slab < 0:
+            return False
+
+        map_[layout.classes + slab] = chr(class_)
+
+        chunk_size = layout.chunk_sizes[class_]
+        first = slab * layout.slab_size + 1
+
+        for index in xrange(layout.slab_size // chunk_size):
+            self._free(first + index * chunk_size)
+
+        return True
+
+    def _evict(self, class_):
+        '''Evict an entry of a size class, using the CLOCK algorithm'''
+
+        layout = self._layout
+        map_ = self._map
+        hand = _HEADER.unpack_from(map_, 0)[5]
+
+        for _ in xrange(2 * layout.slot_count):
+            hand = (hand + 1) % layout.slot_count
+            offset = self._slot_offset(hand)
+
+            _, state, referenced, _, _, chunk, _, _ = \
+                _SLOT.unpack_from(map_, offset)
+
+            if state not in (_USED, _NEGATIVE) or \
+                self._chunk_class(chunk) != class_:
+                continue
+
+            if referenced:
+                map_[offset + 5] = '\0'
+                continue
+
+            self._remove_slot(offset)
+            self._add(_EVICTIONS, 1)
+            break
+        else:
+            return False
+
+        header = list(_HEADER.unpack_from(map_, 0))
+        header[5] = hand
+        _HEADER.pack_into(map_, 0, *header)
+
+        return True
+
+    def _find(self, key, hash_):
+        '''Find the slot of a key, and a free slot for it, with the write
+        lock held
+
+        :return: Offset of the slot holding `key`, or :data:`None`, and
+            offset of a free slot in its probe window, or :data:`None`
+        '''
+
+        layout = self._layout
+        map_ = self._map
+        start = hash_ % layout.slot_count
+        now = time.time()
+
+        found = free = None
+
+        for probe in xrange(PROBE_LIMIT):
+            offset = self._slot_offset((start + probe) % layout.slot_count)
+
+            _, state, _, key_length, _, chunk, hash__, expires = \
+                _SLOT.unpack_from(map_, offset)
+
+            if state == _EMPTY:
+                if free is None:
+                    free = offset
+                break
+
+            if state == _DELETED:
+                if free is None:
+                    free = offset
+                continue
+
+            if hash__ == hash_ and key_length == len(key):
+                chunk_offset = layout.slabs + chunk - 1
+                if map_[chunk_offset:chunk_offset + key_length] == key:
+                    found = offset
+                    break
+
+            if expires <= now:
+                self._remove_slot(offset)
+                if free is None:
+                    free = offset
+
+        return found, free
+
+    def put(self, key, value, epoch=None):
+        '''Store the value of a key
+
+        See :meth:`pyrakoon.cache.ReadCache.put`.
+
+        :param key: Key
+        :type key: :class:`str`
+        :param value: Value, or :data:`None` if the key doesn't exist
+        :type value: :class:`str`
+        :param epoch: Value of :attr:`epoch` before the value was read
+        :type epoch: :class:`int`
+        '''
+
+        data = key + (value or '')
+
+        if len(data) > self._layout.slab_size or len(key) > 0xffff:
+            return
+
+        hash_ = _hash(key)
+        ttl = self._ttl if value is not None else self._negative_ttl
+
+        self._acquire()
+        try:
+            if epoch is not None and epoch != self.epoch:
+                return
+
+            found, free = self._find(key, hash_)
+
+            if found is not None:
+                self._remove_slot(found)
+                free = found
+
+            if free is None:
+                # Probe window is full, evict the entry expiring first,
+                # preferring entries not used recently
+                def eviction_order(offset):
+                    '''Sort key of the entry in a slot, to pick a victim'''
+
+                    _, _, referenced, _, _, _, _, expires = \
+                        _SLOT.unpack_from(self._map, offset)
+
+                    return referenced, expires
+
+                start = hash_ % self._layout.slot_count
+                free = min((self._slot_offset(
+                    (start + probe) % self._layout.slot_count)
+                    for probe in xrange(PROBE_LIMIT)), key=eviction_order)
+
+                self._remove_slot(free)
+                self._add(_EVICTIONS, 1)
+
+            chunk = self._allocate(len(data))
+
+            if chunk is None:
+                return
+
+            chunk_offset = self._layout.slabs + chunk - 1
+            self._map[chunk_offset:chunk_offset + len(data)] = data
+
+            self._write_slot(free, _USED if value is not None else _NEGATIVE,
+                len(key), len(data) - len(key), chunk, hash_,
+                time.time() + ttl)
+
+            self._add(_ENTRIES, 1)
+            self._add(_BYTES, len(data))
+        finally:
+            self._release()
+
+    def discard(self, key):
+        '''Remove a key from the cache
+
+        :param key: Key to remove
+        :type key: :class:`str`
+        '''
+
+        self._acquire()
+        try:
+            self._add(_EPOCH, 1)
+
+            found, _ = self._find(key, _hash(key))
+
+            if found is not None:
+                self._remove_slot(found)
+                self._add(_INVALIDATIONS, 1)
+        finally:
+            self._release()
+
+    def discard_prefix(self, prefix):
+        '''Remove all keys starting with a prefix from the cache
+
+        :param prefix: Prefix of keys to remove
+        :type prefix: :class:`str`
+        '''
+
+        layout = self._layout
+        map_ = self._map
+
+        self._acquire()
+        try:
+            self._add(_EPOCH, 1)
+
+            for index in xrange(layout.slot_count):
+                offset = self._slot_offset(index)
+
+                _, state, _, key_length, _, chunk, _, _ = \
+                    _SLOT.unpack_from(map_, offset)
+
+                if state not in (_USED, _NEGATIVE) or \
+                    key_length < len(prefix):
+                    continue
+
+                chunk_offset = layout.slabs + chunk - 1
+
+                if map_[chunk_offset:chunk_offset + len(prefix)] == prefix:
+                    self._remove_slot(offset)
+                    self._add(_INVALIDATIONS, 1)
+        finally:
+            self._release()
+
+    def clear(self):
+        '''Remove all entries'''
+
+        layout = self._layout
+
+        self._acquire()
+        try:
+            self._add(_EPOCH, 1)
+            self._add(_INVALIDATIONS, self._counter(_ENTRIES))
+
+            for index in xrange(layout.slot_count):
+                offset = self._slot_offset(index)
+
+                if _SLOT.unpack_from(self._map, offset)[1] != _EMPTY:
+                    self._write_slot(offset, _EMPTY)
+
+            self._map[layout.classes:layout.classes + layout.slab_count] = \
+                chr(_UNASSIGNED) * layout.slab_count
+            self._map[layout.free_lists:layout.slots] = \
+                '\0' * (layout.slots - layout.free_lists)
+
+            self._add(_ENTRIES, -self._counter(_ENTRIES))
+            self._add(_BYTES, -self._counter(_BYTES))
+        finally:
+            self._release()
+
+    @property
+    def statistics(self):
+        '''Number of entries, their size, and counters of hits (of which
+        negative hits), misses, evictions, expirations and invalidations
+
+        :type: `dict` of `str` to `int`
+        '''
+
+        return {
+            'entries': self._counter(_ENTRIES),
+            'bytes': self._counter(_BYTES),
+            'hits': self._hits,
+            'negative_hits': self._negative_hits,
+            'misses': self._misses,
+            'evictions': self._counter(_EVICTIONS),
+            'expirations': self._expirations,
+            'invalidations': self._counter(_INVALIDATIONS),
+        }
@@ -0,0 +1,298 @@
+# This file is part of Pyrakoon, a distributed key-value store client.
+#
+# Copyright (C) 2014 Incubaid BVBA
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''Log of requests exceeding a latency threshold
+
+:class:`SlowLog` is a :class:`pyrakoon.trace.Tracer` recording every
+request which takes longer than a threshold as a :class:`SlowRequest`. The
+latest entries are kept in a bounded ring buffer, and can optionally be
+written to a log file and/or a :class:`logging.Logger`. Output is rate
+limited, entries exceeding the rate are only kept in the ring buffer, and
+the number of entries skipped is reported in the next line written.
+
+Entries describe the request sent: its type, the (truncated) key or prefix,
+range bounds, `max_elements`, the number of keys or steps, the size of the
+request and response, the node, and whether the request was retried or the
+master had to be looked up first.
+
+Example::
+
+    slow_log = SlowLog(threshold=0.05, path='/var/log/app/arakoon-slow.log')
+    client.tracer = slow_log
+
+    for entry in slow_log.entries():
+        print entry
+'''
+
+import time
+import logging
+import threading
+import collections
+
+from pyrakoon import protocol, trace
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_THRESHOLD = 0.1
+'''Default latency threshold, in seconds''' #pylint: disable=W0105
+DEFAULT_SIZE = 1000
+'''Default number of entries kept''' #pylint: disable=W0105
+DEFAULT_RATE = 10.0
+'''Default maximum number of entries written per second
+''' #pylint: disable=W0105
+DEFAULT_KEY_LENGTH = 64
+'''Default maximum length of keys in entries''' #pylint: disable=W0105
+
+_KEY_ARGS = ('key', 'prefix', 'begin_key', 'end_key')
+
+
+def _truncate(value, length):
+    '''Truncate a key, marking truncated keys with an ellipsis'''
+
+    if value is None or len(value) <= length:
+        return value
+
+    return value[:length] + '...'
+
+
+class SlowRequest(object): #pylint: disable=R0902,R0903
+    '''Description of a slow request'''
+
+    __slots__ = ('timestamp', 'message_type', 'duration', 'phases', 'key',
+        'prefix', 'begin_key', 'end_key', 'max_elements', 'key_count',
+        'bytes_sent', 'bytes_received', 'node', 'retries', 'master_lookups',
+        'error')
+
+    def __init__(self, trace_, key_length=DEFAULT_KEY_LENGTH):
+        '''Describe a finished request
+
+        :param trace_: Trace of the request
+        :type trace_: :class:`pyrakoon.trace.Trace`
+        :param key_length: Maximum length of keys
+        :type key_length: :class:`int`
+        '''
+
+        self.timestamp = time.time()
+        self.message_type = trace_.message_type.__name__
+        self.duration = trace_.duration
+        self.phases = trace_.phases
+        self.bytes_sent = trace_.bytes_sent
+        self.bytes_received = trace_.bytes_received
+        self.node = trace_.node
+        self.retries = trace_.retries
+        self.master_lookups = trace_.master_lookups
+        self.error = trace_.error
+
+        message = trace_.message
+
+        for name in _KEY_ARGS:
+            setattr(self, name,
+                _truncate(getattr(message, name, None), key_length))
+
+        self.max_elements = getattr(message, 'max_elements', None)
+
+        if isinstance(message, protocol.Sequence):
+            keys = message.sequence.steps
+        else:
+            keys = getattr(message, 'keys', None)
+        self.key_count = len(keys) if keys is not None else None
+
+    def __str__(self):
+        fields = [
+            time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(self.timestamp)),
+            self.message_type,
+            'duration=%.6f' % self.duration,
+        ]
+
+        for name in _KEY_ARGS + ('max_elements', 'key_count'):
+            value = getattr(self, name)
+
+            if value is not None:
+                fields.append('%s=%r' % (name, value))
+
+        fields.extend([
+            'sent=%d' % self.bytes_sent,
+            'received=%d' % self.bytes_received,
+            'node=%s' % (self.node, ),
+        ])
+
+        if self.retries:
+            fields.append('retries=%d' % self.retries)
+        if self.master_lookups:
+            fields.append('master_lookups=%d' % self.master_lookups)
+        if self.error is not None:
+            fields.append('error=%s' % type(self.error).__name__)
+
+        fields.extend('%s=%.6f' % (name, self.phases[name])
+            for name in trace.PHASES if name in self.phases)
+
+        return ' '.join(fields)
+
+    def __repr__(self):
+        return '<SlowRequest %s>' % self
+
+
+class SlowLog(trace.Tracer):
+    '''Tracer recording requests exceeding a latency threshold'''
+
+    #pylint: disable=R0913
+    def __init__(self, threshold=DEFAULT_THRESHOLD, size=DEFAULT_SIZE,
+        path=None, logger=None, rate=DEFAULT_RATE,
+        key_length=DEFAULT_KEY_LENGTH):
+        '''
+        :param threshold: Minimal duration of requests recorded, in seconds
+        :type threshold: :class:`float`
+        :param size: Number of entries kept
+        :type size: :class:`int`
+        :param path: Path of a file entries are appended to
+        :type path: :class:`str`
+        :param logger: Logger entries are written to, at `WARNING` level
+        :type logger: :class:`logging.Logger`
+        :param rate: Maximum number of entries written per second, and
+            burst size
+        :type rate: :class:`float`
+        :param key_length: Maximum length of keys in entries
+        :type key_length: :class:`int`
+        '''
+
+        super(SlowLog, self).__init__()
+
+        self._threshold = threshold
+        self._entries = collections.deque(maxlen=size)
+        self._fd = open(path, 'a') if path is not None else None
+        self._logger = logger
+        self._rate = float(rate)
+        self._key_length = key_length
+
+        self._lock = threading.Lock()
+        self._tokens = max(self._rate, 1.0)
+        self._last = time.time()
+        self._recorded = 0
+        self._written = 0
+        self._skipped = 0
+        self._pending_skipped = 0
+
+    threshold = property(lambda self: self._threshold,
+        doc='Minimal duration of requests recorded, in seconds')
+
+    def _add(self, trace_):
+        '''Record a finished request, if it's slow'''
+
+        duration = trace_.duration
+
+        if duration is None or duration < self._threshold:
+            return
+
+        entry = SlowRequest(trace_, self._key_length)
+
+        self._lock.acquire()
+        try:
+            self._entries.append(entry)
+            self._recorded += 1
+
+            if self._fd is None and self._logger is None:
+                return
+
+            now = time.time()
+            self._tokens = min(max(self._rate, 1.0),
+                self._tokens + (now - self._last) * self._rate)
+            self._last = now
+
+            if self._tokens < 1.0:
+                self._skipped += 1
+                self._pending_skipped += 1
+                return
+
+            self._tokens -= 1.0
+            self._written += 1
+
+            line = str(entry)
+
+            if self._pending_skipped:
+                line = '%s (%d slow requests skipped)' % (line,
+                    self._pending_skipped)
+                self._pending_skipped = 0
+
+            self._write(line)
+        finally:
+            self._lock.release()
+
+    on_decoded = _add
+    on_error = _add
+
+    def _write(self, line):
+        '''Write a line to the configured outputs'''
+
+        if self._fd is not None:
+            try:
+                self._fd.write(line + '\n')
+                self._fd.flush()
+            except (IOError, OSError):
+                LOGGER.exception('Unable to write slow request log')
+
+        if self._logger is not None:
+            self._logger.warning('Slow request: %s', line)
+
+    def entries(self):
+        '''Get the latest slow requests, oldest first
+
+        :rtype: `list` of :class:`SlowRequest`
+        '''
+
+        self._lock.acquire()
+        try:
+            return list(self._entries)
+        finally:
+            self._lock.release()
+
+    def reset(self):
+        '''Forget all entries'''
+
+        self._lock.acquire()
+        try:
+            self._entries.clear()
+        finally:
+            self._lock.release()
+
+    @property
+    def statistics(self):
+        '''Number of slow requests recorded, written and skipped because of
+        the rate limit
+
+        :type: `dict` of `str` to `int`
+        '''
+
+        self._lock.acquire()
+        try:
+            return {
+                'recorded': self._recorded,
+                'written': self._written,
+                'skipped': self._skipped,
+            }
+        finally:
+            self._lock.release()
+
+    def close(self):
+        '''Close the log file, if any'''
+
+        self._lock.acquire()
+        try:
+            fd, self._fd = self._fd, None
+        finally:
+            self._lock.release()
+
+        if fd is not None:
+            fd.close()
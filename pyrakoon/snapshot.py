@@ -0,0 +1,393 @@
+# This file is part of Pyrakoon, a distributed key-value store client.
+#
+# Copyright (C) 2014 Incubaid BVBA
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''Read-only client serving a local snapshot of the key space
+
+A snapshot is a dump file as written by :mod:`pyrakoon.dump`. The file is
+memory-mapped, and an index of record offsets is built when it's opened.
+Lookups use binary search over this index, and values are sliced straight
+from the mapping.
+
+Example:
+
+    >>> import tempfile
+    >>> from pyrakoon import dump
+    >>> fd = tempfile.NamedTemporaryFile()
+    >>> writer = dump.DumpWriter(fd)
+    >>> for i in xrange(5):
+    ...     writer.write('key_%d' % i, 'value_%d' % i)
+    >>> writer.close()
+    >>> client = SnapshotClient(fd.name)
+    >>> client.get('key_3')
+    'value_3'
+    >>> client.range('key_1', True, 'key_3', False)
+    ['key_1', 'key_2']
+    >>> client.get_key_count()
+    5
+    >>> client.close()
+    >>> fd.close()
+'''
+
+import mmap
+import array
+import struct
+
+from pyrakoon import client, dump, errors, protocol
+from pyrakoon.client.utils import prefix_upper_bound
+
+_LENGTH = struct.Struct('<I')
+_INDEX_FIXED = _LENGTH.size + 8 # Record count and segment offset
+
+def _offset_array():
+    '''Create an array suitable to store file offsets'''
+
+    for typecode in 'LQ':
+        try:
+            if array.array(typecode).itemsize >= 8:
+                return array.array(typecode)
+        except ValueError:
+            continue
+
+    return array.array('L')
+
+
+class SnapshotClient(object, client.AbstractClient, client.ClientMixin):
+    '''Read-only client serving requests from a local snapshot file
+
+    Only the read subset of :class:`pyrakoon.client.ClientMixin` is
+    supported: :meth:`get`, :meth:`exists`, :meth:`multi_get`,
+    :meth:`multi_get_option`, :meth:`range`, :meth:`range_entries`,
+    :meth:`rev_range_entries`, :meth:`prefix` and :meth:`get_key_count`
+    (and the iterators built on top of these). Update calls raise
+    :class:`~pyrakoon.errors.ReadOnly`, any other call raises
+    :class:`~pyrakoon.errors.NotSupported`.
+
+    Since a snapshot is local, the `allow_dirty` flag of all calls is
+    ignored.
+    '''
+
+    _UPDATES = frozenset((protocol.Set, protocol.Delete, protocol.TestAndSet,
+        protocol.Sequence, protocol.DeletePrefix, protocol.Replace,
+        protocol.UserFunction, protocol.Confirm))
+
+    def __init__(self, path):
+        '''Open a snapshot file
+
+        :param path: Path of the snapshot (dump) file
+        :type path: :class:`str`
+
+        :raise pyrakoon.dump.DumpError: Malformed snapshot file
+        '''
+
+        super(SnapshotClient, self).__init__()
+
+        fd = open(path, 'rb')
+        try:
+            self._map = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            fd.close()
+
+        self._offsets = _offset_array()
+
+        try:
+            self._build_index()
+        except:
+            self.close()
+            raise
+
+        self._handlers = {
+            protocol.Get: self._handle_get,
+            protocol.Exists: self._handle_exists,
+            protocol.MultiGet: self._handle_multi_get,
+            protocol.MultiGetOption: self._handle_multi_get_option,
+            protocol.Range: self._handle_range,
+            protocol.RangeEntries: self._handle_range_entries,
+            protocol.RevRangeEntries: self._handle_rev_range_entries,
+            protocol.PrefixKeys: self._handle_prefix,
+            protocol.GetKeyCount: lambda _: len(self._offsets),
+        }
+
+    @property
+    def connected(self):
+        '''Check whether the snapshot is opened'''
+
+        return self._map is not None
+
+    def close(self):
+        '''Close the snapshot'''
+
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+    def _build_index(self):
+        '''Record the offset of every record in the snapshot'''
+
+        map_ = self._map
+        size = len(map_)
+        unpack = _LENGTH.unpack_from
+        offsets = self._offsets
+
+        def check(end):
+            '''Check whether `end` lies within the file'''
+
+            if end > size:
+                raise dump.DumpError('Unexpected end of snapshot')
+
+        check(len(dump.MAGIC) + _LENGTH.size)
+        if map_[:len(dump.MAGIC)] != dump.MAGIC:
+            raise dump.DumpError('Not a dump file')
+
+        offset = len(dump.MAGIC)
+        version, = unpack(map_, offset)
+        if version != dump.VERSION:
+            raise dump.DumpError('Unsupported dump version %d' % version)
+        offset += _LENGTH.size
+
+        last_key = None
+
+        while True:
+            check(offset + 1)
+            marker = map_[offset]
+            offset += 1
+
+            if marker == dump.RECORD_MARKER:
+                check(offset + _LENGTH.size)
+                key_length, = unpack(map_, offset)
+                key = map_[offset + _LENGTH.size:
+                    offset + _LENGTH.size + key_length]
+
+                if last_key is not None and key <= last_key:
+                    raise dump.DumpError('Keys not sorted at offset %d' %
+                        offset)
+
+                offsets.append(offset)
+                last_key = key
+
+                offset += _LENGTH.size + key_length
+                check(offset + _LENGTH.size)
+                offset += _LENGTH.size + unpack(map_, offset)[0]
+                check(offset)
+            elif marker == dump.INDEX_MARKER:
+                offset += _INDEX_FIXED
+
+                for _ in xrange(2):
+                    check(offset + _LENGTH.size)
+                    offset += _LENGTH.size + unpack(map_, offset)[0]
+
+                offset += _LENGTH.size
+                check(offset)
+            elif marker == dump.END_MARKER:
+                check(offset + 8)
+                count, = struct.unpack_from('<Q', map_, offset)
+
+                if count != len(offsets):
+                    raise dump.DumpError('Snapshot has %d records, expected '
+                        '%d' % (len(offsets), count))
+
+                return
+            else:
+                raise dump.DumpError('Invalid marker %r at offset %d' % (
+                    marker, offset - 1))
+
+    def _key(self, index):
+        '''Retrieve the key of the record at position `index`'''
+
+        offset = self._offsets[index]
+        length, = _LENGTH.unpack_from(self._map, offset)
+        offset += _LENGTH.size
+
+        return self._map[offset:offset + length]
+
+    def _value(self, index):
+        '''Retrieve a zero-copy view on the value of the record at `index`'''
+
+        offset = self._offsets[index]
+        offset += _LENGTH.size + _LENGTH.unpack_from(self._map, offset)[0]
+        length, = _LENGTH.unpack_from(self._map, offset)
+
+        return buffer(self._map, offset + _LENGTH.size, length)
+
+    def _bisect(self, key, right=False):
+        '''Find the position of `key`, like :func:`bisect.bisect_left`
+
+        If `right` is set, :func:`bisect.bisect_right` is mimicked instead.
+        '''
+
+        low, high = 0, len(self._offsets)
+
+        while low < high:
+            middle = (low + high) // 2
+            middle_key = self._key(middle)
+
+            if middle_key < key or (right and middle_key == key):
+                low = middle + 1
+            else:
+                high = middle
+
+        return low
+
+    def _find(self, key):
+        '''Find the position of `key`, or :data:`None` if not found'''
+
+        index = self._bisect(key)
+
+        if index < len(self._offsets) and self._key(index) == key:
+            return index
+
+        return None
+
+    def _bounds(self, message):
+        '''Calculate the index range matching a range message'''
+
+        begin_key, end_key = message.begin_key, message.end_key
+
+        if begin_key is None:
+            begin = 0
+        else:
+            begin = self._bisect(begin_key, not message.begin_inclusive)
+
+        if end_key is None:
+            end = len(self._offsets)
+        else:
+            end = self._bisect(end_key, message.end_inclusive)
+
+        return begin, max(begin, end)
+
+    def _rev_bounds(self, message):
+        '''Calculate the (ascending) index range of a reverse range message'''
+
+        begin_key, end_key = message.begin_key, message.end_key
+
+        if begin_key is None:
+            end = len(self._offsets)
+        else:
+            end = self._bisect(begin_key, message.begin_inclusive)
+
+        if end_key is None:
+            begin = 0
+        else:
+            begin = self._bisect(end_key, not message.end_inclusive)
+
+        return begin, max(begin, end)
+
+    @staticmethod
+    def _limit(begin, end, max_elements):
+        '''Limit an index range to `max_elements` items'''
+
+        if max_elements >= 0:
+            end = min(end, begin + max_elements)
+
+        return begin, end
+
+    def get_buffer(self, key):
+        '''Retrieve a zero-copy view on the value of a key
+
+        The result is only valid until the snapshot is closed.
+
+        :param key: Key to look up
+        :type key: :class:`str`
+
+        :return: Value of `key`
+        :rtype: :class:`buffer`
+
+        :raise pyrakoon.errors.NotFound: Key not found
+        '''
+
+        index = self._find(key)
+
+        if index is None:
+            raise errors.NotFound(key)
+
+        return self._value(index)
+
+    def _handle_get(self, message):
+        '''Handle a "get" message'''
+
+        return str(self.get_buffer(message.key))
+
+    def _handle_exists(self, message):
+        '''Handle an "exists" message'''
+
+        return self._find(message.key) is not None
+
+    def _handle_multi_get(self, message):
+        '''Handle a "multi_get" message'''
+
+        return [str(self.get_buffer(key)) for key in message.keys]
+
+    def _handle_multi_get_option(self, message):
+        '''Handle a "multi_get_option" message'''
+
+        result = []
+
+        for key in message.keys:
+            index = self._find(key)
+            result.append(str(self._value(index))
+                if index is not None else None)
+
+        return result
+
+    def _handle_range(self, message):
+        '''Handle a "range" message'''
+
+        begin, end = self._bounds(message)
+        begin, end = self._limit(begin, end, message.max_elements)
+
+        return [self._key(index) for index in xrange(begin, end)]
+
+    def _handle_range_entries(self, message):
+        '''Handle a "range_entries" message'''
+
+        begin, end = self._bounds(message)
+        begin, end = self._limit(begin, end, message.max_elements)
+
+        return [(self._key(index), str(self._value(index)))
+            for index in xrange(begin, end)]
+
+    def _handle_rev_range_entries(self, message):
+        '''Handle a "rev_range_entries" message'''
+
+        begin, end = self._rev_bounds(message)
+
+        if message.max_elements >= 0:
+            begin = max(begin, end - message.max_elements)
+
+        return [(self._key(index), str(self._value(index)))
+            for index in xrange(end - 1, begin - 1, -1)]
+
+    def _handle_prefix(self, message):
+        '''Handle a "prefix" message'''
+
+        upper = prefix_upper_bound(message.prefix)
+
+        begin = self._bisect(message.prefix)
+        end = self._bisect(upper) if upper is not None else len(self._offsets)
+        begin, end = self._limit(begin, end, message.max_elements)
+
+        return [self._key(index) for index in xrange(begin, end)]
+
+    def _process(self, message):
+        handler = self._handlers.get(type(message), None)
+
+        if handler is not None:
+            return handler(message)
+
+        if type(message) in self._UPDATES:
+            raise errors.ReadOnly('Snapshot is read-only')
+
+        raise errors.NotSupported('Message %s not supported by snapshot' %
+            type(message).__name__)
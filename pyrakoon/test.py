@@ -19,9 +19,11 @@
 import os.path
 import time
 import shutil
+import socket
 import struct
 import logging
 import tempfile
+import threading
 import subprocess
 
 try:
@@ -29,7 +31,7 @@ try:
 except ImportError:
     import StringIO
 
-from pyrakoon import client, compat, errors, protocol, utils
+from pyrakoon import client, compat, errors, protocol, sequence, utils
 
 
 LOGGER = logging.getLogger(__name__)
@@ -50,8 +52,21 @@ class FakeClient(object, client.AbstractClient, client.ClientMixin):
 
         self._values = {}
 
-    def _process(self, message): #pylint: disable=R0912
+    def _process(self, message):
         bytes_ = StringIO.StringIO(''.join(message.serialize())).read
+        result = StringIO.StringIO(self._handle(bytes_))
+
+        return utils.read_blocking(message.receive(), result.read)
+
+    def _handle(self, bytes_): #pylint: disable=R0912,R0915
+        '''Handle a single serialized command
+
+        :param bytes_: Function to read command bytes
+        :type bytes_: `callable` of `int -> str`
+
+        :return: Serialized response
+        :rtype: :class:`str`
+        '''
 
         # Helper
         recv = lambda type_: utils.read_blocking(type_.receive(), bytes_)
@@ -111,6 +126,50 @@ class FakeClient(object, client.AbstractClient, client.ClientMixin):
                 for rbytes in protocol.STRING.serialize(self._values[key]):
                     yield rbytes
 
+        def handle_multi_get():
+            '''Handle a "multi_get" command'''
+
+            _ = recv(protocol.BOOL)
+            # Lists are received in reverse order
+            keys = list(reversed(recv(protocol.List(protocol.STRING))))
+
+            for key in keys:
+                if key not in self._values:
+                    for rbytes in protocol.UINT32.serialize(
+                        errors.NotFound.CODE):
+                        yield rbytes
+                    for rbytes in protocol.STRING.serialize(key):
+                        yield rbytes
+
+                    return
+
+            for rbytes in protocol.UINT32.serialize(
+                protocol.RESULT_SUCCESS):
+                yield rbytes
+
+            # Lists are sent in reverse order
+            for rbytes in protocol.List(protocol.STRING).serialize(
+                reversed([self._values[key] for key in keys])):
+                yield rbytes
+
+        def handle_multi_get_option():
+            '''Handle a "multi_get_option" command'''
+
+            _ = recv(protocol.BOOL)
+            keys = list(reversed(recv(protocol.List(protocol.STRING))))
+
+            for rbytes in protocol.UINT32.serialize(
+                protocol.RESULT_SUCCESS):
+                yield rbytes
+
+            # Arrays are sent in order
+            for rbytes in protocol.UINT32.serialize(len(keys)):
+                yield rbytes
+            for key in keys:
+                for rbytes in protocol.Option(protocol.STRING).serialize(
+                    self._values.get(key, None)):
+                    yield rbytes
+
         def handle_set():
             '''Handle a "set" command'''
 
@@ -123,6 +182,19 @@ class FakeClient(object, client.AbstractClient, client.ClientMixin):
                 protocol.RESULT_SUCCESS):
                 yield rbytes
 
+        def handle_confirm():
+            '''Handle a "confirm" command'''
+
+            key = recv(protocol.STRING)
+            value = recv(protocol.STRING)
+
+            if self._values.get(key, None) != value:
+                self._values[key] = value
+
+            for rbytes in protocol.UINT32.serialize(
+                protocol.RESULT_SUCCESS):
+                yield rbytes
+
         def handle_delete():
             '''Handle a "delete" command'''
 
@@ -140,6 +212,23 @@ class FakeClient(object, client.AbstractClient, client.ClientMixin):
                     protocol.RESULT_SUCCESS):
                     yield rbytes
 
+        def handle_delete_prefix():
+            '''Handle a "delete_prefix" command'''
+
+            prefix = recv(protocol.STRING)
+
+            matches = [key for key in self._values.iterkeys()
+                if key.startswith(prefix)]
+
+            for key in matches:
+                del self._values[key]
+
+            for rbytes in protocol.UINT32.serialize(
+                protocol.RESULT_SUCCESS):
+                yield rbytes
+            for rbytes in protocol.UINT32.serialize(len(matches)):
+                yield rbytes
+
         def handle_prefix_keys():
             '''Handle a "prefix_keys" command'''
 
@@ -207,6 +296,117 @@ class FakeClient(object, client.AbstractClient, client.ClientMixin):
                 orig_value):
                 yield rbytes
 
+        def find_range():
+            '''Find the keys matching the arguments of a range command'''
+
+            _ = recv(protocol.BOOL)
+            begin_key = recv(protocol.Option(protocol.STRING))
+            begin_inclusive = recv(protocol.BOOL)
+            end_key = recv(protocol.Option(protocol.STRING))
+            end_inclusive = recv(protocol.BOOL)
+            max_elements = recv(protocol.INT32)
+
+            def match(key):
+                '''Check whether a key falls within the requested range'''
+
+                if begin_key is not None:
+                    if key < begin_key or \
+                        (key == begin_key and not begin_inclusive):
+                        return False
+
+                if end_key is not None:
+                    if key > end_key or (key == end_key and not end_inclusive):
+                        return False
+
+                return True
+
+            matches = sorted(key for key in self._values if match(key))
+
+            return matches if max_elements < 0 else matches[:max_elements]
+
+        def handle_range():
+            '''Handle a "range" command'''
+
+            matches = find_range()
+
+            for rbytes in protocol.UINT32.serialize(
+                protocol.RESULT_SUCCESS):
+                yield rbytes
+
+            # Lists are sent in reverse order
+            for rbytes in protocol.List(protocol.STRING).serialize(
+                reversed(matches)):
+                yield rbytes
+
+        def handle_range_entries():
+            '''Handle a "range_entries" command'''
+
+            matches = find_range()
+
+            for rbytes in protocol.UINT32.serialize(
+                protocol.RESULT_SUCCESS):
+                yield rbytes
+
+            # Lists are sent in reverse order
+            for rbytes in protocol.List(protocol.Product(
+                protocol.STRING, protocol.STRING)).serialize(
+                    (key, self._values[key]) for key in reversed(matches)):
+                yield rbytes
+
+
+        def handle_sequence():
+            '''Handle a "sequence" or "synced_sequence" command'''
+
+            data = recv(protocol.STRING)
+            read = StringIO.StringIO(data).read
+            step_recv = lambda type_: utils.read_blocking(type_.receive(), read)
+
+            values = dict(self._values)
+
+            def apply_step():
+                '''Apply a single sequence step to `values`'''
+
+                tag = step_recv(protocol.UINT32)
+
+                if tag == sequence.Set.TAG:
+                    key = step_recv(protocol.STRING)
+                    values[key] = step_recv(protocol.STRING)
+                elif tag == sequence.Delete.TAG:
+                    key = step_recv(protocol.STRING)
+                    if key not in values:
+                        raise errors.NotFound(key)
+                    del values[key]
+                elif tag == sequence.Assert.TAG:
+                    key = step_recv(protocol.STRING)
+                    value = step_recv(protocol.Option(protocol.STRING))
+                    if values.get(key) != value:
+                        raise errors.AssertionFailed(key)
+                elif tag == sequence.AssertExists.TAG:
+                    key = step_recv(protocol.STRING)
+                    if key not in values:
+                        raise errors.AssertionFailed(key)
+                elif tag == sequence.Sequence.TAG:
+                    for _ in xrange(step_recv(protocol.UINT32)):
+                        apply_step()
+                else:
+                    raise errors.UnknownFailure('Unknown step %d' % tag)
+
+            try:
+                apply_step()
+            except errors.ArakoonError as exc:
+                for rbytes in protocol.UINT32.serialize(exc.CODE):
+                    yield rbytes
+                for rbytes in protocol.STRING.serialize(str(exc)):
+                    yield rbytes
+
+                return
+
+            self._values = values
+
+            for rbytes in protocol.UINT32.serialize(
+                protocol.RESULT_SUCCESS):
+                yield rbytes
+
 
         handlers = {
             protocol.Hello.TAG: handle_hello,
@@ -214,20 +414,182 @@ class FakeClient(object, client.AbstractClient, client.ClientMixin):
             protocol.WhoMaster.TAG: handle_who_master,
             protocol.Get.TAG: handle_get,
             protocol.Set.TAG: handle_set,
+            protocol.Confirm.TAG: handle_confirm,
             protocol.Delete.TAG: handle_delete,
+            protocol.DeletePrefix.TAG: handle_delete_prefix,
             protocol.PrefixKeys.TAG: handle_prefix_keys,
             protocol.TestAndSet.TAG: handle_test_and_set,
+            protocol.Range.TAG: handle_range,
+            protocol.RangeEntries.TAG: handle_range_entries,
+            protocol.MultiGet.TAG: handle_multi_get,
+            protocol.MultiGetOption.TAG: handle_multi_get_option,
+            0x0010 | protocol.Message.MASK: handle_sequence,
+            0x0024 | protocol.Message.MASK: handle_sequence,
         }
 
         if command in handlers:
-            result = StringIO.StringIO(''.join(handlers[command]()))
+            return ''.join(handlers[command]())
         else:
-            result = StringIO.StringIO()
-            result.write(struct.pack('<I', errors.UnknownFailure.CODE))
-            result.write(struct.pack('<I', 0))
-            result.seek(0)
+            return struct.pack('<I', errors.UnknownFailure.CODE) + \
+                struct.pack('<I', 0)
 
-        return utils.read_blocking(message.receive(), result.read)
+
+class RecordingClient(FakeClient):
+    '''Fake client recording the messages it handles
+
+    :attr:`messages` holds all messages handled, in order, and :attr:`spread`
+    tells for every one of them whether it was handled as part of a
+    :meth:`~pyrakoon.client.AbstractClient._process_spread` call.
+    '''
+
+    def __init__(self):
+        super(RecordingClient, self).__init__()
+
+        self.messages = []
+        self.spread = []
+        self._spreading = False
+
+    def _process(self, message):
+        self.messages.append(message)
+        self.spread.append(self._spreading)
+
+        return super(RecordingClient, self)._process(message)
+
+    def _process_spread(self, messages, max_in_flight=None):
+        self._spreading = True
+
+        try:
+            for result in super(RecordingClient, self)._process_spread(
+                messages, max_in_flight):
+                yield result
+        finally:
+            self._spreading = False
+
+    def reset(self):
+        '''Forget all messages handled so far'''
+
+        del self.messages[:]
+        del self.spread[:]
+
+
+class FakeServer(object):
+    '''Fake Arakoon node, serving a :class:`FakeClient` over TCP
+
+    Every connection is handled by a separate thread. Requests are handled
+    one at a time, so all connections share the same consistent store.
+    '''
+
+    def __init__(self, cluster_id, store=None):
+        '''Create a fake server, listening on a random local port
+
+        :param cluster_id: Identifier of the cluster
+        :type cluster_id: :class:`str`
+        :param store: Store to serve, a new one by default
+        :type store: :class:`FakeClient`
+        '''
+
+        self.cluster_id = cluster_id
+        self.store = store or FakeClient()
+        self.connections = 0
+
+        self._prologue = protocol.build_prologue(cluster_id)
+        self._lock = threading.Lock()
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._socket.bind(('127.0.0.1', 0))
+        self._socket.listen(16)
+
+        self._thread = threading.Thread(target=self._serve)
+        self._thread.daemon = True
+        self._thread.start()
+
+    address = property(lambda self: self._socket.getsockname(),
+        doc='Address (host & port) the server listens on')
+
+    def _serve(self):
+        '''Accept connections until the server is stopped'''
+
+        while True:
+            try:
+                connection, _ = self._socket.accept()
+            except Exception: #pylint: disable=W0703
+                return
+
+            self.connections += 1
+
+            thread = threading.Thread(target=self._handle,
+                args=(connection, ))
+            thread.daemon = True
+            thread.start()
+
+    def _handle(self, connection):
+        '''Handle requests on a single connection'''
+
+        def recv(count):
+            '''Read exactly `count` bytes'''
+
+            parts = []
+
+            while count > 0:
+                data = connection.recv(count)
+                if not data:
+                    raise EOFError
+
+                parts.append(data)
+                count -= len(data)
+
+            return ''.join(parts)
+
+        try:
+            if recv(len(self._prologue)) != self._prologue:
+                return
+
+            while True:
+                command = recv(4)
+                data = []
+
+                def read(count):
+                    '''Read request bytes, after the command'''
+
+                    if data:
+                        return data.pop()
+
+                    return recv(count)
+
+                data.append(command)
+
+                self._lock.acquire()
+                try:
+                    response = self.store._handle(read) #pylint: disable=W0212
+                finally:
+                    self._lock.release()
+
+                connection.sendall(response)
+        except (EOFError, IOError):
+            pass
+        finally:
+            connection.close()
+
+    def connect(self):
+        '''Create a :class:`SocketClient` connected to the server
+
+        :return: Connected client, to be disconnected by the caller
+        :rtype: :class:`SocketClient`
+        '''
+
+        client_ = SocketClient(self.address, self.cluster_id)
+        client_.connect()
+
+        return client_
+
+    def stop(self):
+        '''Stop accepting connections'''
+
+        self._socket.close()
+
+
+class SocketClient(client.SocketClient, client.ClientMixin):
+    '''Socket client, e.g. to connect to a :class:`FakeServer`'''
 
 
 DEFAULT_CLIENT_PORT = 4932
@@ -0,0 +1,454 @@
+# This file is part of Pyrakoon, a distributed key-value store client.
+#
+# Copyright (C) 2014 Incubaid BVBA
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''Tracing of the phases of individual requests
+
+A :class:`Tracer` can be attached to a :class:`pyrakoon.client.SocketClient`
+or :class:`pyrakoon.tx.ArakoonProtocol` by setting their `tracer`
+attribute, or to a :class:`pyrakoon.compat.ArakoonClient` using its `tracer`
+argument. For every request :meth:`Tracer.sample` accepts, the transport
+creates a :class:`Trace` and invokes the hooks of the tracer as the request
+progresses:
+
+1. :meth:`Tracer.on_request_start` before the message is serialized
+2. :meth:`Tracer.on_sent` once the request was written to the socket
+3. :meth:`Tracer.on_first_byte` once the first bytes of the response were
+   received
+4. :meth:`Tracer.on_decoded` once the result was decoded, or
+   :meth:`Tracer.on_error` if the request failed
+
+The timestamps in a trace are taken from :func:`monotonic`, so the
+duration of every phase can be calculated (see :attr:`Trace.phases`):
+
+- *serialize*: encoding the message
+- *queue*: waiting for the connection lock (or outstanding requests)
+- *send*: writing the request to the socket
+- *server*: waiting for the first byte of the response
+- *decode*: receiving and decoding the response
+
+:class:`SlowestSampler` is a tracer keeping the slowest requests. Use
+:class:`CompositeTracer` to attach several tracers to a single transport.
+
+Example:
+
+    >>> sampler = SlowestSampler(size=2)
+    >>> client.tracer = sampler #doctest: +SKIP
+    >>> client.get('key') #doctest: +SKIP
+    >>> sampler.samples() #doctest: +SKIP
+    [<Trace Get 0.000812s serialize=0.000011 queue=0.000001 ...>]
+'''
+
+import time
+import heapq
+import threading
+
+PHASES = ('serialize', 'queue', 'send', 'server', 'decode')
+'''Names of the phases of a request, in order''' #pylint: disable=W0105
+
+
+def _get_monotonic():
+    '''Find the best available monotonic clock'''
+
+    if hasattr(time, 'monotonic'):
+        return time.monotonic #pylint: disable=E1101
+
+    try:
+        import ctypes
+        import ctypes.util
+    except ImportError:
+        return time.time
+
+    class Timespec(ctypes.Structure): #pylint: disable=R0903
+        '''`struct timespec`'''
+
+        _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+    clock_monotonic = 1
+
+    for name in ('c', 'rt'):
+        path = ctypes.util.find_library(name)
+        if not path:
+            continue
+
+        try:
+            clock_gettime = ctypes.CDLL(path, use_errno=True).clock_gettime
+        except (OSError, AttributeError):
+            continue
+
+        if clock_gettime(clock_monotonic, ctypes.byref(Timespec())) != 0:
+            continue
+
+        def monotonic_():
+            '''Read the monotonic clock'''
+
+            # The GIL is released during the call, so every call needs its
+            # own struct
+            timespec = Timespec()
+            clock_gettime(clock_monotonic, ctypes.byref(timespec))
+            return timespec.tv_sec + timespec.tv_nsec * 1e-9
+
+        return monotonic_
+
+    return time.time
+
+monotonic = _get_monotonic()
+'''Get the time of a monotonic clock, in seconds
+
+Falls back to :func:`time.time` if no monotonic clock is available.
+''' #pylint: disable=W0105
+
+
+class Tracer(object):
+    '''Base class of request tracers, ignoring all events
+
+    Hooks are invoked synchronously by the thread handling the request, so
+    they should be cheap. Exceptions raised by hooks are propagated to the
+    caller of the request.
+    '''
+
+    def sample(self, message): #pylint: disable=W0613,R0201
+        '''Decide whether to trace a request, before its trace is created
+
+        Requests which aren't sampled aren't traced at all, so they don't
+        incur any tracing overhead. All requests are traced by default.
+
+        :param message: Message about to be sent
+        :type message: :class:`pyrakoon.protocol.Message`
+
+        :rtype: :class:`bool`
+        '''
+
+        return True
+
+    def on_request_start(self, trace):
+        '''A request is about to be serialized and sent
+
+        :param trace: Trace of the request
+        :type trace: :class:`Trace`
+        '''
+
+    def on_sent(self, trace):
+        '''A request was sent
+
+        :param trace: Trace of the request
+        :type trace: :class:`Trace`
+        '''
+
+    def on_first_byte(self, trace):
+        '''The first bytes of a response were received
+
+        :param trace: Trace of the request
+        :type trace: :class:`Trace`
+        '''
+
+    def on_decoded(self, trace):
+        '''The response of a request was decoded
+
+        :param trace: Trace of the request
+        :type trace: :class:`Trace`
+        '''
+
+    def on_error(self, trace):
+        '''A request failed, see :attr:`Trace.error`
+
+        :param trace: Trace of the request
+        :type trace: :class:`Trace`
+        '''
+
+
+class Trace(object): #pylint: disable=R0902
+    '''Timestamps and byte counts of a single request
+
+    Timestamps which weren't reached (yet) are :data:`None`.
+    '''
+
+    __slots__ = ('tracer', 'message_type', 'message', 'node', 'start',
+        'serialized', 'acquired', 'sent', 'first_byte', 'end', 'bytes_sent',
+        'bytes_received', 'retries', 'master_lookups', 'error')
+
+    def __init__(self, tracer, message_type, node, message=None):
+        '''Start tracing a request, invoking :meth:`Tracer.on_request_start`
+
+        :param tracer: Tracer to notify
+        :type tracer: :class:`Tracer`
+        :param message_type: Type of the message sent
+        :type message_type: `type`
+        :param node: Node the request is sent to, if known
+        :type node: `object`
+        :param message: Message sent, if available
+        :type message: :class:`pyrakoon.protocol.Message`
+        '''
+
+        self.tracer = tracer
+        self.message_type = message_type
+        self.message = message
+        self.node = node
+        self.serialized = self.acquired = self.sent = None
+        self.first_byte = self.end = None
+        self.bytes_sent = self.bytes_received = 0
+        self.retries = self.master_lookups = 0
+        self.error = None
+
+        self.start = monotonic()
+        tracer.on_request_start(self)
+
+    def mark_serialized(self, size):
+        '''The message was serialized into `size` bytes'''
+
+        self.serialized = monotonic()
+        self.bytes_sent = size
+
+    def mark_acquired(self):
+        '''The connection was acquired'''
+
+        self.acquired = monotonic()
+
+    def mark_sent(self):
+        '''The request was sent, invoking :meth:`Tracer.on_sent`'''
+
+        self.sent = monotonic()
+        self.tracer.on_sent(self)
+
+    def mark_received(self, size):
+        '''`size` bytes of the response were received, invoking
+        :meth:`Tracer.on_first_byte` for the first ones'''
+
+        self.bytes_received += size
+
+        if self.first_byte is None:
+            self.first_byte = monotonic()
+            self.tracer.on_first_byte(self)
+
+    def mark_retry(self):
+        '''The request is about to be sent again, e.g. to a new master'''
+
+        self.retries += 1
+        self.first_byte = None
+        self.bytes_received = 0
+
+    def mark_master_lookup(self):
+        '''The master node has to be looked up before sending the request'''
+
+        self.master_lookups += 1
+
+    def mark_decoded(self):
+        '''The response was decoded, invoking :meth:`Tracer.on_decoded`'''
+
+        self.end = monotonic()
+        self.tracer.on_decoded(self)
+
+    def mark_failed(self, error):
+        '''The request failed, invoking :meth:`Tracer.on_error`'''
+
+        self.end = monotonic()
+        self.error = error
+        self.tracer.on_error(self)
+
+    def reader(self, read):
+        '''Wrap a blocking read function to record received bytes
+
+        :param read: Function reading a given number of bytes
+        :type read: `callable`
+
+        :return: Wrapped function
+        :rtype: `callable`
+        '''
+
+        def read_(count):
+            '''Read `count` bytes, recording them'''
+
+            data = read(count)
+            self.mark_received(len(data))
+
+            return data
+
+        return read_
+
+    def receiver(self, receive):
+        '''Wrap a result parser factory to record received bytes
+
+        This is used by transports which feed data to the parser coroutine
+        as it arrives, instead of reading it.
+
+        :param receive: Function creating a result parser coroutine, see
+            :meth:`pyrakoon.protocol.Message.receive`
+        :type receive: `callable`
+
+        :return: Wrapped function
+        :rtype: `callable`
+        '''
+
+        def receive_():
+            '''Create a result parser, recording the data it's fed'''
+
+            receiver = receive()
+            request = receiver.next()
+
+            while True:
+                data = yield request
+                self.mark_received(len(data))
+                request = receiver.send(data)
+
+        return receive_
+
+    @property
+    def duration(self):
+        '''Total duration of the request, in seconds, or :data:`None` if it
+        didn't finish yet'''
+
+        if self.end is None:
+            return None
+
+        return self.end - self.start
+
+    @property
+    def phases(self):
+        '''Duration of every phase reached, in seconds, see :data:`PHASES`
+
+        :type: `dict` of `str` to `float`
+        '''
+
+        points = (self.start, self.serialized, self.acquired, self.sent,
+            self.first_byte, self.end)
+        result = {}
+
+        for index, name in enumerate(PHASES):
+            begin, end = points[index], points[index + 1]
+
+            if begin is not None and end is not None:
+                result[name] = end - begin
+
+        return result
+
+    def __repr__(self):
+        phases = self.phases
+        duration = self.duration
+
+        return '<Trace %s %s%s%s>' % (self.message_type.__name__,
+            '%.6fs' % duration if duration is not None else 'pending',
+            ''.join(' %s=%.6f' % (name, phases[name])
+                for name in PHASES if name in phases),
+            ' error=%r' % self.error if self.error is not None else '')
+
+
+class SlowestSampler(Tracer):
+    '''Tracer keeping the traces of the slowest requests'''
+
+    def __init__(self, size=10):
+        '''
+        :param size: Number of traces to keep
+        :type size: :class:`int`
+        '''
+
+        super(SlowestSampler, self).__init__()
+
+        self._size = size
+        self._heap = []
+        self._lock = threading.Lock()
+
+    def _add(self, trace):
+        '''Keep a finished trace, if it's among the slowest'''
+
+        entry = (trace.duration, id(trace), trace)
+
+        self._lock.acquire()
+        try:
+            if len(self._heap) < self._size:
+                heapq.heappush(self._heap, entry)
+            elif entry[0] > self._heap[0][0]:
+                heapq.heapreplace(self._heap, entry)
+        finally:
+            self._lock.release()
+
+    on_decoded = _add
+    on_error = _add
+
+    def samples(self):
+        '''Get the slowest traces, slowest first
+
+        :rtype: `list` of :class:`Trace`
+        '''
+
+        self._lock.acquire()
+        try:
+            entries = list(self._heap)
+        finally:
+            self._lock.release()
+
+        return [trace for (_, _, trace) in sorted(entries, reverse=True)]
+
+    def reset(self):
+        '''Forget all traces'''
+
+        self._lock.acquire()
+        try:
+            self._heap = []
+        finally:
+            self._lock.release()
+
+
+class CompositeTracer(Tracer):
+    '''Tracer notifying several tracers, in order
+
+    A request is traced if any of the tracers samples it, and only the
+    tracers which sampled it are notified.
+    '''
+
+    def __init__(self, *tracers):
+        '''
+        :param tracers: Tracers to notify
+        :type tracers: `tuple` of :class:`Tracer`
+        '''
+
+        super(CompositeTracer, self).__init__()
+
+        self.tracers = tracers
+        self._local = threading.local()
+
+    def sample(self, message):
+        # The trace is created right after sampling, by the same thread
+        sampled = tuple(tracer for tracer in self.tracers
+            if tracer.sample(message))
+        self._local.sampled = sampled
+
+        return bool(sampled)
+
+    def on_request_start(self, trace):
+        sampled = getattr(self._local, 'sampled', None)
+        self._local.sampled = None
+
+        if sampled is not None and len(sampled) < len(self.tracers):
+            # Notify the tracers which sampled the request only
+            trace.tracer = CompositeTracer(*sampled)
+
+        for tracer in sampled if sampled is not None else self.tracers:
+            tracer.on_request_start(trace)
+
+    def on_sent(self, trace):
+        for tracer in self.tracers:
+            tracer.on_sent(trace)
+
+    def on_first_byte(self, trace):
+        for tracer in self.tracers:
+            tracer.on_first_byte(trace)
+
+    def on_decoded(self, trace):
+        for tracer in self.tracers:
+            tracer.on_decoded(trace)
+
+    def on_error(self, trace):
+        for tracer in self.tracers:
+            tracer.on_error(trace)
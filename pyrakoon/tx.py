@@ -20,13 +20,14 @@
 .. _Arakoon: http://www.arakoon.org
 '''
 
+import functools
 import collections
 
 from twisted.internet import defer, protocol as twisted_protocol
 from twisted.protocols import basic, stateful
 from twisted.python import log
 
-from pyrakoon import client, errors, protocol, utils
+from pyrakoon import client, errors, protocol, trace, utils
 
 #pylint: disable=R0904,C0103,R0901
 
@@ -70,6 +71,20 @@ class ArakoonProtocol(object,
     _INITIAL_REQUEST_SIZE = protocol.UINT32.PACKER.size
     connected = False
 
+    instrumentation = None
+    '''Instrumentation recording the outcome of every request
+
+    :type: :class:`pyrakoon.instrument.Instrumentation`
+    ''' #pylint: disable=W0105
+
+    tracer = None
+    '''Tracer notified of the progress of every request
+
+    Requests are considered sent once they're handed to the transport.
+
+    :type: :class:`pyrakoon.trace.Tracer`
+    ''' #pylint: disable=W0105
+
     def __init__(self, cluster_id):
         '''Initialize a new `ArakoonProtocol`
 
@@ -85,14 +100,67 @@ class ArakoonProtocol(object,
         self._cluster_id = cluster_id
 
     def _process(self, message):
+        process = self._processMessage
+        trace_ = None
+
+        tracer = self.tracer
+
+        if tracer is not None and tracer.sample(message):
+            trace_ = trace.Trace(tracer, type(message), None, message)
+            process = functools.partial(process, trace_=trace_)
+
+        instrumentation = self.instrumentation
+
+        if instrumentation is not None:
+            deferred = instrumentation.process_deferred(process, message)
+        else:
+            deferred = process(message)
+
+        if trace_ is not None:
+            def decoded(result):
+                '''Mark the request as decoded'''
+
+                trace_.mark_decoded()
+                return result
+
+            def failed(reason):
+                '''Mark the request as failed'''
+
+                trace_.mark_failed(reason.value)
+                return reason
+
+            deferred.addCallbacks(decoded, failed)
+
+        return deferred
+
+    def _processMessage(self, message, trace_=None, counts=None):
+        '''Send a message, returning a `Deferred` firing with its result'''
+
         if not self.connected:
             return defer.fail(
                 client.NotConnectedError('Protocol not connected'))
 
         deferred = defer.Deferred()
-        self._outstanding.append((message.receive, deferred))
+        receive = message.receive
+
+        if trace_ is not None:
+            receive = trace_.receiver(receive)
+
+        if counts is not None:
+            receive = counts.receiver(receive)
+
+        self._outstanding.append((receive, deferred))
 
         data = list(message.serialize())
+
+        if counts is not None:
+            counts.sent += sum(len(part) for part in data)
+
+        if trace_ is not None:
+            trace_.mark_serialized(sum(len(part) for part in data))
+            trace_.mark_acquired()
+            trace_.mark_sent()
+
         self.transport.writeSequence(data)
 
         return deferred
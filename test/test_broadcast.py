@@ -0,0 +1,129 @@
+# This file is part of Pyrakoon, a distributed key-value store client.
+#
+# Copyright (C) 2014 Incubaid BVBA
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''Tests for code in `pyrakoon.broadcast`'''
+
+import time
+import socket
+import unittest
+
+from pyrakoon import broadcast, compat, errors, protocol, test
+
+CLUSTER_ID = 'pyrakoon_test'
+
+def _unused_address():
+    '''Get a local address nobody listens on'''
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(('127.0.0.1', 0))
+    address = sock.getsockname()
+    sock.close()
+
+    return address
+
+
+class TestBroadcast(unittest.TestCase):
+    '''Test `broadcast` against `pyrakoon.test.FakeServer` nodes'''
+
+    def setUp(self):
+        self.servers = [test.FakeServer(CLUSTER_ID) for _ in xrange(2)]
+
+        # Accepts connections in its backlog, but never answers
+        self.silent = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.silent.bind(('127.0.0.1', 0))
+        self.silent.listen(4)
+
+        self.nodes = {
+            'node_0': self.servers[0].address,
+            'node_1': self.servers[1].address,
+        }
+
+    def tearDown(self):
+        for server in self.servers:
+            server.stop()
+
+        self.silent.close()
+
+    def test_message(self):
+        '''Test broadcasting a message'''
+
+        results = broadcast.broadcast(self.nodes, CLUSTER_ID,
+            protocol.WhoMaster())
+
+        self.assertEquals(results, {
+            'node_0': test.FakeClient.MASTER,
+            'node_1': test.FakeClient.MASTER,
+        })
+
+    def test_callable(self):
+        '''Test broadcasting a call on a client'''
+
+        self.servers[0].store.set('key', 'value_0')
+        self.servers[1].store.set('key', 'value_1')
+
+        results = broadcast.broadcast(self.nodes, CLUSTER_ID,
+            lambda client: client.get('key'))
+
+        self.assertEquals(results, {'node_0': 'value_0', 'node_1': 'value_1'})
+
+    def test_errors(self):
+        '''Test failures are reported per node'''
+
+        self.servers[0].store.set('key', 'value')
+
+        self.nodes['dead'] = _unused_address()
+
+        results = broadcast.broadcast(self.nodes, CLUSTER_ID,
+            lambda client: client.get('key'))
+
+        self.assertEquals(results['node_0'], 'value')
+        self.assert_(isinstance(results['node_1'], errors.NotFound))
+        self.assert_(isinstance(results['dead'], socket.error))
+
+    def test_timeout(self):
+        '''Test unresponsive nodes don't hold up the others'''
+
+        self.nodes['silent'] = self.silent.getsockname()
+
+        start = time.time()
+        results = broadcast.broadcast(self.nodes, CLUSTER_ID,
+            protocol.WhoMaster(), timeout=0.5)
+        elapsed = time.time() - start
+
+        self.assert_(elapsed < 2.0)
+        self.assertEquals(results['node_0'], test.FakeClient.MASTER)
+        self.assert_(isinstance(results['silent'], socket.timeout))
+
+    def test_invalid_call(self):
+        '''Test passing something which isn't a message or callable'''
+
+        self.assertRaises(TypeError, broadcast.broadcast, self.nodes,
+            CLUSTER_ID, 'who_master')
+
+    def test_compat(self):
+        '''Test broadcasting using the compatibility client'''
+
+        config = compat.ArakoonClientConfig(CLUSTER_ID, dict(
+            (name, ([host], port))
+            for (name, (host, port)) in self.nodes.iteritems()))
+        client = compat.ArakoonClient(config)
+
+        results = client.broadcast(lambda client: client.get('key'), 2.0)
+
+        self.assertEquals(set(results), set(self.nodes))
+
+        for result in results.itervalues():
+            self.assert_(isinstance(result, compat.ArakoonNotFound))
@@ -0,0 +1,203 @@
+# This file is part of Pyrakoon, a distributed key-value store client.
+#
+# Copyright (C) 2014 Incubaid BVBA
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''Tests for code in `pyrakoon.bulk`'''
+
+import os
+import socket
+import random
+import shutil
+import tempfile
+import unittest
+
+from pyrakoon import bulk, errors, test
+
+def make_records(count):
+    '''Generate `count` records, in random order'''
+
+    records = [('key_%05d' % i, 'value_%d' % i) for i in xrange(count)]
+    random.shuffle(records)
+
+    return records
+
+
+class FlakyClient(test.FakeClient):
+    '''Fake client failing a given call with a given error'''
+
+    def __init__(self, fail_at, error):
+        super(FlakyClient, self).__init__()
+
+        self.calls = 0
+        self.fail_at = fail_at
+        self.error = error
+
+    def _process(self, message):
+        self.calls += 1
+
+        if self.calls == self.fail_at:
+            raise self.error
+
+        return super(FlakyClient, self)._process(message)
+
+
+class TestBulkLoader(unittest.TestCase):
+    '''Test `BulkLoader` using `pyrakoon.test.FakeClient`'''
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='pyrakoon_test_bulk')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _check(self, client, count):
+        '''Check `client` contains exactly `count` generated records'''
+
+        self.assertEquals(len(list(client.iter_prefix('', 100))), count)
+
+        for i in xrange(count):
+            self.assertEquals(client.get('key_%05d' % i), 'value_%d' % i)
+
+    def test_load(self):
+        '''Test loading records in batches'''
+
+        client = test.FakeClient()
+        loader = bulk.BulkLoader(client, batch_count=50)
+
+        stats = loader.load(make_records(1000))
+
+        self.assertEquals(stats.records, 1000)
+        self.assertEquals(stats.batches, 20)
+        self.assertEquals(stats.retries, 0)
+        self._check(client, 1000)
+
+    def test_load_processes(self):
+        '''Test loading records using encoding worker processes'''
+
+        client = test.FakeClient()
+        loader = bulk.BulkLoader(client, batch_bytes=1024, processes=2)
+
+        stats = loader.load(make_records(500))
+
+        self.assertEquals(stats.records, 500)
+        self._check(client, 500)
+
+    def test_retry(self):
+        '''Test batches are resubmitted after a transient failure'''
+
+        client = FlakyClient(3, socket.error('Connection reset'))
+        loader = bulk.BulkLoader(client, batch_count=10, backoff=0)
+
+        stats = loader.load(make_records(100))
+
+        self.assertEquals(stats.retries, 1)
+        self.assertEquals(stats.batches, 10)
+        self._check(client, 100)
+
+    def test_redirect(self):
+        '''Test batches are resubmitted right away after a redirect'''
+
+        client = FlakyClient(3, errors.NotMaster('arakoon_1'))
+        redirects = []
+        client.redirect = lambda exc: redirects.append(exc) or True
+
+        loader = bulk.BulkLoader(client, batch_count=10, backoff=60)
+
+        stats = loader.load(make_records(100))
+
+        self.assertEquals(stats.retries, 1)
+        self.assertEquals([str(exc) for exc in redirects], ['arakoon_1'])
+        self._check(client, 100)
+
+    def test_rediscover(self):
+        '''Test the master is looked up again after master errors which
+        don't name the new master'''
+
+        client = FlakyClient(3, errors.NoLongerMaster(''))
+        lookups = []
+        client.redirect = lambda exc: False
+        client.rediscover = lambda: lookups.append(None) or True
+
+        loader = bulk.BulkLoader(client, batch_count=10, backoff=0)
+
+        stats = loader.load(make_records(100))
+
+        self.assertEquals(stats.retries, 1)
+        self.assertEquals(len(lookups), 1)
+        self._check(client, 100)
+
+    def test_resume(self):
+        '''Test resuming an interrupted load using a checkpoint'''
+
+        checkpoint = os.path.join(self.tmpdir, 'checkpoint')
+        records = make_records(100)
+
+        client = FlakyClient(4, errors.ReadOnly('Read-only'))
+        loader = bulk.BulkLoader(client, batch_count=10,
+            checkpoint=checkpoint, checkpoint_interval=0)
+
+        self.assertRaises(errors.ReadOnly, loader.load, records)
+        self.assertEquals(bulk.read_checkpoint(checkpoint), (30, 'key_00029'))
+
+        client2 = test.FakeClient()
+        loader = bulk.BulkLoader(client2, batch_count=10,
+            checkpoint=checkpoint)
+
+        stats = loader.load(records)
+
+        self.assertEquals(stats.skipped, 30)
+        self.assertEquals(stats.records, 100)
+        self.assertEquals(len(list(client2.iter_prefix('', 100))), 70)
+        self.assertEquals(bulk.read_checkpoint(checkpoint), (100, 'key_00099'))
+
+
+class TestMasterClient(unittest.TestCase):
+    '''Test `MasterClient` following master changes'''
+
+    def setUp(self):
+        self.store = test.FakeClient()
+        self.store.MASTER = 'arakoon_0'
+        self.servers = [test.FakeServer('pyrakoon_test', self.store)
+            for _ in xrange(2)]
+        self.nodes = dict(('arakoon_%d' % i, ([server.address[0]],
+            server.address[1])) for (i, server) in enumerate(self.servers))
+
+    def tearDown(self):
+        for server in self.servers:
+            server.stop()
+
+    def test_master_changes(self):
+        '''Test switching to a new master'''
+
+        client = bulk.connect_master('pyrakoon_test', self.nodes)
+
+        try:
+            client.set('key', 'value')
+            self.assertEquals(client._address[1], self.servers[0].address[1])
+
+            self.failIf(client.rediscover())
+            self.store.MASTER = 'arakoon_1'
+            self.assert_(client.rediscover())
+            self.failIf(client.connected)
+
+            client.connect()
+            self.assertEquals(client.get('key'), 'value')
+            self.assertEquals(client._address[1], self.servers[1].address[1])
+
+            self.failIf(client.redirect(errors.NotMaster('arakoon_1')))
+            self.failIf(client.redirect(errors.NotMaster('None')))
+            self.assert_(client.redirect(errors.NotMaster('arakoon_0')))
+        finally:
+            client._disconnect()
@@ -0,0 +1,190 @@
+# This file is part of Pyrakoon, a distributed key-value store client.
+#
+# Copyright (C) 2014 Incubaid BVBA
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''Tests for code in `pyrakoon.cache`'''
+
+import time
+import unittest
+
+from pyrakoon import cache, errors, protocol, sequence, test
+
+class TestReadCache(unittest.TestCase):
+    '''Tests for `ReadCache`'''
+
+    def test_lru(self):
+        '''Test the least recently used entries are evicted'''
+
+        cache_ = cache.ReadCache(max_entries=2)
+
+        cache_.put('a', '1')
+        cache_.put('b', '2')
+        self.assertEquals(cache_.get('a'), (True, '1'))
+        cache_.put('c', None)
+
+        self.assertEquals(cache_.get('b'), (False, None))
+        self.assertEquals(cache_.get('a'), (True, '1'))
+        self.assertEquals(cache_.get('c'), (True, None))
+        self.assertEquals(cache_.statistics['evictions'], 1)
+        self.assertEquals(cache_.statistics['negative_hits'], 1)
+
+    def test_bytes(self):
+        '''Test the size of entries is bounded'''
+
+        cache_ = cache.ReadCache(max_bytes=2 * cache.ENTRY_OVERHEAD + 20)
+
+        cache_.put('a', 'x' * 100)
+        self.assertEquals(len(cache_), 0)
+
+        cache_.put('a', 'x' * 9)
+        cache_.put('b', 'x' * 9)
+        cache_.put('c', 'x')
+
+        self.assertEquals(cache_.get('a'), (False, None))
+        self.assertEquals(cache_.statistics['bytes'],
+            2 * cache.ENTRY_OVERHEAD + 12)
+
+        cache_.discard_prefix('')
+        self.assertEquals(cache_.statistics['bytes'], 0)
+
+    def test_ttl(self):
+        '''Test entries expire, negative ones after their own TTL'''
+
+        cache_ = cache.ReadCache(ttl=60, negative_ttl=0.01)
+
+        cache_.put('a', '1')
+        cache_.put('b', None)
+        time.sleep(0.02)
+
+        self.assertEquals(cache_.get('a'), (True, '1'))
+        self.assertEquals(cache_.get('b'), (False, None))
+        self.assertEquals(cache_.statistics['expirations'], 1)
+
+    def test_epoch(self):
+        '''Test values read before an invalidation are dropped'''
+
+        cache_ = cache.ReadCache()
+
+        epoch = cache_.epoch
+        cache_.discard('other')
+        cache_.put('a', '1', epoch)
+
+        self.assertEquals(cache_.get('a'), (False, None))
+
+
+class TestCachingClient(unittest.TestCase):
+    '''Tests for `CachingClient`'''
+
+    def setUp(self):
+        self.server = test.RecordingClient()
+
+        for i in xrange(5):
+            self.server.set('key_%d' % i, 'value_%d' % i)
+
+        self.server.reset()
+
+        self.client = cache.CachingClient(self.server, cache.ReadCache(ttl=60))
+
+    def _sent(self):
+        '''Get and forget the types of the messages sent to the server'''
+
+        result = [type(message) for message in self.server.messages]
+        self.server.reset()
+
+        return result
+
+    def test_get(self):
+        '''Test dirty reads are cached, consistent reads aren't'''
+
+        for _ in xrange(3):
+            self.assertEquals(self.client.get('key_1', allow_dirty=True),
+                'value_1')
+            self.assertRaises(errors.NotFound, self.client.get, 'nokey',
+                allow_dirty=True)
+            self.assertEquals(self.client.exists('key_1', allow_dirty=True),
+                True)
+
+        self.assertEquals(self._sent(), [protocol.Get, protocol.Get])
+
+        self.assertEquals(self.client.get('key_1'), 'value_1')
+        self.assertEquals(self._sent(), [protocol.Get])
+
+    def test_multi_get(self):
+        '''Test only keys which aren't cached are fetched'''
+
+        self.client.get('key_1', allow_dirty=True)
+        self.client.exists('nokey', allow_dirty=True)
+        self._sent()
+
+        self.assertEquals(self.client.multi_get(['key_1', 'key_2'],
+            allow_dirty=True), ['value_1', 'value_2'])
+        self.assertEquals(self.server.messages[0].keys, ['key_2'])
+        self._sent()
+
+        self.assertEquals(self.client.multi_get_option(
+            ['key_2', 'nokey', 'key_3'], allow_dirty=True),
+            ['value_2', None, 'value_3'])
+        self.assertEquals(self.server.messages[0].keys, ['key_3'])
+        self._sent()
+
+        self.assertRaises(errors.NotFound, self.client.multi_get,
+            ['key_1', 'nokey'], allow_dirty=True)
+        self.assertEquals(self._sent(), [])
+
+    def test_invalidation(self):
+        '''Test writes invalidate the keys they modify'''
+
+        def read(*keys):
+            '''Read keys, returning their (cached) values'''
+
+            return self.client.multi_get_option(list(keys), allow_dirty=True)
+
+        read('key_0', 'key_1', 'key_2', 'key_3')
+
+        self.client.set('key_0', 'new')
+        self.client.sequence([sequence.Delete('key_1'),
+            sequence.Sequence([sequence.Set('key_2', 'new')])])
+
+        self.assertEquals(read('key_0', 'key_1', 'key_2', 'key_3'),
+            ['new', None, 'new', 'value_3'])
+        self.assertEquals(self.server.messages[-1].keys,
+            ['key_0', 'key_1', 'key_2'])
+
+        self.client.delete_prefix('key_')
+        self.assertEquals(read('key_3', 'key_4'), [None, None])
+        self.assertEquals(self.server.messages[-1].keys, ['key_3', 'key_4'])
+
+    def test_pipelined(self):
+        '''Test pipelined cached reads are served in order'''
+
+        self.client.get('key_1', allow_dirty=True)
+        self._sent()
+
+        messages = [
+            protocol.Get(True, 'key_1'),
+            protocol.Get(True, 'key_2'),
+            protocol.Set('key_1', 'new'),
+            protocol.Exists(True, 'key_1'),
+        ]
+
+        self.assertEquals(list(self.client._process_spread(messages)),
+            ['value_1', 'value_2', None, True])
+        self.assertEquals(self._sent(),
+            [protocol.Get, protocol.Set, protocol.Exists])
+
+        self.assertEquals(self.client.get('key_2', allow_dirty=True),
+            'value_2')
+        self.assertEquals(self.client.get('key_1', allow_dirty=True), 'new')
+        self.assertEquals(self._sent(), [protocol.Get])
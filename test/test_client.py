@@ -16,7 +16,9 @@
 
 '''Tests for code in `pyrakoon.client`'''
 
+import socket
 import unittest
+import threading
 
 try:
     import cStringIO as StringIO
@@ -160,3 +162,194 @@ class TestScenario(unittest.TestCase):
             'value2')
 
         self.assertFalse(client_.exists('taskey'))
+
+
+class TestIterPrefix(unittest.TestCase):
+    '''Test paged iteration using `pyrakoon.test.FakeClient`'''
+
+    def setUp(self):
+        self.client = test.FakeClient()
+
+        for i in xrange(25):
+            self.client.set('key_%02d' % i, 'value_%d' % i)
+
+        self.client.set('kez', 'other')
+        self.client.set('key', 'exact')
+
+    def test_iter_prefix(self):
+        '''Test `iter_prefix` returns all matching keys, in order'''
+
+        for page_size in (1, 7, 26, 100):
+            keys = list(self.client.iter_prefix('key_', page_size))
+            self.assertEquals(keys, ['key_%02d' % i for i in xrange(25)])
+
+    def test_iter_prefix_with_values(self):
+        '''Test `iter_prefix` with `with_values` set'''
+
+        entries = list(self.client.iter_prefix('key', 4, with_values=True))
+
+        self.assertEquals(entries[0], ('key', 'exact'))
+        self.assertEquals(entries[1:],
+            [('key_%02d' % i, 'value_%d' % i) for i in xrange(25)])
+
+    def test_iter_range(self):
+        '''Test `iter_range` honours the range boundaries'''
+
+        keys = list(self.client.iter_range('key_05', False, 'key_10', True, 2))
+        self.assertEquals(keys, ['key_%02d' % i for i in xrange(6, 11)])
+
+    def test_invalid_page_size(self):
+        '''Test `iter_prefix` with an invalid page size'''
+
+        self.assertRaises(ValueError, list, self.client.iter_prefix('key', 0))
+
+
+class TestMultiGetChunking(unittest.TestCase):
+    '''Test chunking of `multi_get` and `multi_get_option` calls'''
+
+    def setUp(self):
+        self.client = test.FakeClient()
+        self.client.MULTI_GET_CHUNK_KEYS = 7
+        self.client.MULTI_GET_CHUNK_BYTES = 100
+
+        for i in xrange(50):
+            self.client.set('key_%02d' % i, 'value_%d' % i)
+
+        self.messages = []
+        process = self.client._process
+
+        def counting_process(message):
+            '''Record all processed messages'''
+
+            self.messages.append(message)
+            return process(message)
+
+        self.client._process = counting_process
+
+    def test_multi_get(self):
+        '''Test chunked `multi_get` calls return values in order'''
+
+        keys = ['key_%02d' % i for i in xrange(49, -1, -2)]
+
+        for allow_dirty in (False, True):
+            del self.messages[:]
+
+            self.assertEquals(self.client.multi_get(keys, allow_dirty),
+                ['value_%d' % i for i in xrange(49, -1, -2)])
+            self.assertEquals([len(message.keys)
+                for message in self.messages], [7, 7, 7, 4])
+
+        self.assertRaises(errors.NotFound, self.client.multi_get,
+            keys + ['key_50'])
+
+    def test_multi_get_option(self):
+        '''Test chunked `multi_get_option` calls return values in order'''
+
+        keys = ['key_%02d' % i for i in xrange(0, 60, 3)]
+
+        self.assertEquals(self.client.multi_get_option(keys),
+            ['value_%d' % i if i < 50 else None for i in xrange(0, 60, 3)])
+        self.assertEquals(len(self.messages), 3)
+
+    def test_chunk_bytes(self):
+        '''Test chunks are bounded by the size of their keys'''
+
+        self.client.MULTI_GET_CHUNK_BYTES = 25
+
+        self.assertEquals(self.client.multi_get(['key_00', 'key_01', 'key_02']),
+            ['value_0', 'value_1', 'value_2'])
+        self.assertEquals([len(message.keys) for message in self.messages],
+            [2, 1])
+
+    def test_small(self):
+        '''Test small calls use a single message'''
+
+        self.assertEquals(self.client.multi_get([]), [])
+        self.assertEquals(self.client.multi_get(['key_01']), ['value_1'])
+        self.assertEquals(len(self.messages), 2)
+
+
+class TestPipelining(unittest.TestCase):
+    '''Test `SocketClient._process_pipelined` against a fake server'''
+
+    class Client(client.SocketClient, client.ClientMixin):
+        '''A socket client'''
+
+    def setUp(self):
+        self.server = test.FakeClient()
+        client_socket, server_socket = socket.socketpair()
+
+        def recv(count):
+            '''Read exactly `count` bytes from the server socket'''
+
+            data = ''
+            while len(data) < count:
+                part = server_socket.recv(count - len(data))
+                if not part:
+                    raise EOFError
+                data += part
+            return data
+
+        def serve():
+            '''Handle requests until the connection is closed'''
+
+            try:
+                while True:
+                    server_socket.sendall(self.server._handle(recv))
+            except EOFError:
+                pass
+            finally:
+                server_socket.close()
+
+        self.thread = threading.Thread(target=serve)
+        self.thread.daemon = True
+        self.thread.start()
+
+        self.client = self.Client(None, 'pyrakoon_test')
+        self.client._socket = client_socket
+
+    def tearDown(self):
+        self.client._socket.close()
+        self.thread.join()
+
+    def test_pipelined(self):
+        '''Test results of pipelined messages are returned in order'''
+
+        sets = (protocol.Set('key_%d' % i, 'value_%d' % i)
+            for i in xrange(20))
+        self.assertEquals(list(self.client._process_pipelined(sets, 3)),
+            [None] * 20)
+
+        gets = [protocol.Get(False, 'key_%d' % i) for i in xrange(20)]
+        self.assertEquals(list(self.client._process_pipelined(gets)),
+            ['value_%d' % i for i in xrange(20)])
+
+    def test_pipelined_error(self):
+        '''Test the connection remains usable after an error'''
+
+        self.client.set('key', 'value')
+
+        gets = [protocol.Get(False, key) for key in ('key', 'nokey', 'key')]
+        results = self.client._process_pipelined(gets, 2)
+
+        self.assertEquals(results.next(), 'value')
+        self.assertRaises(errors.NotFound, results.next)
+
+        self.assert_(self.client.connected)
+        self.assertEquals(self.client.get('key'), 'value')
+
+    def test_multi_get_pipelined(self):
+        '''Test chunked `multi_get` calls are pipelined'''
+
+        self.client.MULTI_GET_CHUNK_KEYS = 3
+
+        for i in xrange(10):
+            self.client.set('key_%d' % i, 'value_%d' % i)
+
+        keys = ['key_%d' % i for i in xrange(10)]
+        self.assertEquals(self.client.multi_get(keys),
+            ['value_%d' % i for i in xrange(10)])
+        self.assertRaises(errors.NotFound, self.client.multi_get,
+            keys + ['key_10'])
+        self.assertEquals(self.client.multi_get_option(['key_10'] + keys),
+            [None] + ['value_%d' % i for i in xrange(10)])
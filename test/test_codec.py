@@ -0,0 +1,116 @@
+# This file is part of Pyrakoon, a distributed key-value store client.
+#
+# Copyright (C) 2014 Incubaid BVBA
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''Tests for code in `pyrakoon.codec`'''
+
+import os
+import unittest
+
+from pyrakoon import codec, sequence, test
+
+LARGE = '{"name": "value", "items": [1, 2, 3]}' * 50
+
+class TestValueCodec(unittest.TestCase):
+    '''Test `ValueCodec`'''
+
+    def setUp(self):
+        self.codec = codec.ValueCodec(threshold=64)
+
+    def test_roundtrip(self):
+        '''Test values are restored after encoding'''
+
+        for value in ('', 'small', LARGE, os.urandom(1024),
+            codec.MAGIC, codec.MAGIC + LARGE):
+            encoded = self.codec.encode(value)
+            self.assertEquals(self.codec.decode(encoded), value)
+
+    def test_compression(self):
+        '''Test large values are compressed, small ones aren't'''
+
+        self.assert_(len(self.codec.encode(LARGE)) < len(LARGE) / 5)
+        self.assertEquals(self.codec.encode('small'), 'small')
+
+        # Incompressible data is stored as-is
+        data = os.urandom(1024)
+        self.assertEquals(self.codec.encode(data), data)
+
+        stats = self.codec.statistics['zlib']
+        self.assertEquals(stats.encoded, 1)
+        self.assertEquals(stats.skipped, 1)
+        self.assert_(stats.ratio > 5)
+
+    def test_legacy(self):
+        '''Test values without a valid header are returned unchanged'''
+
+        for value in ('', 'plain', LARGE, codec.MAGIC,
+            codec.MAGIC + '\x01\x00\x00\x00\x00garbage'):
+            self.assertEquals(self.codec.decode(value), value)
+
+
+class TestCodecClient(unittest.TestCase):
+    '''Test `CodecClient` wrapping a `pyrakoon.test.FakeClient`'''
+
+    def setUp(self):
+        self.inner = test.FakeClient()
+        self.client = codec.CodecClient(self.inner,
+            codec.ValueCodec(threshold=64))
+
+    def test_set_get(self):
+        '''Test `set` and `get`'''
+
+        self.client.set('key', LARGE)
+        self.assert_(len(self.inner.get('key')) < len(LARGE))
+        self.assertEquals(self.client.get('key'), LARGE)
+
+        self.inner.set('legacy', LARGE)
+        self.assertEquals(self.client.get('legacy'), LARGE)
+
+    def test_reads(self):
+        '''Test decoding of `multi_get` and range results'''
+
+        for i in xrange(5):
+            self.client.set('key_%d' % i, LARGE + str(i))
+
+        self.assertEquals(self.client.multi_get(['key_3', 'key_1']),
+            [LARGE + '3', LARGE + '1'])
+        self.assertEquals(self.client.multi_get_option(['key_0', 'key_9']),
+            [LARGE + '0', None])
+        self.assertEquals(
+            self.client.range_entries('key_1', True, 'key_3', True),
+            [('key_%d' % i, LARGE + str(i)) for i in xrange(1, 4)])
+
+        self.client.MULTI_GET_CHUNK_KEYS = 2
+        self.assertEquals(
+            self.client.multi_get(['key_%d' % i for i in xrange(5)]),
+            [LARGE + str(i) for i in xrange(5)])
+
+    def test_test_and_set(self):
+        '''Test `test_and_set` encodes test and set values'''
+
+        self.assertEquals(self.client.test_and_set('key', None, LARGE), None)
+        self.assertEquals(self.client.test_and_set('key', LARGE, LARGE + 'x'),
+            LARGE)
+        self.assertEquals(self.client.get('key'), LARGE + 'x')
+
+    def test_sequence(self):
+        '''Test values in sequence steps are encoded'''
+
+        self.client.sequence([sequence.Set('a', LARGE),
+            sequence.Sequence([sequence.Set('b', LARGE + 'b')])])
+
+        self.assert_(len(self.inner.get('b')) < len(LARGE))
+        self.assertEquals(self.client.get('a'), LARGE)
+        self.assertEquals(self.client.get('b'), LARGE + 'b')
@@ -18,11 +18,14 @@
 
 import time
 import logging
+import threading
 import unittest
+import StringIO
 
 import nose
 
-from pyrakoon import compat, sequence, test
+from pyrakoon import compat, errors, instrument, metrics, protocol, \
+    ratelimit, retry, routing, scatter, sequence, test, trace
 
 LOGGER = logging.getLogger(__name__)
 
@@ -51,6 +54,915 @@ class TestArgumentChecks(unittest.TestCase):
         self.assertRaises(compat.ArakoonInvalidArguments, client.hello, 123)
 
 
+
+class FakeConnection(object):
+    '''Fake node connection, backed by a `pyrakoon.test.FakeClient`'''
+
+    def __init__(self, server, broken=False):
+        self.server = server
+        self.broken = broken
+        self.requests = 0
+        self.buffer = ''
+
+    def send(self, data):
+        '''Handle a request'''
+
+        self.requests += 1
+        self.buffer += self.server._handle(StringIO.StringIO(data).read)
+
+    def read(self, count):
+        '''Read part of the pending responses'''
+
+        if self.broken:
+            raise compat.ArakoonSockReadNoBytes
+
+        data, self.buffer = self.buffer[:count], self.buffer[count:]
+        return data
+
+    def close(self):
+        '''Close the connection'''
+
+        self.buffer = ''
+
+
+class TestPipeline(unittest.TestCase):
+    '''Test pipelining and spreading of messages over nodes'''
+
+    def setUp(self):
+        self.server = test.FakeClient()
+
+        for i in xrange(20):
+            self.server.set('key_%02d' % i, 'value_%d' % i)
+
+        config = compat.ArakoonClientConfig('test', {
+            'node_0': (['127.0.0.1'], 4000),
+            'node_1': (['127.0.0.1'], 4001),
+        })
+
+        self.client = compat._ArakoonClient(config)
+        self.client._connections = {
+            'node_0': FakeConnection(self.server),
+            'node_1': FakeConnection(self.server),
+        }
+
+        def determine_master():
+            '''Fake master lookup'''
+
+            self.client.master_id = 'node_0'
+
+        self.client.determine_master = determine_master
+
+    def _messages(self, count):
+        '''Generate `get` messages for the first `count` keys'''
+
+        return [protocol.Get(False, 'key_%02d' % i) for i in xrange(count)]
+
+    def test_pipelined(self):
+        '''Test pipelined messages are sent to the master'''
+
+        self.assertEquals(
+            list(self.client._process_pipelined(self._messages(10), 3)),
+            ['value_%d' % i for i in xrange(10)])
+        self.assertEquals(self.client._connections['node_0'].requests, 10)
+        self.assertEquals(self.client._connections['node_1'].requests, 0)
+
+    def test_rate_limited(self):
+        '''Test pipelined messages are submitted within the limit'''
+
+        limiter = ratelimit.RateLimiter(
+            adaptive=ratelimit.AdaptiveLimit(initial=2))
+        self.client._limiter = limiter
+
+        self.assertEquals(
+            list(self.client._process_pipelined(self._messages(10), 3)),
+            ['value_%d' % i for i in xrange(10)])
+        self.assertEquals(self.client._process(protocol.Get(False, 'key_01')),
+            'value_1')
+        self.assertEquals(limiter.statistics['requests'], 11)
+        self.assertEquals(limiter.in_flight, 0)
+
+    def test_instrumented(self):
+        '''Test requests are recorded by the instrumentation'''
+
+        instrumentation = instrument.Instrumentation()
+        self.client._instrumentation = instrumentation
+
+        self.assertEquals(self.client.get('key_01'), 'value_1')
+        self.assertRaises(errors.NotFound, self.client.get, 'nokey')
+        self.assertEquals(self.client.exists('key_01'), True)
+
+        stats = instrumentation.snapshot()
+        self.assertEquals(stats[protocol.Get.TAG].requests, 2)
+        self.assertEquals(stats[protocol.Get.TAG].errors, {'NotFound': 1})
+        self.assertEquals(stats[protocol.Exists.TAG].requests, 1)
+
+    def test_traced(self):
+        '''Test requests are traced'''
+
+        sampler = trace.SlowestSampler()
+        self.client._tracer = sampler
+
+        self.assertEquals(self.client.get('key_01'), 'value_1')
+        self.assertRaises(errors.NotFound, self.client.get, 'nokey')
+
+        samples = sampler.samples()
+        self.assertEquals(len(samples), 2)
+        self.assertEquals(set(type(sample.error) for sample in samples),
+            set([type(None), errors.NotFound]))
+
+        self.assertEquals(
+            sorted(sample.master_lookups for sample in samples), [0, 1])
+
+        for sample in samples:
+            self.assertEquals(sample.node, 'node_0')
+            self.assertEquals(sorted(sample.phases), sorted(trace.PHASES))
+
+    def test_spread(self):
+        '''Test spread messages are sent to all nodes'''
+
+        self.assertEquals(
+            list(self.client._process_spread(self._messages(10), 2)),
+            ['value_%d' % i for i in xrange(10)])
+        self.assertEquals(self.client._connections['node_0'].requests, 5)
+        self.assertEquals(self.client._connections['node_1'].requests, 5)
+
+    def test_spread_failure(self):
+        '''Test messages to a failing node are resubmitted to the master'''
+
+        self.client._connections['node_1'].broken = True
+
+        self.assertEquals(
+            list(self.client._process_spread(self._messages(10), 2)),
+            ['value_%d' % i for i in xrange(10)])
+        self.assertEquals(self.client._connections['node_0'].buffer, '')
+
+    def test_error(self):
+        '''Test outstanding results are read when a message fails'''
+
+        messages = self._messages(10)
+        messages.insert(3, protocol.Get(False, 'nokey'))
+
+        self.assertRaises(errors.NotFound, list,
+            self.client._process_spread(messages, 2))
+
+        for connection in self.client._connections.itervalues():
+            self.assertEquals(connection.buffer, '')
+
+
+class TestRouting(unittest.TestCase):
+    '''Test routing of dirty reads'''
+
+    def setUp(self):
+        self.server = test.FakeClient()
+
+        for i in xrange(20):
+            self.server.set('key_%02d' % i, 'value_%d' % i)
+
+        nodes = ['node_0', 'node_1', 'node_2']
+        config = compat.ArakoonClientConfig('test', dict(
+            (node, (['127.0.0.1'], 4000 + i)) for (i, node) in enumerate(nodes)))
+
+        self.router = routing.RendezvousRouter()
+        self.client = compat._ArakoonClient(config, router=self.router)
+        self.client.master_id = 'node_0'
+        self.client._connections = dict(
+            (node, FakeConnection(self.server)) for node in nodes)
+
+        self.preferred = dict(('key_%02d' % i, self.router.candidates(
+            protocol.Get(True, 'key_%02d' % i), nodes, 'node_0')[0])
+            for i in xrange(20))
+
+    def _requests(self):
+        '''Get the number of requests handled by every node'''
+
+        return dict((node, connection.requests)
+            for (node, connection) in self.client._connections.iteritems())
+
+    def test_affinity(self):
+        '''Test dirty reads of a key go to the same slave'''
+
+        for _ in xrange(2):
+            for i in xrange(20):
+                self.assertEquals(
+                    self.client.get('key_%02d' % i, allow_dirty=True),
+                    'value_%d' % i)
+
+        expected = {'node_0': 0, 'node_1': 0, 'node_2': 0}
+        for node in self.preferred.itervalues():
+            expected[node] += 2
+
+        self.assertEquals(self._requests(), expected)
+        self.assert_(expected['node_1'] and expected['node_2'])
+
+        self.client.get('key_00')
+        self.assertEquals(self._requests()['node_0'], 1)
+
+    def test_failure(self):
+        '''Test reads fall back to the next node when a node fails'''
+
+        self.client._connections['node_1'].broken = True
+
+        for i in xrange(20):
+            self.assertEquals(
+                self.client.get('key_%02d' % i, allow_dirty=True),
+                'value_%d' % i)
+
+        self.assertEquals(self.client._connections['node_0'].requests, 0)
+        self.assertEquals(self.client._connections['node_2'].requests, 20)
+
+    def test_overloaded(self):
+        '''Test reads fall back to the next node when a node refuses them'''
+
+        self.client._connections['node_1'] = ErrorConnection(
+            errors.GoingDown('Going down'))
+
+        for i in xrange(20):
+            self.assertEquals(
+                self.client.get('key_%02d' % i, allow_dirty=True),
+                'value_%d' % i)
+
+        self.assertEquals(self.client._connections['node_0'].requests, 0)
+        self.assertEquals(self.client._connections['node_2'].requests, 20)
+        self.failIf('node_1' in self.client._connections)
+
+    def test_instrumented(self):
+        '''Test instrumented reads are routed on their key'''
+
+        self.client._instrumentation = instrument.Instrumentation()
+
+        prefixes = ['key_%d' % i for i in xrange(2)]
+        nodes = set(self.router.candidates(
+            protocol.PrefixKeys(True, prefix, -1), ['node_0', 'node_1',
+                'node_2'], 'node_0')[0]
+            for prefix in prefixes)
+        self.assertEquals(len(nodes), 2)
+
+        for prefix in prefixes:
+            self.client.prefix(prefix, allow_dirty=True)
+
+        requests = self._requests()
+        self.assertEquals(set(node for node in requests if requests[node]),
+            nodes)
+
+    def test_spread(self):
+        '''Test spread messages are routed, avoiding overloaded nodes'''
+
+        messages = [protocol.Get(True, 'key_%02d' % i) for i in xrange(20)]
+
+        self.assertEquals(list(self.client._process_spread(messages)),
+            ['value_%d' % i for i in xrange(20)])
+
+        expected = {'node_0': 0, 'node_1': 0, 'node_2': 0}
+        for node in self.preferred.itervalues():
+            expected[node] += 1
+
+        self.assertEquals(self._requests(), expected)
+
+        for connection in self.client._connections.itervalues():
+            connection.requests = 0
+
+        self.assertEquals(list(self.client._process_spread(messages[:3], 1)),
+            ['value_0', 'value_1', 'value_2'])
+        self.assertEquals(sorted(self._requests().values()), [1, 1, 1])
+
+
+class DelayedConnection(FakeConnection):
+    '''Fake node connection taking some time to answer'''
+
+    def __init__(self, server, delay):
+        super(DelayedConnection, self).__init__(server)
+
+        self.delay = delay
+
+    def read(self, count):
+        time.sleep(self.delay)
+        self.delay = 0
+
+        return super(DelayedConnection, self).read(count)
+
+
+class TestScatter(unittest.TestCase):
+    '''Test scattering of multi-gets over nodes'''
+
+    def setUp(self):
+        self.server = test.FakeClient()
+
+        for i in xrange(30):
+            self.server.set('key_%02d' % i, 'value_%d' % i)
+
+        nodes = ['node_0', 'node_1', 'node_2']
+        config = compat.ArakoonClientConfig('test', dict(
+            (node, (['127.0.0.1'], 4000 + i)) for (i, node) in enumerate(nodes)))
+
+        self.scatter = scatter.Scatter(min_keys=10)
+        self.client = compat._ArakoonClient(config, scatter=self.scatter)
+        self.client.master_id = 'node_0'
+        self.client._connections = dict(
+            (node, FakeConnection(self.server)) for node in nodes)
+
+        self.keys = ['key_%02d' % i for i in xrange(30)]
+
+    def test_scatter(self):
+        '''Test keys are looked up by all nodes, and merged in order'''
+
+        self.assertEquals(self.client.multi_get(self.keys, allow_dirty=True),
+            ['value_%d' % i for i in xrange(30)])
+        self.assertEquals(self.client.multi_get_option(
+            self.keys[:10] + ['nokey'], allow_dirty=True),
+            ['value_%d' % i for i in xrange(10)] + [None])
+
+        for connection in self.client._connections.itervalues():
+            self.assertEquals(connection.requests, 2)
+
+        self.assertEquals(sorted(self.scatter.latencies),
+            ['node_0', 'node_1', 'node_2'])
+
+    def test_slow_node(self):
+        '''Test a slow node doesn't slow down the measurements of nodes
+        whose results are read later'''
+
+        self.client._connections['node_0'] = DelayedConnection(self.server,
+            0.2)
+
+        self.assertEquals(self.client.multi_get(self.keys, allow_dirty=True),
+            ['value_%d' % i for i in xrange(30)])
+
+        latencies = self.scatter.latencies
+        self.assert_(latencies['node_0'] >= 0.2 / 10)
+        self.assert_(latencies['node_1'] < 0.2 / 100)
+        self.assert_(latencies['node_2'] < 0.2 / 100)
+
+        sizes = dict((node_id, len(part)) for (node_id, part)
+            in self.scatter.partition(self.keys, ['node_0', 'node_1', 'node_2']))
+        self.assert_(sizes['node_1'] >= 10 and sizes['node_2'] >= 10)
+        self.assert_(sizes.get('node_0', 0) < 10)
+
+    def test_small(self):
+        '''Test small and consistent multi-gets aren't scattered'''
+
+        self.client.multi_get(self.keys[:5], allow_dirty=True)
+        self.client.multi_get(self.keys)
+
+        self.assertEquals(self.client._connections['node_0'].requests, 2)
+        self.assertEquals(self.scatter.latencies, {})
+
+    def test_iterable(self):
+        '''Test keys can be given as any iterable'''
+
+        values = self.client.multi_get(iter(self.keys), allow_dirty=True)
+        self.assertEquals(values, self.client.multi_get(self.keys))
+        self.assertEquals(self.client.multi_get(iter(self.keys[:5])),
+            values[:5])
+
+    def test_failure(self):
+        '''Test keys of a failing node are looked up by the master'''
+
+        self.client._connections['node_1'].broken = True
+
+        self.assertEquals(self.client.multi_get(self.keys, allow_dirty=True),
+            ['value_%d' % i for i in xrange(30)])
+        self.assertEquals(self.client._connections['node_0'].requests, 2)
+
+        self.assertEquals([node_id for (node_id, _)
+            in self.scatter.partition(self.keys, ['node_0', 'node_1', 'node_2'])],
+            ['node_0', 'node_2'])
+
+    def test_error(self):
+        '''Test errors are raised after all results were read'''
+
+        self.assertRaises(errors.NotFound, self.client.multi_get,
+            ['nokey'] + self.keys, allow_dirty=True)
+
+        for connection in self.client._connections.itervalues():
+            self.assertEquals(connection.buffer, '')
+
+
+class SlowConnection(FakeConnection):
+    '''Fake node connection which doesn't answer in time'''
+
+    def read(self, count):
+        time.sleep(0.5)
+
+        raise compat.ArakoonSockNotReadable
+
+
+class LateConnection(FakeConnection):
+    '''Fake connection to a new node, answering after the deadline'''
+
+    created = []
+
+    def __init__(self, address, cluster_id): #pylint: disable=W0613
+        server = test.FakeClient()
+        server.MASTER = 'node_1'
+
+        super(LateConnection, self).__init__(server)
+
+        self.closed = False
+        self.late = True
+
+        LateConnection.created.append(self)
+
+    def connect(self):
+        '''Connect to the node'''
+
+    def read(self, count):
+        if self.late:
+            self.late = False
+            time.sleep(0.3)
+
+        return super(LateConnection, self).read(count)
+
+    def close(self):
+        self.closed = True
+
+
+class TestMasterDiscovery(unittest.TestCase):
+    '''Test concurrent master discovery'''
+
+    def _client(self, *masters):
+        '''Create a client for nodes answering the given masters, `False`
+        meaning a node is down and `Ellipsis` that it hangs'''
+
+        nodes = ['node_%d' % i for i in xrange(len(masters))]
+        config = compat.ArakoonClientConfig('test', dict(
+            (node, (['127.0.0.1'], 4000 + i)) for (i, node) in enumerate(nodes)))
+
+        client = compat._ArakoonClient(config)
+        client._connections = {}
+
+        for node, master in zip(nodes, masters):
+            server = test.FakeClient()
+            server.MASTER = master if master is not Ellipsis else None
+
+            if master is Ellipsis:
+                client._connections[node] = SlowConnection(server)
+            else:
+                client._connections[node] = FakeConnection(server,
+                    master is False)
+
+        return client
+
+    def _master(self, *masters):
+        '''Look up the master of nodes answering the given masters'''
+
+        client = self._client(*masters)
+        client.determine_master()
+
+        return client.master_id
+
+    def test_quorum(self):
+        '''Test the master confirmed by a majority is found'''
+
+        self.assertEquals(self._master('node_1', 'node_1', 'node_1'),
+            'node_1')
+        self.assertEquals(self._master(False, 'node_1', 'node_1'), 'node_1')
+        self.assertEquals(self._master('node_0', 'node_1', 'node_1'),
+            'node_1')
+        self.assertEquals(self._master(None, 'node_1', 'node_1'), 'node_1')
+
+    def test_partial(self):
+        '''Test a master without quorum is only accepted if all nodes
+        which answered agree'''
+
+        self.assertEquals(self._master('node_0', False, False), 'node_0')
+        self.assertRaises(compat.ArakoonNoMaster, self._master,
+            'node_0', 'node_1', False)
+        self.assertRaises(compat.ArakoonNoMaster, self._master,
+            'node_1', False, False)
+
+    def test_timeout(self):
+        '''Test nodes are queried concurrently, and nodes which don't
+        answer in time are dropped'''
+
+        timeout = compat.ARA_CFG_CONN_TIMEOUT
+        compat.ARA_CFG_CONN_TIMEOUT = 0.1
+
+        try:
+            client = self._client(Ellipsis, Ellipsis, 'node_2')
+
+            start = time.time()
+            client.determine_master()
+            self.assert_(time.time() - start < 0.5)
+
+            self.assertEquals(client.master_id, 'node_2')
+
+            self.assertEquals(client._connections.keys(), ['node_2'])
+        finally:
+            compat.ARA_CFG_CONN_TIMEOUT = timeout
+
+    def test_late_connection(self):
+        '''Test connections created by queries answering after the deadline
+        are closed'''
+
+        timeout = compat.ARA_CFG_CONN_TIMEOUT
+        compat.ARA_CFG_CONN_TIMEOUT = 0.1
+        connection_class = compat._ClientConnection
+        compat._ClientConnection = LateConnection
+        del LateConnection.created[:]
+
+        try:
+            client = self._client('node_1', 'node_1', 'node_1')
+            del client._connections['node_0']
+
+            client.determine_master()
+            self.assertEquals(client.master_id, 'node_1')
+
+            time.sleep(0.5)
+
+            connection, = LateConnection.created
+            self.assert_(connection.closed)
+            self.assertEquals(sorted(client._connections.keys()),
+                ['node_1', 'node_2'])
+        finally:
+            compat._ClientConnection = connection_class
+            compat.ARA_CFG_CONN_TIMEOUT = timeout
+
+
+class ErrorConnection(FakeConnection):
+    '''Fake node connection answering every request with an error'''
+
+    def __init__(self, error):
+        super(ErrorConnection, self).__init__(None)
+
+        self.error = error
+
+    def send(self, data):
+        self.requests += 1
+        self.buffer += ''.join(protocol.UINT32.serialize(self.error.CODE)) + \
+            ''.join(protocol.STRING.serialize(self.error.args[0]))
+
+
+class TestMasterHint(unittest.TestCase):
+    '''Test redirection to the master named in errors'''
+
+    def setUp(self):
+        self.server = test.FakeClient()
+        self.server.MASTER = 'node_1'
+        self.server.set('key', 'value')
+
+        config = compat.ArakoonClientConfig('test', {
+            'node_0': (['127.0.0.1'], 4000),
+            'node_1': (['127.0.0.1'], 4001),
+            'node_2': (['127.0.0.1'], 4002),
+        })
+
+        self.client = compat._ArakoonClient(config)
+        self.client.master_id = 'node_0'
+        self.client._connections = {
+            'node_0': ErrorConnection(errors.NotMaster('node_1')),
+            'node_1': FakeConnection(self.server),
+            'node_2': FakeConnection(self.server),
+        }
+
+    def test_redirect(self):
+        '''Test requests are redirected without looking up the master'''
+
+        self.assertEquals(self.client.get('key'), 'value')
+        self.assertEquals(self.client.master_id, 'node_1')
+
+        self.assertEquals(self.client._connections['node_0'].requests, 1)
+        self.assertEquals(self.client._connections['node_1'].requests, 1)
+        self.assertEquals(self.client._connections['node_2'].requests, 0)
+
+    def test_pipelined(self):
+        '''Test pipelined requests are resubmitted to the named master'''
+
+        messages = [protocol.Get(False, 'key')] * 3
+
+        self.assertEquals(list(self.client._process_pipelined(messages)),
+            ['value'] * 3)
+        self.assertEquals(self.client._connections['node_2'].requests, 0)
+
+    def test_no_longer_master(self):
+        '''Test requests failing with `NoLongerMaster` aren't retried'''
+
+        self.client._connections['node_0'] = ErrorConnection(
+            errors.NoLongerMaster('node_1'))
+
+        self.assertRaises(errors.NoLongerMaster, self.client.set, 'key', 'new')
+        self.assertEquals(self.client.master_id, 'node_1')
+        self.assertEquals(self.client.get('key'), 'value')
+
+
+class FlakyConnection(FakeConnection):
+    '''Fake node connection rejecting the first requests (with `NotMaster`
+    by default), or failing the first reads'''
+
+    def __init__(self, server, rejections=0, failures=0, error=None):
+        super(FlakyConnection, self).__init__(server)
+
+        self.rejections = rejections
+        self.failures = failures
+        self.error = error or errors.NotMaster('None')
+
+    def send(self, data):
+        if self.rejections:
+            self.rejections -= 1
+            self.requests += 1
+            self.buffer += ''.join(protocol.UINT32.serialize(
+                self.error.CODE)) + \
+                ''.join(protocol.STRING.serialize(self.error.args[0]))
+        else:
+            super(FlakyConnection, self).send(data)
+
+    def read(self, count):
+        if self.failures:
+            self.failures -= 1
+            self.buffer = ''
+            raise compat.ArakoonSockReadNoBytes
+
+        return super(FlakyConnection, self).read(count)
+
+
+class TestRetryPolicy(unittest.TestCase):
+    '''Test requests are retried according to the retry policy'''
+
+    def _client(self, connection, **kwargs):
+        '''Create a client using a single connection'''
+
+        config = compat.ArakoonClientConfig('test', {
+            'node_0': (['127.0.0.1'], 4000),
+        }, retry.RetryPolicy(**kwargs))
+
+        client = compat._ArakoonClient(config)
+        client._get_connection = lambda node_id: connection
+        client.drop_connections = lambda: None
+
+        def determine_master():
+            '''Fake master lookup'''
+
+            client.master_id = 'node_0'
+
+        client.determine_master = determine_master
+
+        return client
+
+    def test_default(self):
+        '''Test the default policy uses the module settings'''
+
+        config = compat.ArakoonClientConfig('test', {})
+        policy = config.getRetryPolicy()
+
+        self.assertEquals((policy.cap, policy.deadline, policy.tries),
+            (compat.ARA_CFG_CONN_BACKOFF, compat.ARA_CFG_NO_MASTER_RETRY,
+                compat.ARA_CFG_TRY_CNT))
+
+    def test_unlocked(self):
+        '''Test the lock isn't held while waiting to retry'''
+
+        server = test.FakeClient()
+        server.set('key', 'value')
+
+        client = self._client(FlakyConnection(server, rejections=2),
+            base=0.2, cap=0.2)
+        results = []
+
+        thread = threading.Thread(
+            target=lambda: results.append(client.get('key')))
+        thread.start()
+
+        time.sleep(0.1)
+        self.assert_(client._lock.acquire(False))
+        client._lock.release()
+
+        thread.join()
+        self.assertEquals(results, ['value'])
+
+    def test_idempotence(self):
+        '''Test only idempotent requests are retried after read failures'''
+
+        server = test.FakeClient()
+        server.set('key', 'value')
+
+        connection = FlakyConnection(server, failures=1)
+        client = self._client(connection, base=0.01, tries=2)
+        self.assertEquals(client.get('key'), 'value')
+
+        connection.failures = 1
+        self.assertRaises(compat.ArakoonSockReadNoBytes, client.delete,
+            'key')
+
+        connection.failures = 2
+        self.assertRaises(compat.ArakoonSockReadNoBytes, client.get, 'key')
+
+    def test_instrumented(self):
+        '''Test instrumented requests are classified like others'''
+
+        server = test.FakeClient()
+        server.set('key', 'value')
+
+        client = self._client(FlakyConnection(server, failures=1),
+            base=0.01, tries=2)
+        client._instrumentation = instrument.Instrumentation()
+
+        self.assertEquals(client.get('key'), 'value')
+
+    def test_server_errors(self):
+        '''Test errors returned by nodes are retried according to the
+        policy'''
+
+        server = test.FakeClient()
+        server.set('key', 'value')
+
+        connection = FlakyConnection(server, rejections=2,
+            error=errors.GoingDown('Going down'))
+        client = self._client(connection, base=0.01)
+        self.assertEquals(client.get('key'), 'value')
+        self.assertEquals(connection.requests, 3)
+
+        connection.error = errors.TooManyDeadNodes('Too many dead nodes')
+        connection.rejections = 1
+        client = self._client(connection, base=0.01, tries=2)
+        self.assertEquals(client.get('key'), 'value')
+
+        connection.rejections = 1
+        self.assertRaises(errors.TooManyDeadNodes, client.delete, 'key')
+
+        self.assertRaises(errors.NotFound, client.get, 'other')
+
+
+class ConcurrentConnection(FakeConnection):
+    '''Fake node connection recording the number of concurrent reads, and
+    whether it was closed'''
+
+    def __init__(self, server, state):
+        super(ConcurrentConnection, self).__init__(server)
+
+        self.state = state
+        self.closed = False
+
+    def read(self, count):
+        state = self.state
+
+        state['lock'].acquire()
+        try:
+            state['reading'] += 1
+            state['concurrency'] = max(state['concurrency'], state['reading'])
+
+            if state['reading'] == state['threads']:
+                state['event'].set()
+        finally:
+            state['lock'].release()
+
+        # Wait for all threads to read, but don't hang if they can't
+        state['event'].wait(0.5)
+
+        try:
+            return super(ConcurrentConnection, self).read(count)
+        finally:
+            state['lock'].acquire()
+            try:
+                state['reading'] -= 1
+            finally:
+                state['lock'].release()
+
+    def close(self):
+        super(ConcurrentConnection, self).close()
+
+        self.closed = True
+
+
+class TestConcurrency(unittest.TestCase):
+    '''Test threads sharing a client don't wait for each other'''
+
+    def setUp(self):
+        self.server = test.FakeClient()
+        self.server.set('key', 'value')
+
+        config = compat.ArakoonClientConfig('test', {
+            'node_0': (['127.0.0.1'], 4000),
+        })
+
+        self.state = {
+            'lock': threading.Lock(),
+            'event': threading.Event(),
+            'threads': 2,
+            'reading': 0,
+            'concurrency': 0,
+        }
+        self.created = []
+
+        self.client = compat._ArakoonClient(config)
+        self.client.master_id = 'node_0'
+
+        def get_connection(node_id):
+            '''Get the connection of the calling thread, or create one'''
+
+            connections = self.client._connections
+
+            if node_id not in connections:
+                connections[node_id] = ConcurrentConnection(self.server,
+                    self.state)
+                self.created.append(connections[node_id])
+
+            return connections[node_id]
+
+        self.client._get_connection = get_connection
+
+    def _run(self, *targets):
+        '''Run every target in a separate thread'''
+
+        threads = [threading.Thread(target=target) for target in targets]
+
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def test_parallel(self):
+        '''Test requests of several threads are handled in parallel'''
+
+        results = []
+        get = lambda: results.append(self.client.get('key'))
+
+        self._run(get, get)
+
+        self.assertEquals(results, ['value', 'value'])
+        self.assertEquals(self.state['concurrency'], 2)
+        self.assertEquals(len(self.created), 2)
+
+    def test_drop_connections(self):
+        '''Test connections of all threads are dropped'''
+
+        self.state['threads'] = 1
+        ready = threading.Event()
+        dropped = threading.Event()
+        results = []
+
+        def get():
+            '''Get a key before and after connections are dropped'''
+
+            results.append(self.client.get('key'))
+            ready.set()
+            dropped.wait()
+            results.append(self.client.get('key'))
+
+        def drop():
+            '''Drop connections from another thread'''
+
+            ready.wait()
+            self.client.drop_connections()
+            dropped.set()
+
+        self._run(get, drop)
+
+        self.assertEquals(results, ['value', 'value'])
+        self.assertEquals(len(self.created), 2)
+        self.assert_(self.created[0].closed)
+        self.failIf(self.created[1].closed)
+
+    def test_discovery(self):
+        '''Test the master is looked up once for concurrent requests'''
+
+        lookups = []
+
+        def discover_master():
+            '''Slow fake master lookup'''
+
+            lookups.append(None)
+            time.sleep(0.1)
+
+            return 'node_0'
+
+        self.client.master_id = None
+        self.client._discover_master = discover_master
+        self.state['threads'] = 5
+
+        self._run(*([lambda: self.client.get('key')] * 5))
+
+        self.assertEquals(len(lookups), 1)
+        self.assertEquals(self.state['concurrency'], 5)
+
+
+class TestMasterChanges(unittest.TestCase):
+    '''Test master changes are counted'''
+
+    def test_master_changes(self):
+        '''Test only changes of a known master are counted'''
+
+        server = test.FakeClient()
+        config = compat.ArakoonClientConfig('test_master_changes', {
+            'node_0': (['127.0.0.1'], 4000),
+            'node_1': (['127.0.0.1'], 4001),
+        })
+
+        client = compat._ArakoonClient(config)
+        client._connections = {
+            'node_0': FakeConnection(server),
+            'node_1': FakeConnection(server),
+        }
+
+        changes = metrics.MASTER_CHANGES.labels('test_master_changes')
+
+        for master, count in (('node_0', 0), ('node_0', 0), ('node_1', 1)):
+            server.MASTER = master
+            client.master_id = None
+            client.determine_master()
+
+            self.assertEquals(client.master_id, master)
+            self.assertEquals(changes.get(), count)
+
+
 class TestCompatClient(unittest.TestCase, test.ArakoonEnvironmentMixin):
     '''Test the compatibility client against a real Arakoon server'''
 
@@ -128,6 +1040,13 @@ class TestCompatClient(unittest.TestCase, test.ArakoonEnvironmentMixin):
         for match in matches:
             self.assertEquals(client.get(match), 'value')
 
+        matches = list(client.iter_prefix('key_', 7))
+        self.assertEquals(set(matches), set('key_%d' % i for i in xrange(100)))
+
+        matches = list(client.iter_prefix('key_1', 3, True))
+        self.assertEquals(len(matches), 11)
+        self.assert_(all(value == 'value' for _, value in matches))
+
         matches = client.range('key_10', True, 'key_15', False)
         self.assertEquals(len(matches), 5)
         self.assertEquals(set(matches),
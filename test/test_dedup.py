@@ -0,0 +1,136 @@
+# This file is part of Pyrakoon, a distributed key-value store client.
+#
+# Copyright (C) 2014 Incubaid BVBA
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''Tests for code in `pyrakoon.dedup`'''
+
+import time
+import unittest
+
+from pyrakoon import dedup, errors, protocol, sequence, test
+
+class TestDigestCache(unittest.TestCase):
+    '''Tests for `DigestCache`'''
+
+    def test_eviction(self):
+        '''Test the least recently used entry is evicted'''
+
+        cache = dedup.DigestCache(size=2)
+        cache.put('a', '1')
+        cache.put('b', '2')
+        self.assertEquals(cache.get('a'), '1')
+        cache.put('c', '3')
+
+        self.assertEquals(len(cache), 2)
+        self.assertEquals(cache.get('b'), None)
+        self.assertEquals(cache.get('a'), '1')
+        self.assertEquals(cache.get('c'), '3')
+
+    def test_ttl(self):
+        '''Test entries expire'''
+
+        cache = dedup.DigestCache(ttl=0.01)
+        cache.put('a', '1')
+        self.assertEquals(cache.get('a'), '1')
+
+        time.sleep(0.02)
+        self.assertEquals(cache.get('a'), None)
+
+    def test_discard_prefix(self):
+        '''Test discarding all keys with a prefix'''
+
+        cache = dedup.DigestCache()
+        for key in ('a/1', 'a/2', 'b/1'):
+            cache.put(key, key)
+
+        cache.discard_prefix('a/')
+
+        self.assertEquals(len(cache), 1)
+        self.assertEquals(cache.get('b/1'), 'b/1')
+
+
+class TestWriteIfChangedClient(unittest.TestCase):
+    '''Tests for `WriteIfChangedClient`'''
+
+    def setUp(self):
+        self.inner = test.RecordingClient()
+        self.client = dedup.WriteIfChangedClient(self.inner)
+
+    def _sent(self):
+        '''Get the types of the messages sent to the inner client'''
+
+        return [type(message) for message in self.inner.messages]
+
+    def test_set(self):
+        '''Test unchanged values are suppressed, unknown keys confirmed'''
+
+        self.client.set('key', 'value')
+        self.client.set('key', 'value')
+        self.client.set('key', 'other')
+
+        self.assertEquals(self._sent(),
+            [protocol.Confirm, protocol.Set])
+        self.assertEquals(self.inner.get('key'), 'other')
+        self.assertEquals(self.client.statistics['suppressed'], 1)
+        self.assertEquals(self.client.statistics['confirmed'], 1)
+        self.assertEquals(self.client.statistics['written'], 1)
+
+    def test_invalidation(self):
+        '''Test updates by other calls invalidate the cache'''
+
+        self.client.set('a', 'value')
+        self.client.set('b', 'value')
+        self.client.set('c/1', 'value')
+        self.client.delete('a')
+        self.client.sequence([sequence.Delete('b')])
+        self.client.delete_prefix('c/')
+
+        self.assertEquals(len(self.client.cache), 0)
+
+        self.inner.reset()
+        self.client.set('a', 'value')
+        self.assertEquals(self._sent(), [protocol.Confirm])
+        self.assertEquals(self.inner.get('a'), 'value')
+
+    def test_failure(self):
+        '''Test failed writes aren't cached'''
+
+        def fail(message):
+            '''Fail every request'''
+
+            raise errors.GoingDown('Shutting down')
+
+        self.inner._process = fail
+
+        self.assertRaises(errors.GoingDown, self.client.set, 'key', 'value')
+        self.assertEquals(len(self.client.cache), 0)
+
+    def test_pipelined(self):
+        '''Test suppressed writes in a pipeline keep results in order'''
+
+        self.client.set('a', 'value')
+        self.inner.reset()
+
+        messages = [protocol.Set('b', 'value'), protocol.Set('a', 'value'),
+            protocol.Get(False, 'b'), protocol.Set('a', 'value')]
+
+        results = list(self.client._process_pipelined(messages))
+
+        self.assertEquals(results, [None, None, 'value', None])
+        self.assertEquals(self._sent(), [protocol.Confirm, protocol.Get])
+        self.assertEquals(self.client.statistics['suppressed'], 2)
+
+        list(self.client._process_pipelined([protocol.Set('b', 'value')]))
+        self.assertEquals(self.client.statistics['suppressed'], 3)
@@ -0,0 +1,121 @@
+# This file is part of Pyrakoon, a distributed key-value store client.
+#
+# Copyright (C) 2014 Incubaid BVBA
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''Tests for code in `pyrakoon.dump`'''
+
+import unittest
+import StringIO
+
+from pyrakoon import dump, test
+
+class TestDump(unittest.TestCase):
+    '''Test dump export and import using `pyrakoon.test.FakeClient`'''
+
+    def setUp(self):
+        self.client = test.FakeClient()
+
+        for i in xrange(100):
+            self.client.set('key_%03d' % i, 'value_%d' % i)
+        for i in xrange(10):
+            self.client.set('other_%d' % i, '\x00' * i)
+
+    def _export(self, **kwargs):
+        '''Export to a file object, rewound to its start'''
+
+        fd = StringIO.StringIO()
+        count = dump.export_dump(self.client, fd, page_size=7,
+            segment_records=16, **kwargs)
+        fd.seek(0)
+
+        return count, fd
+
+    def test_roundtrip(self):
+        '''Test exporting all keys and reading them back'''
+
+        count, fd = self._export()
+
+        self.assertEquals(count, 110)
+        self.assertEquals(list(dump.read_dump(fd)),
+            list(self.client.iter_prefix('', 1000, True)))
+
+    def test_prefix(self):
+        '''Test exporting a prefix or a range'''
+
+        count, fd = self._export(prefix='other_')
+        self.assertEquals(count, 10)
+        self.assertEquals([key for (key, _) in dump.read_dump(fd)],
+            ['other_%d' % i for i in xrange(10)])
+
+        count, fd = self._export(begin_key='key_010', end_key='key_020')
+        self.assertEquals(count, 10)
+        self.assertEquals([key for (key, _) in dump.read_dump(fd)],
+            ['key_%03d' % i for i in xrange(10, 20)])
+
+        self.assertRaises(ValueError, self._export, prefix='key_',
+            begin_key='key_010')
+
+    def test_index(self):
+        '''Test reading index blocks'''
+
+        _, fd = self._export()
+        entries = list(dump.read_index(fd))
+
+        self.assertEquals(len(entries), 7)
+        self.assertEquals([entry.count for entry in entries],
+            [16] * 6 + [14])
+        self.assertEquals(entries[0].first_key, 'key_000')
+        self.assertEquals(entries[-1].last_key, 'other_9')
+
+        fd.seek(entries[1].offset)
+        self.assertEquals(fd.read(1), 'R')
+
+    def test_corruption(self):
+        '''Test corrupted or truncated dumps are detected'''
+
+        _, fd = self._export()
+        data = fd.getvalue()
+
+        offset = data.index('value_50')
+        corrupted = data[:offset] + 'X' + data[offset + 1:]
+        self.assertRaises(dump.DumpError, list,
+            dump.read_dump(StringIO.StringIO(corrupted)))
+
+        self.assertRaises(dump.DumpError, list,
+            dump.read_dump(StringIO.StringIO(data[:-3])))
+        self.assertRaises(dump.DumpError, list,
+            dump.read_dump(StringIO.StringIO('garbage')))
+
+    def test_import(self):
+        '''Test importing a dump'''
+
+        _, fd = self._export()
+
+        client = test.FakeClient()
+        stats = dump.import_dump(client, fd, batch_count=25)
+
+        self.assertEquals(stats.records, 110)
+        self.assertEquals(stats.batches, 5)
+        self.assertEquals(list(client.iter_prefix('', 1000, True)),
+            list(self.client.iter_prefix('', 1000, True)))
+
+    def test_unordered(self):
+        '''Test writing keys out of order fails'''
+
+        writer = dump.DumpWriter(StringIO.StringIO())
+        writer.write('b', '')
+
+        self.assertRaises(ValueError, writer.write, 'a', '')
+        self.assertRaises(ValueError, writer.write, 'b', '')
@@ -0,0 +1,162 @@
+# This file is part of Pyrakoon, a distributed key-value store client.
+#
+# Copyright (C) 2014 Incubaid BVBA
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''Tests for code in `pyrakoon.hotkeys`'''
+
+import random
+import unittest
+
+from pyrakoon import hotkeys, protocol, sequence, test, trace
+
+class TestCountMinSketch(unittest.TestCase):
+    '''Tests for `CountMinSketch`'''
+
+    def test_estimates(self):
+        '''Test estimates never underestimate, and are close for hot keys'''
+
+        sketch = hotkeys.CountMinSketch(width=2048, depth=4)
+        counts = {}
+
+        for _ in xrange(20000):
+            key = 'key_%d' % min(int(random.expovariate(0.01)), 5000)
+            counts[key] = counts.get(key, 0) + 1
+            sketch.add(key)
+
+        for key, count in counts.iteritems():
+            self.assert_(sketch.estimate(key) >= count)
+
+        hottest = max(counts, key=counts.get)
+        self.assert_(sketch.estimate(hottest) < counts[hottest] * 1.1)
+
+
+class TestHotKeyTracker(unittest.TestCase):
+    '''Tests for `HotKeyTracker`'''
+
+    def test_hot_keys(self):
+        '''Test the hottest keys are found, overall and per operation'''
+
+        tracker = hotkeys.HotKeyTracker(sample_rate=1.0, top=3)
+
+        for i in xrange(2000):
+            tracker.record(protocol.Get(False, 'key_%d' % i), 10)
+
+            if i % 4 == 0:
+                tracker.record(protocol.Get(False, 'hot'), 10)
+            if i % 10 == 0:
+                tracker.record(protocol.Set('big', 'x' * 1000), 1000)
+
+        hot = tracker.hot_keys()
+        self.assertEquals(hot[0].key, 'hot')
+        self.assertEquals(hot[0].requests, 500)
+        self.assertEquals(hot[1].key, 'big')
+        self.assertAlmostEquals(hot[0].share, 500 / 2700.0)
+
+        self.assertEquals([key.key for key in tracker.hot_keys(by='bytes')][0],
+            'big')
+        self.assertEquals([key.key for key in tracker.hot_keys('Set')],
+            ['big'])
+        self.assertEquals(tracker.hot_keys('Delete'), [])
+        self.assertEquals(tracker.operations, ['Get', 'Set'])
+        self.assertRaises(ValueError, tracker.hot_keys, by='latency')
+
+        tracker.reset()
+        self.assertEquals(tracker.hot_keys(), [])
+
+    def test_prefixes(self):
+        '''Test prefixes are taken from arguments and derived from keys'''
+
+        tracker = hotkeys.HotKeyTracker(sample_rate=1.0, separator='/')
+
+        tracker.record(protocol.PrefixKeys(False, 'users/', -1))
+        tracker.record(protocol.Sequence([sequence.Set('users/1', 'a'),
+            sequence.Sequence([sequence.Delete('groups/1')])], False))
+        tracker.record(protocol.MultiGet(False, ['users/2', 'nosep']))
+
+        self.assertEquals(
+            [(key.key, key.requests) for key in tracker.hot_prefixes()],
+            [('users/', 3), ('groups/', 1)])
+        self.assertEquals(
+            sorted(key.key for key in tracker.hot_keys('Sequence')),
+            ['groups/1', 'users/1'])
+
+    def test_sampling(self):
+        '''Test estimates are scaled by the sample rate'''
+
+        tracker = hotkeys.HotKeyTracker(sample_rate=0.1)
+
+        for _ in xrange(10000):
+            tracker.record(protocol.Get(False, 'key'), 1)
+
+        requests = tracker.hot_keys()[0].requests
+        self.assert_(8000 < requests < 12000, requests)
+
+    def test_tracer(self):
+        '''Test recording the requests of a `SocketClient`'''
+
+        server = test.FakeServer('pyrakoon_test')
+        server.store.set('key', 'value')
+
+        tracker = hotkeys.HotKeyTracker(sample_rate=1.0)
+        sampler = trace.SlowestSampler()
+
+        client_ = server.connect()
+        client_.tracer = trace.CompositeTracer(tracker, sampler)
+
+        try:
+            for _ in xrange(3):
+                client_.get('key')
+        finally:
+            client_._disconnect()
+            server.stop()
+
+        hot, = tracker.hot_keys()
+        self.assertEquals((hot.key, hot.requests), ('key', 3))
+        self.assertEquals(hot.bytes,
+            3 * (len(''.join(protocol.Get(False, 'key').serialize())) + 13))
+        self.assertEquals(len(sampler.samples()), 3)
+
+    def test_unsampled(self):
+        '''Test requests which aren't sampled aren't traced'''
+
+        server = test.FakeServer('pyrakoon_test')
+        server.store.set('key', 'value')
+
+        traced = []
+
+        class Tracker(hotkeys.HotKeyTracker):
+            '''Tracker recording the traces it's notified of'''
+
+            def on_request_start(self, trace_):
+                traced.append(trace_)
+
+        tracker = Tracker(sample_rate=1e-9)
+        sampler = trace.SlowestSampler()
+
+        client_ = server.connect()
+
+        try:
+            client_.tracer = tracker
+            client_.get('key')
+
+            client_.tracer = trace.CompositeTracer(tracker, sampler)
+            client_.get('key')
+        finally:
+            client_._disconnect()
+            server.stop()
+
+        self.assertEquals(traced, [])
+        self.assertEquals(tracker.hot_keys(), [])
+        self.assertEquals(len(sampler.samples()), 1)
@@ -0,0 +1,125 @@
+# This file is part of Pyrakoon, a distributed key-value store client.
+#
+# Copyright (C) 2014 Incubaid BVBA
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''Tests for code in `pyrakoon.instrument`'''
+
+import random
+import unittest
+import threading
+
+from pyrakoon import errors, instrument, protocol, test
+
+class TestLatencyHistogram(unittest.TestCase):
+    '''Tests for `LatencyHistogram`'''
+
+    def test_percentiles(self):
+        '''Test percentiles are accurate within a few percent'''
+
+        histogram = instrument.LatencyHistogram()
+        samples = [random.uniform(0.0001, 1.0) for _ in xrange(10000)]
+
+        for sample in samples:
+            histogram.record(sample)
+
+        samples.sort()
+
+        for percentile in (50, 90, 99, 99.9):
+            exact = samples[int(len(samples) * percentile / 100.0) - 1]
+            estimate = histogram.percentile(percentile)
+
+            self.assert_(abs(estimate - exact) / exact < 0.05,
+                'p%s: %f vs %f' % (percentile, estimate, exact))
+
+    def test_empty(self):
+        '''Test percentiles of an empty histogram'''
+
+        self.assertEquals(instrument.LatencyHistogram().percentile(50), None)
+
+    def test_merge(self):
+        '''Test merging histograms'''
+
+        first = instrument.LatencyHistogram()
+        second = instrument.LatencyHistogram()
+        first.record(0.001)
+        second.record(0.001)
+        second.record(1.0)
+
+        first.merge(second)
+
+        self.assertEquals(first.count, 3)
+        self.assert_(first.percentile(100) > 0.9)
+
+
+class TestInstrumentation(unittest.TestCase):
+    '''Tests for `Instrumentation`'''
+
+    def test_threads(self):
+        '''Test measurements of several threads are merged'''
+
+        instrumentation = instrument.Instrumentation()
+
+        def run():
+            '''Record some measurements'''
+
+            for _ in xrange(100):
+                instrumentation.record(protocol.Get, 0.001, 10, 20)
+
+        threads = [threading.Thread(target=run) for _ in xrange(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        run()
+
+        stats = instrumentation.snapshot()[protocol.Get.TAG]
+        self.assertEquals(stats.requests, 500)
+        self.assertEquals(stats.bytes_received, 10000)
+        self.assertEquals(stats.histogram.count, 500)
+
+        # Terminated threads got folded
+        self.assertEquals(len(instrumentation._threads), 1)
+        self.assertEquals(
+            instrumentation.snapshot()[protocol.Get.TAG].requests, 500)
+
+        instrumentation.reset()
+        self.assertEquals(instrumentation.snapshot(), {})
+
+    def test_socket_client(self):
+        '''Test instrumenting a `SocketClient`'''
+
+        server = test.FakeServer('pyrakoon_test')
+        server.store.set('key', 'value')
+
+        client_ = server.connect()
+        client_.instrumentation = instrument.Instrumentation()
+
+        try:
+            self.assertEquals(client_.get('key'), 'value')
+            self.assertRaises(errors.NotFound, client_.get, 'nokey')
+        finally:
+            client_._disconnect()
+            server.stop()
+
+        stats = client_.instrumentation.snapshot()[protocol.Get.TAG]
+
+        self.assertEquals(stats.requests, 2)
+        self.assertEquals(stats.errors, {'NotFound': 1})
+        self.assertEquals(stats.bytes_sent,
+            len(''.join(protocol.Get(False, 'key').serialize())) +
+            len(''.join(protocol.Get(False, 'nokey').serialize())))
+        # Result code and value, result code and error message
+        self.assertEquals(stats.bytes_received, (4 + 4 + 5) + (4 + 4 + 5))
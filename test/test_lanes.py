@@ -0,0 +1,96 @@
+# This file is part of Pyrakoon, a distributed key-value store client.
+#
+# Copyright (C) 2014 Incubaid BVBA
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''Tests for code in `pyrakoon.lanes`'''
+
+import unittest
+import threading
+
+from pyrakoon import errors, lanes, test
+
+class TestLaneClient(unittest.TestCase):
+    '''Test `LaneClient` against a `pyrakoon.test.FakeServer`'''
+
+    def setUp(self):
+        self.server = test.FakeServer('pyrakoon_test')
+
+        for i in xrange(100):
+            self.server.store.set('key_%02d' % i, 'value_%d' % i)
+
+        self.client = lanes.LaneClient(self.server.address, 'pyrakoon_test',
+            bulk_concurrency=1, bulk_threshold=50)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.stop()
+
+    def _idle(self, lane):
+        '''Count idle connections in a lane'''
+
+        return len(self.client._pools[lane]._idle)
+
+    def test_default_lanes(self):
+        '''Test requests are handled in their default lane'''
+
+        self.assertEquals(self.client.get('key_01'), 'value_1')
+        self.assertRaises(errors.NotFound, self.client.get, 'nokey')
+        self.assertEquals(self.client.range('key_', True, 'key_05', False, 3),
+            ['key_00', 'key_01', 'key_02'])
+
+        self.assertEquals(self._idle(lanes.NORMAL), 1)
+        self.assertEquals(self._idle(lanes.BULK), 0)
+
+        self.assertEquals(len(self.client.range_entries(None, True, None,
+            True)), 100)
+        self.assertEquals(len(self.client.range('key_', True, None, True,
+            50)), 50)
+
+        self.assertEquals(self._idle(lanes.BULK), 1)
+        self.assertEquals(self._idle(lanes.INTERACTIVE), 0)
+
+    def test_lane(self):
+        '''Test submitting requests in a given lane'''
+
+        interactive = self.client.lane(lanes.INTERACTIVE)
+
+        self.assertEquals(interactive.get('key_02'), 'value_2')
+        self.assertEquals(len(interactive.range(None, True, None, True)),
+            100)
+        self.assertEquals(self._idle(lanes.INTERACTIVE), 1)
+        self.assertEquals(self._idle(lanes.BULK), 0)
+
+        self.assertRaises(ValueError, self.client.lane, 'urgent')
+
+    def test_bulk_concurrency(self):
+        '''Test the number of bulk connections is capped'''
+
+        def scan():
+            '''Run some bulk requests'''
+
+            for _ in xrange(10):
+                self.client.range_entries(None, True, None, True)
+
+        threads = [threading.Thread(target=scan) for _ in xrange(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEquals(self._idle(lanes.BULK), 1)
+        self.assertEquals(self.server.connections, 1)
+
+        self.assertEquals(self.client.statistics[lanes.BULK],
+            {'size': 1, 'in_use': 0, 'idle': 1, 'created': 1})
@@ -0,0 +1,257 @@
+# This file is part of Pyrakoon, a distributed key-value store client.
+#
+# Copyright (C) 2014 Incubaid BVBA
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''Tests for code in `pyrakoon.metrics`'''
+
+import socket
+import urllib2
+import unittest
+import threading
+import StringIO
+
+from pyrakoon import errors, instrument, metrics, protocol
+
+class TestMetrics(unittest.TestCase):
+    '''Tests for `Counter` and `Gauge`'''
+
+    def test_render(self):
+        '''Test rendering metrics with labels'''
+
+        registry = metrics.Registry()
+
+        counter = metrics.Counter('test_total', 'Test\ncounter', ('key', ))
+        gauge = metrics.Gauge('test_gauge', 'Test gauge')
+        registry.register(counter)
+        registry.register(gauge)
+
+        counter.labels('a"b').inc()
+        counter.labels('c\\d').inc(2)
+        gauge.set(1.5)
+
+        self.assertEquals(registry.render(), '\n'.join([
+            '# HELP test_total Test\\ncounter',
+            '# TYPE test_total counter',
+            'test_total{key="a\\"b"} 1',
+            'test_total{key="c\\\\d"} 2',
+            '# HELP test_gauge Test gauge',
+            '# TYPE test_gauge gauge',
+            'test_gauge 1.5',
+        ]) + '\n')
+
+        gauge.set_function(lambda: 3)
+        self.assert_('test_gauge 3\n' in registry.render())
+
+        registry.unregister(gauge)
+        self.assert_('test_gauge' not in registry.render())
+
+    def test_invalid(self):
+        '''Test invalid names and labels are refused'''
+
+        self.assertRaises(ValueError, metrics.Counter, 'test-total', 'Test')
+
+        counter = metrics.Counter('test_total', 'Test', ('key', ))
+        self.assertRaises(ValueError, counter.inc)
+        self.assertRaises(ValueError, counter.labels, 'a', 'b')
+
+    def test_threads(self):
+        '''Test counter increments of several threads are summed'''
+
+        counter = metrics.Counter('test_total', 'Test')
+
+        def run():
+            '''Increment the counter'''
+
+            for _ in xrange(1000):
+                counter.inc()
+
+        threads = [threading.Thread(target=run) for _ in xrange(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEquals(counter.collect()[0].samples,
+            [('test_total', {}, 4000)])
+
+    def test_terminated_threads(self):
+        '''Test increments of terminated threads are kept, but their cells
+        are released'''
+
+        counter = metrics.Counter('test_total', 'Test')
+
+        for _ in xrange(20):
+            thread = threading.Thread(target=counter.inc)
+            thread.start()
+            thread.join()
+
+        counter.inc()
+
+        self.assertEquals(counter.collect()[0].samples,
+            [('test_total', {}, 21)])
+        self.assertEquals(len(counter._values[()]._cells), 1)
+
+
+class TestCollectors(unittest.TestCase):
+    '''Tests for the collectors'''
+
+    def test_instrumentation(self):
+        '''Test reporting instrumentation measurements'''
+
+        instrumentation = instrument.Instrumentation()
+        instrumentation.record(protocol.Get, 0.001, 20, 10)
+        instrumentation.record(protocol.Get, 0.003, 20, 10,
+            errors.NotFound())
+
+        collector = metrics.InstrumentationCollector(instrumentation,
+            quantiles=(0.5, ), labels={'client': 'test'})
+        families = dict((family.name, family)
+            for family in collector.collect())
+
+        latency = families['pyrakoon_request_duration_seconds']
+        self.assertEquals([sample[:2] for sample in latency.samples], [
+            ('pyrakoon_request_duration_seconds',
+                {'client': 'test', 'operation': 'Get', 'quantile': '0.5'}),
+            ('pyrakoon_request_duration_seconds_sum',
+                {'client': 'test', 'operation': 'Get'}),
+            ('pyrakoon_request_duration_seconds_count',
+                {'client': 'test', 'operation': 'Get'}),
+        ])
+        self.assertEquals(latency.samples[2][2], 2)
+
+        self.assertEquals(
+            families['pyrakoon_request_sent_bytes_total'].samples,
+            [('pyrakoon_request_sent_bytes_total',
+                {'client': 'test', 'operation': 'Get'}, 40)])
+        self.assertEquals(families['pyrakoon_request_errors_total'].samples,
+            [('pyrakoon_request_errors_total',
+                {'client': 'test', 'operation': 'Get', 'error': 'NotFound'},
+                1)])
+        self.assertEquals(families['pyrakoon_requests_in_flight'].samples,
+            [('pyrakoon_requests_in_flight', {'client': 'test'}, 0)])
+
+    def test_lane_pools(self):
+        '''Test reporting lane pool statistics'''
+
+        class Client(object): #pylint: disable=R0903
+            '''Fake lane client'''
+
+            statistics = {
+                'bulk': {'size': 2, 'in_use': 1, 'idle': 0, 'created': 3},
+            }
+
+        text = ''.join(family.render() for family in
+            metrics.LanePoolCollector(Client()).collect())
+
+        self.assert_('pyrakoon_pool_size{lane="bulk"} 2\n' in text)
+        self.assert_(
+            'pyrakoon_pool_connections{lane="bulk",state="in_use"} 1\n'
+            in text)
+        self.assert_('pyrakoon_pool_connections_created_total{lane="bulk"} 3'
+            in text)
+
+    def test_node_statistics(self):
+        '''Test reporting node statistics'''
+
+        class Collector(metrics.NodeStatisticsCollector):
+            '''Collector using canned statistics'''
+
+            def _fetch(self):
+                return {
+                    'node_0': {
+                        'avg_set_size': 12.5,
+                        'set_info': {'n': 3, 'max': 0.25},
+                        'node_is': {'node-1': 4},
+                        'version': 'ignored',
+                    },
+                    'node_1': socket.timeout(),
+                }
+
+        collector = Collector({}, 'test', interval=0.01)
+        self.assertEquals(collector.collect()[0].samples, [])
+
+        collector.refresh()
+        text = ''.join(family.render() for family in collector.collect())
+
+        for line in ('arakoon_node_up{node="node_0"} 1',
+            'arakoon_node_up{node="node_1"} 0',
+            'arakoon_avg_set_size{node="node_0"} 12.5',
+            'arakoon_set_info_n{node="node_0"} 3',
+            'arakoon_node_is_node_1{node="node_0"} 4'):
+            self.assert_(line + '\n' in text, line)
+
+        self.assert_('version' not in text)
+
+    def test_background_refresh(self):
+        '''Test node statistics are refreshed in the background'''
+
+        refreshed = threading.Event()
+
+        class Collector(metrics.NodeStatisticsCollector):
+            '''Collector signalling refreshes'''
+
+            def _fetch(self):
+                refreshed.set()
+                return {'node_0': {'avg_set_size': 1.0}}
+
+        collector = Collector({}, 'test', interval=0.01)
+
+        collector.start()
+        try:
+            self.assertRaises(RuntimeError, collector.start)
+            refreshed.wait(5)
+        finally:
+            collector.stop()
+
+        self.assert_(refreshed.is_set())
+        self.assertEquals(collector.collect()[0].samples,
+            [('arakoon_node_up', {'node': 'node_0'}, 1)])
+
+
+class TestExport(unittest.TestCase):
+    '''Tests for `dump` and `serve`'''
+
+    def setUp(self):
+        self.registry = metrics.Registry()
+        counter = metrics.Counter('test_total', 'Test')
+        counter.inc()
+        self.registry.register(counter)
+
+    def test_dump(self):
+        '''Test writing metrics to a file'''
+
+        fd = StringIO.StringIO()
+        metrics.dump(fd, self.registry)
+
+        self.assertEquals(fd.getvalue(), self.registry.render())
+
+    def test_serve(self):
+        '''Test serving metrics over HTTP'''
+
+        server = metrics.serve(('127.0.0.1', 0), self.registry)
+
+        try:
+            url = 'http://%s:%d' % server.server_address
+
+            response = urllib2.urlopen(url + '/metrics')
+            self.assertEquals(response.info()['Content-Type'],
+                metrics.CONTENT_TYPE)
+            self.assertEquals(response.read(), self.registry.render())
+
+            self.assertRaises(urllib2.HTTPError, urllib2.urlopen,
+                url + '/other')
+        finally:
+            server.shutdown()
+            server.server_close()
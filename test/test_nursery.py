@@ -44,6 +44,48 @@ log_dir = %(LOG_DIR)s
 log_level = debug
 '''
 
+class TestNurseryIterPrefix(unittest.TestCase):
+    '''Test `NurseryClient.iter_prefix` using fake clusters'''
+
+    def setUp(self):
+        routing = nursery.InternalNode('key_10',
+            nursery.LeafNode('left'),
+            nursery.InternalNode('key_20',
+                nursery.LeafNode('middle'), nursery.LeafNode('right')))
+        config = nursery.NurseryConfig(routing,
+            dict((name, {}) for name in ('left', 'middle', 'right')))
+
+        self.clients = {}
+
+        def create_client(name, _):
+            client_ = test.FakeClient()
+            self.clients[name] = client_
+            return client_
+
+        self.client = nursery.NurseryClient(lambda _: config, create_client)
+
+        for i in xrange(30):
+            self.client.set('key_%02d' % i, 'value_%d' % i)
+
+    def test_routing(self):
+        '''Test keys are spread over the clusters'''
+
+        self.assertEquals(len(list(self.clients['left'].iter_prefix('', 5))),
+            10)
+        self.assertEquals(len(list(self.clients['middle'].iter_prefix('', 5))),
+            10)
+
+    def test_iter_prefix(self):
+        '''Test `iter_prefix` across cluster boundaries'''
+
+        self.assertEquals(list(self.client.iter_prefix('key_', 3)),
+            ['key_%02d' % i for i in xrange(30)])
+        self.assertEquals(list(self.client.iter_prefix('key_1', 4, True)),
+            [('key_%02d' % i, 'value_%d' % i) for i in xrange(10, 20)])
+        self.assertEquals(list(self.client.iter_prefix('key_2', 100)),
+            ['key_%02d' % i for i in xrange(20, 30)])
+
+
 class TestNurseryClient(unittest.TestCase, test.NurseryEnvironmentMixin):
     '''Test the nursery client against a real Arakoon nursery setup'''
 
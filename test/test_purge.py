@@ -0,0 +1,208 @@
+# This file is part of Pyrakoon, a distributed key-value store client.
+#
+# Copyright (C) 2014 Incubaid BVBA
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''Tests for code in `pyrakoon.purge`'''
+
+import os
+import time
+import shutil
+import tempfile
+import unittest
+
+from pyrakoon import bulk, errors, protocol, purge, test
+
+class ConcurrentClient(test.FakeClient):
+    '''Fake client deleting a key right before the first sequence'''
+
+    def __init__(self, key):
+        super(ConcurrentClient, self).__init__()
+
+        self.key = key
+
+    def _process(self, message):
+        if isinstance(message, protocol.Sequence) and self.key:
+            key, self.key = self.key, None
+            self.delete(key)
+
+        return super(ConcurrentClient, self)._process(message)
+
+
+class SlowClient(test.FakeClient):
+    '''Fake client taking some time to handle every sequence'''
+
+    def _process(self, message):
+        if isinstance(message, protocol.Sequence):
+            time.sleep(0.02)
+
+        return super(SlowClient, self)._process(message)
+
+
+class TestBulkDeleter(unittest.TestCase):
+    '''Test `BulkDeleter` using `pyrakoon.test.FakeClient`'''
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='pyrakoon_test_purge')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _fill(self, client):
+        '''Store 100 keys in two tenants'''
+
+        for i in xrange(50):
+            client.set('tenant_a/%02d' % i, 'value')
+            client.set('tenant_b/%02d' % i, 'value')
+
+        return client
+
+    def _keys(self, client):
+        '''Retrieve all keys in `client`'''
+
+        return client.range(None, True, None, True, -1)
+
+    def test_delete_prefix(self):
+        '''Test deleting all keys matching a prefix'''
+
+        client = self._fill(test.FakeClient())
+
+        stats = purge.BulkDeleter(client, batch_count=7).delete_prefix(
+            'tenant_a/')
+
+        self.assertEquals(stats.deleted, 50)
+        self.assertEquals(stats.batches, 8)
+        self.assertEquals(stats.last_key, 'tenant_a/49')
+        self.assertEquals(self._keys(client),
+            ['tenant_b/%02d' % i for i in xrange(50)])
+
+    def test_delete_range(self):
+        '''Test deleting a key range'''
+
+        client = self._fill(test.FakeClient())
+
+        stats = purge.BulkDeleter(client, batch_count=10).delete_range(
+            'tenant_a/10', False, 'tenant_b/05', True)
+
+        self.assertEquals(stats.deleted, 39 + 6)
+        self.assertEquals(self._keys(client),
+            ['tenant_a/%02d' % i for i in xrange(11)] +
+            ['tenant_b/%02d' % i for i in xrange(6, 50)])
+
+    def test_conflict(self):
+        '''Test batches are retried when keys get deleted concurrently'''
+
+        client = self._fill(ConcurrentClient('tenant_a/03'))
+
+        stats = purge.BulkDeleter(client, batch_count=10).delete_prefix(
+            'tenant_a/')
+
+        self.assertEquals(stats.conflicts, 1)
+        self.assertEquals(stats.deleted, 49)
+        self.assertEquals(len(self._keys(client)), 50)
+
+    def test_retry(self):
+        '''Test batches failing with a transient error are retried'''
+
+        client = self._fill(test.FakeClient())
+        original = client._process
+        failures = [errors.GoingDown('Shutting down')]
+
+        def process(message):
+            '''Fail the first sequence'''
+
+            if isinstance(message, protocol.Sequence) and failures:
+                raise failures.pop()
+
+            return original(message)
+
+        client._process = process
+
+        stats = purge.BulkDeleter(client, backoff=0).delete_prefix(
+            'tenant_b/')
+
+        self.assertEquals(stats.retries, 1)
+        self.assertEquals(stats.deleted, 50)
+
+    def test_master_change(self):
+        '''Test the client follows the master after master errors'''
+
+        client = self._fill(test.FakeClient())
+        original = client._process
+        failures = [errors.NoLongerMaster(''), errors.NotMaster('arakoon_1')]
+        redirects = []
+        lookups = []
+
+        def process(message):
+            '''Fail the first sequences'''
+
+            if isinstance(message, protocol.Sequence) and failures:
+                raise failures.pop()
+
+            return original(message)
+
+        client._process = process
+        client.redirect = lambda exc: redirects.append(exc) or \
+            bool(str(exc))
+        client.rediscover = lambda: lookups.append(None) or True
+
+        stats = purge.BulkDeleter(client, backoff=0.01).delete_prefix(
+            'tenant_b/')
+
+        self.assertEquals(stats.retries, 2)
+        self.assertEquals(stats.deleted, 50)
+        self.assertEquals([type(exc) for exc in redirects],
+            [errors.NotMaster, errors.NoLongerMaster])
+        self.assertEquals(len(lookups), 1)
+
+    def test_adaptive_batches(self):
+        '''Test batches shrink when exceeding the latency target'''
+
+        client = self._fill(SlowClient())
+
+        stats = purge.BulkDeleter(client, batch_count=16,
+            target_latency=0.001).delete_prefix('tenant_a/')
+
+        self.assertEquals(stats.deleted, 50)
+        self.assertEquals(stats.batch_count, 1)
+
+    def test_rate(self):
+        '''Test the number of keys deleted per second is capped'''
+
+        client = self._fill(test.FakeClient())
+
+        start = time.time()
+        stats = purge.BulkDeleter(client, batch_count=10,
+            rate=200).delete_prefix('tenant_a/')
+
+        self.assert_(time.time() - start >= 0.15)
+        self.assert_(stats.throttled > 0)
+
+    def test_resume(self):
+        '''Test resuming an interrupted deletion using a checkpoint'''
+
+        client = self._fill(test.FakeClient())
+        checkpoint = os.path.join(self.tmpdir, 'checkpoint')
+
+        # Pretend the first 20 keys were deleted by an earlier run
+        bulk.write_checkpoint(checkpoint, 20, 'tenant_a/19')
+
+        stats = purge.BulkDeleter(client, checkpoint=checkpoint) \
+            .delete_prefix('tenant_a/')
+
+        self.assertEquals(stats.deleted, 50)
+        self.assertEquals(bulk.read_checkpoint(checkpoint),
+            (50, 'tenant_a/49'))
+        self.assertEquals(client.range('tenant_a/', True, 'tenant_b/', False,
+            -1), ['tenant_a/%02d' % i for i in xrange(20)])
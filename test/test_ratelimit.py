@@ -0,0 +1,192 @@
+# This file is part of Pyrakoon, a distributed key-value store client.
+#
+# Copyright (C) 2014 Incubaid BVBA
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''Tests for code in `pyrakoon.ratelimit`'''
+
+import time
+import unittest
+import threading
+
+from pyrakoon import errors, protocol, ratelimit, sequence, test
+
+class TestTokenBucket(unittest.TestCase):
+    '''Test `TokenBucket`'''
+
+    def test_consume(self):
+        '''Test consumers are delayed when exceeding the rate'''
+
+        bucket = ratelimit.TokenBucket(100000, burst=10000)
+
+        start = time.time()
+        self.assertEquals(bucket.consume(10000), 0.0)
+        self.assert_(time.time() - start < 0.05)
+
+        self.assert_(bucket.consume(20000) > 0)
+        self.assert_(time.time() - start >= 0.15)
+
+
+class TestAdaptiveLimit(unittest.TestCase):
+    '''Test `AdaptiveLimit`'''
+
+    def test_increase(self):
+        '''Test the limit grows while latency is below target'''
+
+        limit = ratelimit.AdaptiveLimit(initial=4, maximum=6,
+            target_latency=0.1)
+
+        for _ in xrange(5):
+            limit.acquire()
+            limit.release(1, time.time(), 0.01)
+
+        self.assertEquals(limit.limit, 5)
+        self.assertEquals(limit.in_flight, 0)
+
+        for _ in xrange(100):
+            limit.acquire()
+            limit.release(1, time.time(), 0.01)
+
+        self.assertEquals(limit.limit, 6)
+
+    def test_decrease(self):
+        '''Test the limit shrinks once per window on latency spikes'''
+
+        limit = ratelimit.AdaptiveLimit(initial=16, target_latency=0.1)
+
+        start = time.time()
+        limit.acquire(2)
+        limit.release(1, start, 0.5)
+        limit.release(1, start, 0.5)
+        self.assertEquals(limit.limit, 8)
+
+        time.sleep(0.01)
+        limit.acquire()
+        limit.release(1, time.time(), 0.01, overloaded=True)
+        self.assertEquals(limit.limit, 4)
+
+    def test_acquire_blocks(self):
+        '''Test requests wait for a slot below the limit'''
+
+        limit = ratelimit.AdaptiveLimit(initial=1)
+        limit.acquire()
+
+        acquired = threading.Event()
+
+        def acquire():
+            '''Acquire a slot in the background'''
+
+            limit.acquire()
+            acquired.set()
+
+        thread = threading.Thread(target=acquire)
+        thread.start()
+
+        self.assertFalse(acquired.wait(0.05))
+        limit.release(1, time.time(), 0.0)
+        self.assert_(acquired.wait(1))
+
+        thread.join()
+
+
+class OverloadedClient(test.FakeClient):
+    '''Fake client reporting overload on `get`'''
+
+    def _process(self, message):
+        if isinstance(message, protocol.Get):
+            raise errors.GoingDown('Going down')
+
+        return super(OverloadedClient, self)._process(message)
+
+
+class TestRateLimitedClient(unittest.TestCase):
+    '''Test `RateLimitedClient`'''
+
+    def test_ops_rate(self):
+        '''Test the number of requests per second is limited'''
+
+        limiter = ratelimit.RateLimiter(ops_rate=100, ops_burst=1)
+        client = ratelimit.RateLimitedClient(test.FakeClient(), limiter)
+
+        start = time.time()
+        for i in xrange(11):
+            client.set('key', str(i))
+
+        self.assert_(time.time() - start >= 0.09)
+        self.assertEquals(limiter.statistics['requests'], 11)
+        self.assert_(limiter.statistics['delayed'] >= 9)
+
+    def test_overload(self):
+        '''Test the limit shrinks when the cluster is overloaded'''
+
+        limiter = ratelimit.RateLimiter(
+            adaptive=ratelimit.AdaptiveLimit(initial=8))
+        client = ratelimit.RateLimitedClient(OverloadedClient(), limiter)
+
+        client.set('key', 'value')
+        self.assertEquals(limiter.limit, 8)
+
+        self.assertRaises(errors.GoingDown, client.get, 'key')
+        self.assertEquals(limiter.limit, 4)
+        self.assertEquals(limiter.in_flight, 0)
+
+    def test_pipeline(self):
+        '''Test pipelined requests are submitted within the limit'''
+
+        limiter = ratelimit.RateLimiter(
+            adaptive=ratelimit.AdaptiveLimit(initial=2))
+        client = ratelimit.RateLimitedClient(test.FakeClient(), limiter)
+        client.MULTI_GET_CHUNK_KEYS = 3
+
+        for i in xrange(20):
+            client.set('key_%d' % i, 'value_%d' % i)
+
+        self.assertEquals(
+            client.multi_get(['key_%d' % i for i in xrange(20)]),
+            ['value_%d' % i for i in xrange(20)])
+        self.assertEquals(limiter.in_flight, 0)
+        self.assertEquals(limiter.window(), limiter.limit)
+
+    def test_pipeline_latency(self):
+        '''Test the limit shrinks when pipelined windows exceed the target'''
+
+        limiter = ratelimit.RateLimiter(adaptive=ratelimit.AdaptiveLimit(
+            initial=4, target_latency=0.05))
+
+        def process_pipelined(messages, _):
+            '''Handle messages taking 20ms each'''
+
+            for message in messages:
+                time.sleep(0.02)
+                yield message
+
+        self.assertEquals(list(limiter.pipeline(process_pipelined,
+            range(4))), range(4))
+        self.assertEquals(limiter.limit, 2)
+
+    def test_message_size(self):
+        '''Test the size of messages is estimated without serializing'''
+
+        messages = [
+            protocol.Set('key', 'value'),
+            protocol.MultiGet(False, ['key_0', 'key_1']),
+            protocol.Sequence([sequence.Set('key', 'value'),
+                sequence.Sequence([sequence.Delete('other')])], False),
+        ]
+
+        for message in messages:
+            size = len(''.join(message.serialize()))
+            estimate = ratelimit._message_size(message)
+
+            self.assert_(0 < estimate <= size, (message, estimate, size))
@@ -0,0 +1,77 @@
+# This file is part of Pyrakoon, a distributed key-value store client.
+#
+# Copyright (C) 2014 Incubaid BVBA
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''Tests for code in `pyrakoon.retry`'''
+
+import random
+import socket
+import unittest
+
+from pyrakoon import errors, protocol, retry
+
+class TestRetryPolicy(unittest.TestCase):
+    '''Tests for `RetryPolicy`'''
+
+    def test_classification(self):
+        '''Test which failures are retried'''
+
+        policy = retry.RetryPolicy()
+        get = protocol.Get(False, 'key')
+        delete = protocol.Delete('key')
+
+        for message in (get, delete):
+            self.assert_(policy.should_retry(errors.NotMaster(''), message))
+            self.assert_(policy.should_retry(errors.GoingDown(''), message))
+            self.assert_(policy.should_retry(socket.error(), message, False))
+            self.assert_(policy.should_retry(ValueError(), message, True,
+                True))
+            self.failIf(policy.should_retry(errors.NotFound('key'), message))
+
+        self.assert_(policy.should_retry(socket.error(), get))
+        self.assert_(policy.should_retry(errors.NoLongerMaster(''), get))
+        self.failIf(policy.should_retry(socket.error(), delete))
+        self.failIf(policy.should_retry(errors.NoLongerMaster(''), delete))
+
+    def test_backoff(self):
+        '''Test delays are jittered, growing, and capped'''
+
+        policy = retry.RetryPolicy(base=0.01, cap=0.5, deadline=60)
+        retry_ = policy.start()
+
+        # Delays are random, don't let the test be
+        random.seed(0)
+        delays = [retry_.backoff(errors.NotMaster(''), None)
+            for _ in xrange(50)]
+
+        self.assert_(all(0.01 <= delay <= 0.5 for delay in delays))
+        self.assert_(max(delays[-10:]) > 0.1)
+        self.assertEquals(retry_.retries, 50)
+
+    def test_limits(self):
+        '''Test connection failures are bounded by `tries`, and all failures
+        by the deadline'''
+
+        retry_ = retry.RetryPolicy(tries=3).start()
+        message = protocol.Get(False, 'key')
+
+        self.assertNotEquals(retry_.backoff(EOFError(), message), None)
+        self.assertNotEquals(retry_.backoff(errors.NotMaster(''), message),
+            None)
+        self.assertNotEquals(retry_.backoff(EOFError(), message), None)
+        self.assertEquals(retry_.backoff(EOFError(), message), None)
+
+        retry_ = retry.RetryPolicy(base=0.1, deadline=0.05).start()
+        self.assertEquals(retry_.backoff(errors.NotMaster(''), message), None)
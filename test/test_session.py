@@ -0,0 +1,146 @@
+# This file is part of Pyrakoon, a distributed key-value store client.
+#
+# Copyright (C) 2014 Incubaid BVBA
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''Tests for code in `pyrakoon.session`'''
+
+import time
+import unittest
+
+from pyrakoon import errors, protocol, sequence, session, test
+
+class TestSessionClient(unittest.TestCase):
+    '''Tests for `SessionClient`'''
+
+    def setUp(self):
+        self.server = test.RecordingClient()
+
+        for i in xrange(5):
+            self.server.set('key_%d' % i, 'value_%d' % i)
+
+        self.client = session.SessionClient(self.server, window=60)
+
+    def _reads(self):
+        '''Get and forget the `allow_dirty` flags of the reads handled, and
+        whether they were spread'''
+
+        result = [(message.allow_dirty, spread) for (message, spread)
+            in zip(self.server.messages, self.server.spread)
+            if hasattr(message, 'allow_dirty')]
+        self.server.reset()
+
+        return result
+
+    def _dirty(self):
+        '''Get and forget the `allow_dirty` flags of the reads handled'''
+
+        return [dirty for (dirty, _) in self._reads()]
+
+    def test_keys(self):
+        '''Test reads of written keys go to the master'''
+
+        self.client.set('key_0', 'new')
+        self.client.sequence([sequence.Delete('key_1'),
+            sequence.Sequence([sequence.Set('key_2', 'new')])])
+
+        self.assertEquals(self.client.get('key_0', allow_dirty=True), 'new')
+        self.assertEquals(self.client.exists('key_1', allow_dirty=True),
+            False)
+        self.assertEquals(self.client.multi_get(['key_2', 'key_3'],
+            allow_dirty=True), ['new', 'value_3'])
+        self.assertEquals(self.client.get('key_3', allow_dirty=True),
+            'value_3')
+        self.client.get('key_3')
+
+        self.assertEquals(self._dirty(), [False, False, False, True, False])
+
+    def test_ranges(self):
+        '''Test range and prefix reads overlapping written keys or prefixes
+        go to the master'''
+
+        self.client.test_and_set('key_1', 'value_1', 'new')
+        self.client.delete_prefix('other/')
+
+        self.client.range('key_0', True, 'key_2', True, -1, True)
+        self.client.range('key_2', True, 'key_9', True, -1, True)
+        self.client.range_entries('key_3', True, 'key_4', True, -1, True)
+        self.client.prefix('key_', allow_dirty=True)
+        self.client.prefix('other/sub', allow_dirty=True)
+        self.client.prefix('o', allow_dirty=True)
+        self.client.prefix('x', allow_dirty=True)
+        self.client.exists('other/1', allow_dirty=True)
+
+        self.assertEquals(self._dirty(),
+            [False, True, True, False, False, False, True, False])
+
+        #pylint: disable=W0212
+        message, master = self.client._route(
+            protocol.RevRangeEntries(True, 'key_4', True, 'key_0', True, -1))
+        self.assert_(master)
+        self.assertEquals((message.allow_dirty, message.begin_key),
+            (False, 'key_4'))
+
+    def test_window(self):
+        '''Test keys are read from slaves again after the window'''
+
+        client = session.SessionClient(self.server, window=0.01)
+
+        client.test_and_set('key_0', 'value_0', 'new')
+        self.assertEquals(client.statistics['keys'], 1)
+        client.get('key_0', allow_dirty=True)
+
+        time.sleep(0.02)
+
+        client.get('key_0', allow_dirty=True)
+
+        self.assertEquals(self._dirty(), [False, True])
+        self.assertEquals(client.statistics,
+            {'keys': 0, 'prefixes': 0, 'dirty': 1, 'master': 1})
+
+    def test_user_function(self):
+        '''Test all reads go to the master after a user function'''
+
+        self.assertRaises(errors.ArakoonError, self.client.user_function,
+            'function', None)
+
+        self.client.get('key_0', allow_dirty=True)
+        self.client.prefix('x', allow_dirty=True)
+
+        self.assertEquals(self._dirty(), [False, False])
+
+    def test_spread(self):
+        '''Test only spread reads of unwritten keys are spread'''
+
+        self.client.set('key_2', 'new')
+
+        messages = [protocol.Get(True, 'key_%d' % i) for i in xrange(5)]
+
+        self.assertEquals(list(self.client._process_spread(messages)),
+            ['value_0', 'value_1', 'new', 'value_3', 'value_4'])
+        self.assertEquals(self._reads(), [(True, True), (True, True),
+            (False, False), (True, True), (True, True)])
+
+    def test_pipelined(self):
+        '''Test writes in a pipeline affect subsequent reads'''
+
+        messages = [
+            protocol.Get(True, 'key_1'),
+            protocol.Set('key_1', 'new'),
+            protocol.Get(True, 'key_1'),
+        ]
+
+        self.assertEquals(list(self.client._process_pipelined(messages)),
+            ['value_1', None, 'new'])
+        self.assertEquals(self._dirty(), [True, False])
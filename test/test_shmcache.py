@@ -0,0 +1,171 @@
+# This file is part of Pyrakoon, a distributed key-value store client.
+#
+# Copyright (C) 2014 Incubaid BVBA
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''Tests for code in `pyrakoon.shmcache`'''
+
+import os
+import time
+import shutil
+import tempfile
+import unittest
+
+from pyrakoon import cache, protocol, shmcache, test
+
+def _cache(**kwargs):
+    '''Create a small shared cache'''
+
+    kwargs.setdefault('size', 256 * 1024)
+    kwargs.setdefault('slab_size', 4096)
+    kwargs.setdefault('ttl', 60)
+
+    return shmcache.SharedReadCache(**kwargs)
+
+
+class TestSharedReadCache(unittest.TestCase):
+    '''Tests for `SharedReadCache`'''
+
+    def test_get_put(self):
+        '''Test storing, replacing and discarding values'''
+
+        cache_ = _cache()
+
+        cache_.put('a', '1')
+        cache_.put('b', None)
+        cache_.put('a', 'x' * 1000)
+
+        self.assertEquals(cache_.get('a'), (True, 'x' * 1000))
+        self.assertEquals(cache_.get('b'), (True, None))
+        self.assertEquals(cache_.get('c'), (False, None))
+        self.assertEquals(len(cache_), 2)
+        self.assertEquals(cache_.statistics['bytes'], 1002)
+
+        cache_.discard('a')
+        cache_.discard_prefix('')
+        self.assertEquals(cache_.get('a'), (False, None))
+        self.assertEquals(cache_.get('b'), (False, None))
+        self.assertEquals(cache_.statistics['invalidations'], 2)
+
+        cache_.put('big', 'x' * 5000)
+        self.assertEquals(len(cache_), 0)
+
+    def test_ttl(self):
+        '''Test entries expire, negative ones after their own TTL'''
+
+        cache_ = _cache(negative_ttl=0.01)
+
+        cache_.put('a', '1')
+        cache_.put('b', None)
+        time.sleep(0.02)
+
+        self.assertEquals(cache_.get('a'), (True, '1'))
+        self.assertEquals(cache_.get('b'), (False, None))
+        self.assertEquals(cache_.statistics['expirations'], 1)
+
+    def test_epoch(self):
+        '''Test values read before an invalidation are dropped'''
+
+        cache_ = _cache()
+
+        epoch = cache_.epoch
+        cache_.discard('other')
+        cache_.put('a', '1', epoch)
+
+        self.assertEquals(cache_.get('a'), (False, None))
+
+    def test_eviction(self):
+        '''Test entries are evicted once memory runs out, recently used
+        ones last'''
+
+        cache_ = _cache(size=64 * 1024)
+
+        cache_.put('hot', 'x' * 100)
+
+        for i in xrange(1000):
+            cache_.put('key_%d' % i, 'x' * 100)
+            self.assertEquals(cache_.get('hot'), (True, 'x' * 100))
+
+        self.assert_(cache_.statistics['evictions'] > 0)
+        self.assert_(len(cache_) < 1000)
+        self.assertEquals(cache_.get('key_999'), (True, 'x' * 100))
+
+        cache_.clear()
+        self.assertEquals(len(cache_), 0)
+        self.assertEquals(cache_.statistics['bytes'], 0)
+
+        cache_.put('a', '1')
+        self.assertEquals(cache_.get('a'), (True, '1'))
+
+    def test_fork(self):
+        '''Test processes forked after creation share entries'''
+
+        cache_ = _cache()
+        cache_.put('parent', '1')
+
+        pid = os.fork()
+
+        if pid == 0:
+            #pylint: disable=W0212
+            try:
+                cache_.put('child', '2')
+                os._exit(0 if cache_.get('parent') == (True, '1') else 1)
+            except: #pylint: disable=W0702
+                os._exit(2)
+
+        _, status = os.waitpid(pid, 0)
+
+        self.assertEquals(status, 0)
+        self.assertEquals(cache_.get('child'), (True, '2'))
+
+    def test_path(self):
+        '''Test caches mapping the same file share entries'''
+
+        directory = tempfile.mkdtemp()
+
+        try:
+            path = os.path.join(directory, 'cache')
+
+            first = _cache(path=path)
+            first.put('a', '1')
+
+            second = _cache(path=path)
+            self.assertEquals(second.get('a'), (True, '1'))
+
+            second.discard('a')
+            self.assertEquals(first.get('a'), (False, None))
+            self.assertEquals(first.epoch, second.epoch)
+
+            first.close()
+            second.close()
+        finally:
+            shutil.rmtree(directory)
+
+    def test_caching_client(self):
+        '''Test using the cache in a `CachingClient`'''
+
+        server = test.RecordingClient()
+        server.set('key', 'value')
+        server.reset()
+
+        client = cache.CachingClient(server, _cache())
+
+        for _ in xrange(3):
+            self.assertEquals(client.get('key', allow_dirty=True), 'value')
+
+        client.set('key', 'new')
+        self.assertEquals(client.get('key', allow_dirty=True), 'new')
+
+        self.assertEquals([type(message) for message in server.messages],
+            [protocol.Get, protocol.Set, protocol.Get])
@@ -0,0 +1,130 @@
+# This file is part of Pyrakoon, a distributed key-value store client.
+#
+# Copyright (C) 2014 Incubaid BVBA
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''Tests for code in `pyrakoon.slowlog`'''
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from pyrakoon import errors, protocol, sequence, slowlog, test, trace
+
+def _trace(message, duration):
+    '''Create a finished trace of a given duration'''
+
+    trace_ = trace.Trace(trace.Tracer(), type(message), 'node_0', message)
+    trace_.start = 0.0
+    trace_.end = duration
+
+    return trace_
+
+
+class TestSlowLog(unittest.TestCase):
+    '''Tests for `SlowLog`'''
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_threshold(self):
+        '''Test only slow requests are recorded, in a bounded buffer'''
+
+        slow_log = slowlog.SlowLog(threshold=0.1, size=2)
+
+        for duration in (0.2, 0.05, 0.3, 0.4):
+            slow_log.on_decoded(_trace(protocol.Get(False, 'key'), duration))
+
+        self.assertEquals([entry.duration for entry in slow_log.entries()],
+            [0.3, 0.4])
+        self.assertEquals(slow_log.statistics['recorded'], 3)
+
+        slow_log.reset()
+        self.assertEquals(slow_log.entries(), [])
+
+    def test_entry(self):
+        '''Test entries describe the request'''
+
+        slow_log = slowlog.SlowLog(threshold=0, key_length=4)
+
+        slow_log.on_decoded(_trace(
+            protocol.Range(False, 'begin', True, 'end', False, -1), 1.0))
+        slow_log.on_error(_trace(protocol.MultiGet(False, ['a', 'b']), 1.0))
+
+        slow_log.on_decoded(_trace(protocol.Sequence([
+            sequence.Set('a', 'b'), sequence.Delete('c')], False), 1.0))
+
+        range_, multi_get, sequence_ = slow_log.entries()
+
+        self.assertEquals(range_.message_type, 'Range')
+        self.assertEquals(range_.begin_key, 'begi...')
+        self.assertEquals(range_.end_key, 'end')
+        self.assertEquals(range_.max_elements, -1)
+        self.assertEquals(range_.key, None)
+        self.assertEquals(range_.node, 'node_0')
+        self.assertEquals(multi_get.key_count, 2)
+        self.assertEquals(sequence_.key_count, 2)
+        self.assert_(' begin_key=\'begi...\' ' in str(range_))
+
+    def test_rate_limit(self):
+        '''Test entries written to the log file are rate limited'''
+
+        path = os.path.join(self.directory, 'slow.log')
+        slow_log = slowlog.SlowLog(threshold=0, path=path, rate=2)
+
+        for _ in xrange(5):
+            slow_log.on_decoded(_trace(protocol.PrefixKeys(False, 'p', -1),
+                1.0))
+
+        slow_log._tokens = 1.0
+        slow_log.on_decoded(_trace(protocol.Get(False, 'key'), 1.0))
+        slow_log.close()
+
+        lines = open(path).read().splitlines()
+
+        self.assertEquals(len(slow_log.entries()), 6)
+        self.assertEquals(slow_log.statistics,
+            {'recorded': 6, 'written': 3, 'skipped': 3})
+        self.assertEquals(len(lines), 3)
+        self.assert_(' PrefixKeys ' in lines[0])
+        self.assert_(' prefix=\'p\' max_elements=-1 ' in lines[0])
+        self.assert_(lines[2].endswith(' (3 slow requests skipped)'))
+
+    def test_socket_client(self):
+        '''Test recording requests of a `SocketClient`'''
+
+        server = test.FakeServer('pyrakoon_test')
+        server.store.set('key', 'value')
+        address = server.address
+
+        client_ = server.connect()
+        client_.tracer = slowlog.SlowLog(threshold=0)
+
+        try:
+            client_.get('key')
+            self.assertRaises(errors.NotFound, client_.get, 'nokey')
+        finally:
+            client_._disconnect()
+            server.stop()
+
+        found, not_found = client_.tracer.entries()
+
+        self.assertEquals((found.key, found.bytes_received), ('key', 13))
+        self.assertEquals(found.node, address)
+        self.assertEquals(not_found.key, 'nokey')
+        self.assert_(isinstance(not_found.error, errors.NotFound))
@@ -0,0 +1,128 @@
+# This file is part of Pyrakoon, a distributed key-value store client.
+#
+# Copyright (C) 2014 Incubaid BVBA
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''Tests for code in `pyrakoon.snapshot`'''
+
+import unittest
+import tempfile
+
+from pyrakoon import dump, errors, snapshot, test
+
+class TestSnapshotClient(unittest.TestCase):
+    '''Compare `SnapshotClient` with `pyrakoon.test.FakeClient`'''
+
+    def setUp(self):
+        self.reference = test.FakeClient()
+
+        for i in xrange(0, 200, 2):
+            self.reference.set('key_%03d' % i, 'value_%d' % i)
+        self.reference.set('other', '')
+        self.reference.set('\xff', '\x00\xff')
+
+        self.fd = tempfile.NamedTemporaryFile(prefix='pyrakoon_test_snapshot')
+        dump.export_dump(self.reference, self.fd, segment_records=10)
+
+        self.client = snapshot.SnapshotClient(self.fd.name)
+
+    def tearDown(self):
+        self.client.close()
+        self.fd.close()
+
+    def test_get(self):
+        '''Test `get` and `exists`'''
+
+        for key in ('key_000', 'key_100', 'key_198', 'other', '\xff'):
+            self.assertEquals(self.client.get(key), self.reference.get(key))
+            self.assert_(self.client.exists(key))
+
+        for key in ('', 'key_001', 'key_199', 'zzz', '\xff\xff'):
+            self.assertRaises(errors.NotFound, self.client.get, key)
+            self.assertFalse(self.client.exists(key))
+
+        self.assertEquals(str(self.client.get_buffer('key_010')), 'value_10')
+        self.assertEquals(self.client.get_key_count(), 102)
+
+    def test_multi_get(self):
+        '''Test `multi_get` and `multi_get_option`'''
+
+        self.assertEquals(self.client.multi_get(['key_004', 'other']),
+            ['value_4', ''])
+        self.assertRaises(errors.NotFound, self.client.multi_get,
+            ['key_004', 'key_005'])
+        self.assertEquals(
+            self.client.multi_get_option(['key_005', 'key_004', 'other']),
+            [None, 'value_4', ''])
+
+    def test_range(self):
+        '''Test `range` and `range_entries` against the reference client'''
+
+        bounds = (None, 'key_', 'key_010', 'key_011', 'key_198', 'zzz')
+
+        for begin_key in bounds:
+            for end_key in bounds:
+                for begin_inclusive in (True, False):
+                    for end_inclusive in (True, False):
+                        for max_elements in (-1, 0, 3):
+                            args = (begin_key, begin_inclusive, end_key,
+                                end_inclusive, max_elements)
+
+                            self.assertEquals(self.client.range(*args),
+                                self.reference.range(*args))
+                            self.assertEquals(
+                                self.client.range_entries(*args),
+                                self.reference.range_entries(*args))
+
+    def test_rev_range_entries(self):
+        '''Test `rev_range_entries`'''
+
+        self.assertEquals(
+            self.client.rev_range_entries('key_090', True, 'key_080', False,
+                3),
+            [('key_090', 'value_90'), ('key_088', 'value_88'),
+                ('key_086', 'value_86')])
+        self.assertEquals(
+            [key for (key, _) in self.client.rev_range_entries('key_089',
+                False, 'key_080', True)],
+            ['key_088', 'key_086', 'key_084', 'key_082', 'key_080'])
+        self.assertEquals(
+            [key for (key, _) in self.client.rev_range_entries(None, True,
+                None, True, 2)],
+            ['\xff', 'other'])
+        self.assertEquals(
+            self.client.rev_range_entries('key_000', True, 'key_010', True),
+            [])
+
+    def test_prefix(self):
+        '''Test `prefix`'''
+
+        keys = self.reference.range(None, True, None, True)
+
+        for prefix in ('', 'key_', 'key_01', 'key_1', 'o', 'x', '\xff'):
+            matches = [key for key in keys if key.startswith(prefix)]
+
+            self.assertEquals(self.client.prefix(prefix), matches)
+            self.assertEquals(self.client.prefix(prefix, 0), [])
+            self.assertEquals(self.client.prefix(prefix, 5), matches[:5])
+
+    def test_updates(self):
+        '''Test updates and unsupported calls fail'''
+
+        self.assertRaises(errors.ReadOnly, self.client.set, 'key', 'value')
+        self.assertRaises(errors.ReadOnly, self.client.delete, 'key_000')
+        self.assertRaises(errors.NotSupported, self.client.who_master)
+
+        self.client.close()
+        self.assertFalse(self.client.connected)
@@ -0,0 +1,175 @@
+# This file is part of Pyrakoon, a distributed key-value store client.
+#
+# Copyright (C) 2014 Incubaid BVBA
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''Tests for code in `pyrakoon.trace`'''
+
+import unittest
+import threading
+
+from pyrakoon import errors, instrument, protocol, test, trace
+
+class RecordingTracer(trace.Tracer):
+    '''Tracer recording all events'''
+
+    def __init__(self):
+        super(RecordingTracer, self).__init__()
+
+        self.events = []
+
+    def on_request_start(self, trace_):
+        self.events.append(('start', trace_.message_type))
+
+    def on_sent(self, trace_):
+        self.events.append(('sent', trace_.bytes_sent))
+
+    def on_first_byte(self, trace_):
+        self.events.append(('first_byte', ))
+
+    def on_decoded(self, trace_):
+        self.events.append(('decoded', trace_.bytes_received))
+
+    def on_error(self, trace_):
+        self.events.append(('error', type(trace_.error)))
+
+
+class TestTrace(unittest.TestCase):
+    '''Tests for `Trace`'''
+
+    def test_phases(self):
+        '''Test phase durations are calculated from timestamps'''
+
+        trace_ = trace.Trace(trace.Tracer(), protocol.Get, None)
+        trace_.start = 1.0
+        trace_.serialized = 1.5
+        trace_.acquired = 3.0
+
+        self.assertEquals(trace_.phases, {'serialize': 0.5, 'queue': 1.5})
+        self.assertEquals(trace_.duration, None)
+
+        trace_.sent = 3.25
+        trace_.first_byte = 4.0
+        trace_.end = 5.0
+
+        self.assertEquals(trace_.phases, {'serialize': 0.5, 'queue': 1.5,
+            'send': 0.25, 'server': 0.75, 'decode': 1.0})
+        self.assertEquals(trace_.duration, 4.0)
+
+    def test_monotonic(self):
+        '''Test the monotonic clock doesn't go backwards'''
+
+        first = trace.monotonic()
+        self.assert_(trace.monotonic() >= first)
+
+    def test_monotonic_threads(self):
+        '''Test the monotonic clock doesn't go backwards in any thread when
+        read concurrently'''
+
+        backwards = []
+
+        def read():
+            '''Read the clock repeatedly'''
+
+            last = trace.monotonic()
+
+            for _ in xrange(20000):
+                now = trace.monotonic()
+
+                if now < last:
+                    backwards.append(last - now)
+
+                last = now
+
+        threads = [threading.Thread(target=read) for _ in xrange(4)]
+
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEquals(backwards, [])
+
+
+class TestSlowestSampler(unittest.TestCase):
+    '''Tests for `SlowestSampler`'''
+
+    def test_slowest(self):
+        '''Test only the slowest traces are kept'''
+
+        sampler = trace.SlowestSampler(size=3)
+
+        for duration in (5, 1, 7, 3, 9, 2):
+            trace_ = trace.Trace(sampler, protocol.Get, None)
+            trace_.start = 0.0
+            trace_.end = duration
+            sampler.on_decoded(trace_)
+
+        self.assertEquals([trace_.duration for trace_ in sampler.samples()],
+            [9, 7, 5])
+
+        sampler.reset()
+        self.assertEquals(sampler.samples(), [])
+
+
+class TestSocketClient(unittest.TestCase):
+    '''Test tracing requests of a `SocketClient`'''
+
+    def setUp(self):
+        self.server = test.FakeServer('pyrakoon_test')
+        self.server.store.set('key', 'value')
+
+        self.client = self.server.connect()
+
+    def tearDown(self):
+        self.client._disconnect()
+        self.server.stop()
+
+    def test_events(self):
+        '''Test all hooks are invoked in order'''
+
+        tracer = RecordingTracer()
+        self.client.tracer = tracer
+
+        self.assertEquals(self.client.get('key'), 'value')
+        self.assertRaises(errors.NotFound, self.client.get, 'nokey')
+
+        size = len(''.join(protocol.Get(False, 'key').serialize()))
+
+        self.assertEquals(tracer.events, [
+            ('start', protocol.Get), ('sent', size), ('first_byte', ),
+            ('decoded', 4 + 4 + 5),
+            ('start', protocol.Get), ('sent', size + 2), ('first_byte', ),
+            ('error', errors.NotFound),
+        ])
+
+    def test_sampler(self):
+        '''Test sampling traced requests, combined with instrumentation'''
+
+        sampler = trace.SlowestSampler(size=2)
+        self.client.tracer = sampler
+        self.client.instrumentation = instrument.Instrumentation()
+
+        for _ in xrange(5):
+            self.client.get('key')
+
+        samples = sampler.samples()
+
+        self.assertEquals(len(samples), 2)
+        self.assert_(samples[0].duration >= samples[1].duration)
+        self.assertEquals(sorted(samples[0].phases), sorted(trace.PHASES))
+        self.assertEquals(samples[0].node, self.server.address)
+        self.assertEquals(
+            self.client.instrumentation.snapshot()[protocol.Get.TAG].requests,
+            5)
@@ -26,7 +26,7 @@ except ImportError:
 from twisted.internet import defer, error
 from twisted.trial import unittest
 
-from pyrakoon import client, errors, protocol, tx
+from pyrakoon import client, errors, instrument, protocol, trace, tx
 
 bytes_ = lambda str_: (ord(c) for c in str_)
 
@@ -154,6 +154,61 @@ class TestTwistedClient(unittest.TestCase):
 
         return deferred
 
+    def test_instrumented(self):
+        '''Test requests are recorded by the instrumentation'''
+
+        expected = protocol.build_prologue(self.CLUSTER_ID)
+        expected += ''.join(protocol.Get(False, 'key').serialize())
+        to_send = ''.join(chr(i) for i in itertools.chain(
+            (errors.NotFound.CODE, 0, 0, 0),
+            (3, 0, 0, 0),
+            bytes_('key'),
+        ))
+
+        client = self._create_client(_FakeTransport(self, expected, to_send))
+        client.instrumentation = instrument.Instrumentation()
+
+        def check(_):
+            '''Check the recorded statistics'''
+
+            stats = client.instrumentation.snapshot()[protocol.Get.TAG]
+
+            self.assertEquals(stats.requests, 1)
+            self.assertEquals(stats.errors, {'NotFound': 1})
+            self.assertEquals(stats.bytes_sent,
+                len(expected) - len(protocol.build_prologue(self.CLUSTER_ID)))
+            self.assertEquals(stats.bytes_received, len(to_send))
+
+        deferred = client.get('key')
+        deferred.addErrback(lambda exc: exc.trap(errors.NotFound))
+        deferred.addCallback(check)
+
+        return deferred
+
+    def test_traced(self):
+        '''Test requests are traced'''
+
+        expected = protocol.build_prologue(self.CLUSTER_ID)
+        expected += ''.join(protocol.Delete('key').serialize())
+        to_send = ''.join(chr(i) for i in (0, 0, 0, 0))
+
+        client = self._create_client(_FakeTransport(self, expected, to_send))
+        client.tracer = trace.SlowestSampler()
+
+        def check(_):
+            '''Check the recorded trace'''
+
+            sample, = client.tracer.samples()
+
+            self.assertEquals(sample.message_type, protocol.Delete)
+            self.assertEquals(sample.bytes_received, 4)
+            self.assertEquals(sorted(sample.phases), sorted(trace.PHASES))
+
+        deferred = client.delete('key')
+        deferred.addCallback(check)
+
+        return deferred
+
     def test_disconnect(self):
         '''Test disconnect'''
 